@@ -1,4 +1,6 @@
+import html
 import os
+import re
 import shutil
 import sys
 from typing import Union, List
@@ -11,11 +13,16 @@ import importlib.util
 import glob
 from unittest import mock
 import io
-from .annotate_templates import TEMPLATE_PACKAGE, TEMPLATE_URL, TEMPLATE_ANNOTATE_INDEX
+from .annotate_templates import TEMPLATE_PACKAGE, TEMPLATE_URL, TEMPLATE_ANNOTATE_INDEX, TEMPLATE_PROFILE_STYLE, \
+    TEMPLATE_PROFILE_SUMMARY
 from cython_dev_tools.common import open_url_in_browser
 import webbrowser
 import subprocess
 
+RE_ANNOTATION_LINE = re.compile(r'<pre class="cython line score-(?P<score>\d+)"(?P<attrs>[^>]*)>'
+                                r'(?P<prefix>\+|&#xA0;)<span class="">(?P<lineno>\d+)</span>: ')
+
+
 def annotate_command(args):
     """
     Main entry point for shell command
@@ -26,6 +33,8 @@ def annotate_command(args):
             args.annotate_target,
             project_root=args.project_root,
             append=args.append,
+            profile=args.profile,
+            hot_threshold=args.hot_threshold,
     )
     if args.browser:
         open_url_in_browser(f'file://{annotate_idx_fn}')
@@ -37,11 +46,15 @@ def annotate(
             pyx_file_or_list: Union[str, List[str], None] = None,
             project_root: str = None,
             append = False,
+            profile: str = None,
+            hot_threshold=1.0,
             ):
     """
     In normal circumstances this command will be called after build --annotate
     :param pyx_file_or_list:
     :param project_root:
+    :param profile: profile JSON with pyx line timings (`cytool lprun`, `cytool perf`, ...), shown as heatmap overlay
+    :param hot_threshold: lines with self time >= this percent of the profile and Python interaction are outlined
     :return:
     """
 
@@ -86,6 +99,13 @@ def annotate(
     html_files = [get_pyx_html(fn) for fn in pyx_file_or_list]
 
     annotation_index_path = os.path.join(cython_dev_tools_path, 'annotation_index.html')
+    profile_data = None
+    file_shares = {}
+    if profile:
+        from cython_dev_tools.testing.profile_data import load_profile
+        profile_data = load_profile(profile)
+        if not profile_data['lines']:
+            raise ValueError(f'Profile has no line timings (use `cytool lprun` or `cytool perf`): {profile}')
 
     for pyx_fn, html_fn in html_files:
         assert project_root in pyx_fn, f'{pyx_fn} does not belong to project root'
@@ -115,6 +135,15 @@ def annotate(
 
         assert os.path.exists(html_fn), f'No annotations was generated from {pyx_fn}'
 
+        if profile_data is not None:
+            rel_pyx_fn = os.path.relpath(pyx_fn, project_root)
+            with open(html_fn, 'r') as fh:
+                html_text, file_share = profile_heatmap_html(fh.read(), rel_pyx_fn, profile_data,
+                                                             os.path.basename(profile), hot_threshold=hot_threshold)
+            with open(html_fn, 'w') as fh:
+                fh.write(html_text)
+            file_shares[os.path.join('annotations', f_rel_path)] = file_share
+
         # Move file to annotations
         if not is_singe_file:
             log.trace(f'Copy: {html_fn} to {annotate_html_file}')
@@ -127,9 +156,72 @@ def annotate(
     if is_singe_file:
         return annotation_index_path
     else:
-        return build_annotation_index(annotation_index_path)
+        return build_annotation_index(annotation_index_path, file_shares=file_shares)
+
+
+def profile_heatmap_html(annotation_html: str, rel_pyx_fn, profile: dict, profile_name, hot_threshold=1.0):
+    """
+    Colors lines of Cython annotation HTML by their self time share of the profile (see `testing/profile_data.py`),
+    function definition lines show the function total, "hot and yellow" lines are outlined and listed on top
+
+    :param rel_pyx_fn: pyx path relative to the project root, as in profile line keys
+    :return: (html, share of the profile self time in this file)
+    """
+    from cython_dev_tools.testing.flamegraph import format_weight
+
+    total = profile['total'] or 1
+    unit = profile['unit']
+    lines = {}
+    for key, l in profile['lines'].items():
+        fn, lineno = key.rsplit(':', 1)
+        if fn == rel_pyx_fn:
+            lines[int(lineno)] = l
+    functions = {f['line']: (name, f) for name, f in profile['functions'].items() if f.get('file') == rel_pyx_fn}
+    max_self = max((l['self'] for l in lines.values()), default=0) or 1
+    hot_yellow = []
+
+    def heat_line(m):
+        lineno, score = int(m['lineno']), int(m['score'])
+        l = lines.get(lineno)
+        share = l['self'] / total if l else 0.0
+        css_class = f'cython line score-{score}'
+        heat = '<span class="cytools-heat"></span>'
+        if l and l['self'] > 0:
+            tip = f'self: {format_weight(l["self"], unit)} ({share:.2%})'
+            if l.get('std'):
+                tip += f' +/- {format_weight(l["std"], unit)}'
+            if l.get('total', l['self']) != l['self']:
+                tip += f', with callees: {format_weight(l["total"], unit)} ({l["total"] / total:.2%})'
+            heat = (f'<span class="cytools-heat" style="background-color: rgba(214, 39, 40, '
+                    f'{0.1 + 0.9 * l["self"] / max_self:.2f})" title="{tip}">{share:.1%}</span>')
+            if share * 100 >= hot_threshold and score > 0:
+                css_class += ' cytools-hot-yellow'
+                hot_yellow.append((lineno, share, score, l.get('code', '')))
+        badge = ''
+        if lineno in functions:
+            name, f = functions[lineno]
+            badge = (f'<span class="cytools-func-total" title="{html.escape(name)}">'
+                     f'total: {format_weight(f["total"], unit)} ({f["total"] / total:.1%})</span>')
+        return f'<pre class="{css_class}" id="L{lineno}"{m["attrs"]}>{heat}{badge}{m["prefix"]}<span class="">{m["lineno"]}</span>: '
+
+    annotation_html = RE_ANNOTATION_LINE.sub(heat_line, annotation_html)
+    file_share = sum(l['self'] for l in lines.values()) / total
+
+    hot_rows = ''.join(f'<tr><td><a href="#L{lineno}">line {lineno}</a></td><td>{share:.1%}</td>'
+                       f'<td>score {score}</td><td><code>{html.escape(code)}</code></td></tr>'
+                       for lineno, share, score, code in sorted(hot_yellow, key=lambda x: -x[1]))
+    summary = TEMPLATE_PROFILE_SUMMARY.substitute(
+            profile=html.escape(f'{profile_name} ({profile["kind"]} {profile["target"]}, '
+                                f'{format_weight(profile["total"], unit)})'),
+            file_share=f'{file_share:.1%}',
+            hot_threshold=f'{hot_threshold:g}',
+            hot_lines=hot_rows or '<tr><td>none</td></tr>',
+    )
+    annotation_html = annotation_html.replace('</head>', TEMPLATE_PROFILE_STYLE + '</head>', 1)
+    annotation_html = annotation_html.replace('<body class="cython">', '<body class="cython">\n' + summary, 1)
+    return annotation_html, file_share
 
-def build_package_links(pkg_path, relative_path, only_files = False):
+def build_package_links(pkg_path, relative_path, only_files = False, file_shares: dict = None):
     str_buf = io.StringIO()
 
     if only_files:
@@ -144,11 +236,15 @@ def build_package_links(pkg_path, relative_path, only_files = False):
 
         if os.path.isdir(_abs_path):
             str_buf.write(f'{d}\n')
-            str_buf.write(build_package_links(_abs_path, os.path.join(relative_path, d)))
+            str_buf.write(build_package_links(_abs_path, os.path.join(relative_path, d), file_shares=file_shares))
         elif _abs_path.endswith('.html'):
+            label = d.replace('.html', '.pyx')
+            if file_shares and os.path.join(relative_path, d) in file_shares:
+                # Profile self time in the file
+                label += f' ({file_shares[os.path.join(relative_path, d)]:.1%})'
             str_buf.write(TEMPLATE_URL.substitute(
                     url=os.path.join(relative_path, d).replace('\\', '/'),
-                    label=d.replace('.html', '.pyx')
+                    label=label
             ))
 
         str_buf.write('</li>\n')
@@ -159,7 +255,7 @@ def build_package_links(pkg_path, relative_path, only_files = False):
         return f''
 
 
-def build_annotation_index(annotation_index_path):
+def build_annotation_index(annotation_index_path, file_shares: dict = None):
     log.debug(f'Building annotation index file in {annotation_index_path}')
     cython_dev_tools_path = os.path.dirname(annotation_index_path)
     annotations_path = os.path.join(cython_dev_tools_path, 'annotations')
@@ -174,7 +270,8 @@ def build_annotation_index(annotation_index_path):
         if not os.path.isdir(pkg_path):
             continue
         log.trace(f'Annotation index: processing package {pkg_name}')
-        package_links = build_package_links(pkg_path, relative_path=os.path.join('annotations', d))
+        package_links = build_package_links(pkg_path, relative_path=os.path.join('annotations', d),
+                                            file_shares=file_shares)
         if package_links:
 
             accordion_buff.write(TEMPLATE_PACKAGE.substitute(package_name=pkg_name.replace('/', '_').replace('.', '_'),
@@ -182,7 +279,8 @@ def build_annotation_index(annotation_index_path):
                                                              package_contents=package_links,
                                                              ))
 
-    package_links = build_package_links(annotations_path, relative_path=os.path.join('annotations'), only_files=True)
+    package_links = build_package_links(annotations_path, relative_path=os.path.join('annotations'), only_files=True,
+                                        file_shares=file_shares)
     if package_links:
         log.trace(f'Annotation index: processing root package')
         accordion_buff.write(TEMPLATE_PACKAGE.substitute(package_name='__cytools_project_root__',
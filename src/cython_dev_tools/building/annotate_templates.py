@@ -50,4 +50,25 @@ TEMPLATE_PACKAGE = Template("""
 
 # url
 # label
-TEMPLATE_URL = Template("""<a href="${url}" target="iframe_annotation">${label}</a>""")
\ No newline at end of file
+TEMPLATE_URL = Template("""<a href="${url}" target="iframe_annotation">${label}</a>""")
+
+# Profile heatmap overlay styles, inserted into Cython annotation HTML head
+TEMPLATE_PROFILE_STYLE = """<style type="text/css">
+.cytools-heat {display: inline-block; width: 6em; margin-right: 6px; text-align: right; color: #333;}
+.cytools-func-total {float: right; padding: 0 6px; font-weight: bold; color: #8b0000;}
+.cytools-hot-yellow {outline: 2px solid #d62728; outline-offset: -2px;}
+.cytools-profile {font-family: sans-serif; font-size: 90%; border: 1px solid #ccc; padding: 4px 8px; margin: 8px 0;}
+.cytools-profile td {padding: 0 8px;}
+</style>
+"""
+
+# profile - profile description
+# file_share - share of the profile total in this file
+# hot_threshold - hot line threshold (percent)
+# hot_lines - table rows of hot and yellow lines
+TEMPLATE_PROFILE_SUMMARY = Template("""<div class="cytools-profile">
+<p>Profile: $profile, this file self time: $file_share of the total</p>
+<p>Hot and yellow lines (self time &gt;= ${hot_threshold}% and Python interaction):</p>
+<table>$hot_lines</table>
+</div>
+""")
@@ -3,15 +3,21 @@ import sys
 from typing import List
 
 from cython_dev_tools.logs import log
-from cython_dev_tools.common import check_project_initialized
-from setuptools import Extension, setup
+from cython_dev_tools.common import check_project_initialized, machine_fingerprint
+from cython_dev_tools.building.flag_profiles import load_flag_profiles, apply_flag_profiles, link_flags
+from setuptools import Extension, Distribution, setup
+from distutils.ccompiler import new_compiler
 import numpy as np
 from Cython.Build import cythonize
+import Cython.Build.Dependencies
+import Cython.Utils
 import importlib.util
 import glob
+import copy
 from unittest import mock
 import re
 import json
+from datetime import datetime
 from Cython.Compiler import Options
 
 
@@ -20,16 +26,35 @@ RE_IS_DEF_CODE_LINE = re.compile(r"( +|^)[^#]def.*$", re.MULTILINE)
 RE_CYTHON_SRC = re.compile(r".*\/\* BEGIN: Cython Metadata((?P<cython_meta>.*))END: Cython Metadata \*\/.*", re.DOTALL)
 RE_IS_CYTHON = re.compile(r".*\/\*\sGenerated\sby\sCython\s.*\*\/.*", re.DOTALL)
 
+BUILD_MANIFEST_FILENAME = 'build_manifest.json'
+
 def build_command(args):
     """
     Main entry point for shell command
     """
     log.setup('cython_dev_tools__build', verbosity=args.verbose)
 
+    if args.pgo:
+        from cython_dev_tools.building.pgo import pgo_build
+        if args.debug:
+            raise ValueError('PGO is available only for release builds')
+        pgo_build(args.project_root, args.pgo, annotate=args.annotate)
+        return
+
+    if args.profile:
+        from cython_dev_tools.building.profiles import build_profile
+        if args.debug:
+            raise ValueError('Build profiles are release builds, --debug is not supported')
+        build_profile(args.project_root, args.profile, force=args.force, annotate=args.annotate)
+        return
+
     build(args.project_root,
           is_debug=args.debug,
           force=args.force,
           annotate=args.annotate,
+          trace_only=args.trace_only,
+          use_flag_profiles=not args.no_flag_profiles,
+          use_pgo=not args.no_pgo,
           )
 
 
@@ -37,7 +62,38 @@ def build(project_root: str = None,
           is_debug=False,
           force=False,
           annotate=False,
+          trace_only: List[str] = None,
+          compiler_directives: dict = None,
+          directives_modules: List[str] = None,
+          compile_flags: List[str] = None,
+          flags_modules: List[str] = None,
+          use_flag_profiles=True,
+          pgo_generate=False,
+          use_pgo=True,
+          build_profile: str = None,
+          cython_debug=False,
           ):
+    """
+    Builds all project cython extensions in place
+
+    :param project_root:
+    :param is_debug: build with GDB info, line tracing and profiling (required for coverage and line profiler)
+    :param force: force rebuilding all cython files
+    :param annotate: create HTML annotation file nearby .pyx
+    :param trace_only: list of packages/modules (e.g. `pkg.sub`), only matching extensions get line tracing
+                       when `is_debug`, the rest is built as release
+    :param compiler_directives: extra Cython compiler directives, i.e. {'boundscheck': False}
+    :param directives_modules: list of packages/modules, `compiler_directives` are applied only to matching
+                       extensions (all by default)
+    :param compile_flags: extra C compiler flags of release build, i.e. ['-O3', '-march=native'],
+                       they override flag profiles of `flags_modules` (all modules by default)
+    :param use_flag_profiles: apply `.cython_dev_tools/flag_profiles.json` to release build
+    :param pgo_generate: release build instrumented for PGO training (`-fprofile-generate`)
+    :param use_pgo: apply up-to-date PGO profiles of `cytool build --pgo` to release build
+    :param build_profile: named build profile (see `building/profiles.py`), recorded in the build manifest
+    :param cython_debug: write `cython_debug` mapping info (C -> pyx functions and lines) of release build,
+                       i.e. for native profilers, the generated C code is the same
+    """
 
     log.trace(f'project root: {project_root}')
 
@@ -83,6 +139,8 @@ def build(project_root: str = None,
                 language_level="3",
         )
 
+    debug_macros = None
+    debug_cythonize_kw = {}
     if is_debug:
         log.debug('Adding debug flags')
         debug_macros = ("CYTHON_TRACE_NOGIL", 1), ("CYTHON_TRACE", 1)
@@ -94,40 +152,32 @@ def build(project_root: str = None,
                                   compiler_directives={'linetrace': True, 'profile': True, 'binding': True})
         log.trace(f'debug_macros: {debug_macros}')
         log.trace(f'debug_cythonize_kw: {debug_cythonize_kw}')
-
-        for ext in project_extensions:
-            log.trace(f'Patching extension macros: {ext.name}')
-
-            if ext.define_macros is None:
-                ext.define_macros = []
-            log.trace(f'\tbefore: {ext.define_macros}')
-            for dbg_m in debug_macros:
-                has_found = False
-                for i, m in enumerate(ext.define_macros):
-                    assert len(m) == 2, f'Extension macros expected to be a tuple of 2 elements'
-                    if m[0].upper() == dbg_m[0]:
-                        # Already has a macros, rewrite value
-                        has_found = True
-                        ext.define_macros[i] = (m[0], dbg_m[1])
-                        break
-                if not has_found:
-                    ext.define_macros.append(dbg_m)
-            log.trace(f'\tafter: {ext.define_macros}')
-
-
-
-
-        # Updating cythonize kw
-        cythonize_kwargs.update(debug_cythonize_kw)
+    elif cython_debug:
+        debug_cythonize_kw = dict(gdb_debug=True, output_dir=cython_dev_tools_path)
 
     if not force:
         for ext in project_extensions:
-            force = check_force_rebuild(project_root, ext.name, ext.sources, requested_is_debug=is_debug)
+            force = check_force_rebuild(project_root, ext.name, ext.sources, requested_is_debug=is_debug, trace_only=trace_only)
             if force:
                 # Something triggered force, no need to loop through everything
                 log.info(f'Debug<->release version switch detected, forcing rebuild')
                 break
 
+    # Cython caches the dependency tree and parsed sources per process (by relative paths), they are stale
+    # when several project trees (i.e. variants) are built in one process
+    Cython.Build.Dependencies._dep_tree = None
+    Cython.Utils.clear_function_caches()
+
+    if not force and is_directives_changed(cython_dev_tools_path, compiler_directives, directives_modules):
+        # Cython doesn't track directives passed to cythonize()
+        log.info(f'Compiler directives changed, forcing rebuild')
+        force = True
+
+    if not force and cython_debug and not os.path.exists(os.path.join(cython_dev_tools_path, 'cython_debug')):
+        # Mapping info is written only when .pyx are cythonized
+        log.info(f'Cython debug info is missing, forcing rebuild')
+        force = True
+
     # Ready to compile
     log.debug('Compiling and building')
     log.trace(f'cythonize_kwargs: {cythonize_kwargs}')
@@ -138,18 +188,233 @@ def build(project_root: str = None,
     cythonize_kwargs['annotate'] = annotate
     cythonize_kwargs['build_dir'] = src_build_dir
 
-    ext_modules = cythonize(project_extensions, **cythonize_kwargs)
-
-    setup(name='Cython tools virtual ext',
-          ext_modules=ext_modules,
-          script_args=['build_ext', '--inplace'],
-          #script_args=['build_ext', f'--build-lib={lib_directory}']
-          )
+    def group_cythonize_kwargs(is_traced, has_directives):
+        group_kw = dict(cythonize_kwargs)
+        if is_debug:
+            if is_traced:
+                group_kw.update(debug_cythonize_kw)
+            else:
+                # Release, but with GDB mapping info
+                group_kw.update({k: v for k, v in debug_cythonize_kw.items() if k != 'compiler_directives'})
+        elif cython_debug:
+            group_kw.update(debug_cythonize_kw)
+        if has_directives:
+            group_kw['compiler_directives'] = dict(group_kw.get('compiler_directives') or {}, **compiler_directives)
+        return group_kw
+
+    if (is_debug and trace_only) or (compiler_directives and directives_modules):
+        # Modules are cythonized by groups of the same settings, i.e. traced / release, with / without directives
+        file_groups = group_module_sources(project_extensions,
+                                           trace_only=trace_only if is_debug else None,
+                                           directives_modules=directives_modules if compiler_directives else None,
+                                           is_debug=is_debug,
+                                           has_directives=bool(compiler_directives))
+        all_files = [fn for files in file_groups.values() for fn in files]
+        log.trace(f'file_groups: {file_groups}')
+        if is_debug and trace_only and not any(is_traced for is_traced, _ in file_groups.keys()):
+            log.warning(f'No modules matching --trace-only {trace_only}')
+        if compiler_directives and not any(has_directives for _, has_directives in file_groups.keys()):
+            log.warning(f'No modules matching directives modules {directives_modules}')
+
+        ext_modules = []
+        for (is_traced, has_directives), files in sorted(file_groups.items()):
+            group_extensions = copy.deepcopy(project_extensions)
+            if is_traced:
+                patch_debug_macros(group_extensions, debug_macros)
+            ext_modules += cythonize(group_extensions,
+                                     exclude=[fn for fn in all_files if fn not in files],
+                                     **group_cythonize_kwargs(is_traced, has_directives))
+    else:
+        if is_debug:
+            patch_debug_macros(project_extensions, debug_macros)
+        ext_modules = cythonize(project_extensions, **group_cythonize_kwargs(is_debug, bool(compiler_directives)))
+
+    build_ext_args = ['build_ext', '--inplace']
+    if not is_debug:
+        profiles = load_flag_profiles(cython_dev_tools_path) if use_flag_profiles else {}
+        if compile_flags is not None:
+            # Explicit flags override saved profiles of the modules
+            profiles = {k: v for k, v in profiles.items() if not is_traced_module(k, flags_modules)}
+            for module in flags_modules or ['']:
+                profiles[module] = dict(extra_compile_args=compile_flags, extra_link_args=link_flags(compile_flags))
+        if profiles:
+            apply_flag_profiles(ext_modules, profiles, machine_id=machine_fingerprint()['id'])
+
+        from cython_dev_tools.building.pgo import apply_pgo_generate, apply_pgo_profiles
+        if pgo_generate:
+            apply_pgo_generate(ext_modules)
+        elif use_pgo:
+            apply_pgo_profiles(ext_modules, project_root, cython_dev_tools_path, default_build_temp())
+    if is_compile_flags_changed(cython_dev_tools_path, ext_modules):
+        # distutils does not track compiler flags, C sources must be recompiled
+        log.info('Compiler flags changed, forcing C extensions recompilation')
+        build_ext_args.append('--force')
+
+    dist = setup(name='Cython tools virtual ext',
+                 ext_modules=ext_modules,
+                 script_args=build_ext_args,
+                 #script_args=['build_ext', f'--build-lib={lib_directory}']
+                 )
+
+    write_build_manifest(project_root, cython_dev_tools_path, dist.get_command_obj('build_ext'),
+                         is_debug=is_debug, trace_only=trace_only,
+                         compiler_directives=compiler_directives, directives_modules=directives_modules,
+                         build_profile=build_profile)
 
     os.chdir(prev_dir)
     log.info(f'Build completed')
 
 
+def write_build_manifest(project_root, cython_dev_tools_path, build_ext_cmd, is_debug, trace_only=None,
+                         compiler_directives=None, directives_modules=None, build_profile=None):
+    """
+    Saves the information about the last build at `.cython_dev_tools/build_manifest.json`,
+    i.e. extension modules .so paths and their modification time, build variant, and compilation flags
+    """
+    modules = {}
+    for ext in build_ext_cmd.extensions:
+        so_fn = build_ext_cmd.get_ext_fullpath(ext.name)
+        modules[ext.name] = dict(
+                so_path=os.path.relpath(os.path.abspath(so_fn), project_root),
+                object_path=os.path.relpath(extension_object_path(ext, build_ext_cmd.build_temp), project_root),
+                mtime=os.path.getmtime(so_fn) if os.path.exists(so_fn) else None,
+                traced=is_debug and is_traced_module(ext.name, trace_only),
+                compiler_directives=compiler_directives if is_traced_module(ext.name, directives_modules) else None,
+                define_macros=ext.define_macros,
+                extra_compile_args=ext.extra_compile_args,
+                extra_link_args=ext.extra_link_args,
+        )
+
+    manifest = dict(
+            built_at=datetime.now().isoformat(),
+            is_debug=is_debug,
+            trace_only=trace_only or [],
+            build_profile=build_profile,
+            modules=modules,
+    )
+    with open(os.path.join(cython_dev_tools_path, BUILD_MANIFEST_FILENAME), 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+
+
+def default_build_temp() -> str:
+    """
+    Absolute path of setuptools build_ext temp directory (object files) in the current dir
+    """
+    build_ext_cmd = Distribution().get_command_obj('build_ext')
+    build_ext_cmd.ensure_finalized()
+    return os.path.abspath(build_ext_cmd.build_temp)
+
+
+def extension_object_path(ext, build_temp) -> str:
+    """
+    Absolute path of the object file of the extension C source (i.e. .c generated by Cython)
+    """
+    c_sources = [fn for fn in ext.sources if fn.endswith(('.c', '.cpp'))]
+    return os.path.abspath(new_compiler().object_filenames(c_sources[:1], output_dir=build_temp)[0])
+
+
+def is_directives_changed(cython_dev_tools_path, compiler_directives=None, directives_modules=None) -> bool:
+    """
+    Checks if extra compiler directives of any module differ from the last build manifest
+    """
+    modules = load_build_manifest(cython_dev_tools_path).get('modules', {})
+    for module_name, m in modules.items():
+        expected = compiler_directives if is_traced_module(module_name, directives_modules) else None
+        if (m.get('compiler_directives') or None) != (expected or None):
+            return True
+    return False
+
+
+def is_compile_flags_changed(cython_dev_tools_path, ext_modules) -> bool:
+    """
+    Checks if compile / link args of any extension differ from the last build manifest
+    """
+    modules = load_build_manifest(cython_dev_tools_path).get('modules', {})
+    for ext in ext_modules:
+        if ext.name not in modules:
+            continue
+        m = modules[ext.name]
+        if list(m.get('extra_compile_args') or []) != list(ext.extra_compile_args or []) or \
+                list(m.get('extra_link_args') or []) != list(ext.extra_link_args or []):
+            return True
+    return False
+
+
+def load_build_manifest(cython_dev_tools_path) -> dict:
+    """
+    Loads the last build manifest, or returns empty dict if the project has not been built by cytool yet
+    """
+    manifest_fn = os.path.join(cython_dev_tools_path, BUILD_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_fn):
+        return {}
+    with open(manifest_fn, 'r') as fh:
+        return json.load(fh)
+
+
+def patch_debug_macros(project_extensions, debug_macros):
+    """
+    Adds (or overrides) line tracing macros of extensions
+    """
+    for ext in project_extensions:
+        log.trace(f'Patching extension macros: {ext.name}')
+
+        if ext.define_macros is None:
+            ext.define_macros = []
+        log.trace(f'\tbefore: {ext.define_macros}')
+        for dbg_m in debug_macros:
+            has_found = False
+            for i, m in enumerate(ext.define_macros):
+                assert len(m) == 2, f'Extension macros expected to be a tuple of 2 elements'
+                if m[0].upper() == dbg_m[0]:
+                    # Already has a macros, rewrite value
+                    has_found = True
+                    ext.define_macros[i] = (m[0], dbg_m[1])
+                    break
+            if not has_found:
+                ext.define_macros.append(dbg_m)
+        log.trace(f'\tafter: {ext.define_macros}')
+
+
+def get_module_name(pyx_path: str) -> str:
+    """
+    Module name of the .pyx file path relative to project root, i.e. pkg/sub/module.pyx -> pkg.sub.module
+    """
+    return os.path.splitext(os.path.normpath(pyx_path))[0].replace(os.path.sep, '.')
+
+
+def is_traced_module(module_name: str, trace_only: List[str] = None) -> bool:
+    """
+    Checks if module matches any of `trace_only` packages/modules, (all modules are traced if trace_only is empty)
+    """
+    if not trace_only:
+        return True
+    for pkg in trace_only:
+        pkg = pkg.strip('.')
+        if module_name == pkg or module_name.startswith(pkg + '.'):
+            return True
+    return False
+
+
+def group_module_sources(project_extensions, trace_only: List[str] = None, directives_modules: List[str] = None,
+                         is_debug=False, has_directives=False):
+    """
+    Groups all .pyx sources of the project extensions by their build settings
+
+    :return: {(is_traced, has_directives): [.pyx files]}
+    """
+    file_groups = {}
+    for ext in project_extensions:
+        for src_pattern in ext.sources:
+            if not src_pattern.endswith('.pyx'):
+                continue
+            for fn in glob.glob(src_pattern, recursive=True):
+                module_name = ext.name if '*' not in ext.name else get_module_name(fn)
+                key = (is_debug and is_traced_module(module_name, trace_only),
+                       has_directives and is_traced_module(module_name, directives_modules))
+                file_groups.setdefault(key, []).append(fn)
+    return file_groups
+
+
 def load_extensions_from_setup():
     """
     A hacky extension loader from the existing setup.py, when it presents in project root
@@ -163,7 +428,9 @@ def load_extensions_from_setup():
     with mock.patch('setuptools.setup') as mock_setup:
         with mock.patch('Cython.Build.cythonize') as mock_cythonize:
             # Gently mock setup initialization call to get cythonize call args
-            import setup
+            # (setup.py of the current project root, the build may be called for several project trees)
+            spec = importlib.util.spec_from_file_location('setup', os.path.join(os.getcwd(), 'setup.py'))
+            spec.loader.exec_module(importlib.util.module_from_spec(spec))
             log.trace(f'setup.py: cythonize call: {mock_cythonize.call_args}')
             if mock_cythonize.call_count == 0:
                 # No cythonize called / non-cython setup.py or something
@@ -185,7 +452,7 @@ def load_extensions_from_setup():
     return project_extensions, cythonize_kwargs
 
 
-def check_force_rebuild(project_root: str, ext_name: str, ext_sources: List[str], requested_is_debug: bool) -> bool:
+def check_force_rebuild(project_root: str, ext_name: str, ext_sources: List[str], requested_is_debug: bool, trace_only: List[str] = None) -> bool:
     """
     Checks all Cython .c sources to figure out their compilation instructions and compare with current build requirements.
 
@@ -202,8 +469,11 @@ def check_force_rebuild(project_root: str, ext_name: str, ext_sources: List[str]
             continue
 
         for fn in glob.glob(src_pattern, recursive=True):
+            module_name = ext_name if '*' not in ext_name else get_module_name(fn)
+            requested_is_traced = requested_is_debug and is_traced_module(module_name, trace_only)
+
             # Check for # distutils: define_macros=NPY_NO_DEPRECATED_API=NPY_1_7_API_VERSION
-            if requested_is_debug:
+            if requested_is_traced:
                 with open(fn, 'r') as fh:
                     lines = fh.readlines()
                     for l in lines:
@@ -249,8 +519,8 @@ def check_force_rebuild(project_root: str, ext_name: str, ext_sources: List[str]
                                 has_trace_nogil = True
 
                     src_is_debug = has_trace and has_trace_nogil
-                    if requested_is_debug != src_is_debug:
-                        if requested_is_debug:
+                    if requested_is_traced != src_is_debug:
+                        if requested_is_traced:
                             log.debug(f'{c_src} is built with no debug flags, forcing rebuilt all to get debug version')
                         else:
                             log.debug(f'{c_src} is built with debug flags, forcing rebuilt all to get production version')
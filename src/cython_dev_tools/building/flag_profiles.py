@@ -0,0 +1,82 @@
+"""
+Per-module C compiler flag profiles
+
+Profiles are saved by `cytool tune-flags --save` at `.cython_dev_tools/flag_profiles.json`, and applied by the
+release builds to the matching extension modules (the most specific package/module key wins):
+
+    {"modules": {"pkg.kernels": {"extra_compile_args": ["-O3", "-march=native"], "extra_link_args": [], ...}}}
+"""
+import json
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from cython_dev_tools.logs import log
+
+FLAG_PROFILES_FILENAME = 'flag_profiles.json'
+
+# Flags which must be passed to the linker too
+LINK_FLAGS_PREFIXES = ('-flto', '-fprofile-', '-fopenmp')
+
+
+def load_flag_profiles(cython_dev_tools_path) -> dict:
+    profiles_fn = os.path.join(cython_dev_tools_path, FLAG_PROFILES_FILENAME)
+    if not os.path.exists(profiles_fn):
+        return {}
+    with open(profiles_fn, 'r') as fh:
+        return json.load(fh).get('modules', {})
+
+
+def save_flag_profile(cython_dev_tools_path, module: str, compile_flags: List[str], **info):
+    """
+    Adds (or replaces) the flags profile of the package/module
+
+    :param info: extra information, i.e. target, speedup, machine_id
+    """
+    profiles = load_flag_profiles(cython_dev_tools_path)
+    profiles[module] = dict(extra_compile_args=list(compile_flags),
+                            extra_link_args=link_flags(compile_flags),
+                            tuned_at=datetime.now().isoformat(timespec='seconds'),
+                            **info)
+    with open(os.path.join(cython_dev_tools_path, FLAG_PROFILES_FILENAME), 'w') as fh:
+        json.dump(dict(modules=profiles), fh, indent=1)
+
+
+def link_flags(compile_flags: List[str]) -> List[str]:
+    return [f for f in compile_flags if f.startswith(LINK_FLAGS_PREFIXES)]
+
+
+def find_module_profile(profiles: dict, module_name: str) -> Optional[dict]:
+    """
+    The profile of the most specific package/module matching the module name (empty key matches all modules)
+    """
+    best_key = None
+    for key in profiles:
+        pkg = key.strip('.')
+        if not pkg or module_name == pkg or module_name.startswith(pkg + '.'):
+            if best_key is None or len(pkg) > len(best_key.strip('.')):
+                best_key = key
+    return profiles[best_key] if best_key is not None else None
+
+
+def apply_flag_profiles(ext_modules, profiles: dict, machine_id=None) -> int:
+    """
+    Appends profile flags to `extra_compile_args` / `extra_link_args` of cythonized extensions (after the defaults,
+    so i.e. `-O3` overrides distutils `-O2`)
+
+    :return: number of patched extensions
+    """
+    n_patched = 0
+    for ext in ext_modules:
+        profile = find_module_profile(profiles, ext.name)
+        if not profile:
+            continue
+        if machine_id and profile.get('machine_id') not in (None, machine_id):
+            log.warning(f'{ext.name}: flag profile was tuned on another machine, '
+                        f'{profile["extra_compile_args"]} may be suboptimal here (re-run `cytool tune-flags`)')
+        # New lists, extensions may share them after cythonize()
+        ext.extra_compile_args = list(ext.extra_compile_args or []) + profile['extra_compile_args']
+        ext.extra_link_args = list(ext.extra_link_args or []) + profile.get('extra_link_args', [])
+        log.debug(f'{ext.name}: applying flag profile {profile["extra_compile_args"]}')
+        n_patched += 1
+    return n_patched
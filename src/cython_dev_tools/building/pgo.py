@@ -0,0 +1,178 @@
+"""
+GCC profile-guided optimization (PGO) of Cython extensions
+
+`cytool build --pgo TARGET`:
+1. builds the project with `-fprofile-generate` in a separate variant tree
+2. runs the training target there (entry point call, or unit tests path), `.gcda` files are written next to objects
+3. saves `.gcda` per module at `.cython_dev_tools/pgo/` with the module source hash
+4. rebuilds the project with `-fprofile-use -fprofile-partial-training`
+
+The next release builds reuse the saved profiles; a module profile is ignored when the module source has changed.
+GCC looks for the profile next to the object file (i.e. `build/temp.*/<abs path>/module.gcda`), which is different
+in the variant tree and the project, so profiles are copied there before each build.
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from datetime import datetime
+from typing import Optional
+
+from cython_dev_tools.building.build import build, load_build_manifest, default_build_temp, extension_object_path
+from cython_dev_tools.building.variants import build_variant_tree, variant_env
+from cython_dev_tools.common import check_project_initialized, split_call_target, find_package_path
+from cython_dev_tools.logs import log
+
+PGO_DIRNAME = 'pgo'
+PGO_PROFILES_FILENAME = 'profiles.json'
+PGO_VARIANT_NAME = 'pgo_generate'
+
+PGO_GENERATE_FLAGS = ['-fprofile-generate']
+# Partial training: functions without profile (not executed, or inlined) are optimized as usual, not for size.
+# Line checksums always mismatch, they include the .c path (variant tree vs project), GCC still uses the counts;
+# the profile of the changed source is not applied at all (see `module_source_hash`)
+PGO_USE_FLAGS = ['-fprofile-use', '-fprofile-partial-training', '-Wno-coverage-mismatch', '-Wno-missing-profile']
+
+
+def module_source_hash(project_root, module_name) -> Optional[str]:
+    """
+    Hash of the module .pyx and .pxd sources, or None if the module source is not found
+    """
+    base_fn = os.path.join(project_root, *module_name.split('.'))
+    h = hashlib.sha1()
+    has_source = False
+    for ext in ('.pyx', '.pxd'):
+        if os.path.exists(base_fn + ext):
+            with open(base_fn + ext, 'rb') as fh:
+                h.update(fh.read())
+            has_source = True
+    return h.hexdigest() if has_source else None
+
+
+def load_pgo_profiles(cython_dev_tools_path) -> dict:
+    profiles_fn = os.path.join(cython_dev_tools_path, PGO_DIRNAME, PGO_PROFILES_FILENAME)
+    if not os.path.exists(profiles_fn):
+        return {}
+    with open(profiles_fn, 'r') as fh:
+        return json.load(fh)
+
+
+def apply_pgo_generate(ext_modules):
+    for ext in ext_modules:
+        ext.extra_compile_args = list(ext.extra_compile_args or []) + PGO_GENERATE_FLAGS
+        ext.extra_link_args = list(ext.extra_link_args or []) + PGO_GENERATE_FLAGS
+
+
+def apply_pgo_profiles(ext_modules, project_root, cython_dev_tools_path, build_temp) -> int:
+    """
+    Adds `-fprofile-use` to the extensions which have an up-to-date PGO profile, and copies the profile `.gcda`
+    next to the extension object file
+
+    :return: number of extensions with PGO
+    """
+    profiles = load_pgo_profiles(cython_dev_tools_path)
+    n_applied = 0
+    for ext in ext_modules:
+        profile = profiles.get(ext.name)
+        if not profile:
+            continue
+        if profile['source_hash'] != module_source_hash(project_root, ext.name):
+            log.warning(f'{ext.name}: source changed since PGO training, profile is ignored '
+                        f'(re-run `cytool build --pgo {profile["target"]}`)')
+            continue
+        object_fn = extension_object_path(ext, build_temp)
+        os.makedirs(os.path.dirname(object_fn), exist_ok=True)
+        shutil.copy(os.path.join(cython_dev_tools_path, PGO_DIRNAME, profile['gcda']),
+                    os.path.splitext(object_fn)[0] + '.gcda')
+        ext.extra_compile_args = list(ext.extra_compile_args or []) + PGO_USE_FLAGS
+        log.debug(f'{ext.name}: using PGO profile trained by {profile["target"]}')
+        n_applied += 1
+    return n_applied
+
+
+def run_pgo_training(variant_root, variant_tools_path, training_target):
+    """
+    Runs the training target with the instrumented build:
+    - entry point call, i.e. `package/module.pyx@main` or `package/module.pyx@process(1000)`
+    - unit tests path, i.e. `tests/` or `tests/test_parser.py`
+    """
+    env = variant_env(variant_root)
+    if '@' in training_target:
+        from cython_dev_tools.testing.bench import measure_call, BENCH_DIRNAME
+        if '(' not in training_target:
+            training_target += '()'
+        entry_target, entry_args = split_call_target(training_target)
+        _, package, entry_method = find_package_path(variant_root, entry_target)
+        bench_path = os.path.join(variant_tools_path, BENCH_DIRNAME)
+        os.makedirs(bench_path, exist_ok=True)
+        measure_call(variant_root, variant_tools_path, package, entry_method, entry_args, bench_path, env,
+                     processes=1, repeats=1, warmup=0, min_time=0)
+    else:
+        if not os.path.exists(os.path.join(variant_root, training_target)):
+            raise FileNotFoundError(f'PGO training target must be an entry point (package/module.pyx@func(args)) '
+                                    f'or unit tests path, got {training_target}')
+        ret = subprocess.call(['python', '-m', 'pytest', '-q', training_target], cwd=variant_root, env=env)
+        if ret == 5:
+            raise RuntimeError(f'No tests collected by PGO training target {training_target}')
+        if ret != 0:
+            log.warning(f'PGO training tests failed (exit code {ret}), the profile may be incomplete')
+
+
+def collect_pgo_profiles(project_root, cython_dev_tools_path, variant_root, variant_tools_path, training_target) -> int:
+    """
+    Saves `.gcda` files of the training run at `.cython_dev_tools/pgo/`
+
+    :return: number of profiled modules
+    """
+    pgo_path = os.path.join(cython_dev_tools_path, PGO_DIRNAME)
+    os.makedirs(pgo_path, exist_ok=True)
+    profiles = load_pgo_profiles(cython_dev_tools_path)
+
+    n_collected = 0
+    for module_name, m in load_build_manifest(variant_tools_path)['modules'].items():
+        gcda_fn = os.path.join(variant_root, os.path.splitext(m['object_path'])[0] + '.gcda')
+        if not os.path.exists(gcda_fn):
+            log.debug(f'{module_name}: no PGO profile (not loaded by training)')
+            profiles.pop(module_name, None)
+            continue
+        shutil.copy(gcda_fn, os.path.join(pgo_path, f'{module_name}.gcda'))
+        profiles[module_name] = dict(gcda=f'{module_name}.gcda',
+                                     source_hash=module_source_hash(project_root, module_name),
+                                     target=training_target,
+                                     trained_at=datetime.now().isoformat(timespec='seconds'))
+        n_collected += 1
+
+    with open(os.path.join(pgo_path, PGO_PROFILES_FILENAME), 'w') as fh:
+        json.dump(profiles, fh, indent=1)
+    return n_collected
+
+
+def pgo_build(project_root=None, training_target=None, annotate=False):
+    """
+    Full PGO cycle: instrumented variant build, training, and the project build with profiles
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+
+    log.info('PGO: building instrumented variant')
+    variant_root = build_variant_tree(project_root, cython_dev_tools_path, PGO_VARIANT_NAME, pgo_generate=True)
+    variant_tools_path = os.path.join(variant_root, os.path.basename(cython_dev_tools_path))
+
+    # Counters are accumulated by GCC, remove the previous training data
+    for m in load_build_manifest(variant_tools_path)['modules'].values():
+        gcda_fn = os.path.join(variant_root, os.path.splitext(m['object_path'])[0] + '.gcda')
+        if os.path.exists(gcda_fn):
+            os.unlink(gcda_fn)
+
+    log.info(f'PGO: training by {training_target}')
+    run_pgo_training(variant_root, variant_tools_path, training_target)
+
+    n_collected = collect_pgo_profiles(project_root, cython_dev_tools_path, variant_root, variant_tools_path,
+                                       training_target)
+    if n_collected == 0:
+        raise RuntimeError(f'No PGO profiles collected, training target {training_target} does not use '
+                           f'any project extension')
+    log.info(f'PGO: {n_collected} module profiles collected, rebuilding the project')
+
+    # Force: the profile has changed, but sources may not
+    build(project_root, force=True, annotate=annotate)
@@ -0,0 +1,83 @@
+"""
+Named build profiles
+
+A build profile is a release build with the given C compiler flags and Cython directives, built in its own variant
+tree (`.cython_dev_tools/variants/profile_<name>`), so switching between profiles doesn't rebuild the project.
+`run`, `tests` and `bench` with `--profile NAME` use the profile tree (updated incrementally before the run).
+
+Built-in profiles can be overridden, or new ones added, in the project config `cytool.json` at the project root:
+
+    {"build_profiles": {"fast": {"extra_compile_args": ["-O3", "-march=native"],
+                                 "compiler_directives": {"boundscheck": false},
+                                 "cython_debug": true}}}
+
+`cython_debug` writes C -> pyx mapping info of the profile tree (used by `cytool perf`).
+"""
+import json
+import os
+
+from cython_dev_tools.building.variants import build_variant_tree
+from cython_dev_tools.common import check_project_initialized
+from cython_dev_tools.logs import log
+
+PROJECT_CONFIG_FILENAME = 'cytool.json'
+PROFILE_VARIANT_PREFIX = 'profile_'
+
+BUILD_PROFILES = {
+    'fast': dict(extra_compile_args=['-O3', '-march=native']),
+    # Link time optimization across all C sources of each extension
+    'lto': dict(extra_compile_args=['-O3', '-flto=auto']),
+    'size': dict(extra_compile_args=['-Os']),
+    # Optimized, but with symbols, frame pointers and pyx mapping for native profilers (perf, valgrind),
+    # no line tracing
+    'profile': dict(extra_compile_args=['-O2', '-g', '-fno-omit-frame-pointer'], cython_debug=True),
+    # Cython functions report calls to Python profilers (cProfile)
+    'cprofile': dict(compiler_directives={'profile': True}, cython_debug=True),
+}
+BUILD_PROFILE_KEYS = {'extra_compile_args', 'compiler_directives', 'cython_debug'}
+
+
+def load_project_config(project_root) -> dict:
+    config_fn = os.path.join(project_root, PROJECT_CONFIG_FILENAME)
+    if not os.path.exists(config_fn):
+        return {}
+    with open(config_fn, 'r') as fh:
+        return json.load(fh)
+
+
+def get_build_profiles(project_root) -> dict:
+    """
+    Built-in build profiles updated by the project config
+    """
+    return dict(BUILD_PROFILES, **load_project_config(project_root).get('build_profiles', {}))
+
+
+def get_build_profile(project_root, name) -> dict:
+    profiles = get_build_profiles(project_root)
+    if name not in profiles:
+        raise ValueError(f'Unknown build profile `{name}`, available: {", ".join(sorted(profiles))}')
+    profile = profiles[name]
+    unknown_keys = set(profile) - BUILD_PROFILE_KEYS
+    if unknown_keys:
+        raise ValueError(f'Build profile `{name}` has unsupported keys {sorted(unknown_keys)}, '
+                         f'expected: {sorted(BUILD_PROFILE_KEYS)}')
+    return profile
+
+
+def build_profile(project_root, name, force=False, annotate=False) -> str:
+    """
+    Builds (incrementally) the profile variant tree
+
+    :return: profile tree root path
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    profile = get_build_profile(project_root, name)
+    log.debug(f'Build profile `{name}`: {profile}')
+
+    return build_variant_tree(project_root, cython_dev_tools_path, f'{PROFILE_VARIANT_PREFIX}{name}',
+                              force=force,
+                              annotate=annotate,
+                              compile_flags=profile.get('extra_compile_args', []),
+                              compiler_directives=profile.get('compiler_directives'),
+                              cython_debug=profile.get('cython_debug', False),
+                              build_profile=name)
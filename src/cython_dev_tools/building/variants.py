@@ -0,0 +1,121 @@
+"""
+Build variant trees
+
+A variant is a copy of the project source tree at `.cython_dev_tools/variants/<name>/` built with different
+settings (compiler directives, C flags, etc.), so several builds of the same code can coexist and be benchmarked
+by the same harness without touching the project build.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from cython_dev_tools.building.build import build
+from cython_dev_tools.building.flag_profiles import FLAG_PROFILES_FILENAME
+from cython_dev_tools.logs import log
+from cython_dev_tools.settings import CYTHON_TOOLS_DIRNAME
+
+VARIANTS_DIRNAME = 'variants'
+
+# Not copied into variant trees
+VARIANT_SKIP_DIRS = {CYTHON_TOOLS_DIRNAME, '.git', '.hg', '.svn', '.idea', '.vscode', '.tox', '.venv', 'venv',
+                     '__pycache__', 'build', 'dist', '.pytest_cache'}
+VARIANT_SKIP_EXT = {'.so', '.pyd', '.dll', '.o', '.obj', '.pyc', '.gcda', '.gcno'}
+
+
+def variant_name(prefix: str, settings: dict) -> str:
+    """
+    Stable variant tree name for the build settings, i.e. `exp_3f2a9c01b2`
+    """
+    settings_hash = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:10]
+    return f'{prefix}_{settings_hash}'
+
+
+def is_cython_generated(fn) -> bool:
+    """
+    .c/.cpp/.html file generated by Cython from .pyx with the same name
+    """
+    base, ext = os.path.splitext(fn)
+    return ext in ('.c', '.cpp', '.html') and os.path.exists(base + '.pyx')
+
+
+def sync_variant_tree(project_root, variant_root):
+    """
+    Copies project sources into the variant tree, only changed files are copied (with mtime preserved),
+    so the following variant builds are incremental. Files removed from the project are removed from the variant.
+    """
+    os.makedirs(os.path.join(variant_root, CYTHON_TOOLS_DIRNAME), exist_ok=True)
+
+    n_copied = 0
+    project_files = set()
+    for dirpath, dirnames, filenames in os.walk(project_root, followlinks=True):
+        dirnames[:] = [d for d in dirnames if d not in VARIANT_SKIP_DIRS and not d.endswith('.egg-info')]
+        rel_dir = os.path.relpath(dirpath, project_root)
+        for fn in filenames:
+            src_fn = os.path.join(dirpath, fn)
+            if os.path.splitext(fn)[1] in VARIANT_SKIP_EXT or is_cython_generated(src_fn):
+                continue
+            rel_fn = os.path.normpath(os.path.join(rel_dir, fn))
+            project_files.add(rel_fn)
+
+            dst_fn = os.path.join(variant_root, rel_fn)
+            src_stat = os.stat(src_fn)
+            if os.path.exists(dst_fn):
+                dst_stat = os.stat(dst_fn)
+                if dst_stat.st_mtime == src_stat.st_mtime and dst_stat.st_size == src_stat.st_size:
+                    continue
+            os.makedirs(os.path.dirname(dst_fn), exist_ok=True)
+            shutil.copy2(src_fn, dst_fn)
+            n_copied += 1
+
+    # Remove sources deleted from the project (but keep build artifacts)
+    for dirpath, dirnames, filenames in os.walk(variant_root):
+        dirnames[:] = [d for d in dirnames if d not in VARIANT_SKIP_DIRS]
+        for fn in filenames:
+            dst_fn = os.path.join(dirpath, fn)
+            rel_fn = os.path.relpath(dst_fn, variant_root)
+            if rel_fn not in project_files and os.path.splitext(fn)[1] not in VARIANT_SKIP_EXT \
+                    and not is_cython_generated(dst_fn):
+                os.unlink(dst_fn)
+
+    # Variant builds use the same flag profiles as the project build
+    profiles_fn = os.path.join(project_root, CYTHON_TOOLS_DIRNAME, FLAG_PROFILES_FILENAME)
+    variant_profiles_fn = os.path.join(variant_root, CYTHON_TOOLS_DIRNAME, FLAG_PROFILES_FILENAME)
+    if os.path.exists(profiles_fn):
+        shutil.copy2(profiles_fn, variant_profiles_fn)
+    elif os.path.exists(variant_profiles_fn):
+        os.unlink(variant_profiles_fn)
+
+    log.debug(f'Variant tree {variant_root}: {n_copied} files updated')
+
+
+def build_variant_tree(project_root, cython_dev_tools_path, name, **build_kwargs) -> str:
+    """
+    Syncs the variant tree with the project sources and builds it
+
+    :param name: variant name (tree dir name)
+    :param build_kwargs: `build()` arguments, i.e. compiler_directives
+    :return: variant tree root path
+    """
+    variant_root = os.path.join(cython_dev_tools_path, VARIANTS_DIRNAME, name)
+    sync_variant_tree(project_root, variant_root)
+
+    log.info(f'Building variant `{name}`: {build_kwargs}')
+    prev_dir = os.getcwd()
+    try:
+        build(variant_root, **build_kwargs)
+    finally:
+        os.chdir(prev_dir)
+    return variant_root
+
+
+def variant_env(variant_root) -> dict:
+    """
+    Environment for running python code with the variant build
+    """
+    my_env = os.environ.copy()
+    if "PYTHONPATH" in my_env:
+        my_env["PYTHONPATH"] = f"{variant_root}:" + my_env["PYTHONPATH"]
+    else:
+        my_env["PYTHONPATH"] = f"{variant_root}"
+    return my_env
@@ -1,4 +1,7 @@
+import hashlib
+import json
 import os
+import platform
 import re
 from typing import List
 
@@ -39,9 +42,32 @@ def make_run_args(code_file, package, entry_method, escape=False, pytest=False)
                 return ['-c', f'import {package}; {package}.{entry_method}();']
 
 
-def check_method_args(args_str: str):
+def log_exit_code(ret: int, run_target: str):
+    """
+    Logs python process exit code (negative codes are signals as in subprocess.Popen)
+    """
+    if ret == 0:
+        log.trace(f'python correctly finished')
+    elif ret == -11:
+        # Segmentation fault
+        log.critical(f'Python SEGMENTATION FAULT during running: {run_target} ErrCode: {ret}, try to run with `debug` command')
+    elif ret == -5:
+        log.critical(f'Python POSSIBLE unhandled breakpoint during running: {run_target} ErrCode: {ret}, try to run with `debug` command')
+    else:
+        log.error(f'Python returned error while running: {run_target} ErrCode: {ret}')
+
+
+# Fixture factories in arguments, i.e. `(@fixture:make_data(1000), n=5)`, see testing/fixtures.py
+FIXTURE_LOADER_NAME = '__cytool_fixture__'
+RE_FIXTURE_REF = re.compile(r'@fixture:([A-Za-z_][\w.]*)\s*\(')
+
+
+def check_method_args(args_str: str, variables: dict = None):
     """
     Parses primitive arguments and decide if they are OK for passing as entry point function
+
+    :param variables: names available in the arguments string, i.e. {'n': 1000} for `(n, k=n // 2)`,
+        `@fixture:factory(args)` references require fixture loader variable (see `testing.fixtures.fixture_variables()`)
     """
     if not args_str:
         # Empty args / kwargs
@@ -51,14 +77,34 @@ def check_method_args(args_str: str):
     if not args_str.startswith('(') or not args_str.endswith(')'):
         raise ValueError(f'Arguments must start with "(" and end with ")"')
 
+    if RE_FIXTURE_REF.search(args_str):
+        if FIXTURE_LOADER_NAME not in (variables or {}):
+            raise ValueError(f'@fixture: arguments are not supported in this context, got `{args_str}`')
+        # @fixture:make_data(1000) -> __cytool_fixture__('make_data')(1000)
+        args_str = RE_FIXTURE_REF.sub(lambda m: f"{FIXTURE_LOADER_NAME}('{m.group(1)}')(", args_str)
+
     def __test_args(*args, **kwargs):
         return args, kwargs
     try:
-        return eval(f"__test_args{args_str}")
+        return eval(f"__test_args{args_str}", None, dict(variables or {}, __test_args=__test_args))
     except Exception as exc:
         raise ValueError(f'Error parsing arguments `{args_str}`, it must only contain primitive or builtin types, err: {exc}')
 
 
+def split_call_target(call_target: str):
+    """
+    Splits call target into entry point and arguments string
+
+    :param call_target: i.e. package/sub_package/module.pyx@main() or package.module@main(1, 2, n=5)
+    :return: ('package.module@main', '(1, 2, n=5)')
+    """
+    if '(' not in call_target or not call_target.endswith(')') or '@' not in call_target:
+        raise ValueError(f'Target (got {call_target}) should be a package path with entry point with args, '
+                         f'e.g. package/sub_package/module.pyx@main() or package.module@main(1, 2, n=5)')
+    arg_i = call_target.index('(')
+    return call_target[:arg_i], call_target[arg_i:]
+
+
 def check_method_exists(code_file, method_def, as_entry=False) -> bool:
     """
     Check is the file contains method in its source code, raises ValueError on failure
@@ -312,3 +358,30 @@ def parse_input(input_type, default=None, prompt='', regex=None, n_trials=3):
         raise ValueError(f'Input validation failed')
 
     return valid_value
+
+
+def machine_fingerprint() -> dict:
+    """
+    Hardware / software info which affects the performance
+    """
+    cpu_model = platform.processor()
+    try:
+        with open('/proc/cpuinfo', 'r') as fh:
+            for l in fh:
+                if l.startswith('model name'):
+                    cpu_model = l.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+
+    info = dict(
+        node=platform.node(),
+        system=platform.system(),
+        machine=platform.machine(),
+        cpu_model=cpu_model,
+        cpu_count=os.cpu_count(),
+        python=platform.python_version(),
+        python_implementation=platform.python_implementation(),
+    )
+    info['id'] = hashlib.sha1(json.dumps(info, sort_keys=True).encode()).hexdigest()[:16]
+    return info
@@ -44,6 +44,18 @@ def main(argv=None):
     parser_build.add_argument('--debug', '-d', action='store_true', help='build debug version for coverage and GDB')
     parser_build.add_argument('--annotate', '-a', action='store_true', help='create HTML annotation file nearby .pyx')
     parser_build.add_argument('--force', '-f', action='store_true', help='force rebuilding all cython files')
+    parser_build.add_argument('--trace-only', '-t', action='append',
+                              help='with --debug: line tracing only for matching package/module (can be used multiple times), '
+                                   'the rest is built as release')
+    parser_build.add_argument('--no-flag-profiles', action='store_true',
+                              help='do not apply C compiler flag profiles saved by `cytool tune-flags --save`')
+    parser_build.add_argument('--pgo', metavar='TRAINING_TARGET',
+                              help='profile-guided optimization build: builds instrumented variant, runs the training target\n'
+                                   '(entry point call `package/module.pyx@func(args)` or unit tests path) and rebuilds with profiles')
+    parser_build.add_argument('--no-pgo', action='store_true', help='do not apply PGO profiles saved by `cytool build --pgo`')
+    parser_build.add_argument('--profile',
+                              help='named build profile (built-in: fast, lto, size, profile, or from `cytool.json` project config), '
+                                   f'built in a separate tree `{CYTHON_TOOLS_DIRNAME}/variants/profile_<name>`')
     parser_build.set_defaults(func=cython_dev_tools.building.build_command)
 
     #
@@ -55,6 +67,11 @@ def main(argv=None):
     parser_cover.add_argument('--coverage-engine', help=f'Test runner package (pytest only tested so far)', default='pytest')
     parser_cover.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
     parser_cover.add_argument('--browser', '-b', action='store_true',  help='Open url in browser when coverage is ready')
+    parser_cover.add_argument('--test-contexts', '-c', action='store_true',
+                              help='Record lines executed by each test, required for `tests --affected`')
+    parser_cover.add_argument('--trace-only', '-t', action='append',
+                              help='Line tracing only for matching package/module (can be used multiple times), '
+                                   'the rest is built as release')
     parser_cover.set_defaults(func=cython_dev_tools.testing.coverage_command)
 
     #
@@ -68,6 +85,12 @@ def main(argv=None):
                                                          f'"." - all in project \n'
                                                          f'"package_name/" - all in package including subpackages ')
     parser_annotate.add_argument('--append', '-a', action='store_true', help='Instead of cleaning up previous annotation index, appends new to the structure')
+    parser_annotate.add_argument('--profile', metavar='PROFILE_JSON',
+                                 help=f'Overlay line timings heatmap of the profile (`cytool lprun`, `perf`, `callgrind` or `cachegrind` JSON\n'
+                                      f'at {CYTHON_TOOLS_DIRNAME}/profiles/), function lines show the function total,\n'
+                                      f'hot lines with Python interaction (yellow) are outlined and listed on top')
+    parser_annotate.add_argument('--hot-threshold', type=float, default=1.0,
+                                 help='Minimal line self time, percent of the profile total, for "hot and yellow" lines (default: 1.0)')
     parser_annotate.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
     parser_annotate.add_argument('--browser', '-b', action='store_true',  help='Open url in browser when annotation is ready')
     parser_annotate.set_defaults(func=cython_dev_tools.building.annotate_command)
@@ -109,7 +132,7 @@ def main(argv=None):
     # `valgrind` command arguments
     #
     parser_valgrind = subparsers.add_parser('valgrind',
-                                            description='Checks memory leaks with Valgrind tool',
+                                            description='Checks memory errors and leaks with Valgrind memcheck, identical stacks are grouped, leaks sorted by bytes lost',
                                             formatter_class=RawTextHelpFormatter)
     parser_valgrind.add_argument('run_target',
                             help=f'A python/cython module path (must be relative to project root!)\n'
@@ -125,6 +148,131 @@ def main(argv=None):
     parser_valgrind.add_argument('--no-replace', '-r', action='store_false', help='Don\'t replace Cython raw c-functions names by mapping pyx code')
     parser_valgrind.set_defaults(func=cython_dev_tools.debugger.valgrind_command)
 
+    #
+    # `perf` command arguments
+    #
+    parser_perf = subparsers.add_parser('perf',
+                                        description='Samples Cython entry point call with Linux `perf record` in the `profile` build\n'
+                                                    '(optimized, with frame pointers), C symbols and lines are mapped to pyx functions and lines.\n'
+                                                    'Prints hot functions / lines, saves the profile JSON and collapsed stacks (.folded)\n'
+                                                    f'at `{CYTHON_TOOLS_DIRNAME}/profiles/`',
+                                        formatter_class=RawTextHelpFormatter)
+    parser_perf.add_argument('action', choices=['record', 'report'],
+                             help='record - run the target under perf\n'
+                                  'report - re-read perf data (default: the last recorded)')
+    parser_perf.add_argument('target', nargs='?',
+                             help=f'record: a cython module path with function and optional arguments (must be relative to project root!)\n'
+                                  f'report: perf data file\n'
+                                  f'Examples:\n'
+                                  f'cy_tools_samples/profiler/cy_module.pyx@approx_pi2(100000)\n'
+                                  f'cy_tools_samples.profiler.cy_module@approx_pi2\n'
+                             )
+    parser_perf.add_argument('--duration', '-d', type=float, default=1.0,
+                             help='The target is called repeatedly for at least DURATION seconds (default: %(default)s)')
+    parser_perf.add_argument('--frequency', '-F', type=int, default=999, help='Sampling frequency, Hz (default: %(default)s)')
+    parser_perf.add_argument('--call-graph', choices=['fp', 'dwarf'], default='fp',
+                             help='Stack unwinding: fp - frame pointers, dwarf - debug info, slower, but sees through libraries\n'
+                                  'built without frame pointers (default: %(default)s)')
+    parser_perf.add_argument('--limit', '-l', type=int, default=20, help='Number of hot functions / lines to show (default: %(default)s)')
+    parser_perf.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_perf.set_defaults(func=cython_dev_tools.debugger.perf_command)
+
+    #
+    # `callgrind` command arguments
+    #
+    parser_callgrind = subparsers.add_parser('callgrind',
+                                             description='Counts instructions of Cython entry point call with valgrind callgrind in the `profile` build,\n'
+                                                         'collected only inside the entry function (no interpreter startup). C functions and lines are\n'
+                                                         'mapped to pyx functions and lines. Saves the profile JSON, pyx-mapped callgrind file (kcachegrind)\n'
+                                                         f'at `{CYTHON_TOOLS_DIRNAME}/profiles/`, and instructions per call to the performance history',
+                                             formatter_class=RawTextHelpFormatter)
+    parser_callgrind.add_argument('target',
+                                  help=f'A cython module path with def / cpdef function and optional arguments (must be relative to project root!)\n'
+                                       f'Examples:\n'
+                                       f'cy_tools_samples/profiler/cy_module.pyx@approx_pi2(1000)\n'
+                                       f'cy_tools_samples.profiler.cy_module@approx_pi2\n'
+                                  )
+    parser_callgrind.add_argument('--calls', '-n', type=int, default=1, help='Number of the target calls (default: %(default)s)')
+    parser_callgrind.add_argument('--compare', '-c', metavar='BASELINE',
+                                  help='Compare instructions per call with baseline, exit code is 1 if increased by more than --max-change\n'
+                                       'BASELINE - git revision (the last result measured at it), callgrind profile JSON file, or `last`\n')
+    parser_callgrind.add_argument('--max-change', type=float, default=0.01,
+                                  help='Relative instructions per call increase reported as regression (default: %(default)s)')
+    parser_callgrind.add_argument('--limit', '-l', type=int, default=20, help='Number of hot functions / lines to show (default: %(default)s)')
+    parser_callgrind.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_callgrind.set_defaults(func=cython_dev_tools.debugger.callgrind_command)
+
+    #
+    # `cachegrind` command arguments
+    #
+    parser_cachegrind = subparsers.add_parser('cachegrind',
+                                              description='Simulates caches and branch prediction of Cython entry point call with valgrind cachegrind\n'
+                                                          'in the `profile` build. D1 / LL cache misses and branch mispredicts are attributed to pyx lines.\n'
+                                                          f'Saves the profile JSON of the --sort metric at `{CYTHON_TOOLS_DIRNAME}/profiles/`',
+                                              formatter_class=RawTextHelpFormatter)
+    parser_cachegrind.add_argument('target',
+                                   help=f'A cython module path with function and optional arguments (must be relative to project root!)\n'
+                                        f'Examples:\n'
+                                        f'cy_tools_samples/profiler/cy_module.pyx@approx_pi2(1000)\n'
+                                        f'cy_tools_samples.profiler.cy_module@approx_pi2\n'
+                                   )
+    parser_cachegrind.add_argument('--calls', '-n', type=int, default=1, help='Number of the target calls (default: %(default)s)')
+    parser_cachegrind.add_argument('--sort', '-s', choices=['Ir', 'D1', 'LL', 'mispredicts'], default='D1',
+                                   help='Metric of the lines order and the saved profile (default: %(default)s)\n'
+                                        'Ir - instructions, D1 / LL - data cache misses, mispredicts - branch mispredicts')
+    parser_cachegrind.add_argument('--limit', '-l', type=int, default=20, help='Number of pyx lines to show (default: %(default)s)')
+    parser_cachegrind.add_argument('--annotate', '-a', action='store_true', help='Annotate pyx modules with the metric heatmap')
+    parser_cachegrind.add_argument('--browser', '-b', action='store_true', help='Open the annotation in the browser')
+    parser_cachegrind.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_cachegrind.set_defaults(func=cython_dev_tools.debugger.cachegrind_command)
+
+    #
+    # `massif` command arguments
+    #
+    parser_massif = subparsers.add_parser('massif',
+                                          description='Heap profile of Cython entry point call with valgrind massif in the `profile` build.\n'
+                                                      'Allocation stacks are attributed to the innermost pyx line, the report with the heap timeline\n'
+                                                      f'by pyx allocation sites is saved at `{CYTHON_TOOLS_DIRNAME}/massif/`',
+                                          formatter_class=RawTextHelpFormatter)
+    parser_massif.add_argument('target',
+                               help=f'A cython module path with function and optional arguments (must be relative to project root!)\n'
+                                    f'Examples:\n'
+                                    f'cy_tools_samples/low_level/dynamic_memory.pyx@main\n'
+                                    f'cy_tools_samples.profiler.cy_module@approx_pi2(1000)\n'
+                               )
+    parser_massif.add_argument('--calls', '-n', type=int, default=1, help='Number of the target calls (default: %(default)s)')
+    parser_massif.add_argument('--depth', type=int, default=30, help='Maximum depth of allocation stacks (default: %(default)s)')
+    parser_massif.add_argument('--threshold', type=float, default=0.5,
+                               help='Allocations below this percent of the heap are merged (default: %(default)s)')
+    parser_massif.add_argument('--limit', '-l', type=int, default=20, help='Number of allocation sites to show (default: %(default)s)')
+    parser_massif.add_argument('--browser', '-b', action='store_true', help='Open the heap timeline report in the browser')
+    parser_massif.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_massif.set_defaults(func=cython_dev_tools.debugger.massif_command)
+
+    #
+    # `dhat` command arguments
+    #
+    parser_dhat = subparsers.add_parser('dhat',
+                                        description='Allocation churn of Cython entry point call with valgrind DHAT in the `profile` build.\n'
+                                                    'Allocations are attributed to the innermost pyx line, call sites are ranked by allocated blocks,\n'
+                                                    f'bytes, average lifetime or access ratio, the report is saved at `{CYTHON_TOOLS_DIRNAME}/dhat/`',
+                                        formatter_class=RawTextHelpFormatter)
+    parser_dhat.add_argument('target',
+                             help=f'A cython module path with function and optional arguments (must be relative to project root!)\n'
+                                  f'Examples:\n'
+                                  f'cy_tools_samples/profiler/cy_module.pyx@approx_pi2(1000)\n'
+                                  f'cy_tools_samples.profiler.cy_module@approx_pi2\n'
+                             )
+    parser_dhat.add_argument('--calls', '-n', type=int, default=1, help='Number of the target calls (default: %(default)s)')
+    parser_dhat.add_argument('--sort', '-s', choices=['blocks', 'bytes', 'lifetime', 'access'], default='blocks',
+                             help='Call sites order (default: %(default)s)\n'
+                                  'blocks / bytes - allocated, the most first\n'
+                                  'lifetime - average block lifetime, the shortest first\n'
+                                  'access - reads and writes per allocated byte, the lowest first')
+    parser_dhat.add_argument('--limit', '-l', type=int, default=20, help='Number of call sites to show (default: %(default)s)')
+    parser_dhat.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_dhat.set_defaults(func=cython_dev_tools.debugger.dhat_command)
+
     #
     # `run` command arguments
     #
@@ -140,6 +288,8 @@ def main(argv=None):
                                  f'package.sub_package.cy_module@main - starts main() in Cython module, entry point is mandatory\n'
                             )
     parser_run.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_run.add_argument('--warm', '-w', action='store_true', help=f'Run in the process forked from pre-warmed server (see `warm` command)')
+    parser_run.add_argument('--profile', help='Use the named build profile tree (see `build --profile`)')
     parser_run.set_defaults(func=cython_dev_tools.debugger.run_command)
 
     #
@@ -159,8 +309,35 @@ def main(argv=None):
     parser_tests.add_argument('--quiet', '-q', action='store_true', help=f'Reduces test suite verbosity to minimum')
     parser_tests.add_argument('--disable-warnings', '-w', action='store_true', help=f'Ignore all warnings')
     parser_tests.add_argument('--lf', '-l', action='store_true', help=f'Run only last failed')
+    parser_tests.add_argument('--affected', '-a', action='store_true',
+                              help=f'Run only tests which execute changed lines (requires `cover --test-contexts` run first)')
+    parser_tests.add_argument('--workers', '-n', type=int,
+                              help=f'Run test modules in N parallel worker processes, crashed workers (i.e. segfault) are respawned\n'
+                                   f'and the rest of tests continues')
+    parser_tests.add_argument('--warm', action='store_true',
+                              help=f'Run in the process forked from pre-warmed server with all project modules imported (see `warm` command)')
+    parser_tests.add_argument('--report', '-r', choices=['slow', 'memory'],
+                              help=f'Do not run tests, show the slowest / the most memory-hungry tests by the last run history\n'
+                                   f'(duration, CPU time and peak RSS of each test are recorded at every run)')
+    parser_tests.add_argument('--regression-factor', type=float, default=2.0,
+                              help=f'Warn if test duration or RSS growth exceeds FACTOR * median of its previous runs '
+                                   f'(default: %(default)s, 0 - disable)')
+    parser_tests.add_argument('--affected-base', help=f'Git revision for changes lookup (default: revision of the last `cover --test-contexts`)')
+    parser_tests.add_argument('--profile', help='Use the named build profile tree (see `build --profile`)')
     parser_tests.set_defaults(func=cython_dev_tools.testing.tests_command)
 
+    #
+    # `warm` command arguments
+    #
+    parser_warm = subparsers.add_parser('warm',
+                                        description='Starts pre-warmed fork server for `tests --warm` / `run --warm` commands.\n'
+                                                    'The server keeps pytest, numpy and project extension modules imported, and\n'
+                                                    'restarts automatically when the project is rebuilt.',
+                                        formatter_class=RawTextHelpFormatter)
+    parser_warm.add_argument('--stop', '-s', action='store_true', help='Stop the server')
+    parser_warm.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_warm.set_defaults(func=cython_dev_tools.testing.warm_command)
+
     #
     # `clean` command arguments
     #
@@ -200,6 +377,8 @@ def main(argv=None):
                                    f'-f recip_square2 - another function in `profile_target` module`\n'
                                    f'-f SomeClass.class_method - class method profile\n'
                                    f'-f cy_tools_samples.profiler.cy_module.pyx@SQ.recip_square_ - another package with class\n'
+                                   f'-f package/module.pyx@cdef_func - cdef functions and cdef class methods are profiled\n'
+                                   f'   in a separate call by Cython line trace events (requires `build --debug`)\n'
                               )
 
     parser_lprun.add_argument('--module', '-m',
@@ -210,9 +389,136 @@ def main(argv=None):
                                    f'-m cy_tools_samples.profiler.cy_module - by package\n'
                               )
 
+    parser_lprun.add_argument('--auto', '-a', action='store_true',
+                              help=f'Run cProfile pass first, then line profile only hot functions of the entry point package\n'
+                                   f'(with subpackages), instead of instrumenting entire modules with -m\n')
+    parser_lprun.add_argument('--auto-threshold', type=float, default=5.0,
+                              help=f'Minimal self time of the function, percent of the total, for --auto (default: 5.0)\n')
+    parser_lprun.add_argument('--repeats', '-r', type=int, default=5,
+                              help=f'Number of profiled calls of the target in the clean python process, line timings\n'
+                                   f'are averaged with stdev (default: 5)\n')
+    parser_lprun.add_argument('--limit', '-l', type=int, default=10,
+                              help=f'Number of lines in the hot lines table (default: 10)\n')
+    parser_lprun.add_argument('--trace-only', '-t', action='append',
+                              help=f'Rebuild with line tracing only for matching package/module (can be used multiple times), '
+                                   f'the rest is built as release for near production speed\n'
+                                   f'Example: -t cy_tools_samples.profiler\n')
     parser_lprun.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
     parser_lprun.set_defaults(func=cython_dev_tools.testing.lprun_command)
+
+    #
+    # `profile` command arguments
+    #
+    parser_profile = subparsers.add_parser('profile',
+                                           description='Function-level profile with call tree of Cython entry point call, exported as\n'
+                                                       'flamegraph SVG/HTML and speedscope JSON (https://www.speedscope.app), frames are\n'
+                                                       'labeled by pyx qualified names. By default cProfile in the `cprofile` build\n'
+                                                       '(Cython profile=True directive), or perf samples of the `profile` build with --perf.\n'
+                                                       'Compares saved profiles with --diff',
+                                           formatter_class=RawTextHelpFormatter)
+    parser_profile.add_argument('profile_target', nargs='?',
+                                help=f'A python/cython module path with function and optional arguments (must be relative to project root!)\n'
+                                     f'Examples:\n'
+                                     f'cy_tools_samples/profiler/cy_module.pyx@approx_pi2(100000)\n'
+                                     f'cy_tools_samples.profiler.cy_module@approx_pi2(n=100000)\n'
+                                )
+    parser_profile.add_argument('--diff', nargs=2, metavar=('A', 'B'),
+                                help='Compare two saved profiles (lprun, perf or cProfile JSON), A - before, B - after,\n'
+                                     'prints functions and lines ranked by the share change, and saves differential flamegraph\n'
+                                     f'Example: --diff {CYTHON_TOOLS_DIRNAME}/profiles/A.json {CYTHON_TOOLS_DIRNAME}/profiles/B.json')
+    parser_profile.add_argument('--perf', action='store_true', help='Sample with Linux perf instead of cProfile (see `perf` command)')
+    parser_profile.add_argument('--duration', '-d', type=float, default=1.0,
+                                help='The target is called repeatedly for at least DURATION seconds (default: %(default)s)')
+    parser_profile.add_argument('--limit', '-l', type=int, default=20, help='Number of hot functions to show (default: %(default)s)')
+    parser_profile.add_argument('--browser', '-b', action='store_true', help='Open flamegraph in the browser')
+    parser_profile.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_profile.set_defaults(func=cython_dev_tools.testing.profile_command)
+
+    #
+    # `bench` command arguments
+    #
+    parser_bench = subparsers.add_parser('bench',
+                                         description='Benchmarks Cython/Python entry point function in several fresh processes',
+                                         formatter_class=RawTextHelpFormatter)
+    parser_bench.add_argument('bench_target',
+                              help=f'A python/cython module path with function and arguments (must be relative to project root!)\n'
+                                   f'Examples:\n'
+                                   f'cy_tools_samples/profiler/cy_module.pyx@approx_pi2(10)\n'
+                                   f'cy_tools_samples.profiler.cy_module@approx_pi2(n=10)\n'
+                              )
+    parser_bench.add_argument('--processes', '-P', type=int, default=5, help='Number of fresh python processes (default: %(default)s)')
+    parser_bench.add_argument('--repeats', '-r', type=int, default=5, help='Number of samples per process (default: %(default)s)')
+    parser_bench.add_argument('--warmup', '-w', type=int, default=1, help='Number of warmup calls in each process (default: %(default)s)')
+    parser_bench.add_argument('--min-time', type=float, default=0.2,
+                              help='Minimal time of one sample in seconds, the number of loops is calibrated by it (default: %(default)s)')
+    parser_bench.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the mean interval (default: %(default)s)')
+    parser_bench.add_argument('--output', '-o', help=f'Results JSON file (default: `{CYTHON_TOOLS_DIRNAME}/bench/<package>.<func>_<datetime>.json`)')
+    parser_bench.add_argument('--compare', '-c', metavar='BASELINE',
+                              help=f'Compare with baseline, exit code is 1 on significant slowdown (Mann-Whitney U test)\n'
+                                   f'BASELINE - git revision (the last result measured at it), results JSON file, or `last`\n')
+    parser_bench.add_argument('--sweep', '-s', metavar='VAR=START:STOP:STEP',
+                              help=f'Run benchmark for each value of the variable used in arguments, fit empirical complexity\n'
+                                   f'and draw the scaling plot, STEP is a number or `log10` / `log2` for geometric range\n'
+                                   f'Example: cy_module.pyx@approx_pi2(n) --sweep n=1e3:1e6:log10\n')
+    parser_bench.add_argument('--browser', '-b', action='store_true', help='Open sweep scaling plot in the browser')
+    parser_bench.add_argument('--alpha', type=float, default=0.05, help='Significance level of the slowdown test (default: %(default)s)')
+    parser_bench.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_bench.add_argument('--profile', help='Use the named build profile tree (see `build --profile`)')
+    parser_bench.set_defaults(func=cython_dev_tools.testing.bench_command)
     
+    #
+    # `experiment` command arguments
+    #
+    parser_experiment = subparsers.add_parser('experiment',
+                                              description='Builds each combination of Cython compiler directive values into a separate\n'
+                                                          'variant tree and benchmarks them, the first values combination is a baseline',
+                                              formatter_class=RawTextHelpFormatter)
+    parser_experiment.add_argument('--directives', '-d', action='append', required=True,
+                                   help='Directive values to try (can be used multiple times)\n'
+                                        'Example: -d boundscheck=True,False -d wraparound=True,False')
+    parser_experiment.add_argument('--module', '-m', action='append',
+                                   help='Apply directives only to the matching package/module (can be used multiple times)\n'
+                                        'Example: -m cy_tools_samples.profiler.cy_module')
+    parser_experiment.add_argument('--bench', '-b', required=True,
+                                   help='Benchmark target (see `bench` command)\n'
+                                        'Example: -b cy_tools_samples/profiler/cy_module.pyx@approx_pi2(1000)')
+    parser_experiment.add_argument('--processes', '-P', type=int, default=5, help='Number of fresh python processes per variant (default: %(default)s)')
+    parser_experiment.add_argument('--repeats', '-r', type=int, default=5, help='Number of samples per process (default: %(default)s)')
+    parser_experiment.add_argument('--warmup', '-w', type=int, default=1, help='Number of warmup calls in each process (default: %(default)s)')
+    parser_experiment.add_argument('--min-time', type=float, default=0.2, help='Minimal time of one sample in seconds (default: %(default)s)')
+    parser_experiment.add_argument('--confidence', type=float, default=0.95, help='Confidence level of speedup intervals (default: %(default)s)')
+    parser_experiment.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_experiment.set_defaults(func=cython_dev_tools.testing.experiment_command)
+
+    #
+    # `tune-flags` command arguments
+    #
+    parser_tune_flags = subparsers.add_parser('tune-flags',
+                                              description='Greedy search of C compiler flags per module for the fastest benchmark, each flag set is built\n'
+                                                          'in a separate variant tree. The best flags can be saved as a per-module profile\n'
+                                                          '(`.cython_dev_tools/flag_profiles.json`), which is applied by the next release builds',
+                                              formatter_class=RawTextHelpFormatter)
+    parser_tune_flags.add_argument('--bench', '-b', required=True,
+                                   help='Benchmark target (see `bench` command)\n'
+                                        'Example: -b cy_tools_samples/profiler/cy_module.pyx@approx_pi2(1000)')
+    parser_tune_flags.add_argument('--module', '-m', action='append',
+                                   help='Tune flags of the matching package/module (can be used multiple times),\n'
+                                        'each module is searched separately, the others keep their flags\n'
+                                        'Default: the benchmark target module')
+    parser_tune_flags.add_argument('--flags', '-f', action='append',
+                                   help='Flags search space option, alternatives separated by `|` (can be used multiple times)\n'
+                                        'Example: --flags="-O2|-O3" --flags=-march=native\n'
+                                        'Default: "-O2|-O3", -march=native, -ffast-math, -funroll-loops, \n'
+                                        '         -fno-semantic-interposition, -flto')
+    parser_tune_flags.add_argument('--save', '-s', action='store_true', help='Save the best flags as the modules flag profile')
+    parser_tune_flags.add_argument('--processes', '-P', type=int, default=5, help='Number of fresh python processes per flag set (default: %(default)s)')
+    parser_tune_flags.add_argument('--repeats', '-r', type=int, default=5, help='Number of samples per process (default: %(default)s)')
+    parser_tune_flags.add_argument('--warmup', '-w', type=int, default=1, help='Number of warmup calls in each process (default: %(default)s)')
+    parser_tune_flags.add_argument('--min-time', type=float, default=0.1, help='Minimal time of one sample in seconds (default: %(default)s)')
+    parser_tune_flags.add_argument('--alpha', type=float, default=0.05, help='Significance level of the flag improvement test (default: %(default)s)')
+    parser_tune_flags.add_argument('--project-root', '-p', help=f'A project root path and also `{CYTHON_TOOLS_DIRNAME}` working dir')
+    parser_tune_flags.set_defaults(func=cython_dev_tools.testing.tune_flags_command)
+
     #
     # `template` command arguments
     #
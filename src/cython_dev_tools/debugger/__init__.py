@@ -1,3 +1,8 @@
 from .debug import debug_command, debug
 from .run import run_command, run
-from .valgrind import valgrind_command, valgrind
\ No newline at end of file
+from .valgrind import valgrind_command, valgrind
+from .perf import perf_command, perf_record, perf_report
+from .callgrind import callgrind_command, callgrind
+from .cachegrind import cachegrind_command, cachegrind
+from .massif import massif_command, massif
+from .dhat import dhat_command, dhat
@@ -0,0 +1,198 @@
+"""
+Cache and branch prediction simulation: valgrind cachegrind of the `profile` build (optimized, with symbols)
+
+D1 / LL cache misses and branch mispredicts of Cython C code are attributed to pyx lines by `cython_debug` info
+(see `perf.map_cython_frame()`), i.e. to compare data layouts (SoA vs AoS of cdef structs), which wall time doesn't
+explain. Cachegrind counts the whole process, so shares are of the pyx code costs (the interpreter startup excluded).
+The profile of the selected metric is saved in the common format (see `testing/profile_data.py`), for the annotation
+heatmap overlay (`cytool annotate --profile`) and `cytool profile --diff`.
+"""
+import os
+
+from cython_dev_tools.common import open_url_in_browser
+from cython_dev_tools.debugger.callgrind import parse_callgrind
+from cython_dev_tools.debugger.perf import map_cython_frame
+from cython_dev_tools.debugger.valgrind import valgrind_target, run_valgrind_tool
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.profile_data import make_profile, save_profile, attach_line_sources, print_profile_files
+
+CACHEGRIND_OUT_FILENAME = 'cachegrind.out'
+# Metrics by cachegrind events (`--cache-sim=yes --branch-sim=yes`)
+CACHE_METRICS = {
+    'Ir': ['Ir'],
+    'D1': ['D1mr', 'D1mw'],
+    'LL': ['DLmr', 'DLmw'],
+    'mispredicts': ['Bcm', 'Bim'],
+}
+CACHE_METRIC_UNITS = {'Ir': 'Ir', 'D1': 'D1 misses', 'LL': 'LL misses', 'mispredicts': 'mispredicts'}
+DATA_REFS_EVENTS = ['Dr', 'Dw']
+BRANCHES_EVENTS = ['Bc', 'Bi']
+
+
+def cachegrind_command(args):
+    log.setup('cython_dev_tools__cachegrind', verbosity=args.verbose)
+
+    cachegrind(args.target,
+               project_root=args.project_root,
+               calls=args.calls,
+               metric=args.sort,
+               limit=args.limit,
+               annotate=args.annotate,
+               browser=args.browser,
+               )
+
+
+def cachegrind(target,
+               project_root=None,
+               calls=1,
+               metric='D1',
+               limit=20,
+               annotate=False,
+               browser=False,
+               ) -> str:
+    """
+    Simulates caches and branch prediction of the target call with valgrind cachegrind in the `profile` build tree
+
+    :param target: entry point call, i.e. `package/module.pyx@func(1000)` (`()` can be omitted)
+    :param calls: number of the target calls
+    :param metric: metric of the saved profile and the table order, see `CACHE_METRICS`
+    :param limit: number of pyx lines to show
+    :param annotate: annotate pyx modules with the metric heatmap
+    :param browser: open the annotation in the browser
+    :return: profile JSON path
+    """
+    if metric not in CACHE_METRICS:
+        raise ValueError(f'Unknown metric `{metric}`, available: {", ".join(CACHE_METRICS)}')
+    ctx = valgrind_target(target, project_root)
+    out_fn = os.path.join(ctx['cython_dev_tools_path'], 'cachegrind', CACHEGRIND_OUT_FILENAME)
+    if os.path.exists(out_fn):
+        os.unlink(out_fn)
+
+    run_valgrind_tool('cachegrind', ctx, ['--cache-sim=yes',
+                                          '--branch-sim=yes',
+                                          f'--cachegrind-out-file={out_fn}'], calls=calls)
+    if not os.path.exists(out_fn):
+        raise RuntimeError(f'cachegrind output not found: {out_fn}')
+
+    with open(out_fn, 'r') as fh:
+        data = parse_callgrind(fh)
+    missing_events = [e for e in CACHE_METRICS[metric] if e not in data['events']]
+    if missing_events:
+        raise RuntimeError(f'Events {missing_events} not found in {out_fn}, events: {data["events"]}')
+
+    lines, functions = cachegrind_pyx_costs(data, ctx['func_mapper'])
+    if not lines:
+        raise RuntimeError(f'No pyx lines found in {out_fn}, missing `cython_debug` info of the profile build?')
+    attach_line_sources(lines, ctx['project_root'])
+
+    profile = cachegrind_profile(lines, functions, metric, ctx['target'])
+    profile['calls'] = calls
+    profile_fn = save_profile(ctx['cython_dev_tools_path'], profile,
+                              f'{ctx["package"]}.{ctx["entry_method"]}_{metric}')
+
+    print_cache_totals(data, lines)
+    print()
+    print_cache_lines(lines, metric, limit=limit)
+    print()
+    print_profile_files(profile_fn)
+    print(f'Raw cachegrind output: {out_fn}')
+
+    if annotate:
+        from cython_dev_tools.building.annotate import annotate as annotate_pyx
+        pyx_files = sorted({os.path.join(ctx['project_root'], key.rsplit(':', 1)[0]) for key in profile['lines']})
+        annotation_fn = annotate_pyx([fn for fn in pyx_files if os.path.exists(fn)],
+                                     project_root=ctx['project_root'], profile=profile_fn)
+        if browser:
+            open_url_in_browser(f'file://{annotation_fn}')
+        else:
+            print(f'Annotation ({CACHE_METRIC_UNITS[metric]} heatmap): file://{annotation_fn}')
+    return profile_fn
+
+
+def cachegrind_pyx_costs(data: dict, func_mapper: dict):
+    """
+    Event costs of Cython C functions summed by pyx lines and functions
+
+    :param data: see `callgrind.parse_callgrind()`
+    :param func_mapper: see `valgrind.make_func_mapper()`
+    :return: (lines {'file:line': {'events': {event: count}}},
+              functions {name: {'file', 'line', 'events': {event: count}}})
+    """
+    events = data['events']
+    lines = {}
+    functions = {}
+    frames = {}
+
+    def add_events(target: dict, costs):
+        for event, c in zip(events, costs):
+            target[event] = target.get(event, 0) + c
+
+    for f in data['functions'].values():
+        for (file, line), costs in f['self'].items():
+            k = (f['name'], file, line)
+            if k not in frames:
+                frames[k] = map_cython_frame(func_mapper, f['name'], file, line)
+            mapped = frames[k]
+            if mapped is None or mapped['file'] is None:
+                continue
+            func = functions.setdefault(mapped['name'], dict(file=mapped['file'], line=mapped['func_line'], events={}))
+            add_events(func['events'], costs)
+            if mapped['line']:
+                add_events(lines.setdefault(f'{mapped["file"]}:{mapped["line"]}', dict(events={}))['events'], costs)
+    return lines, functions
+
+
+def metric_value(events: dict, metric) -> int:
+    return sum(events.get(e, 0) for e in CACHE_METRICS[metric])
+
+
+def miss_rate(events: dict, metric) -> str:
+    """
+    Misses per data reference, or mispredicts per branch
+    """
+    refs = sum(events.get(e, 0) for e in (BRANCHES_EVENTS if metric == 'mispredicts' else DATA_REFS_EVENTS))
+    return f'{metric_value(events, metric) / refs:.1%}' if refs else '-'
+
+
+def cachegrind_profile(lines: dict, functions: dict, metric, target) -> dict:
+    """
+    Profile of the metric by pyx lines and functions (flat, no call tree), lines keep all event counts
+    """
+    stacks = {name.replace(';', ','): metric_value(f['events'], metric) for name, f in functions.items()}
+    profile_lines = {}
+    for key, l in lines.items():
+        value = metric_value(l['events'], metric)
+        if value > 0:
+            profile_lines[key] = dict(l, self=value, total=value)
+    frames_info = {name.replace(';', ','): dict(file=f['file'], line=f['line']) for name, f in functions.items()}
+    return make_profile('cachegrind', target, CACHE_METRIC_UNITS[metric],
+                        {name: v for name, v in stacks.items() if v > 0},
+                        lines=profile_lines, frames_info=frames_info)
+
+
+def print_cache_totals(data: dict, lines: dict):
+    totals = dict(zip(data['events'], data['totals'] or []))
+    pyx_totals = {}
+    for l in lines.values():
+        for event, c in l['events'].items():
+            pyx_totals[event] = pyx_totals.get(event, 0) + c
+
+    print(f'{"":<8} {"Ir":>14} {"D1 miss":>12} {"rate":>6} {"LL miss":>12} {"rate":>6} {"mispred":>12} {"rate":>6}')
+    for title, events in (('process', totals), ('pyx', pyx_totals)):
+        print(f'{title:<8} {events.get("Ir", 0):>14,} '
+              f'{metric_value(events, "D1"):>12,} {miss_rate(events, "D1"):>6} '
+              f'{metric_value(events, "LL"):>12,} {miss_rate(events, "LL"):>6} '
+              f'{metric_value(events, "mispredicts"):>12,} {miss_rate(events, "mispredicts"):>6}')
+
+
+def print_cache_lines(lines: dict, metric, limit=20):
+    print(f'Pyx lines by {CACHE_METRIC_UNITS[metric]}:')
+    print(f'{"Ir":>12} {"D1 miss":>10} {"rate":>6} {"LL miss":>10} {"rate":>6} {"mispred":>10} {"rate":>6}  line')
+    rows = sorted(lines.items(), key=lambda x: (-metric_value(x[1]['events'], metric),
+                                                -x[1]['events'].get('Ir', 0)))
+    for key, l in rows[:limit]:
+        ev = l['events']
+        code = f'  {l["code"]}' if l.get('code') else ''
+        print(f'{ev.get("Ir", 0):>12,} {metric_value(ev, "D1"):>10,} {miss_rate(ev, "D1"):>6} '
+              f'{metric_value(ev, "LL"):>10,} {miss_rate(ev, "LL"):>6} '
+              f'{metric_value(ev, "mispredicts"):>10,} {miss_rate(ev, "mispredicts"):>6}  {key}{code}')
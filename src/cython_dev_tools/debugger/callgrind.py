@@ -0,0 +1,469 @@
+"""
+Instruction-level profiler: valgrind callgrind of the `profile` build (optimized, with symbols)
+
+The collection is toggled by the entry function C symbol (`--toggle-collect`), so the interpreter startup and
+imports are excluded. Costs of Cython C functions are mapped to pyx functions and lines (see `perf.map_cython_frame()`),
+the pyx-mapped call graph is saved in callgrind format for external viewers (KCachegrind / QCachegrind), and as
+the common profile (see `testing/profile_data.py`).
+
+Instruction counts don't depend on the machine load, so they are recorded in the performance history as a noise-free
+benchmark metric, i.e. for CI on shared machines (see `--compare`).
+"""
+import os
+import re
+import sys
+from typing import TextIO
+
+from cython_dev_tools.debugger.perf import map_cython_frame
+from cython_dev_tools.debugger.valgrind import valgrind_target, run_valgrind_tool
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.call_profile import cprofile_stacks
+from cython_dev_tools.testing.perf_history import record_perf, find_baseline_record, build_variant
+from cython_dev_tools.testing.profile_data import make_profile, save_profile, load_profile, attach_line_sources, \
+    print_hot_functions, print_hot_lines, print_profile_files
+
+CALLGRIND_OUT_FILENAME = 'callgrind.out'
+CALLGRIND_EVENT = 'Ir'
+# Call paths below this share of the total are dropped from the profile stacks
+MIN_STACK_SHARE = 1e-4
+
+# Name compression tables of the specification lines, i.e. `fn=(12) name` and then `cfn=(12)`
+CALLGRIND_NAME_TABLES = {'ob': 'ob', 'cob': 'ob',
+                         'fl': 'fl', 'fi': 'fl', 'fe': 'fl', 'cfi': 'fl', 'cfl': 'fl',
+                         'fn': 'fn', 'cfn': 'fn'}
+CALLGRIND_SPEC_KEYS = set(CALLGRIND_NAME_TABLES) | {'calls', 'jump', 'jcnd'}
+RE_COMPRESSED_NAME = re.compile(r'^\((?P<id>\d+)\)(?: (?P<name>.*))?$')
+
+
+def callgrind_command(args):
+    log.setup('cython_dev_tools__callgrind', verbosity=args.verbose)
+
+    result = callgrind(args.target,
+                       project_root=args.project_root,
+                       calls=args.calls,
+                       compare=args.compare,
+                       max_change=args.max_change,
+                       limit=args.limit,
+                       )
+    if result.get('comparison', {}).get('is_regression'):
+        sys.exit(1)
+
+
+def callgrind(target,
+              project_root=None,
+              calls=1,
+              compare=None,
+              max_change=0.01,
+              limit=20,
+              ) -> dict:
+    """
+    Counts instructions of the target call with valgrind callgrind in the `profile` build tree
+
+    :param target: entry point call, i.e. `package/module.pyx@func(1000)` (`()` can be omitted)
+    :param calls: number of the target calls
+    :param compare: baseline to compare with - git revision (the last result measured at it), profile JSON file,
+        or 'last' (the previous result)
+    :param max_change: relative increase of instructions per call, reported as a regression
+    :param limit: number of hot functions / lines to show
+    :return: {'profile': profile JSON path, 'callgrind': pyx-mapped callgrind file, 'instructions': per call,
+              'comparison': see `compare_instructions()`}
+    """
+    ctx = valgrind_target(target, project_root)
+    symbol = entry_symbol(ctx['func_mapper'], ctx['package'], ctx['entry_method'])
+    out_fn = os.path.join(ctx['cython_dev_tools_path'], 'callgrind', CALLGRIND_OUT_FILENAME)
+    if os.path.exists(out_fn):
+        os.unlink(out_fn)
+
+    run_valgrind_tool('callgrind', ctx, [f'--callgrind-out-file={out_fn}',
+                                         f'--toggle-collect={symbol}',
+                                         '--collect-atstart=no'], calls=calls)
+    if not os.path.exists(out_fn):
+        raise RuntimeError(f'callgrind output not found: {out_fn}')
+
+    with open(out_fn, 'r') as fh:
+        data = parse_callgrind(fh)
+    graph = callgrind_pyx_graph(data, ctx['func_mapper'])
+    profile = callgrind_profile(graph, data['events'], map_cython_frame(ctx['func_mapper'], symbol)['name'],
+                                ctx['target'])
+    if not profile['total']:
+        raise RuntimeError(f'No instructions collected in {out_fn}, the entry function `{symbol}` was not called')
+    attach_line_sources(profile['lines'], ctx['project_root'])
+    profile['calls'] = calls
+
+    profile_fn = save_profile(ctx['cython_dev_tools_path'], profile, f'{ctx["package"]}.{ctx["entry_method"]}')
+    callgrind_fn = os.path.splitext(profile_fn)[0] + '.callgrind'
+    with open(callgrind_fn, 'w') as fh:
+        write_callgrind(fh, graph, data['events'], ctx['project_root'], cmd=ctx['target'])
+
+    instructions = profile['total'] / calls
+    top_functions = sorted(profile['functions'].items(), key=lambda x: -x[1]['self'])[:limit]
+    record_id = record_perf(ctx['project_root'], ctx['cython_dev_tools_path'], 'callgrind', ctx['target'],
+                            ctx['package'],
+                            stats=dict(instructions=instructions, total=profile['total'], calls=calls,
+                                       functions={name: f['self'] for name, f in top_functions}),
+                            samples=[[instructions]],
+                            build_path=ctx['profile_tools_path'])
+    log.debug(f'Performance history record #{record_id}')
+
+    print_hot_functions(profile, limit=limit, mapped_only=False)
+    print()
+    print_hot_lines(profile, limit=limit)
+    print()
+    print_profile_files(profile_fn)
+    print(f'Callgrind (pyx-mapped, i.e. for kcachegrind): {callgrind_fn}')
+    print(f'Raw callgrind output: {out_fn}')
+    print()
+    print(f'{ctx["target"]}: {instructions:,.0f} instructions per call ({calls} calls)')
+
+    result = dict(profile=profile_fn, callgrind=callgrind_fn, instructions=instructions)
+    if compare is not None:
+        variant, flags = build_variant(ctx['profile_tools_path'], ctx['package'])
+        result['comparison'] = compare_instructions(ctx['project_root'], ctx['cython_dev_tools_path'], ctx['target'],
+                                                    instructions, compare, record_id, max_change=max_change,
+                                                    variant=variant, flags=flags)
+    return result
+
+
+def entry_symbol(func_mapper: dict, package, entry_method) -> str:
+    """
+    C symbol of the entry function, which toggles the collection (Python wrapper of def / cpdef function)
+
+    :param func_mapper: see `valgrind.make_func_mapper()`
+    """
+    qualified_name = f'{package}.{entry_method}'
+    symbols = sorted(cname for fm in func_mapper.values() for cname, module_map in fm.items()
+                     if module_map['module_name'] == package and module_map['functions'][cname][0] == qualified_name)
+    for prefix in ('__pyx_pw_', '__pyx_pf_'):
+        for cname in symbols:
+            if cname.startswith(prefix):
+                return cname
+    raise ValueError(f'`{qualified_name}` is not a def / cpdef function of Cython module, '
+                     f'callgrind collection is toggled by its C symbol')
+
+
+def parse_position(token, last: int) -> int:
+    if token == '*':
+        return last
+    value = int(token, 16) if 'x' in token else int(token)
+    return last + value if token[0] in '+-' else value
+
+
+def parse_callgrind(fh: TextIO) -> dict:
+    """
+    Parses callgrind output format (https://valgrind.org/docs/manual/cl-format.html), line by line
+
+    :return: {'events': ['Ir', ...], 'totals': costs or None,
+              'functions': {(object, name): {'object', 'name', 'file',
+                                             'self': {(file, line): costs},
+                                             'calls': {(callee key, file, line): {'calls': count, 'costs': costs}}}}}
+    """
+    events = []
+    positions = ['line']
+    totals = None
+    summary = None
+    names = dict(ob={}, fl={}, fn={})
+    functions = {}
+
+    ob = fl = file = func = None
+    cob = cfile = cfn = None
+    # (callee key, calls count) of the next cost line
+    call = None
+    skip_cost_line = False
+    last_positions = [0]
+
+    def name(kind, value):
+        m = RE_COMPRESSED_NAME.match(value)
+        if not m:
+            return value
+        table = names[CALLGRIND_NAME_TABLES[kind]]
+        if m['name'] is not None:
+            table[m['id']] = m['name']
+        return table.get(m['id'], value)
+
+    def add_costs(target: dict, key, costs):
+        current = target.get(key)
+        target[key] = costs if current is None else [a + b for a, b in zip(current, costs)]
+
+    def get_function(key, file_name):
+        return functions.setdefault(key, dict(object=key[0], name=key[1], file=file_name, self={}, calls={}))
+
+    for line in fh:
+        line = line.rstrip('\n')
+        if not line or line[0] == '#':
+            continue
+
+        if line[0].isdigit() or line[0] in '+-*':
+            # Cost line: positions, then event costs
+            parts = line.split()
+            n_pos = len(positions)
+            last_positions = [parse_position(t, last) for t, last in zip(parts[:n_pos], last_positions)]
+            if skip_cost_line:
+                skip_cost_line = False
+                continue
+            if func is None:
+                continue
+            lineno = last_positions[positions.index('line')] if 'line' in positions else 0
+            costs = [int(c) for c in parts[n_pos:]]
+            costs += [0] * (len(events) - len(costs))
+            if call is not None:
+                callee, count = call
+                c = func['calls'].setdefault((callee, file, lineno), dict(calls=0, costs=None))
+                c['calls'] += count
+                add_costs(c, 'costs', costs)
+                call = None
+                cob = cfile = None
+            else:
+                add_costs(func['self'], (file, lineno), costs)
+            continue
+
+        key, _, value = line.partition('=')
+        if key in CALLGRIND_SPEC_KEYS:
+            if key == 'ob':
+                ob = name(key, value)
+            elif key == 'fl':
+                fl = file = name(key, value)
+            elif key in ('fi', 'fe'):
+                file = name(key, value)
+            elif key == 'fn':
+                file = fl
+                func = get_function((ob, name(key, value)), fl)
+            elif key == 'cob':
+                cob = name(key, value)
+            elif key in ('cfi', 'cfl'):
+                cfile = name(key, value)
+            elif key == 'cfn':
+                cfn = name(key, value)
+            elif key == 'calls':
+                callee = get_function((cob or ob, cfn), cfile or fl)
+                call = ((callee['object'], callee['name']), int(value.split()[0]))
+            else:
+                # Jump info, the next line is its source position
+                skip_cost_line = True
+            continue
+
+        header, _, value = line.partition(':')
+        value = value.strip()
+        if header == 'events':
+            events = value.split()
+        elif header == 'positions':
+            positions = value.split()
+            last_positions = [0] * len(positions)
+        elif header in ('totals', 'summary'):
+            costs = [int(c) for c in value.split()]
+            if header == 'totals':
+                totals = costs if totals is None else [a + b for a, b in zip(totals, costs)]
+            else:
+                summary = costs if summary is None else [a + b for a, b in zip(summary, costs)]
+
+    return dict(events=events, totals=totals or summary, functions=functions)
+
+
+def callgrind_pyx_graph(data: dict, func_mapper: dict) -> dict:
+    """
+    Call graph with Cython C functions merged by pyx qualified name (i.e. Python wrapper and implementation),
+    and their C lines mapped to pyx lines, other functions keep C symbols and lines
+
+    :param data: see `parse_callgrind()`
+    :param func_mapper: see `valgrind.make_func_mapper()`
+    :return: {name: {'object', 'file', 'line': definition line, 'is_pyx', 'self': {(file, line): costs},
+                     'calls': {(callee name, file, line): {'calls': count, 'costs': costs}}}}
+    """
+    frames = {}
+
+    def frame(symbol, src_file=None, src_line=None):
+        k = (symbol, src_file, src_line)
+        if k not in frames:
+            frames[k] = map_cython_frame(func_mapper, symbol, src_file, src_line)
+        return frames[k]
+
+    def node_name(f):
+        mapped = frame(f['name'], f['file'])
+        return mapped['name'] if mapped else f['name']
+
+    def add_costs(target: dict, key, costs):
+        current = target.get(key)
+        target[key] = list(costs) if current is None else [a + b for a, b in zip(current, costs)]
+
+    graph = {}
+    for f in data['functions'].values():
+        mapped = frame(f['name'], f['file'])
+        is_pyx = mapped is not None and mapped['file'] is not None
+        name = node_name(f)
+        node = graph.setdefault(name, dict(object=f['object'],
+                                           file=mapped['file'] if is_pyx else f['file'],
+                                           line=mapped['func_line'] if is_pyx else None,
+                                           is_pyx=is_pyx,
+                                           self={},
+                                           calls={}))
+
+        def position(file, line):
+            if not is_pyx:
+                return file, line
+            return node['file'], frame(f['name'], file, line)['line'] or 0
+
+        for (file, line), costs in f['self'].items():
+            add_costs(node['self'], position(file, line), costs)
+        for (callee_key, file, line), c in f['calls'].items():
+            callee = node_name(data['functions'][callee_key])
+            if callee == name:
+                # Merged wrapper call, or recursion (costs of all levels are in `self` already)
+                continue
+            edge = node['calls'].setdefault((callee,) + position(file, line), dict(calls=0, costs=None))
+            edge['calls'] += c['calls']
+            add_costs(edge, 'costs', c['costs'])
+    return graph
+
+
+def callgrind_profile(graph: dict, events: list, entry_name, target, event=CALLGRIND_EVENT) -> dict:
+    """
+    Profile of the pyx-mapped call graph (instruction counts by default), call paths start at the entry function
+
+    Pyx lines `self` is the cost of the line own C code, `total` includes its calls
+    """
+    i = events.index(event)
+
+    def cost(costs):
+        return costs[i] if costs and i < len(costs) else 0
+
+    # Call costs of the toggled-off callers are outside of the entry function
+    reachable = set()
+    queue = [entry_name] if entry_name in graph else list(graph)
+    while queue:
+        name = queue.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+        queue.extend(callee for callee, _, _ in graph[name]['calls'] if callee in graph)
+
+    # cProfile stats layout, see `call_profile.cprofile_stacks()`
+    stats = {}
+    for name in reachable:
+        node = graph[name]
+        tt = sum(cost(c) for c in node['self'].values())
+        stats[name] = [0, 0, tt, tt + sum(cost(c['costs']) for c in node['calls'].values()), {}]
+    for name in reachable:
+        for (callee, _, _), c in graph[name]['calls'].items():
+            if callee not in stats:
+                continue
+            edge = stats[callee][4].setdefault(name, [0, 0, 0, 0])
+            edge[0] += c['calls']
+            edge[1] += c['calls']
+            edge[3] += cost(c['costs'])
+            stats[callee][0] += c['calls']
+            stats[callee][1] += c['calls']
+
+    total = sum(stats[name][2] for name in reachable)
+    labels = {name: name.replace(';', ',') for name in reachable}
+    stacks = cprofile_stacks(stats, labels, min_weight=max(1, total * MIN_STACK_SHARE), scale=1)
+
+    lines = {}
+    frames_info = {}
+    for name in reachable:
+        node = graph[name]
+        if not node['is_pyx']:
+            continue
+        frames_info[labels[name]] = dict(file=node['file'], line=node['line'])
+        for (file, line), c in node['self'].items():
+            if line:
+                l = lines.setdefault(f'{file}:{line}', dict(self=0, total=0))
+                l['self'] += cost(c)
+                l['total'] += cost(c)
+        for (_, file, line), c in node['calls'].items():
+            if line:
+                lines.setdefault(f'{file}:{line}', dict(self=0, total=0))['total'] += cost(c['costs'])
+
+    profile = make_profile('callgrind', target, event, stacks, lines=lines, frames_info=frames_info)
+    # Small call paths are dropped from stacks, the total is exact
+    profile['total'] = total
+    return profile
+
+
+def write_callgrind(fh: TextIO, graph: dict, events: list, project_root, cmd=None):
+    """
+    Writes the pyx-mapped call graph in callgrind format (pyx files are the project sources)
+    """
+    def path(file, is_pyx):
+        if not file:
+            return '???'
+        return os.path.join(project_root, file) if is_pyx else file
+
+    def format_costs(costs):
+        return ' '.join(str(c) for c in costs)
+
+    totals = [0] * len(events)
+    fh.write('# callgrind format\n')
+    fh.write('version: 1\n')
+    fh.write('creator: cython-dev-tools\n')
+    if cmd:
+        fh.write(f'cmd: {cmd}\n')
+    fh.write('positions: line\n')
+    fh.write(f'events: {" ".join(events)}\n')
+
+    for name, node in graph.items():
+        fh.write('\n')
+        if node['object']:
+            fh.write(f'ob={node["object"]}\n')
+        node_file = path(node['file'], node['is_pyx'])
+        fh.write(f'fl={node_file}\n')
+        fh.write(f'fn={name}\n')
+        current_file = node_file
+
+        def set_file(file):
+            nonlocal current_file
+            file = path(file, node['is_pyx'])
+            if file != current_file:
+                fh.write(f'fi={file}\n')
+                current_file = file
+
+        for (file, line), costs in sorted(node['self'].items(), key=lambda x: (str(x[0][0]), x[0][1])):
+            set_file(file)
+            fh.write(f'{line} {format_costs(costs)}\n')
+            totals = [a + b for a, b in zip(totals, costs)]
+        for (callee, file, line), c in sorted(node['calls'].items(), key=lambda x: (str(x[0][1]), x[0][2], x[0][0])):
+            callee_node = graph[callee]
+            set_file(file)
+            if callee_node['object']:
+                fh.write(f'cob={callee_node["object"]}\n')
+            fh.write(f'cfl={path(callee_node["file"], callee_node["is_pyx"])}\n')
+            fh.write(f'cfn={callee}\n')
+            fh.write(f'calls={c["calls"]} {callee_node["line"] or 0}\n')
+            fh.write(f'{line} {format_costs(c["costs"])}\n')
+
+    fh.write(f'\ntotals: {format_costs(totals)}\n')
+
+
+def compare_instructions(project_root, cython_dev_tools_path, target, instructions, baseline, record_id,
+                         max_change=0.01, variant=None, flags=None) -> dict:
+    """
+    Compares instructions per call with the baseline, the counts are deterministic, so any increase above
+    `max_change` (relative) is a regression, without statistical tests
+
+    The baseline is searched among all machines records, the instruction counts depend on the build, Python
+    version and architecture, not on the hardware (records of other Python versions / architectures are skipped)
+
+    :param variant: build variant and `flags` of the measured build, see `perf_history.build_variant()`
+    """
+    if os.path.isfile(baseline):
+        baseline_profile = load_profile(baseline)
+        if baseline_profile['kind'] != 'callgrind':
+            raise ValueError(f'{baseline} is `{baseline_profile["kind"]}` profile, callgrind profile expected')
+        baseline_instructions = baseline_profile['total'] / baseline_profile.get('calls', 1)
+    else:
+        record = find_baseline_record(project_root, cython_dev_tools_path, 'callgrind', target, baseline,
+                                      exclude_id=record_id, any_machine=True, variant=variant, flags=flags)
+        if record is None:
+            log.warning(f'No callgrind history for {target} at `{baseline}`, '
+                        f'run `cytool callgrind` at the baseline revision first')
+            return {}
+        log.info(f'Baseline: {record["created_at"]} revision {record["revision"]} ({record["variant"]} build)')
+        baseline_instructions = record['stats']['instructions']
+
+    change = instructions / baseline_instructions - 1.0
+    print(f'  baseline: {baseline_instructions:,.0f} instructions per call, change: {change:+.2%}')
+    comparison = dict(baseline_instructions=baseline_instructions,
+                      instructions=instructions,
+                      change=change,
+                      is_regression=change > max_change)
+    if comparison['is_regression']:
+        log.error(f'Instructions count regression of {target}: {change:+.2%} vs `{baseline}`')
+    return comparison
@@ -0,0 +1,173 @@
+"""
+Allocation churn profiler: valgrind DHAT of the `profile` build (optimized, with symbols)
+
+DHAT tracks every heap block: allocation stack, size, lifetime and reads / writes. Allocation stacks are attributed
+to the innermost frame of Cython code, mapped to pyx line by `cython_debug` info (see `perf.map_cython_frame()`),
+Python objects are allocated by `malloc` (`PYTHONMALLOC=malloc`), so temporary objects (i.e. boxed arguments and
+results of cpdef wrappers) are attributed to pyx lines too.
+
+Many short-lived or rarely accessed blocks of a site are candidates for stack buffers, freelists or preallocated pools.
+"""
+import json
+import os
+from datetime import datetime
+from typing import List
+
+from cython_dev_tools.debugger.perf import map_cython_frame
+from cython_dev_tools.debugger.valgrind import valgrind_target, run_valgrind_tool, RE_VALGRIND_FRAME, OTHER_SITE, \
+    format_bytes
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.profile_data import attach_line_sources
+
+DHAT_OUT_FILENAME = 'dhat.out.json'
+DHAT_VIEWER_URL = 'https://nnethercote.github.io/dh_view/dh_view.html'
+# Sort keys, lifetime and access ratio are ascending (short-lived / rarely accessed first)
+DHAT_SORT_KEYS = {'blocks': lambda s: -s['blocks'],
+                  'bytes': lambda s: -s['bytes'],
+                  'lifetime': lambda s: s['avg_lifetime'],
+                  'access': lambda s: s['access_ratio']}
+# Notes thresholds: lifetime (time units, instructions by default), reads + writes per allocated byte
+SHORT_LIFETIME = 1000
+LOW_ACCESS_RATIO = 1.0
+
+
+def dhat_command(args):
+    log.setup('cython_dev_tools__dhat', verbosity=args.verbose)
+
+    dhat(args.target,
+         project_root=args.project_root,
+         calls=args.calls,
+         sort=args.sort,
+         limit=args.limit,
+         )
+
+
+def dhat(target,
+         project_root=None,
+         calls=1,
+         sort='blocks',
+         limit=20,
+         ) -> dict:
+    """
+    Allocation churn of the target call with valgrind DHAT in the `profile` build tree, by pyx call sites
+
+    :param target: entry point call, i.e. `package/module.pyx@func(1000)` (`()` can be omitted)
+    :param calls: number of the target calls
+    :param sort: sites order, see `DHAT_SORT_KEYS`
+    :param limit: number of call sites to show
+    :return: report dict, see `dhat_report()`
+    """
+    if sort not in DHAT_SORT_KEYS:
+        raise ValueError(f'Unknown sort key `{sort}`, available: {", ".join(DHAT_SORT_KEYS)}')
+    ctx = valgrind_target(target, project_root)
+    out_fn = os.path.join(ctx['cython_dev_tools_path'], 'dhat', DHAT_OUT_FILENAME)
+    if os.path.exists(out_fn):
+        os.unlink(out_fn)
+
+    run_valgrind_tool('dhat', ctx, [f'--dhat-out-file={out_fn}'],
+                      calls=calls, extra_env=dict(PYTHONMALLOC='malloc'))
+    if not os.path.exists(out_fn):
+        raise RuntimeError(f'DHAT output not found: {out_fn}')
+
+    with open(out_fn, 'r') as fh:
+        data = json.load(fh)
+    report = dhat_report(data, ctx['func_mapper'], ctx['target'])
+    report['calls'] = calls
+    attach_line_sources({site: s for site, s in report['sites'].items() if site != OTHER_SITE}, ctx['project_root'])
+
+    report_fn = os.path.join(os.path.dirname(out_fn),
+                             f'{ctx["package"]}.{ctx["entry_method"]}_dhat_{datetime.now():%Y%m%d_%H%M%S}.json')
+    with open(report_fn, 'w') as fh:
+        json.dump(report, fh, indent=1)
+
+    print_dhat_report(report, sort=sort, limit=limit)
+    print()
+    print(f'Report: {report_fn}')
+    print(f'Raw DHAT output: {out_fn} (open with {DHAT_VIEWER_URL})')
+    return report
+
+
+def dhat_report(data: dict, func_mapper: dict, target) -> dict:
+    """
+    DHAT program points (allocation stacks) merged by the innermost pyx frame (`file:line`), or `OTHER_SITE`
+
+    :param data: DHAT JSON output (`--mode=heap`)
+    :return: {'target', 'time_unit', 'totals': {'blocks', 'bytes'},
+              'sites': {'file:line': {'name', 'file', 'line', 'blocks', 'bytes', 'max_bytes', 'lifetime',
+                                      'reads', 'writes', 'avg_size', 'avg_lifetime', 'access_ratio'}}}
+    """
+    if data.get('mode', 'heap') != 'heap':
+        raise ValueError(f'DHAT `{data["mode"]}` mode output, `heap` mode expected')
+
+    # Frames table is shared by program points, frames are mapped once
+    frames = {}
+
+    def pyx_frame(index):
+        if index not in frames:
+            m = RE_VALGRIND_FRAME.match(data['ftbl'][index])
+            mapped = None
+            if m:
+                mapped = map_cython_frame(func_mapper, m['symbol'], m['file'], int(m['line']) if m['line'] else None)
+            frames[index] = mapped if mapped is not None and mapped['file'] is not None and mapped['line'] else None
+        return frames[index]
+
+    sites = {}
+    for pp in data['pps']:
+        mapped = next((f for f in map(pyx_frame, pp['fs']) if f is not None), None)
+        site_key = f'{mapped["file"]}:{mapped["line"]}' if mapped else OTHER_SITE
+        site = sites.setdefault(site_key, dict(name=mapped['name'] if mapped else None,
+                                               file=mapped['file'] if mapped else None,
+                                               line=mapped['line'] if mapped else None,
+                                               blocks=0, bytes=0, max_bytes=0, lifetime=0, reads=0, writes=0))
+        site['blocks'] += pp['tbk']
+        site['bytes'] += pp['tb']
+        site['max_bytes'] += pp.get('mb', 0)
+        site['lifetime'] += pp.get('tl', 0)
+        site['reads'] += pp.get('rb', 0)
+        site['writes'] += pp.get('wb', 0)
+
+    for site in sites.values():
+        site['avg_size'] = site['bytes'] / site['blocks'] if site['blocks'] else 0
+        site['avg_lifetime'] = site['lifetime'] / site['blocks'] if site['blocks'] else 0
+        site['access_ratio'] = (site['reads'] + site['writes']) / site['bytes'] if site['bytes'] else 0
+
+    return dict(target=target,
+                created_at=datetime.now().isoformat(timespec='seconds'),
+                time_unit=data.get('tu'),
+                totals=dict(blocks=sum(s['blocks'] for s in sites.values()),
+                            bytes=sum(s['bytes'] for s in sites.values())),
+                sites=sites)
+
+
+def dhat_notes(site: dict) -> str:
+    notes = []
+    if site['avg_lifetime'] < SHORT_LIFETIME:
+        notes.append('short-lived')
+    if site['access_ratio'] < LOW_ACCESS_RATIO:
+        notes.append('low access')
+    return ', '.join(notes)
+
+
+def sorted_sites(report: dict, sort='blocks') -> List[str]:
+    """
+    Pyx call sites by the sort key (ties by the number of blocks), the interpreter / native site is the last
+    """
+    key = DHAT_SORT_KEYS[sort]
+    return sorted(report['sites'], key=lambda s: (s == OTHER_SITE, key(report['sites'][s]),
+                                                  -report['sites'][s]['blocks']))
+
+
+def print_dhat_report(report: dict, sort='blocks', limit=20):
+    totals = report['totals']
+    calls = report.get('calls', 1)
+    print(f'Allocated: {totals["blocks"]:,} blocks, {format_bytes(totals["bytes"])} '
+          f'({totals["blocks"] / calls:,.1f} blocks per call)')
+    print(f'Allocation sites by {sort} (lifetime in {report["time_unit"] or "time units"}, '
+          f'access - reads and writes per allocated byte):')
+    print(f'{"blocks":>10} {"bytes":>10} {"avg size":>9} {"avg life":>10} {"access":>7}  {"notes":<23} site')
+    for site_key in sorted_sites(report, sort)[:limit]:
+        s = report['sites'][site_key]
+        name = f' {s["name"]}' if s.get('name') else ''
+        code = f'  {s["code"]}' if s.get('code') else ''
+        print(f'{s["blocks"]:>10,} {format_bytes(s["bytes"]):>10} {format_bytes(s["avg_size"]):>9} '
+              f'{s["avg_lifetime"]:>10,.0f} {s["access_ratio"]:>7.2f}  {dhat_notes(s):<23} {site_key}{name}{code}')
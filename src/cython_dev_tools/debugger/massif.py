@@ -0,0 +1,353 @@
+"""
+Heap profiler: valgrind massif of the `profile` build (optimized, with symbols)
+
+Massif snapshots the heap over the run (time in executed instructions), detailed snapshots have allocation trees
+(the allocation function first, then its callers). Each allocation stack is attributed to the innermost frame of
+Cython code, mapped to pyx line by `cython_debug` info (see `perf.map_cython_frame()`), the rest is the Python
+interpreter and native code. Python objects are allocated by `malloc` (`PYTHONMALLOC=malloc`), so they are
+attributed to the pyx lines which create them.
+
+The report with the heap timeline chart by pyx allocation sites is saved at `.cython_dev_tools/massif/`.
+"""
+import html
+import json
+import os
+import re
+from datetime import datetime
+from typing import List, TextIO
+
+from cython_dev_tools.common import open_url_in_browser
+from cython_dev_tools.debugger.perf import map_cython_frame
+from cython_dev_tools.debugger.valgrind import valgrind_target, run_valgrind_tool, RE_VALGRIND_FRAME, OTHER_SITE, \
+    format_bytes
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.profile_data import attach_line_sources
+
+MASSIF_OUT_FILENAME = 'massif.out'
+TIMELINE_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#bcbd22',
+                   '#17becf', '#aec7e8']
+
+#  n1: 800 0x4C2DB8F: malloc (vg_replace_malloc.c:299)
+RE_MASSIF_NODE = re.compile(r'^(?P<indent> *)n(?P<children>\d+): (?P<bytes>\d+) (?P<rest>.*)$')
+
+
+def massif_command(args):
+    log.setup('cython_dev_tools__massif', verbosity=args.verbose)
+
+    massif(args.target,
+           project_root=args.project_root,
+           calls=args.calls,
+           depth=args.depth,
+           threshold=args.threshold,
+           limit=args.limit,
+           browser=args.browser,
+           )
+
+
+def massif(target,
+           project_root=None,
+           calls=1,
+           depth=30,
+           threshold=0.5,
+           limit=20,
+           browser=False,
+           ) -> dict:
+    """
+    Heap profile of the target call with valgrind massif in the `profile` build tree, by pyx allocation sites
+
+    :param target: entry point call, i.e. `package/module.pyx@func(1000)` (`()` can be omitted)
+    :param calls: number of the target calls
+    :param depth: maximum depth of massif allocation trees
+    :param threshold: allocations below this percent of the heap are merged in massif trees
+    :param limit: number of allocation sites to show and to plot
+    :param browser: open the report in the browser
+    :return: report dict, see `massif_report()`
+    """
+    ctx = valgrind_target(target, project_root)
+    out_fn = os.path.join(ctx['cython_dev_tools_path'], 'massif', MASSIF_OUT_FILENAME)
+    if os.path.exists(out_fn):
+        os.unlink(out_fn)
+
+    run_valgrind_tool('massif', ctx, [f'--massif-out-file={out_fn}',
+                                      f'--depth={depth}',
+                                      f'--threshold={threshold}',
+                                      '--detailed-freq=1'],
+                      calls=calls, extra_env=dict(PYTHONMALLOC='malloc'))
+    if not os.path.exists(out_fn):
+        raise RuntimeError(f'massif output not found: {out_fn}')
+
+    with open(out_fn, 'r') as fh:
+        data = parse_massif(fh)
+    if not data['snapshots']:
+        raise RuntimeError(f'No snapshots in {out_fn}')
+
+    report = massif_report(data, ctx['func_mapper'], ctx['target'])
+    attach_line_sources({site: s for site, s in report['sites'].items() if site != OTHER_SITE}, ctx['project_root'])
+
+    base_fn = os.path.join(os.path.dirname(out_fn),
+                           f'{ctx["package"]}.{ctx["entry_method"]}_massif_{datetime.now():%Y%m%d_%H%M%S}')
+    with open(base_fn + '.json', 'w') as fh:
+        json.dump(report, fh, indent=1)
+    with open(base_fn + '.html', 'w') as fh:
+        fh.write(render_massif_html(report, limit=limit))
+
+    print_massif_report(report, limit=limit)
+    print()
+    print(f'Report: {base_fn}.json')
+    print(f'Heap timeline: {base_fn}.html')
+    print(f'Raw massif output (ms_print): {out_fn}')
+    if browser:
+        open_url_in_browser(f'file://{base_fn}.html')
+    return report
+
+
+def parse_massif(fh: TextIO) -> dict:
+    """
+    Parses massif output, line by line
+
+    :return: {'cmd', 'time_unit', 'snapshots': [{'time', 'heap', 'heap_extra', 'stacks', 'tree_kind',
+              'tree': allocation tree or None}]}, tree nodes are {'bytes', 'label', 'frame', 'children'},
+              `frame` is {'symbol', 'object', 'file', 'line'} or None
+    """
+    cmd = None
+    time_unit = None
+    snapshots = []
+    snapshot = None
+    # Tree nodes by depth
+    nodes = []
+
+    for line in fh:
+        line = line.rstrip('\n')
+        if not line or line[0] == '#':
+            continue
+
+        m = RE_MASSIF_NODE.match(line)
+        if m and snapshot is not None:
+            node = dict(bytes=int(m['bytes']), label=m['rest'], frame=None, children=[])
+            f = RE_VALGRIND_FRAME.match(m['rest'])
+            if f:
+                node['frame'] = dict(symbol=f['symbol'], object=f['object'], file=f['file'],
+                                     line=int(f['line']) if f['line'] else None)
+            depth = len(m['indent'])
+            del nodes[depth:]
+            if depth == 0:
+                snapshot['tree'] = node
+            elif nodes:
+                nodes[-1]['children'].append(node)
+            nodes.append(node)
+            continue
+
+        if line.startswith(('desc:', 'cmd:', 'time_unit:')):
+            key, _, value = line.partition(':')
+            if key == 'cmd':
+                cmd = value.strip()
+            elif key == 'time_unit':
+                time_unit = value.strip()
+            continue
+
+        key, sep, value = line.partition('=')
+        if sep:
+            if key == 'snapshot':
+                snapshot = dict(time=0, heap=0, heap_extra=0, stacks=0, tree_kind='empty', tree=None)
+                snapshots.append(snapshot)
+                nodes = []
+            elif snapshot is not None and key in ('time', 'mem_heap_B', 'mem_heap_extra_B', 'mem_stacks_B'):
+                field = dict(time='time', mem_heap_B='heap', mem_heap_extra_B='heap_extra', mem_stacks_B='stacks')[key]
+                snapshot[field] = int(value)
+            elif snapshot is not None and key == 'heap_tree':
+                snapshot['tree_kind'] = value
+
+    return dict(cmd=cmd, time_unit=time_unit, snapshots=snapshots)
+
+
+def massif_tree_sites(tree: dict, func_mapper: dict, sites_info: dict, frames: dict = None) -> dict:
+    """
+    Heap bytes of the allocation tree by the innermost pyx frame (`file:line`), or `OTHER_SITE`
+
+    :param sites_info: updated with {'file:line': {'name', 'file', 'line'}}
+    :param frames: mapped frames cache
+    """
+    frames = {} if frames is None else frames
+    sites = {}
+
+    def add(site, n_bytes):
+        if n_bytes > 0:
+            sites[site] = sites.get(site, 0) + n_bytes
+
+    def visit(node):
+        frame = node['frame']
+        if frame is not None:
+            k = (frame['symbol'], frame['file'], frame['line'])
+            if k not in frames:
+                frames[k] = map_cython_frame(func_mapper, frame['symbol'], frame['file'], frame['line'])
+            mapped = frames[k]
+            if mapped is not None and mapped['file'] is not None and mapped['line']:
+                site = f'{mapped["file"]}:{mapped["line"]}'
+                sites_info.setdefault(site, dict(name=mapped['name'], file=mapped['file'], line=mapped['line']))
+                add(site, node['bytes'])
+                return
+        if not node['children']:
+            add(OTHER_SITE, node['bytes'])
+            return
+        for child in node['children']:
+            visit(child)
+        add(OTHER_SITE, node['bytes'] - sum(child['bytes'] for child in node['children']))
+
+    if tree is not None:
+        if tree['children']:
+            # The root is the allocation functions node
+            for child in tree['children']:
+                visit(child)
+            add(OTHER_SITE, tree['bytes'] - sum(child['bytes'] for child in tree['children']))
+        else:
+            add(OTHER_SITE, tree['bytes'])
+    return sites
+
+
+def massif_report(data: dict, func_mapper: dict, target) -> dict:
+    """
+    Heap timeline by pyx allocation sites, and sites at the peak
+
+    :return: {'target', 'time_unit', 'peak': {'time', 'heap', 'heap_extra', 'index'},
+              'sites': {'file:line': {'name', 'file', 'line', 'peak_bytes', 'max_bytes'}},
+              'timeline': [{'time', 'heap', 'heap_extra', 'sites': {site: bytes} or None}]}
+    """
+    sites_info = {}
+    frames = {}
+    timeline = []
+    for s in data['snapshots']:
+        sites = massif_tree_sites(s['tree'], func_mapper, sites_info, frames) if s['tree_kind'] != 'empty' else None
+        if s['tree_kind'] == 'empty' and s['heap'] == 0:
+            sites = {}
+        timeline.append(dict(time=s['time'], heap=s['heap'], heap_extra=s['heap_extra'], sites=sites))
+
+    peak_index = next((i for i, s in enumerate(data['snapshots']) if s['tree_kind'] == 'peak'), None)
+    if peak_index is None:
+        peak_index = max(range(len(timeline)), key=lambda i: timeline[i]['heap'] + timeline[i]['heap_extra'])
+    peak = timeline[peak_index]
+
+    sites = {}
+    for site in list(sites_info) + [OTHER_SITE]:
+        info = sites_info.get(site, dict(name=None, file=None, line=None))
+        values = [t['sites'].get(site, 0) for t in timeline if t['sites'] is not None]
+        if not any(values):
+            continue
+        sites[site] = dict(info, peak_bytes=(peak['sites'] or {}).get(site, 0), max_bytes=max(values))
+
+    return dict(target=target,
+                created_at=datetime.now().isoformat(timespec='seconds'),
+                time_unit=data['time_unit'],
+                peak=dict(index=peak_index, time=peak['time'], heap=peak['heap'], heap_extra=peak['heap_extra']),
+                sites=sites,
+                timeline=timeline)
+
+
+def top_sites(report: dict, limit=20) -> List[str]:
+    """
+    Allocation sites by bytes at the peak, then by the maximum over time
+    """
+    return sorted(report['sites'], key=lambda s: (-report['sites'][s]['peak_bytes'],
+                                                  -report['sites'][s]['max_bytes']))[:limit]
+
+
+def print_massif_report(report: dict, limit=20):
+    peak = report['peak']
+    print(f'Peak heap: {format_bytes(peak["heap"])} (+{format_bytes(peak["heap_extra"])} allocator overhead) '
+          f'at time {peak["time"]:,} {report["time_unit"] or ""}')
+    print(f'Allocation sites by heap at the peak:')
+    print(f'{"peak":>10} {"share":>7} {"max":>10}  site')
+    for site in top_sites(report, limit):
+        s = report['sites'][site]
+        name = f' {s["name"]}' if s.get('name') else ''
+        code = f'  {s["code"]}' if s.get('code') else ''
+        print(f'{format_bytes(s["peak_bytes"]):>10} {s["peak_bytes"] / (peak["heap"] or 1):>7.1%} '
+              f'{format_bytes(s["max_bytes"]):>10}  {site}{name}{code}')
+
+
+def render_massif_svg(report: dict, limit=10, width=1000, height=480) -> str:
+    """
+    Stacked heap timeline chart of the top allocation sites (the rest are merged), the peak is marked
+    """
+    pad_l, pad_r, pad_t, pad_b = 80, 20, 40, 50
+    plot_w, plot_h = width - pad_l - pad_r, height - pad_t - pad_b
+    timeline = [t for t in report['timeline'] if t['sites'] is not None]
+    series = [s for s in top_sites(report, limit) if s != OTHER_SITE]
+    series.append(OTHER_SITE)
+
+    t0 = min((t['time'] for t in timeline), default=0)
+    t1 = max((t['time'] for t in timeline), default=1)
+    t1 = t1 if t1 > t0 else t0 + 1
+    max_heap = max((t['heap'] for t in report['timeline']), default=1) or 1
+
+    def px(t):
+        return pad_l + (t - t0) / (t1 - t0) * plot_w
+
+    def py(b):
+        return pad_t + plot_h - b / max_heap * plot_h
+
+    items = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="sans-serif" font-size="12">',
+             f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14">{html.escape(report["target"])}</text>',
+             f'<rect x="{pad_l}" y="{pad_t}" width="{plot_w}" height="{plot_h}" fill="none" stroke="#888"/>']
+    for k in range(5):
+        b = max_heap * (k + 1) / 5
+        items.append(f'<line x1="{pad_l}" y1="{py(b):.1f}" x2="{pad_l + plot_w}" y2="{py(b):.1f}" stroke="#eee"/>')
+        items.append(f'<text x="{pad_l - 5}" y="{py(b) + 4:.1f}" text-anchor="end">{format_bytes(b)}</text>')
+    items.append(f'<text x="{pad_l + plot_w / 2}" y="{height - 10}" text-anchor="middle">'
+                 f'time ({html.escape(report["time_unit"] or "")})</text>')
+
+    # Stacked areas, `other` is the remainder of the top sites
+    lower = [0] * len(timeline)
+    for i, site in enumerate(series):
+        upper = []
+        for j, t in enumerate(timeline):
+            if site == OTHER_SITE:
+                value = t['heap'] - sum(t['sites'].get(s, 0) for s in series[:-1])
+            else:
+                value = t['sites'].get(site, 0)
+            upper.append(lower[j] + max(0, value))
+        points = [f'{px(t["time"]):.1f},{py(b):.1f}' for t, b in zip(timeline, upper)]
+        points += [f'{px(t["time"]):.1f},{py(b):.1f}' for t, b in reversed(list(zip(timeline, lower)))]
+        color = '#cccccc' if site == OTHER_SITE else TIMELINE_COLORS[i % len(TIMELINE_COLORS)]
+        s = report['sites'].get(site, {})
+        title = f'{site} {s.get("name") or ""}: peak {format_bytes(s.get("peak_bytes", 0))}'
+        items.append(f'<polygon points="{" ".join(points)}" fill="{color}" fill-opacity="0.85" stroke="none">'
+                     f'<title>{html.escape(title)}</title></polygon>')
+        lower = upper
+
+    peak = report['peak']
+    items.append(f'<line x1="{px(peak["time"]):.1f}" y1="{pad_t}" x2="{px(peak["time"]):.1f}" y2="{pad_t + plot_h}" '
+                 f'stroke="#d62728" stroke-dasharray="6,4"/>')
+    items.append(f'<text x="{px(peak["time"]) + 4:.1f}" y="{pad_t + 14}" fill="#d62728">'
+                 f'peak {format_bytes(peak["heap"])}</text>')
+    items.append('</svg>')
+    return '\n'.join(items)
+
+
+def render_massif_html(report: dict, limit=20) -> str:
+    """
+    Report page: heap timeline chart, legend and allocation sites table
+    """
+    series = [s for s in top_sites(report, limit=10) if s != OTHER_SITE]
+    legend = ''.join(f'<li><span style="background:{TIMELINE_COLORS[i % len(TIMELINE_COLORS)]}">&#xA0;&#xA0;&#xA0;'
+                     f'</span> {html.escape(site)} {html.escape(report["sites"][site]["name"] or "")}</li>'
+                     for i, site in enumerate(series))
+    legend += f'<li><span style="background:#cccccc">&#xA0;&#xA0;&#xA0;</span> other</li>'
+
+    peak_heap = report['peak']['heap'] or 1
+    rows = []
+    for site in top_sites(report, limit):
+        s = report['sites'][site]
+        rows.append(f'<tr><td>{format_bytes(s["peak_bytes"])}</td><td>{s["peak_bytes"] / peak_heap:.1%}</td>'
+                    f'<td>{format_bytes(s["max_bytes"])}</td><td>{html.escape(site)}</td>'
+                    f'<td>{html.escape(s.get("name") or "")}</td><td><code>{html.escape(s.get("code") or "")}</code></td></tr>')
+
+    title = f'Heap profile: {report["target"]}'
+    return (f'<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>\n'
+            f'<style>body {{font-family: sans-serif}} td, th {{padding: 2px 8px; text-align: left}} '
+            f'ul {{list-style: none}}</style></head><body>\n'
+            f'<h3>{html.escape(title)}</h3>\n'
+            f'<p>Peak heap: {format_bytes(report["peak"]["heap"])} '
+            f'(+{format_bytes(report["peak"]["heap_extra"])} allocator overhead)</p>\n'
+            f'{render_massif_svg(report)}\n<ul>{legend}</ul>\n'
+            f'<table><tr><th>peak</th><th>share</th><th>max</th><th>site</th><th>function</th><th>code</th></tr>\n'
+            f'{"".join(rows)}</table>\n</body></html>\n')
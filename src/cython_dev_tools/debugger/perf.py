@@ -0,0 +1,355 @@
+"""
+Native sampling profiler: Linux `perf record` of the `profile` build (optimized, with frame pointers)
+
+Cython C symbols (`__pyx_pf_*`, `__pyx_f_*`, ...) are mapped to pyx qualified names, and C lines to pyx lines
+by the `cython_debug` info of the profile tree (see `valgrind.make_func_mapper()`), so the optimized and nogil code,
+which `lprun` can't trace, is profiled too.
+"""
+import os
+import re
+import shutil
+import subprocess
+from typing import List, Optional
+
+from cython_dev_tools.building.profiles import build_profile, PROFILE_VARIANT_PREFIX
+from cython_dev_tools.building.variants import variant_env, VARIANTS_DIRNAME
+from cython_dev_tools.common import check_project_initialized, find_package_path, check_method_args, split_call_target
+from cython_dev_tools.debugger.valgrind import make_func_mapper
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.profile_data import load_call_target, run_call_loop, make_profile, save_profile, \
+    print_hot_functions, print_hot_lines, print_profile_files, attach_line_sources
+
+PERF_DIRNAME = 'perf'
+PERF_BUILD_PROFILE = 'profile'
+PERF_SCRIPT_FIELDS = 'comm,tid,ip,sym,dso,srcline'
+
+#     7f1c2a3b4c5d __pyx_pf_..._2approx_pi2+0x3d (/path/cy_module.cpython-311-x86_64-linux-gnu.so)
+RE_PERF_FRAME = re.compile(r'^\s+(?P<ip>[0-9a-f]+)\s+(?P<symbol>.*?)\s+\((?P<dso>.*)\)\s*$')
+#   cy_module.c:2130
+RE_PERF_SRCLINE = re.compile(r'^\s+(?P<file>[^\s:]+):(?P<line>\d+)')
+RE_SYMBOL_OFFSET = re.compile(r'\+0x[0-9a-f]+$')
+# Cython function symbols: Python wrapper, implementation, cdef function
+RE_PYX_SYMBOL = re.compile(r'^__pyx_(pw|pf|f)_(?P<mangled>\d\w*)$')
+RE_MANGLED_NAME = re.compile(r'^(?P<length>\d+)(?P<tail>.*)$')
+
+
+def perf_command(args):
+    log.setup('cython_dev_tools__perf', verbosity=args.verbose)
+
+    if args.action == 'record':
+        if not args.target:
+            raise ValueError('perf record target is required, i.e. package/module.pyx@func(1000)')
+        perf_record(args.target,
+                    project_root=args.project_root,
+                    duration=args.duration,
+                    frequency=args.frequency,
+                    call_graph=args.call_graph,
+                    limit=args.limit,
+                    )
+    else:
+        perf_report(args.target,
+                    project_root=args.project_root,
+                    limit=args.limit,
+                    )
+
+
+def check_perf_available():
+    if shutil.which('perf') is None:
+        raise RuntimeError('`perf` not found, install Linux perf tools (i.e. `apt install linux-perf` '
+                           'or `apt install linux-tools-$(uname -r)`)')
+    paranoid_fn = '/proc/sys/kernel/perf_event_paranoid'
+    if os.path.exists(paranoid_fn):
+        with open(paranoid_fn, 'r') as fh:
+            if int(fh.read().strip()) > 2:
+                log.warning('perf_event_paranoid > 2, perf may fail to record, '
+                            'try `sudo sysctl kernel.perf_event_paranoid=2`')
+
+
+def run_perf_worker(config: dict):
+    """
+    Profiled process entry point, calls the target for `config['duration']` seconds
+    """
+    log.setup('cython_dev_tools__perf', log_level=config['log_level'])
+    func, f_args, f_kwargs = load_call_target(config['cython_dev_tools_path'], config['package'],
+                                              config['entry_method'], config['entry_args'])
+    n_calls = run_call_loop(func, f_args, f_kwargs, config['duration'])
+    log.debug(f'{config["package"]}.{config["entry_method"]}{config["entry_args"]} called {n_calls} times')
+
+
+def perf_record(target,
+                project_root=None,
+                duration=1.0,
+                frequency=999,
+                call_graph='fp',
+                limit=20,
+                ) -> str:
+    """
+    Samples the target call with `perf record` in the `profile` build tree
+
+    :param target: entry point call, i.e. `package/module.pyx@func(1000)` (`()` can be omitted)
+    :param duration: the target is called repeatedly for at least `duration` seconds
+    :param frequency: sampling frequency, Hz
+    :param call_graph: perf call graph mode, `fp` (frame pointers) or `dwarf` (i.e. for libs without frame pointers)
+    :param limit: number of hot functions / lines to show
+    :return: profile JSON path (see `testing/profile_data.py`)
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    check_perf_available()
+
+    if '(' not in target:
+        target += '()'
+    entry_target, entry_args = split_call_target(target)
+    _, package, entry_method = find_package_path(project_root, entry_target)
+    check_method_args(entry_args, fixture_variables(cython_dev_tools_path, dry_run=True))
+
+    profile_root = build_profile(project_root, PERF_BUILD_PROFILE)
+    profile_tools_path = os.path.join(profile_root, os.path.basename(cython_dev_tools_path))
+
+    perf_path = os.path.join(cython_dev_tools_path, PERF_DIRNAME)
+    os.makedirs(perf_path, exist_ok=True)
+    perf_data_fn = os.path.join(perf_path, 'perf.data')
+
+    config = dict(log_level=log.log_level,
+                  cython_dev_tools_path=profile_tools_path,
+                  package=package,
+                  entry_method=entry_method,
+                  entry_args=entry_args,
+                  duration=duration,
+                  )
+    log.info(f'Recording {target} for {duration}s')
+    ret = subprocess.call(['perf', 'record', '--call-graph', call_graph, '-F', str(frequency), '-o', perf_data_fn,
+                           '--', 'python', '-c',
+                           f'from cython_dev_tools.debugger.perf import run_perf_worker; run_perf_worker({config!r})'],
+                          env=variant_env(profile_root), cwd=profile_root)
+    if ret != 0:
+        raise RuntimeError(f'perf record failed with exit code {ret}, try `cytool run {entry_target} --profile '
+                           f'{PERF_BUILD_PROFILE}` first')
+
+    return perf_report(perf_data_fn, project_root=project_root, target=target, name=f'{package}.{entry_method}',
+                       profile_tools_path=profile_tools_path, limit=limit)
+
+
+def perf_report(perf_data_fn=None, project_root=None, target=None, name=None, profile_tools_path=None,
+                limit=20) -> str:
+    """
+    Maps `perf.data` samples to pyx functions and lines, saves the profile and its collapsed stacks
+
+    :param perf_data_fn: perf data file (by default the last `perf record`)
+    :param profile_tools_path: `cython_debug` info path (by default of the `profile` build tree)
+    :return: profile JSON path
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    check_perf_available()
+    perf_data_fn = perf_data_fn or os.path.join(cython_dev_tools_path, PERF_DIRNAME, 'perf.data')
+    if not os.path.exists(perf_data_fn):
+        raise FileNotFoundError(f'perf data not found: {perf_data_fn}, run `cytool perf record` first')
+
+    if profile_tools_path is None:
+        # Not rebuilt, the mapping must match the recorded build
+        profile_tools_path = os.path.join(cython_dev_tools_path, VARIANTS_DIRNAME,
+                                          f'{PROFILE_VARIANT_PREFIX}{PERF_BUILD_PROFILE}',
+                                          os.path.basename(cython_dev_tools_path))
+    p = subprocess.run(['perf', 'script', '-i', perf_data_fn, '-F', PERF_SCRIPT_FIELDS],
+                       stdout=subprocess.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise RuntimeError(f'perf script failed with exit code {p.returncode}')
+
+    samples = parse_perf_script(p.stdout)
+    profile = perf_samples_profile(samples, make_func_mapper(profile_tools_path), target or perf_data_fn)
+    attach_line_sources(profile['lines'], project_root)
+    if not profile['total']:
+        raise RuntimeError(f'No samples recorded in {perf_data_fn}')
+
+    profile_fn = save_profile(cython_dev_tools_path, profile, name or 'perf')
+    print_hot_functions(profile, limit=limit)
+    print()
+    print_hot_lines(profile, limit=limit)
+    print()
+    print_profile_files(profile_fn)
+    return profile_fn
+
+
+def parse_perf_script(text: str) -> List[List[dict]]:
+    """
+    Parses `perf script -F comm,tid,ip,sym,dso,srcline` output
+
+    :return: samples, each is a list of frames from the leaf, i.e. {'symbol', 'dso', 'src_file', 'src_line'}
+    """
+    samples = []
+    frames = None
+    for line in text.splitlines():
+        if not line.strip():
+            frames = None
+            continue
+        if not line[0].isspace():
+            # Sample header: comm tid
+            frames = []
+            samples.append(frames)
+            continue
+        if frames is None:
+            continue
+        m = RE_PERF_FRAME.match(line)
+        if m:
+            frames.append(dict(symbol=RE_SYMBOL_OFFSET.sub('', m['symbol']), dso=m['dso'], src_file=None,
+                               src_line=None))
+            continue
+        m = RE_PERF_SRCLINE.match(line)
+        if m and frames and m['file'] != '??':
+            frames[-1].update(src_file=m['file'], src_line=int(m['line']))
+    return [s for s in samples if s]
+
+
+def mangle_cython_names(names) -> str:
+    """
+    ['pkg', 'mod'] -> `3pkg_3mod_`, Cython mangling of module path and class names
+    """
+    return ''.join(f'{len(n)}{n}_' for n in names)
+
+
+def demangle_cython_symbol(symbol, func_mapper: dict = None) -> Optional[str]:
+    """
+    Qualified name of Cython function C symbol, i.e.
+    `__pyx_pf_16cy_tools_samples_8profiler_9cy_module_2SQ_2recip_square_` -> `cy_tools_samples.profiler.cy_module.SQ.recip_square_`
+
+    Module path and class names are length prefixed, the function name may have a numeric counter prefix, so
+    the mangled name is ambiguous (`4main_loop` is `main_loop` function, not `main` class `loop` method). The module
+    prefix is taken from `cython_debug` module names of `func_mapper`, the rest is matched against the known qualified
+    names of the module (i.e. `__pyx_pf_` implementation vs `__pyx_pw_` wrapper of the same function), or the known
+    class names prefix and the counter are stripped. Modules without debug info are demangled by length prefixes only.
+
+    :param func_mapper: see `valgrind.make_func_mapper()`
+    """
+    m = RE_PYX_SYMBOL.match(symbol)
+    if not m:
+        return None
+    mangled = m['mangled']
+
+    module_maps = {mm['module_name']: mm for fm in (func_mapper or {}).values() for mm in fm.values()}
+    module_name = max((name for name in module_maps if mangled.startswith(mangle_cython_names(name.split('.')))),
+                      key=len, default=None)
+    if module_name is None:
+        return demangle_length_prefixed(mangled)
+
+    rest = mangled[len(mangle_cython_names(module_name.split('.'))):]
+    qualified_names = {qname for qname, _ in module_maps[module_name]['functions'].values()
+                       if qname.startswith(module_name + '.')}
+    for qname in sorted(qualified_names, key=len, reverse=True):
+        *classes, func_name = qname[len(module_name) + 1:].split('.')
+        if re.fullmatch(re.escape(mangle_cython_names(classes)) + r'\d*' + re.escape(func_name), rest):
+            return qname
+
+    # Unknown function, known classes prefixes are stripped
+    classes = []
+    class_names = {tuple(qname[len(module_name) + 1:].split('.')[:-1]) for qname in qualified_names}
+    for class_path in sorted(class_names, key=len, reverse=True):
+        if class_path and rest.startswith(mangle_cython_names(class_path)):
+            classes = list(class_path)
+            rest = rest[len(mangle_cython_names(class_path)):]
+            break
+    func_name = re.sub(r'^\d+', '', rest)
+    if not func_name:
+        return None
+    return '.'.join([module_name] + classes + [func_name])
+
+
+def demangle_length_prefixed(mangled) -> Optional[str]:
+    """
+    Ambiguous demangling by length prefixes only, when the module is unknown
+    """
+    names = []
+    rest = mangled
+    while True:
+        t = RE_MANGLED_NAME.match(rest)
+        if not t:
+            break
+        length, tail = int(t['length']), t['tail']
+        if 0 < length < len(tail) and tail[length] == '_':
+            names.append(tail[:length])
+            rest = tail[length + 1:]
+        else:
+            # Function counter prefix
+            rest = tail
+            break
+    if not names or not rest:
+        return None
+    return '.'.join(names + [rest])
+
+
+def map_cython_frame(func_mapper: dict, symbol, src_file=None, src_line=None) -> Optional[dict]:
+    """
+    Maps C frame to pyx function and line
+
+    :param func_mapper: see `valgrind.make_func_mapper()`
+    :return: {'name': qualified name, 'file': pyx path relative to project root, 'line': pyx line,
+              'func_line': function definition line}, or None for non-Cython frames
+    """
+    # GCC clones, i.e. `.constprop.0`, `.isra.0`, `.part.0`, `.cold`
+    symbol = symbol.split('.')[0]
+    c_basename = os.path.basename(src_file) if src_file else None
+
+    module_map = func_mapper.get(c_basename, {}).get(symbol)
+    if module_map is None:
+        module_map = next((fm[symbol] for fm in func_mapper.values() if symbol in fm), None)
+
+    if module_map is not None:
+        qualified_name, func_line = module_map['functions'][symbol]
+    else:
+        # I.e. `__pyx_pf_` implementation of def function, only its wrapper is in cython_debug info
+        qualified_name = demangle_cython_symbol(symbol, func_mapper)
+        if qualified_name is None:
+            return None
+        module_maps = [mm for fm in func_mapper.values() for mm in fm.values()
+                       if qualified_name.startswith(mm['module_name'] + '.')]
+        if not module_maps:
+            return dict(name=qualified_name, file=None, line=None, func_line=None)
+        module_map = max(module_maps, key=lambda mm: len(mm['module_name']))
+        func_line = next((lineno for qname, lineno in module_map['functions'].values() if qname == qualified_name),
+                         None)
+
+    line = func_line
+    if src_line and c_basename == module_map['module_c_basename']:
+        line = module_map['line_numbers'].get(src_line, func_line)
+    return dict(name=qualified_name,
+                file=module_map['module_name'].replace('.', '/') + '.pyx',
+                line=line,
+                func_line=func_line)
+
+
+def perf_samples_profile(samples: List[List[dict]], func_mapper: dict, target) -> dict:
+    """
+    Profile of perf samples with Cython frames mapped to pyx (non-Cython frames keep C symbols)
+    """
+    stacks = {}
+    lines = {}
+    frames_info = {}
+    for frames in samples:
+        names = []
+        sample_lines = []
+        for f in frames:
+            mapped = map_cython_frame(func_mapper, f['symbol'], f['src_file'], f['src_line'])
+            if mapped is None:
+                name = f['symbol']
+                if name == '[unknown]' and f['dso'] != '[unknown]':
+                    name = f'[{os.path.basename(f["dso"])}]'
+            else:
+                name = mapped['name']
+            if names and names[-1] == name:
+                # I.e. Python wrapper of the function
+                continue
+            names.append(name)
+            if mapped is not None and mapped['file']:
+                frames_info[name] = dict(file=mapped['file'], line=mapped['func_line'])
+                if mapped['line']:
+                    sample_lines.append(f'{mapped["file"]}:{mapped["line"]}')
+
+        stack = ';'.join(reversed(names))
+        stacks[stack] = stacks.get(stack, 0) + 1
+        # The innermost pyx line is `self`, even if it calls native code
+        for i, line in enumerate(dict.fromkeys(sample_lines)):
+            l = lines.setdefault(line, dict(self=0, total=0))
+            l['total'] += 1
+            if i == 0:
+                l['self'] += 1
+
+    return make_profile('perf', target, 'samples', stacks, lines=lines, frames_info=frames_info)
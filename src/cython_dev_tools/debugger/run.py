@@ -2,7 +2,8 @@ import os
 import subprocess
 import sys
 from cython_dev_tools.logs import log
-from cython_dev_tools.common import check_project_initialized, check_method_exists, find_package_path, make_run_args
+from cython_dev_tools.common import check_project_initialized, check_method_exists, find_package_path, make_run_args, log_exit_code
+from cython_dev_tools.building.profiles import build_profile
 import re
 import signal
 
@@ -12,14 +13,21 @@ def run_command(args):
 
     run(run_target=args.run_target,
         project_root=args.project_root,
+        warm=args.warm,
+        profile=args.profile,
         )
 
 
 def run(run_target,
-        project_root=None):
+        project_root=None,
+        warm=False,
+        profile=None):
     log.debug(f'Running: {run_target}')
     # Check if cython tools in a good state in the project root
     project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    if profile:
+        # Run in the build profile tree
+        project_root, cython_dev_tools_path = check_project_initialized(build_profile(project_root, profile))
 
     # Getting run target
     source_file, package, entry_method = find_package_path(project_root, run_target, as_entry=True)
@@ -37,6 +45,13 @@ def run(run_target,
     else:
         my_env["PYTHONPATH"] = f"{project_root}"
 
+    if warm:
+        # Import here, to avoid circular import of cython_dev_tools.testing
+        from cython_dev_tools.testing.forkserver import warm_request
+        ret = warm_request(project_root, cython_dev_tools_path, 'run', [package, entry_method], my_env)
+        log_exit_code(ret, run_target)
+        return
+
     p = subprocess.Popen(['python'] + run_instruct, env=my_env)
     #p = subprocess.Popen(['python'] + ['-c', 'import sys; print(sys.path)'], env=my_env)
     log.trace("Python spawned (pid %d)", p.pid)
@@ -44,15 +59,7 @@ def run(run_target,
     while True:
         try:
             ret = p.wait()
-            if ret == 0:
-                log.trace(f'python correctly finished')
-            elif ret == -11:
-                # Segmentation fault
-                log.critical(f'Python SEGMENTATION FAULT during running: {run_target} ErrCode: {ret}, try to run with `debug` command')
-            elif  ret == -5:
-                log.critical(f'Python POSSIBLE unhandled breakpoint during running: {run_target} ErrCode: {ret}, try to run with `debug` command')
-            else:
-                log.error(f'Python returned error while running: {run_target} ErrCode: {ret}')
+            log_exit_code(ret, run_target)
         except KeyboardInterrupt:
             pass
         except:
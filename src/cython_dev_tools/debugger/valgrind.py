@@ -1,13 +1,28 @@
 import os
+import shutil
 import subprocess
 import sys
 from cython_dev_tools.logs import log
-from cython_dev_tools.common import check_project_initialized, check_method_exists, find_package_path, make_run_args
-import re
+from cython_dev_tools.common import check_project_initialized, check_method_exists, find_package_path, make_run_args, \
+    check_method_args, split_call_target
+from cython_dev_tools.building.profiles import build_profile
+from cython_dev_tools.building.variants import variant_env
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.profile_data import load_call_target
 import signal
 import xml.etree.ElementTree as ET
 import os
 import glob
+import re
+
+# Optimized, with symbols and `cython_debug` info (see `building/profiles.py`)
+VALGRIND_BUILD_PROFILE = 'profile'
+# Allocations not attributed to Cython code (massif / DHAT sites)
+OTHER_SITE = '(python / native)'
+# Frame of massif trees and DHAT frame table, i.e.
+# 0x5A5: __pyx_pf_3pkg_3mod_2make (mod.c:2130), 0x4F1: PyList_New (in /usr/lib/libpython3.11.so), 0x0: ???
+RE_VALGRIND_FRAME = re.compile(r'^0x[0-9A-Fa-f]+: (?P<symbol>.*?)'
+                               r'(?: \((?:in (?P<object>[^()]*)|(?P<file>[^()]*):(?P<line>\d+))\))?$')
 
 
 def valgrind_command(args):
@@ -60,10 +75,14 @@ def valgrind(run_target,
     my_env['PYTHONMALLOC'] = 'malloc'
 
     valgrind_log_fn = os.path.join(cython_dev_tools_path, 'valgrind.log')
-    if os.path.exists(valgrind_log_fn):
-        os.unlink(valgrind_log_fn)
+    valgrind_xml_fn = os.path.join(cython_dev_tools_path, 'valgrind.xml')
+    for fn in [valgrind_log_fn, valgrind_xml_fn]:
+        if os.path.exists(fn):
+            os.unlink(fn)
     p = subprocess.Popen(['valgrind',
                           f'--log-file={valgrind_log_fn}',
+                          '--xml=yes',
+                          f'--xml-file={valgrind_xml_fn}',
                           '--leak-check=full',
                           'python'
                           ] + run_instruct, env=my_env)
@@ -89,87 +108,209 @@ def valgrind(run_target,
         else:
             break
 
-    if os.path.exists(valgrind_log_fn):
-        # All good let's check
-        if not os.path.exists(valgrind_log_fn):
-            raise RuntimeError(f'No valgrind log found at {os.path.join(cython_dev_tools_path, "valgrind.log")}')
-
-        result = parse_valgrind_logs(cython_dev_tools_path, valgrind_log_fn, replace_cython, filter_cython)
-        for l in result:
-            print(l, end='')
+    if os.path.exists(valgrind_xml_fn):
+        report = parse_valgrind_xml(valgrind_xml_fn, make_func_mapper(cython_dev_tools_path),
+                                    replace_cython=replace_cython, filter_cython_only=filter_cython)
+        print_valgrind_report(report)
+        print()
+        print(f'Valgrind log: {valgrind_log_fn}')
+        return report
     else:
         log.error("Failed to run valgrind!")
 
-def parse_valgrind_logs(cython_dev_tools_path, valgrind_log_fn, replace_cython, filter_cython_only):
+
+def check_valgrind_available():
+    if shutil.which('valgrind') is None:
+        raise RuntimeError('`valgrind` not found, install it (i.e. `apt install valgrind`)')
+
+
+def valgrind_target(target, project_root=None) -> dict:
     """
-    Parses valgrind logs and maps Cython .c calls to .pyx functions (also filters all python junk)
+    Checks the entry point call, and builds (incrementally) the `profile` tree to run under valgrind tools
+
+    :param target: entry point call, i.e. `package/module.pyx@func(1000)` (`()` can be omitted)
+    :return: target context, see `run_valgrind_tool()`
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    check_valgrind_available()
+
+    if '(' not in target:
+        target += '()'
+    entry_target, entry_args = split_call_target(target)
+    _, package, entry_method = find_package_path(project_root, entry_target)
+    check_method_args(entry_args, fixture_variables(cython_dev_tools_path, dry_run=True))
+
+    profile_root = build_profile(project_root, VALGRIND_BUILD_PROFILE)
+    profile_tools_path = os.path.join(profile_root, os.path.basename(cython_dev_tools_path))
+    return dict(target=target,
+                entry_target=entry_target,
+                entry_args=entry_args,
+                package=package,
+                entry_method=entry_method,
+                project_root=project_root,
+                cython_dev_tools_path=cython_dev_tools_path,
+                profile_root=profile_root,
+                profile_tools_path=profile_tools_path,
+                func_mapper=make_func_mapper(profile_tools_path),
+                )
+
+
+def run_valgrind_worker(config: dict):
     """
-    func_mapper = make_func_mapper(cython_dev_tools_path)
-
-    with open(valgrind_log_fn, 'r') as fh:
-        lines = fh.readlines()
-
-    RE_CYTHON_LINE = re.compile(r"(?P<base>==\d+==.*0x[A-Z0-9]+:.*)(?P<fn_name>__pyx_.*) \((?P<c_file>.*\.c):(?P<c_line>\d+)\)")
-    RE_FUNC_CALL_LINE = re.compile(r"(?P<base>==\d+==.*0x[A-Z0-9]+:.*)(?P<fn_name>.*) \((?P<c_file>.*):(?P<c_line>\d+)\)")
-    RE_NEW_REC = re.compile(r"==\d+== \n")
-    RE_REPORT_START = re.compile(r"==\d+== Parent PID:.*\n")
-    RE_LEAK_SUMMARY = re.compile(r"==\d+== LEAK SUMMARY:\n")
-
-    result_lines = []
-    last_rec = -1
-    report_started = False
-    has_cython_calls = False
-
-    def replace_cython_calls(lines, l_start, l_end):
-        for i in range(l_start, l_end):
-            g = RE_CYTHON_LINE.match(lines[i])
-            if replace_cython and g:
-                c_file = g['c_file']
-                fn_name = g['fn_name']
-                c_line_no = int(g['c_line'])
-                if c_file in func_mapper and fn_name in func_mapper[c_file]:
-                    module_map = func_mapper[c_file][fn_name]
-                    _qual_name, _pyx_fn_line_no = module_map['functions'][fn_name]
-
-                    pyx_base_name = os.path.basename(module_map['module_pyx_fn'])
-                    pyx_line_number = module_map['line_numbers'].get(c_line_no, _pyx_fn_line_no)
-
-                    result_lines.append(re.sub(RE_CYTHON_LINE, rf"\g<base>{_qual_name} ({pyx_base_name}:{pyx_line_number})", lines[i]))
+    Process entry point of valgrind tools, calls the target `config['calls']` times
+    """
+    log.setup('cython_dev_tools__valgrind', log_level=config['log_level'])
+    func, f_args, f_kwargs = load_call_target(config['cython_dev_tools_path'], config['package'],
+                                              config['entry_method'], config['entry_args'])
+    for _ in range(config['calls']):
+        func(*f_args, **f_kwargs)
+
+
+def run_valgrind_tool(tool, ctx: dict, tool_args: list, calls=1, extra_env: dict = None) -> str:
+    """
+    Runs the target call under valgrind tool in the `profile` build tree
+
+    :param ctx: target context, see `valgrind_target()`
+    :param tool_args: tool options, output files are expected at the returned path
+    :param calls: number of the target calls
+    :param extra_env: environment variables, i.e. `PYTHONMALLOC=malloc` for heap profilers
+    :return: `.cython_dev_tools/<tool>` output path
+    """
+    out_path = os.path.join(ctx['cython_dev_tools_path'], tool)
+    os.makedirs(out_path, exist_ok=True)
+    log_fn = os.path.join(out_path, 'valgrind.log')
+
+    config = dict(log_level=log.log_level,
+                  cython_dev_tools_path=ctx['profile_tools_path'],
+                  package=ctx['package'],
+                  entry_method=ctx['entry_method'],
+                  entry_args=ctx['entry_args'],
+                  calls=calls,
+                  )
+    my_env = variant_env(ctx['profile_root'])
+    # Deterministic str hashes (dict / set iteration order), so are the tool results
+    my_env['PYTHONHASHSEED'] = '0'
+    my_env.update(extra_env or {})
+
+    log.info(f'Running {ctx["target"]} under valgrind {tool}')
+    ret = subprocess.call(['valgrind', f'--tool={tool}', f'--log-file={log_fn}'] + tool_args +
+                          ['python', '-c',
+                           f'from cython_dev_tools.debugger.valgrind import run_valgrind_worker; '
+                           f'run_valgrind_worker({config!r})'],
+                          env=my_env, cwd=ctx['profile_root'])
+    if ret != 0:
+        raise RuntimeError(f'valgrind {tool} failed with exit code {ret}, see {log_fn}, try `cytool run '
+                           f'{ctx["entry_target"]} --profile {VALGRIND_BUILD_PROFILE}` first')
+    return out_path
+
+
+def parse_valgrind_xml(valgrind_xml, func_mapper: dict, replace_cython=True, filter_cython_only=True) -> dict:
+    """
+    Streaming parser of valgrind memcheck XML output (`--xml=yes`), maps Cython .c frames to .pyx functions and lines,
+    identical error / leak stacks are grouped. Records without Cython frames are skipped (but counted in leak summary).
+
+    :param valgrind_xml: XML file name or file object
+    :param func_mapper: see `make_func_mapper()`
+    :param replace_cython: replace Cython C functions by pyx qualified names and lines
+    :param filter_cython_only: keep only Cython frames in stacks
+    :return: {'errors': [group], 'leaks': [group] (by bytes lost, the most first),
+              'leak_summary': {kind: {'bytes', 'blocks'}}},
+              group: {'kind', 'what', 'frames': [str], 'records', 'bytes', 'blocks'}
+    """
+    # `perf` imports this module
+    from cython_dev_tools.debugger.perf import map_cython_frame
+
+    # Stacks share most of frames, each frame is mapped once
+    frames_cache = {}
+
+    def map_frame(frame):
+        fn, file, line = frame.findtext('fn'), frame.findtext('file'), frame.findtext('line')
+        key = (fn, file, line) if fn else frame.findtext('ip')
+        if key not in frames_cache:
+            mapped = map_cython_frame(func_mapper, fn, file, int(line) if line else None) if fn else None
+            is_cython = mapped is not None and mapped['file'] is not None
+            if is_cython and replace_cython:
+                label = f'{mapped["name"]} ({mapped["file"]}:{mapped["line"]})'
+            elif fn and file:
+                label = f'{fn} ({file}:{line})'
+            elif fn:
+                label = f'{fn} (in {frame.findtext("obj")})'
             else:
-                # Skipp all non Cython functions calls, keep only informational messages
-                if not filter_cython_only or RE_FUNC_CALL_LINE.match(lines[i]) is None:
-                    result_lines.append(lines[i])
-
-    for i, l in enumerate(lines):
-        if last_rec == -1:
-            result_lines.append(l)
-
-        if not report_started:
-            if RE_REPORT_START.match(l):
-                report_started = True
-
-        if last_rec == -1 and report_started and RE_NEW_REC.match(l):
-            # First valgrind record found
-            last_rec = i
-            continue
-
-        if last_rec != -1:
-            # Parsing records
-            g = RE_CYTHON_LINE.match(l)
-            if g:
-                if g['c_file'] in func_mapper and g['fn_name'] in func_mapper[g['c_file']]:
-                    has_cython_calls = True
-
-            elif RE_NEW_REC.match(l):
-                if has_cython_calls:
-                    replace_cython_calls(lines, last_rec, i)
-                last_rec = i
-                has_cython_calls = False
-            elif RE_LEAK_SUMMARY.match(l):
-                last_rec = -1
-                result_lines.append('\n\n')
-                result_lines.append(l)
-    return result_lines
+                label = f'{key} (in {frame.findtext("obj")})'
+            frames_cache[key] = (label, is_cython)
+        return frames_cache[key]
+
+    groups = {}
+    leak_summary = {}
+    root = None
+    context = ET.iterparse(valgrind_xml, events=('start', 'end'))
+    try:
+        for event, elem in context:
+            if root is None:
+                root = elem
+            if event != 'end' or elem.tag != 'error':
+                continue
+
+            kind = elem.findtext('kind')
+            is_leak = kind.startswith('Leak_')
+            leaked_bytes = int(elem.findtext('xwhat/leakedbytes', 0))
+            leaked_blocks = int(elem.findtext('xwhat/leakedblocks', 0))
+            if is_leak:
+                summary = leak_summary.setdefault(kind, dict(bytes=0, blocks=0))
+                summary['bytes'] += leaked_bytes
+                summary['blocks'] += leaked_blocks
+
+            stack = elem.find('stack')
+            frames = [map_frame(f) for f in stack.iter('frame')] if stack is not None else []
+            if any(is_cython for _, is_cython in frames):
+                what = None if is_leak else elem.findtext('what')
+                labels = tuple(label for label, is_cython in frames if is_cython or not filter_cython_only)
+                group = groups.setdefault((kind, what, labels), dict(kind=kind, what=what, frames=list(labels),
+                                                                     records=0, bytes=0, blocks=0))
+                group['records'] += 1
+                group['bytes'] += leaked_bytes
+                group['blocks'] += leaked_blocks
+
+            # Processed errors are dropped, the memory doesn't grow with the log size
+            root.clear()
+    except ET.ParseError as exc:
+        # I.e. valgrind killed, the last error is incomplete
+        log.warning(f'Valgrind XML is truncated: {exc}')
+
+    return dict(errors=sorted((g for g in groups.values() if not g['kind'].startswith('Leak_')),
+                              key=lambda g: -g['records']),
+                leaks=sorted((g for g in groups.values() if g['kind'].startswith('Leak_')),
+                             key=lambda g: (-g['bytes'], -g['blocks'])),
+                leak_summary=leak_summary)
+
+
+def print_valgrind_report(report: dict):
+    for group in report['errors']:
+        print(f'{group["what"]} ({group["kind"]}, {group["records"]} records)')
+        for i, frame in enumerate(group['frames']):
+            print(f'   {"at" if i == 0 else "by"} {frame}')
+        print()
+
+    for group in report['leaks']:
+        print(f'{group["bytes"]:,} bytes in {group["blocks"]:,} blocks ({group["kind"]}, {group["records"]} records)')
+        for i, frame in enumerate(group['frames']):
+            print(f'   {"at" if i == 0 else "by"} {frame}')
+        print()
+
+    print('LEAK SUMMARY:')
+    if not report['leak_summary']:
+        print('   no leaks')
+    for kind, summary in sorted(report['leak_summary'].items()):
+        print(f'   {kind}: {summary["bytes"]:,} bytes in {summary["blocks"]:,} blocks')
+
+
+def format_bytes(value) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if abs(value) < 1024:
+            return f'{value:.0f}{unit}' if unit == 'B' else f'{value:.1f}{unit}'
+        value /= 1024
+    return f'{value:.2f}GB'
+
 
 def make_func_mapper(cython_dev_tools_path) -> dict:
     """
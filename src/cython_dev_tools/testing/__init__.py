@@ -1,3 +1,8 @@
 from .coverage import coverage_command, coverage
 from .profiler import lprun_command, lprun
-from .tests import tests_command, tests
\ No newline at end of file
+from .bench import bench_command, bench
+from .experiment import experiment_command, experiment
+from .tune_flags import tune_flags_command, tune_flags
+from .call_profile import profile_command, profile
+from .tests import tests_command, tests
+from .forkserver import warm_command
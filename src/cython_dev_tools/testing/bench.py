@@ -0,0 +1,356 @@
+"""
+Benchmark runner for Cython entry points
+
+Each benchmark is measured in several fresh python processes, every process does warmup calls first, then
+measures `repeats` samples, each sample is the mean time per call of `loops` calls. The number of loops is
+calibrated by the first process (like `timeit` does), and reused by the rest for the comparable results.
+"""
+import gc
+import html
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import reduce
+
+from cython_dev_tools.building.profiles import build_profile
+from cython_dev_tools.building.variants import variant_env
+from cython_dev_tools.common import check_project_initialized, find_package_path, check_method_args, split_call_target, \
+    open_url_in_browser
+from cython_dev_tools.logs import log
+from cython_dev_tools.settings import CYTHON_TOOLS_DIRNAME
+from cython_dev_tools.testing.stats import describe, format_time
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.complexity import parse_sweep, fit_complexity, render_scaling_svg
+from cython_dev_tools.testing.perf_history import record_perf, find_baseline_record, compare_samples, build_variant, \
+    flags_hash
+
+BENCH_DIRNAME = 'bench'
+
+
+def bench_command(args):
+    log.setup('cython_dev_tools__bench', verbosity=args.verbose)
+
+    results = bench(args.bench_target,
+                    project_root=args.project_root,
+                    processes=args.processes,
+                    repeats=args.repeats,
+                    warmup=args.warmup,
+                    min_time=args.min_time,
+                    confidence=args.confidence,
+                    output=args.output,
+                    compare=args.compare,
+                    alpha=args.alpha,
+                    sweep=args.sweep,
+                    browser=args.browser,
+                    profile=args.profile,
+                    )
+    if results.get('comparison', {}).get('is_slowdown'):
+        sys.exit(1)
+
+
+def calibrate_loops(func, args, kwargs, min_time) -> int:
+    """
+    Number of loops (1, 2, 5, 10, 20, 50, ...) which takes at least `min_time` seconds
+    """
+    i = 1
+    while True:
+        for loops in (i, i * 2, i * 5):
+            t_start = time.perf_counter()
+            for _ in range(loops):
+                func(*args, **kwargs)
+            if time.perf_counter() - t_start >= min_time:
+                return loops
+        i *= 10
+
+
+def run_bench_worker(config: dict):
+    """
+    Benchmark worker process entry point, writes samples to config['result_file']
+    """
+    log.setup('cython_dev_tools__bench', log_level=config['log_level'])
+    entry_module = importlib.import_module(config['package'])
+    func = reduce(getattr, config['entry_method'].split('.'), entry_module)
+    variables = dict(config['variables'], **fixture_variables(config['cython_dev_tools_path'], config['package']))
+    f_args, f_kwargs = check_method_args(config['entry_args'], variables)
+
+    for _ in range(config['warmup']):
+        func(*f_args, **f_kwargs)
+
+    loops = config['loops'] or calibrate_loops(func, f_args, f_kwargs, config['min_time'])
+
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(config['repeats']):
+            t_start = time.perf_counter()
+            for _ in range(loops):
+                func(*f_args, **f_kwargs)
+            samples.append((time.perf_counter() - t_start) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    with open(config['result_file'], 'w') as fh:
+        json.dump(dict(loops=loops, samples=samples), fh)
+
+
+def print_bench_results(results: dict):
+    st = results['stats']
+    print(f'{results["target"]}: {st["n"]} samples ({results["processes"]} processes x {results["repeats"]} repeats '
+          f'x {results["loops"]} loops)')
+    print(f'  mean:   {format_time(st["mean"])} +/- {format_time((st["ci_high"] - st["ci_low"]) / 2)} '
+          f'({st["confidence"]:.0%} CI: {format_time(st["ci_low"])} .. {format_time(st["ci_high"])})')
+    print(f'  median: {format_time(st["median"])}')
+    print(f'  stdev:  {format_time(st["stdev"])} ({st["stdev"] / st["mean"]:.1%})')
+    print(f'  min:    {format_time(st["min"])}')
+
+
+def measure_call(project_root, cython_dev_tools_path, package, entry_method, entry_args, bench_path, env,
+                 processes=5, repeats=5, warmup=1, min_time=0.2, variables=None):
+    """
+    Measures function call time in `processes` fresh python processes
+
+    :return: (samples grouped by process, loops)
+    """
+    config = dict(log_level=log.log_level,
+                  cython_dev_tools_path=cython_dev_tools_path,
+                  package=package,
+                  entry_method=entry_method,
+                  entry_args=entry_args,
+                  variables=variables or {},
+                  warmup=warmup,
+                  repeats=repeats,
+                  min_time=min_time,
+                  loops=None,
+                  )
+    # Unique result file, concurrent benchmarks of the same project don't overwrite each other results
+    fd, config['result_file'] = tempfile.mkstemp(prefix='worker_result_', suffix='.json', dir=bench_path)
+    os.close(fd)
+    groups = []
+    try:
+        for i in range(processes):
+            # Truncated, so the failed process doesn't leave the previous process result
+            open(config['result_file'], 'w').close()
+
+            ret = subprocess.call(['python', '-c',
+                                   f'from cython_dev_tools.testing.bench import run_bench_worker; '
+                                   f'run_bench_worker({config!r})'],
+                                  env=env, cwd=project_root, stdout=subprocess.DEVNULL)
+            if ret != 0 or os.path.getsize(config['result_file']) == 0:
+                raise RuntimeError(f'Benchmark process failed with exit code {ret}, '
+                                   f'try `cytool run {package}@{entry_method}` first')
+
+            with open(config['result_file'], 'r') as fh:
+                worker_result = json.load(fh)
+            config['loops'] = worker_result['loops']
+            groups.append(worker_result['samples'])
+            log.debug(f'Process #{i}: {[format_time(s) for s in worker_result["samples"]]}')
+    finally:
+        os.unlink(config['result_file'])
+
+    return groups, config['loops']
+
+
+def bench(bench_target,
+          project_root=None,
+          processes=5,
+          repeats=5,
+          warmup=1,
+          min_time=0.2,
+          confidence=0.95,
+          output=None,
+          compare=None,
+          alpha=0.05,
+          sweep=None,
+          browser=False,
+          profile=None,
+          ) -> dict:
+    """
+    Benchmarks the entry point function call
+
+    :param bench_target: i.e. package/module.pyx@func(1, n=5)
+    :param processes: number of fresh python processes
+    :param repeats: number of samples per process
+    :param warmup: number of calls before measurement
+    :param min_time: minimal time of one sample (seconds), for loops calibration
+    :param output: results JSON file, by default `.cython_dev_tools/bench/<package>.<func>_<datetime>.json`
+    :param compare: baseline to compare with - git revision (the last result measured at it), results JSON file,
+        or 'last' (the previous result)
+    :param alpha: significance level of the slowdown test
+    :param sweep: variable range used in bench_target arguments, i.e. `n=1e3:1e7:log10` (see `parse_sweep()`)
+    :param browser: open sweep scaling plot in the browser
+    :param profile: measure the named build profile (see `building/profiles.py`)
+    :return: results dict
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+
+    entry_target, entry_args = split_call_target(bench_target)
+    source_file, package, entry_method = find_package_path(project_root, entry_target)
+
+    sweep_variable, sweep_values = parse_sweep(sweep) if sweep else (None, [None])
+    # Fail early on invalid arguments
+    for v in sweep_values:
+        variables = fixture_variables(cython_dev_tools_path, dry_run=True)
+        if sweep_variable:
+            variables[sweep_variable] = v
+        check_method_args(entry_args, variables)
+    log.debug(f'Benchmarking {package}.{entry_method}{entry_args}')
+
+    bench_path = os.path.join(cython_dev_tools_path, BENCH_DIRNAME)
+    os.makedirs(bench_path, exist_ok=True)
+
+    # Build tree to measure, results are saved in the project
+    build_root, build_tools_path, record_target = project_root, cython_dev_tools_path, bench_target
+    if profile:
+        build_root = build_profile(project_root, profile)
+        build_tools_path = os.path.join(build_root, CYTHON_TOOLS_DIRNAME)
+        record_target = f'{bench_target} [profile={profile}]'
+    my_env = variant_env(build_root)
+
+    if output is None:
+        output = os.path.join(bench_path, f'{package}.{entry_method}_{datetime.now():%Y%m%d_%H%M%S}.json')
+
+    if sweep:
+        return bench_sweep(project_root, cython_dev_tools_path, bench_target, package, entry_method, entry_args,
+                           sweep_variable, sweep_values, bench_path, my_env, output, browser,
+                           build_root=build_root, build_tools_path=build_tools_path, record_target=record_target,
+                           processes=processes, repeats=repeats, warmup=warmup, min_time=min_time)
+
+    groups, loops = measure_call(build_root, build_tools_path, package, entry_method, entry_args, bench_path,
+                                 my_env, processes=processes, repeats=repeats, warmup=warmup, min_time=min_time)
+
+    samples = [s for g in groups for s in g]
+    variant, flags = build_variant(build_tools_path, package)
+    results = dict(target=bench_target,
+                   package=package,
+                   entry_method=entry_method,
+                   entry_args=entry_args,
+                   created_at=datetime.now().isoformat(timespec='seconds'),
+                   variant=variant,
+                   flags_hash=flags_hash(flags),
+                   processes=processes,
+                   repeats=repeats,
+                   warmup=warmup,
+                   loops=loops,
+                   stats=describe(samples, groups, confidence),
+                   samples=groups,
+                   )
+    print_bench_results(results)
+
+    with open(output, 'w') as fh:
+        json.dump(results, fh, indent=1)
+    log.info(f'Benchmark results saved: {output}')
+
+    record_id = record_perf(project_root, cython_dev_tools_path, 'bench', record_target, package,
+                            stats=results['stats'], samples=groups, build_path=build_tools_path)
+    log.debug(f'Performance history record #{record_id}')
+
+    if compare is not None:
+        results['comparison'] = compare_with_baseline(project_root, cython_dev_tools_path, results, compare,
+                                                      record_id, alpha, record_target=record_target, flags=flags)
+    return results
+
+
+def bench_sweep(project_root, cython_dev_tools_path, bench_target, package, entry_method, entry_args,
+                variable, values, bench_path, env, output, browser,
+                build_root=None, build_tools_path=None, record_target=None, **measure_kwargs) -> dict:
+    """
+    Benchmarks the function for each sweep variable value, and fits the empirical complexity
+
+    :param build_root: build tree to measure (i.e. build profile tree), the project by default
+    """
+    build_root, build_tools_path = build_root or project_root, build_tools_path or cython_dev_tools_path
+    points = []
+    for v in values:
+        log.info(f'Sweep {variable}={v}')
+        groups, loops = measure_call(build_root, build_tools_path, package, entry_method, entry_args,
+                                     bench_path, env, variables={variable: v}, **measure_kwargs)
+        stats = describe([s for g in groups for s in g], groups)
+        points.append(dict(value=v, loops=loops, stats=stats, samples=groups))
+
+    ns = [p['value'] for p in points]
+    times = [p['stats']['median'] for p in points]
+    fit = fit_complexity(ns, times) if len(points) >= 3 else dict(best=None, exponent=None, models=[])
+
+    print(f'{bench_target} sweep {variable}:')
+    print(f'{variable:>12} {"median":>12} {"min":>12} {"stdev":>8}')
+    for p in points:
+        st = p['stats']
+        print(f'{p["value"]:>12g} {format_time(st["median"]):>12} {format_time(st["min"]):>12} '
+              f'{st["stdev"] / st["mean"]:>8.1%}')
+    if fit['best']:
+        print(f'Best fit: {fit["best"]} (log-log slope {fit["exponent"]:.2f})')
+        for m in fit['models']:
+            print(f'  {m["name"]:<12} relative RMSE: {m["rel_rmse"]:.1%}')
+    else:
+        log.warning('At least 3 sweep points are required for complexity fitting')
+
+    results = dict(target=bench_target,
+                   package=package,
+                   entry_method=entry_method,
+                   entry_args=entry_args,
+                   created_at=datetime.now().isoformat(timespec='seconds'),
+                   variable=variable,
+                   points=points,
+                   fit=fit,
+                   )
+    with open(output, 'w') as fh:
+        json.dump(results, fh, indent=1)
+    log.info(f'Sweep results saved: {output}')
+
+    record_perf(project_root, cython_dev_tools_path, 'sweep', record_target or bench_target, package,
+                stats=dict(variable=variable, values=ns, medians=times, fit=fit), samples=[p['samples'] for p in points],
+                build_path=build_tools_path)
+
+    if fit['best']:
+        plot_fn = os.path.splitext(output)[0] + '.html'
+        with open(plot_fn, 'w') as fh:
+            fh.write(f'<html><head><meta charset="utf-8"><title>{html.escape(bench_target)}</title></head><body>\n')
+            fh.write(render_scaling_svg(f'{bench_target} [{variable}]', variable, ns, times, fit))
+            fh.write('\n</body></html>\n')
+        print(f'Scaling plot: file://{plot_fn}')
+        if browser:
+            open_url_in_browser(f'file://{plot_fn}')
+    return results
+
+
+def compare_with_baseline(project_root, cython_dev_tools_path, results, baseline, record_id, alpha,
+                          record_target=None, flags=None) -> dict:
+    """
+    Compares results with the baseline measured with the same build variant and flags
+
+    :param flags: compilation flags of the measured build (see `build_variant()`)
+    """
+    if os.path.isfile(baseline):
+        with open(baseline, 'r') as fh:
+            baseline_results = json.load(fh)
+        # Results files of older versions don't have build info
+        for k in ('variant', 'flags_hash'):
+            if baseline_results.get(k, results[k]) != results[k]:
+                raise ValueError(f'Baseline {baseline} was measured with another build: '
+                                 f'`{baseline_results.get("variant")}` (flags {baseline_results.get("flags_hash")}) '
+                                 f'vs `{results["variant"]}` (flags {results["flags_hash"]})')
+        baseline_samples = baseline_results['samples']
+    else:
+        record_target = record_target or results['target']
+        record = find_baseline_record(project_root, cython_dev_tools_path, 'bench', record_target, baseline,
+                                      exclude_id=record_id, variant=results['variant'], flags=flags)
+        if record is None:
+            log.warning(f'No benchmark history for {record_target} at `{baseline}` on this machine with this build, '
+                        f'run `cytool bench` at the baseline revision first')
+            return {}
+        log.info(f'Baseline: {record["created_at"]} revision {record["revision"]} ({record["variant"]} build)')
+        baseline_samples = record['samples']
+
+    comparison = compare_samples(baseline_samples, results['samples'], alpha=alpha)
+    print(f'  baseline median: {format_time(comparison["baseline_median"])}, change: {comparison["change"]:+.1%}, '
+          f'p-value: {comparison["p_value"]:.4f}')
+    if comparison['is_slowdown']:
+        log.error(f'Significant slowdown of {results["target"]}: {comparison["change"]:+.1%} vs `{baseline}`')
+    return comparison
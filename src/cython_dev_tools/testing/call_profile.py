@@ -0,0 +1,246 @@
+"""
+Function-level profiles with call tree: cProfile of the `cprofile` build (Cython `profile=True`), or perf samples
+of the `profile` build (see `debugger/perf.py`)
+
+Frames are labeled by pyx qualified names, the profile is exported as flamegraph SVG/HTML and speedscope JSON.
+"""
+import ast
+import cProfile
+import functools
+import os
+import pstats
+import re
+import shutil
+import subprocess
+import time
+
+from cython_dev_tools.building.profiles import build_profile
+from cython_dev_tools.building.variants import variant_env
+from cython_dev_tools.common import check_project_initialized, find_package_path, check_method_args, \
+    split_call_target, open_url_in_browser
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.profile_data import load_call_target, make_profile, save_profile, \
+    print_hot_functions, print_profile_files, PROFILES_DIRNAME
+from cython_dev_tools.testing.profile_diff import profile_diff
+
+CPROFILE_BUILD_PROFILE = 'cprofile'
+# Entries of the profiler itself
+CPROFILE_SKIP_NAMES = {"<method 'disable' of '_lsprof.Profiler' objects>"}
+RE_BUILTIN_CALL = re.compile(r'^<(built-in method )?(?P<name>[\w.]+)>$')
+
+
+def profile_command(args):
+    log.setup('cython_dev_tools__profile', verbosity=args.verbose)
+
+    if args.diff:
+        profile_diff(*args.diff, project_root=args.project_root, limit=args.limit, browser=args.browser)
+        return
+    if not args.profile_target:
+        raise ValueError('profile target is required, i.e. package/module.pyx@func(1000)')
+
+    profile(args.profile_target,
+            project_root=args.project_root,
+            use_perf=args.perf,
+            duration=args.duration,
+            limit=args.limit,
+            browser=args.browser,
+            )
+
+
+def run_cprofile_worker(config: dict):
+    """
+    Profiled process entry point, calls the target under cProfile for `config['duration']` seconds
+    """
+    log.setup('cython_dev_tools__profile', log_level=config['log_level'])
+    func, f_args, f_kwargs = load_call_target(config['cython_dev_tools_path'], config['package'],
+                                              config['entry_method'], config['entry_args'])
+    profiler = cProfile.Profile()
+    t_end = time.perf_counter() + config['duration']
+    while True:
+        profiler.runcall(func, *f_args, **f_kwargs)
+        if time.perf_counter() >= t_end:
+            break
+    profiler.dump_stats(config['result_file'])
+
+
+def pyx_function_names(func_mapper: dict) -> dict:
+    """
+    Qualified names of Cython functions by (module, definition line, name), see `valgrind.make_func_mapper()`
+    """
+    names = {}
+    for fm in func_mapper.values():
+        for module_map in fm.values():
+            for qualified_name, lineno in module_map['functions'].values():
+                names[(module_map['module_name'], lineno, qualified_name.split('.')[-1])] = qualified_name
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def python_qualified_names(filename) -> dict:
+    """
+    Qualified names of functions and methods of Python source by their first line, i.e. {7: 'SQ.recip_square2'}
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r', errors='replace') as fh:
+        try:
+            tree = ast.parse(fh.read(), filename)
+        except SyntaxError:
+            return {}
+
+    names = {}
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                # Code first line is the first decorator line
+                names[min([child.lineno] + [d.lineno for d in child.decorator_list])] = prefix + child.name
+                visit(child, f'{prefix}{child.name}.<locals>.')
+            elif isinstance(child, ast.ClassDef):
+                visit(child, f'{prefix}{child.name}.')
+    visit(tree, '')
+    return names
+
+
+def code_frame(func, project_root, function_names: dict) -> dict:
+    """
+    Label and source location of the code key (filename, line, name) of cProfile or line_profiler stats
+    """
+    filename, lineno, name = func
+    if filename == '~':
+        # Built-in function, or C call of Cython function, i.e. `<pkg.mod.func>` (merged with its frame)
+        m = RE_BUILTIN_CALL.match(name)
+        return dict(name=m['name'] if m else name)
+    rel_fn = os.path.relpath(filename, project_root) if os.path.isabs(filename) else filename
+    if rel_fn.startswith('..'):
+        # Outside of the project, i.e. stdlib
+        return dict(name=f'{name} ({os.path.basename(filename)}:{lineno})')
+    module = os.path.splitext(rel_fn)[0].replace(os.sep, '.')
+    qualified_name = function_names.get((module, lineno, name))
+    if qualified_name is None and rel_fn.endswith('.py'):
+        py_name = python_qualified_names(os.path.join(project_root, rel_fn)).get(lineno)
+        qualified_name = f'{module}.{py_name}' if py_name and py_name.split('.')[-1] == name else None
+    return dict(name=qualified_name or f'{module}.{name}', file=rel_fn, line=lineno)
+
+
+def cprofile_stacks(stats: dict, labels: dict, min_weight=1, scale=1e6) -> dict:
+    """
+    Collapsed stacks (microseconds) of cProfile stats
+
+    cProfile keeps only caller -> callee edges, so the function time is split among its call paths proportionally
+    to the edge times (recursive calls are folded into the outermost call, same name callee into its caller)
+
+    :param stats: `pstats.Stats().stats`
+    :param labels: frame names by cProfile function key
+    :param min_weight: call paths below this weight are dropped
+    :param scale: stacks weight units per stats time unit (i.e. 1 for callgrind instruction counts)
+    """
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    stacks = {}
+
+    def expand(func, path, funcs, t):
+        tt, ct = stats[func][2], stats[func][3]
+        if not path or path[-1] != labels[func]:
+            path = path + [labels[func]]
+        stack = ';'.join(path)
+        if ct > 0:
+            stacks[stack] = stacks.get(stack, 0) + t * tt / ct
+        for child, edge_ct in children.get(func, []):
+            child_t = t * edge_ct / ct if ct > 0 else 0
+            if child not in funcs and child in labels and child_t * scale >= min_weight:
+                expand(child, path, funcs | {child}, child_t)
+
+    for func, (_, _, _, ct, callers) in stats.items():
+        if func not in labels:
+            continue
+        # Called from outside of the profile (i.e. the target), or by skipped functions
+        root_t = sum(edge[3] for caller, edge in callers.items() if caller not in labels) if callers else ct
+        if root_t * scale >= min_weight:
+            expand(func, [], {func}, root_t)
+
+    return {stack: round(t * scale) for stack, t in stacks.items() if round(t * scale) >= min_weight}
+
+
+def cprofile_profile(stats: dict, project_root, func_mapper: dict, target) -> dict:
+    function_names = pyx_function_names(func_mapper)
+    labels = {}
+    frames_info = {}
+    for func in stats:
+        if func[2] in CPROFILE_SKIP_NAMES:
+            continue
+        frame = code_frame(func, project_root, function_names)
+        labels[func] = frame['name'].replace(';', ',')
+        if frame.get('file'):
+            frames_info[labels[func]] = dict(file=frame['file'], line=frame['line'])
+    return make_profile('cprofile', target, 'us', cprofile_stacks(stats, labels), frames_info=frames_info)
+
+
+def profile(profile_target,
+            project_root=None,
+            use_perf=False,
+            duration=1.0,
+            limit=20,
+            browser=False,
+            ) -> str:
+    """
+    Profiles the entry point call, saves the profile with flamegraph and speedscope exports
+
+    :param profile_target: entry point call, i.e. `package/module.pyx@func(1000)` (`()` can be omitted)
+    :param use_perf: sample with `perf` (native code, no profiling overhead), instead of cProfile
+    :param duration: the target is called repeatedly for at least `duration` seconds
+    :param browser: open flamegraph HTML in the browser
+    :return: profile JSON path
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+
+    if use_perf:
+        from cython_dev_tools.debugger.perf import perf_record
+        profile_fn = perf_record(profile_target, project_root=project_root, duration=duration, limit=limit)
+    else:
+        if '(' not in profile_target:
+            profile_target += '()'
+        entry_target, entry_args = split_call_target(profile_target)
+        _, package, entry_method = find_package_path(project_root, entry_target)
+        check_method_args(entry_args, fixture_variables(cython_dev_tools_path, dry_run=True))
+
+        profile_root = build_profile(project_root, CPROFILE_BUILD_PROFILE)
+        profile_tools_path = os.path.join(profile_root, os.path.basename(cython_dev_tools_path))
+        profiles_path = os.path.join(cython_dev_tools_path, PROFILES_DIRNAME)
+        os.makedirs(profiles_path, exist_ok=True)
+
+        config = dict(log_level=log.log_level,
+                      cython_dev_tools_path=profile_tools_path,
+                      package=package,
+                      entry_method=entry_method,
+                      entry_args=entry_args,
+                      duration=duration,
+                      result_file=os.path.join(profiles_path, 'cprofile.prof'),
+                      )
+        log.info(f'Profiling {profile_target} for {duration}s')
+        ret = subprocess.call(['python', '-c',
+                               f'from cython_dev_tools.testing.call_profile import run_cprofile_worker; '
+                               f'run_cprofile_worker({config!r})'],
+                              env=variant_env(profile_root), cwd=profile_root)
+        if ret != 0 or not os.path.exists(config['result_file']):
+            raise RuntimeError(f'Profiled process failed with exit code {ret}, try `cytool run {entry_target} '
+                               f'--profile {CPROFILE_BUILD_PROFILE}` first')
+
+        from cython_dev_tools.debugger.valgrind import make_func_mapper
+        prof = cprofile_profile(pstats.Stats(config['result_file']).stats, profile_root,
+                                make_func_mapper(profile_tools_path), profile_target)
+        profile_fn = save_profile(cython_dev_tools_path, prof, f'{package}.{entry_method}')
+        # Raw stats for other pstats viewers
+        shutil.move(config['result_file'], os.path.splitext(profile_fn)[0] + '.prof')
+
+        print_hot_functions(prof, limit=limit, mapped_only=False)
+        print()
+        print_profile_files(profile_fn)
+
+    if browser:
+        open_url_in_browser(os.path.splitext(profile_fn)[0] + '.html')
+    return profile_fn
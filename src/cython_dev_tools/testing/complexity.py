@@ -0,0 +1,167 @@
+"""
+Parameter sweep and empirical complexity fitting for `cytool bench --sweep`
+"""
+import html
+import math
+from typing import List, Tuple
+
+from cython_dev_tools.testing.stats import format_time
+
+# name, f(n)
+COMPLEXITY_MODELS = [
+    ('O(1)', lambda n: 1.0),
+    ('O(log n)', lambda n: math.log(n)),
+    ('O(n)', lambda n: n),
+    ('O(n log n)', lambda n: n * math.log(n)),
+    ('O(n^2)', lambda n: n ** 2),
+    ('O(n^3)', lambda n: n ** 3),
+]
+
+
+def parse_sweep(sweep_spec: str) -> Tuple[str, List]:
+    """
+    Parses sweep specification `name=start:stop:step`
+
+    Examples:
+        n=1e3:1e7:log10 - 1000, 10000, ..., 10000000
+        n=16:1024:log2 - 16, 32, ..., 1024
+        n=1000:5000:1000 - 1000, 2000, ..., 5000
+
+    :return: (variable name, values), values are int if all of them are integer
+    """
+    try:
+        name, range_spec = sweep_spec.split('=', 1)
+        start, stop, step = range_spec.split(':')
+        start, stop = float(start), float(stop)
+    except ValueError:
+        raise ValueError(f'Sweep must be in format `name=start:stop:step`, i.e. `n=1e3:1e7:log10`, got `{sweep_spec}`')
+    name = name.strip()
+    if not name.isidentifier():
+        raise ValueError(f'Sweep variable must be a valid identifier, got `{name}`')
+    if stop < start:
+        raise ValueError(f'Sweep stop must be >= start, got `{sweep_spec}`')
+
+    values = []
+    if step.startswith('log'):
+        base = float(step[3:] or 10)
+        if start <= 0 or base <= 1:
+            raise ValueError(f'Log sweep requires start > 0 and base > 1, got `{sweep_spec}`')
+        k = round(math.log(start, base))
+        while True:
+            v = base ** k
+            if v > stop * (1 + 1e-9):
+                break
+            if v >= start * (1 - 1e-9):
+                values.append(v)
+            k += 1
+    else:
+        step = float(step)
+        if step <= 0:
+            raise ValueError(f'Sweep step must be > 0, got `{sweep_spec}`')
+        v = start
+        while v <= stop * (1 + 1e-9):
+            values.append(v)
+            v += step
+
+    if all(abs(v - round(v)) < 1e-6 * max(1.0, abs(v)) for v in values):
+        values = [int(round(v)) for v in values]
+    return name, values
+
+
+def fit_complexity(ns: List[float], times: List[float]) -> dict:
+    """
+    Fits t = a + b * f(n) for each complexity model, minimizing the relative error (timings span orders of magnitude)
+
+    :return: {'best': model name, 'exponent': log-log slope, 'models': [{name, a, b, rel_rmse}], the best first}
+    """
+    if len(ns) < 3:
+        raise ValueError('At least 3 sweep points are required for complexity fitting')
+
+    models = []
+    for name, f in COMPLEXITY_MODELS:
+        # Weighted least squares with weights 1/t^2
+        xs = [f(n) for n in ns]
+        w = [1.0 / t ** 2 for t in times]
+        sw = sum(w)
+        swx = sum(wi * x for wi, x in zip(w, xs))
+        swxx = sum(wi * x * x for wi, x in zip(w, xs))
+        swy = sum(wi * t for wi, t in zip(w, times))
+        swxy = sum(wi * x * t for wi, x, t in zip(w, xs, times))
+        det = sw * swxx - swx * swx
+        if abs(det) < 1e-12 * max(1.0, sw * swxx):
+            # Constant model
+            a, b = swy / sw, 0.0
+        else:
+            a = (swxx * swy - swx * swxy) / det
+            b = (sw * swxy - swx * swy) / det
+            if b < 0:
+                # Time decreasing with the growth function is not this model
+                continue
+        rel_rmse = math.sqrt(sum(((a + b * x) / t - 1.0) ** 2 for x, t in zip(xs, times)) / len(times))
+        models.append(dict(name=name, a=a, b=b, rel_rmse=rel_rmse))
+
+    # The simplest model which is (almost) as good as the best one, i.e. O(1) data fits O(n^3) with b ~ 0 too
+    min_rmse = min(m['rel_rmse'] for m in models)
+    best = next(m['name'] for m in models if m['rel_rmse'] <= min_rmse * 1.1 + 0.005)
+    models.sort(key=lambda m: (m['name'] != best, m['rel_rmse']))
+
+    # Empirical exponent: slope of log(t) ~ log(n)
+    lx = [math.log(n) for n in ns]
+    ly = [math.log(t) for t in times]
+    mx, my = sum(lx) / len(lx), sum(ly) / len(ly)
+    sxx = sum((x - mx) ** 2 for x in lx)
+    exponent = sum((x - mx) * (y - my) for x, y in zip(lx, ly)) / sxx if sxx > 0 else 0.0
+
+    return dict(best=best, exponent=exponent, models=models)
+
+
+def render_scaling_svg(title, variable, ns, times, fit, width=720, height=440) -> str:
+    """
+    Log-log scaling plot of measured timings with the best fitted model curve
+    """
+    pad_l, pad_r, pad_t, pad_b = 80, 20, 40, 50
+    plot_w, plot_h = width - pad_l - pad_r, height - pad_t - pad_b
+
+    model = fit['models'][0] if fit['models'] else None
+    f = dict(COMPLEXITY_MODELS)[model['name']] if model else None
+    curve_ns = [ns[0] * (ns[-1] / ns[0]) ** (i / 50) for i in range(51)]
+    curve_ts = [model['a'] + model['b'] * f(n) for n in curve_ns] if model else []
+    all_ts = [t for t in times + curve_ts if t > 0]
+
+    lx0, lx1 = math.log10(min(ns)), math.log10(max(ns))
+    ly0, ly1 = math.log10(min(all_ts)), math.log10(max(all_ts))
+    lx1 = lx1 if lx1 > lx0 else lx0 + 1
+    ly1 = ly1 if ly1 > ly0 else ly0 + 1
+
+    def px(n):
+        return pad_l + (math.log10(n) - lx0) / (lx1 - lx0) * plot_w
+
+    def py(t):
+        return pad_t + plot_h - (math.log10(t) - ly0) / (ly1 - ly0) * plot_h
+
+    items = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="sans-serif" font-size="12">',
+             f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14">{html.escape(title)}</text>',
+             f'<rect x="{pad_l}" y="{pad_t}" width="{plot_w}" height="{plot_h}" fill="none" stroke="#888"/>']
+
+    for n in ns:
+        items.append(f'<line x1="{px(n):.1f}" y1="{pad_t + plot_h}" x2="{px(n):.1f}" y2="{pad_t + plot_h + 5}" stroke="#888"/>')
+        items.append(f'<text x="{px(n):.1f}" y="{pad_t + plot_h + 18}" text-anchor="middle">{n:g}</text>')
+    for k in range(math.floor(ly0), math.ceil(ly1) + 1):
+        t = 10 ** k
+        if ly0 <= k <= ly1:
+            items.append(f'<line x1="{pad_l}" y1="{py(t):.1f}" x2="{pad_l + plot_w}" y2="{py(t):.1f}" stroke="#eee"/>')
+            items.append(f'<text x="{pad_l - 5}" y="{py(t) + 4:.1f}" text-anchor="end">{format_time(t)}</text>')
+    items.append(f'<text x="{pad_l + plot_w / 2}" y="{height - 10}" text-anchor="middle">{html.escape(variable)}</text>')
+
+    if curve_ts:
+        points = ' '.join(f'{px(n):.1f},{py(t):.1f}' for n, t in zip(curve_ns, curve_ts) if t > 0)
+        items.append(f'<polyline points="{points}" fill="none" stroke="#d62728" stroke-dasharray="6,4"/>')
+        items.append(f'<text x="{pad_l + 10}" y="{pad_t + 18}" fill="#d62728">fit: {html.escape(model["name"])} '
+                     f'(log-log slope {fit["exponent"]:.2f})</text>')
+
+    points = ' '.join(f'{px(n):.1f},{py(t):.1f}' for n, t in zip(ns, times))
+    items.append(f'<polyline points="{points}" fill="none" stroke="#1f77b4"/>')
+    for n, t in zip(ns, times):
+        items.append(f'<circle cx="{px(n):.1f}" cy="{py(t):.1f}" r="4" fill="#1f77b4"><title>{variable}={n:g}: {format_time(t)}</title></circle>')
+    items.append('</svg>')
+    return '\n'.join(items)
@@ -5,6 +5,7 @@ from datetime import datetime
 import cython_dev_tools.building
 from cython_dev_tools.common import check_project_initialized, open_url_in_browser
 from cython_dev_tools.logs import log
+from cython_dev_tools.testing.impact import save_impact_map
 
 
 def coverage_command(args):
@@ -16,6 +17,8 @@ def coverage_command(args):
     coverage_rep_url = coverage(tests_target=args.tests_target,
                                 project_root=args.project_root,
                                 coverage_engine=args.coverage_engine,
+                                test_contexts=args.test_contexts,
+                                trace_only=args.trace_only,
                                 )
     if args.browser:
         open_url_in_browser(f'file://{coverage_rep_url}')
@@ -26,6 +29,8 @@ def coverage_command(args):
 def coverage(tests_target: str = '.',
              project_root: str = None,
              coverage_engine='pytest',
+             test_contexts=False,
+             trace_only=None,
              ):
 
     # Check if cython tools in a good state in the project root
@@ -56,7 +61,7 @@ def coverage(tests_target: str = '.',
 
     # Step 1: coverage cython cove must be re-build with debug option
     log.debug(f'Force rebuild extension with debug info')
-    cython_dev_tools.building.build(project_root, is_debug=True)
+    cython_dev_tools.building.build(project_root, is_debug=True, trace_only=trace_only)
 
     # Step 2: make a .coveragerc file with Cython plugin record
     # include = {project_root}/*.pyx
@@ -84,8 +89,19 @@ project_src={os.path.join(cython_dev_tools_path, 'src')}
     # TODO: add it to the test runner too
     pytest_cache_dir = os.path.join(cython_dev_tools_path, '.pytest_cache')
 
+    engine_args = [f'--override-ini=cache_dir={pytest_cache_dir}', '-q']
+    if test_contexts:
+        if coverage_engine != 'pytest':
+            raise ValueError(f'Test contexts are only supported by pytest coverage engine, got {coverage_engine}')
+        # Record each test as dynamic context, for `cytool tests --affected`
+        engine_args += ['-p', 'cython_dev_tools.testing.pytest_plugin', '--cytool-contexts']
+
     coverage_main(['run', f'--data-file={cy_tools_coverage_data}', f'--rcfile={cy_tools_coverage_rc}',
-                   '-m', coverage_engine, f'--override-ini=cache_dir={pytest_cache_dir}', '-q', tests_target])
+                   '-m', coverage_engine] + engine_args + [tests_target])
+
+    if test_contexts:
+        log.debug(f'Saving test impact map')
+        save_impact_map(cy_tools_coverage_data, project_root, cython_dev_tools_path)
 
     log.trace(f'Producing HTML file: {cy_tools_coverage_html}')
     title = f'Cython Tools Coverage at {datetime.now()}'
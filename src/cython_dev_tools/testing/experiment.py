@@ -0,0 +1,167 @@
+"""
+Compiler directive A/B experiments
+
+Each combination of directive values is built into a separate variant tree (see `building/variants.py`) and
+benchmarked by the same harness as `cytool bench`. The first combination (the first value of each directive)
+is the baseline for speedups.
+"""
+import ast
+import itertools
+import json
+import os
+import statistics
+from datetime import datetime
+from typing import List
+
+from cython_dev_tools.building.variants import build_variant_tree, variant_env, variant_name
+from cython_dev_tools.common import check_project_initialized, find_package_path, check_method_args, split_call_target
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.bench import measure_call, BENCH_DIRNAME
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.perf_history import record_perf
+from cython_dev_tools.testing.stats import describe, format_time, bootstrap_ratio_ci
+
+EXPERIMENTS_DIRNAME = 'experiments'
+
+
+def experiment_command(args):
+    log.setup('cython_dev_tools__experiment', verbosity=args.verbose)
+
+    experiment(args.bench,
+               directives=args.directives,
+               modules=args.module,
+               project_root=args.project_root,
+               processes=args.processes,
+               repeats=args.repeats,
+               warmup=args.warmup,
+               min_time=args.min_time,
+               confidence=args.confidence,
+               )
+
+
+def parse_directive_values(directive_spec: str):
+    """
+    Parses `name=value1,value2`, i.e. `boundscheck=True,False` -> ('boundscheck', [True, False])
+    """
+    if '=' not in directive_spec:
+        raise ValueError(f'Directive must be in format `name=value1,value2`, got `{directive_spec}`')
+    name, values = directive_spec.split('=', 1)
+    parsed = []
+    for v in values.split(','):
+        v = v.strip()
+        try:
+            parsed.append(ast.literal_eval(v))
+        except (ValueError, SyntaxError):
+            # i.e. `language_level=3str`
+            parsed.append(v)
+    return name.strip(), parsed
+
+
+def directive_combinations(directives: List[str]) -> List[dict]:
+    """
+    All combinations of directive values, the first one is made of the first values (baseline)
+    """
+    parsed = [parse_directive_values(d) for d in directives]
+    names = [name for name, _ in parsed]
+    return [dict(zip(names, values)) for values in itertools.product(*[values for _, values in parsed])]
+
+
+def format_directives(directives: dict) -> str:
+    return ' '.join(f'{k}={v}' for k, v in directives.items())
+
+
+def experiment(bench_target,
+               directives: List[str],
+               modules: List[str] = None,
+               project_root=None,
+               processes=5,
+               repeats=5,
+               warmup=1,
+               min_time=0.2,
+               confidence=0.95,
+               ) -> dict:
+    """
+    Builds and benchmarks all combinations of compiler directive values
+
+    :param bench_target: benchmark target, i.e. `package/module.pyx@func(10)`
+    :param directives: list of `name=value1,value2` specs
+    :param modules: apply directives only to these packages/modules (all project modules by default)
+    :return: results dict
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    if not directives:
+        raise ValueError('At least one --directives is required')
+
+    entry_target, entry_args = split_call_target(bench_target)
+    source_file, package, entry_method = find_package_path(project_root, entry_target)
+    check_method_args(entry_args, fixture_variables(cython_dev_tools_path, dry_run=True))
+
+    combinations = directive_combinations(directives)
+    log.info(f'Experiment: {len(combinations)} variants, baseline: {format_directives(combinations[0])}')
+
+    variants = []
+    for compiler_directives in combinations:
+        name = variant_name('exp', dict(directives=compiler_directives, modules=modules))
+        variant_root = build_variant_tree(project_root, cython_dev_tools_path, name,
+                                          compiler_directives=compiler_directives,
+                                          directives_modules=modules)
+        variant_tools_path = os.path.join(variant_root, os.path.basename(cython_dev_tools_path))
+        bench_path = os.path.join(variant_tools_path, BENCH_DIRNAME)
+        os.makedirs(bench_path, exist_ok=True)
+
+        log.info(f'Benchmarking {format_directives(compiler_directives)}')
+        groups, loops = measure_call(variant_root, variant_tools_path, package, entry_method, entry_args, bench_path,
+                                     variant_env(variant_root), processes=processes, repeats=repeats, warmup=warmup,
+                                     min_time=min_time)
+        stats = describe([s for g in groups for s in g], groups, confidence)
+        record_perf(project_root, cython_dev_tools_path, 'experiment',
+                    f'{bench_target} [{format_directives(compiler_directives)}]', package,
+                    stats=stats, samples=groups, build_path=variant_tools_path)
+        variants.append(dict(name=name, directives=compiler_directives, loops=loops, stats=stats, samples=groups))
+
+    for v in variants:
+        speedup, ci_low, ci_high = speedup_ci(variants[0]['samples'], v['samples'], confidence=confidence)
+        v.update(speedup=speedup, speedup_ci_low=ci_low, speedup_ci_high=ci_high)
+
+    print_experiment_results(bench_target, modules, variants, confidence)
+
+    results = dict(target=bench_target,
+                   modules=modules,
+                   created_at=datetime.now().isoformat(timespec='seconds'),
+                   processes=processes,
+                   repeats=repeats,
+                   variants=variants,
+                   )
+    experiments_path = os.path.join(cython_dev_tools_path, EXPERIMENTS_DIRNAME)
+    os.makedirs(experiments_path, exist_ok=True)
+    results_fn = os.path.join(experiments_path, f'{package}.{entry_method}_{datetime.now():%Y%m%d_%H%M%S}.json')
+    with open(results_fn, 'w') as fh:
+        json.dump(results, fh, indent=1)
+    log.info(f'Experiment results saved: {results_fn}')
+    return results
+
+
+def speedup_ci(baseline_groups, groups, confidence=0.95):
+    """
+    Speedup of `groups` timings (grouped by process) over `baseline_groups` with the bootstrap confidence interval
+
+    Samples measured in the same process are not independent (like in `stats.describe()`), so the bootstrap is done
+    over per-process means, or over samples when there is only one process
+
+    :return: (speedup, ci_low, ci_high)
+    """
+    if len(baseline_groups) > 1 and len(groups) > 1:
+        return bootstrap_ratio_ci([statistics.fmean(g) for g in baseline_groups], [statistics.fmean(g) for g in groups],
+                                  confidence=confidence)
+    return bootstrap_ratio_ci([s for g in baseline_groups for s in g], [s for g in groups for s in g],
+                              confidence=confidence)
+
+
+def print_experiment_results(bench_target, modules, variants, confidence):
+    print(f'{bench_target}, directives applied to: {", ".join(modules) if modules else "all modules"}')
+    width = max(len(format_directives(v['directives'])) for v in variants)
+    print(f'{"Variant":<{width}} {"median":>12} {"min":>12} {"speedup":>9}  {confidence:.0%} CI')
+    for i, v in enumerate(variants):
+        ci = f'{v["speedup_ci_low"]:.2f}x .. {v["speedup_ci_high"]:.2f}x' if i > 0 else 'baseline'
+        print(f'{format_directives(v["directives"]):<{width}} {format_time(v["stats"]["median"]):>12} '
+              f'{format_time(v["stats"]["min"]):>12} {v["speedup"]:>8.2f}x  {ci}')
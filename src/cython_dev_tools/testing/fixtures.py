@@ -0,0 +1,105 @@
+"""
+Fixture factories for entry point arguments
+
+Arguments string may reference a factory function by `@fixture:factory(args)`, i.e.
+`cy_module.pyx@process(@fixture:make_orderbook(1_000_000), depth=10)`. The factory is a plain python function
+(in the entry point module, or by full name `package.module.factory`), its result is cached at
+`.cython_dev_tools/fixtures/` and reused by the next runs:
+
+- numpy arrays are saved as `.npy` and loaded memory-mapped (copy-on-write, the file is never changed)
+- any other picklable object (including cdef classes) is saved with pickle
+
+The cache is invalidated when the factory module source is changed.
+"""
+import hashlib
+import importlib
+import os
+import pickle
+from typing import Optional
+
+from cython_dev_tools.common import FIXTURE_LOADER_NAME
+from cython_dev_tools.logs import log
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FIXTURES_DIRNAME = 'fixtures'
+
+
+class FixtureLoader:
+    def __init__(self, cython_dev_tools_path, default_module: Optional[str] = None, dry_run=False):
+        """
+        :param default_module: module name for factories without package, i.e. `@fixture:make_data(10)`
+        :param dry_run: do not call factories (only arguments syntax check)
+        """
+        self.fixtures_path = os.path.join(cython_dev_tools_path, FIXTURES_DIRNAME)
+        self.default_module = default_module
+        self.dry_run = dry_run
+
+    def __call__(self, name):
+        def load(*args, **kwargs):
+            return self.load(name, args, kwargs)
+        return load
+
+    def resolve_factory(self, name):
+        if '.' in name:
+            module_name, func_name = name.rsplit('.', 1)
+        elif self.default_module:
+            module_name, func_name = self.default_module, name
+        else:
+            raise ValueError(f'Fixture factory must be a full name `package.module.{name}`')
+
+        module = importlib.import_module(module_name)
+        try:
+            factory = getattr(module, func_name)
+        except AttributeError:
+            raise ValueError(f'Fixture factory `{func_name}` not found in {module_name}')
+        return factory, f'{module_name}.{func_name}', getattr(module, '__file__', None)
+
+    def cache_key(self, name, args, kwargs, source_file) -> str:
+        h = hashlib.sha1(f'{name}{args!r}{sorted(kwargs.items())!r}'.encode())
+        if source_file and os.path.exists(source_file):
+            with open(source_file, 'rb') as fh:
+                h.update(fh.read())
+        return h.hexdigest()[:16]
+
+    def load(self, name, args, kwargs):
+        if self.dry_run:
+            return None
+
+        factory, full_name, source_file = self.resolve_factory(name)
+        cache_fn = os.path.join(self.fixtures_path, f'{full_name}_{self.cache_key(full_name, args, kwargs, source_file)}')
+
+        if os.path.exists(cache_fn + '.npy'):
+            log.debug(f'Fixture {name}{args}: loading memory-mapped {cache_fn}.npy')
+            return np.load(cache_fn + '.npy', mmap_mode='c')
+        if os.path.exists(cache_fn + '.pickle'):
+            log.debug(f'Fixture {name}{args}: loading {cache_fn}.pickle')
+            with open(cache_fn + '.pickle', 'rb') as fh:
+                return pickle.load(fh)
+
+        log.info(f'Fixture {name}{args}: calling factory')
+        obj = factory(*args, **kwargs)
+
+        os.makedirs(self.fixtures_path, exist_ok=True)
+        if np is not None and type(obj) is np.ndarray and not obj.dtype.hasobject:
+            np.save(cache_fn + '.npy', obj)
+            # Use memory-mapped version from the first run, to have the same behaviour as the next runs
+            return np.load(cache_fn + '.npy', mmap_mode='c')
+
+        try:
+            with open(cache_fn + '.pickle', 'wb') as fh:
+                pickle.dump(obj, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as exc:
+            log.warning(f'Fixture {name}{args} result is not cached, it is not picklable: {exc}')
+            os.unlink(cache_fn + '.pickle')
+        return obj
+
+
+def fixture_variables(cython_dev_tools_path, default_module=None, dry_run=False) -> dict:
+    """
+    Variables for `check_method_args()` to support `@fixture:factory(args)` references
+    """
+    return {FIXTURE_LOADER_NAME: FixtureLoader(cython_dev_tools_path, default_module, dry_run=dry_run)}
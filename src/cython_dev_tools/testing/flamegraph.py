@@ -0,0 +1,205 @@
+"""
+Self-contained flamegraph (SVG / HTML) and speedscope (https://www.speedscope.app) export of profiles
+(see `testing/profile_data.py`)
+"""
+import hashlib
+import html
+import json
+from typing import Optional
+
+FLAME_WIDTH = 1200
+FRAME_HEIGHT = 16
+# Frames narrower than this (px) are not drawn
+MIN_FRAME_WIDTH = 0.3
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+SPEEDSCOPE_UNITS = {'us': 'microseconds', 'samples': 'none'}
+
+ZOOM_SCRIPT = """
+<script>
+const PAD = %(pad)d, PLOT_W = %(plot_w)d;
+function label(g, w) {
+  const n = g.dataset.n, fit = Math.floor((w - 6) / 7);
+  return fit < 3 ? '' : (n.length <= fit ? n : n.slice(0, fit - 2) + '..');
+}
+function place(g, fx, fw) {
+  const x = PAD + fx * PLOT_W, w = fw * PLOT_W;
+  g.style.display = w < %(min_w)s ? 'none' : '';
+  g.querySelector('rect').setAttribute('x', x);
+  g.querySelector('rect').setAttribute('width', w);
+  g.querySelector('text').setAttribute('x', x + 3);
+  g.querySelector('text').textContent = label(g, w);
+}
+function zoom(target) {
+  const x0 = +target.dataset.x, w0 = +target.dataset.w, d0 = +target.dataset.d;
+  document.querySelectorAll('g.f').forEach(g => {
+    const x = +g.dataset.x, w = +g.dataset.w, d = +g.dataset.d;
+    if (d < d0 && x <= x0 + 1e-12 && x + w >= x0 + w0 - 1e-12) place(g, 0, 1);
+    else if (d >= d0 && x >= x0 - 1e-12 && x + w <= x0 + w0 + 1e-12) place(g, (x - x0) / w0, w / w0);
+    else g.style.display = 'none';
+  });
+}
+document.querySelectorAll('g.f').forEach(g => g.addEventListener('click', () => zoom(g)));
+document.getElementById('reset').addEventListener('click', () =>
+  document.querySelectorAll('g.f').forEach(g => place(g, +g.dataset.x, +g.dataset.w)));
+</script>
+"""
+
+
+def stacks_tree(stacks: dict) -> dict:
+    """
+    Call tree of collapsed stacks, i.e. {'name': '', 'value': 3, 'children': {'a': {'name': 'a', ...}}}
+    """
+    root = dict(name='', value=0, children={})
+    for stack, weight in stacks.items():
+        root['value'] += weight
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, dict(name=name, value=0, children={}))
+            node['value'] += weight
+    return root
+
+
+def frame_color(name, file: Optional[str]) -> str:
+    """
+    Cython frames are orange, Python frames are yellow, native frames are red (shade varies by name)
+    """
+    v = int(hashlib.md5(name.encode()).hexdigest()[:4], 16) / 0xffff
+    if file and file.endswith('.pyx'):
+        return f'hsl({25 + v * 15:.0f}, 90%, {55 + v * 10:.0f}%)'
+    if file and file.endswith('.py'):
+        return f'hsl({50 + v * 10:.0f}, 80%, {55 + v * 10:.0f}%)'
+    return f'hsl({v * 12:.0f}, 70%, {60 + v * 10:.0f}%)'
+
+
+def format_weight(value, unit) -> str:
+    if unit == 'us':
+        return f'{value / 1000:.3f} ms'
+    return f'{value:g} {unit}'
+
+
+def render_flamegraph_svg(profile: dict, title: str = None, colors: dict = None, details: dict = None,
+                          width=FLAME_WIDTH, interactive=False) -> str:
+    """
+    Flamegraph SVG of the profile stacks, the root frame at the bottom
+
+    :param colors: frame fill colors by call path (i.e. `a;b`) or by name (default: by kind, see `frame_color()`)
+    :param details: extra tooltip text by call path or by name
+    :param interactive: frames have data attributes for zooming by the HTML script
+    """
+    tree = stacks_tree(profile['stacks'])
+    total = tree['value'] or 1
+    functions = profile.get('functions', {})
+
+    def max_depth(node):
+        return 1 + max((max_depth(c) for c in node['children'].values()), default=0)
+
+    pad, pad_t = 10, 40
+    plot_w = width - 2 * pad
+    depth = max_depth(tree) - 1
+    height = pad_t + depth * FRAME_HEIGHT + pad
+
+    items = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" '
+             f'font-size="11">',
+             f'<rect x="0" y="0" width="{width}" height="{height}" fill="#f8f8f8"/>',
+             f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14" font-family="sans-serif">'
+             f'{html.escape(title or profile.get("target", ""))}</text>',
+             f'<text x="{width - pad}" y="20" text-anchor="end" font-family="sans-serif">'
+             f'total: {format_weight(tree["value"], profile["unit"])}</text>']
+    if interactive:
+        items.append(f'<text id="reset" x="{pad}" y="20" font-family="sans-serif" fill="#1f77b4" '
+                     f'style="cursor:pointer">Reset zoom</text>')
+
+    def draw(node, x, d, path):
+        w = node['value'] / total * plot_w
+        if w < MIN_FRAME_WIDTH:
+            return
+        name = node['name']
+        y = pad_t + (depth - d) * FRAME_HEIGHT
+        colors_ = colors or {}
+        fill = colors_.get(path) or colors_.get(name) or frame_color(name, functions.get(name, {}).get('file'))
+        tip = f'{name} ({format_weight(node["value"], profile["unit"])}, {node["value"] / total:.2%})'
+        detail = (details or {}).get(path) or (details or {}).get(name)
+        if detail:
+            tip += f'\n{detail}'
+        fit = int((w - 6) / 7)
+        text = '' if fit < 3 else (name if len(name) <= fit else name[:fit - 2] + '..')
+        data = (f' class="f" data-n="{html.escape(name)}" data-x="{(x - pad) / plot_w:.9f}" '
+                f'data-w="{w / plot_w:.9f}" data-d="{d}" style="cursor:pointer"' if interactive else '')
+        items.append(f'<g{data}><title>{html.escape(tip)}</title>'
+                     f'<rect x="{x:.2f}" y="{y}" width="{w:.2f}" height="{FRAME_HEIGHT - 1}" fill="{fill}" rx="2"/>'
+                     f'<text x="{x + 3:.2f}" y="{y + FRAME_HEIGHT - 4}">{html.escape(text)}</text></g>')
+        for child in sorted(node['children'].values(), key=lambda c: c['name']):
+            draw(child, x, d + 1, f'{path};{child["name"]}')
+            x += child['value'] / total * plot_w
+
+    x = pad
+    for child in sorted(tree['children'].values(), key=lambda c: c['name']):
+        draw(child, x, 1, child['name'])
+        x += child['value'] / total * plot_w
+    items.append('</svg>')
+    return '\n'.join(items)
+
+
+def render_flamegraph_html(profile: dict, title: str = None, colors: dict = None, details: dict = None,
+                           width=FLAME_WIDTH) -> str:
+    """
+    Flamegraph HTML page, click on a frame zooms into it
+    """
+    title = title or profile.get('target', '')
+    svg = render_flamegraph_svg(profile, title=title, colors=colors, details=details, width=width, interactive=True)
+    script = ZOOM_SCRIPT % dict(pad=10, plot_w=width - 20, min_w=MIN_FRAME_WIDTH)
+    return (f'<html><head><meta charset="utf-8"><title>{html.escape(title)}</title></head><body>\n'
+            f'{svg}\n{script}</body></html>\n')
+
+
+def export_speedscope(profile: dict) -> dict:
+    """
+    Speedscope sampled profile of the profile stacks (one sample per stack, weighted)
+    """
+    frames = []
+    frame_index = {}
+    samples = []
+    weights = []
+    for stack, weight in profile['stacks'].items():
+        sample = []
+        for name in stack.split(';'):
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                f = profile.get('functions', {}).get(name, {})
+                frame = dict(name=name)
+                if f.get('file'):
+                    frame.update(file=f['file'], line=f['line'])
+                frames.append(frame)
+            sample.append(frame_index[name])
+        samples.append(sample)
+        weights.append(weight)
+
+    name = profile.get('target') or profile['kind']
+    return {'$schema': SPEEDSCOPE_SCHEMA,
+            'shared': dict(frames=frames),
+            'profiles': [dict(type='sampled',
+                              name=name,
+                              unit=SPEEDSCOPE_UNITS.get(profile['unit'], 'none'),
+                              startValue=0,
+                              endValue=sum(weights),
+                              samples=samples,
+                              weights=weights)],
+            'name': name,
+            'exporter': 'cython-dev-tools'}
+
+
+def write_profile_exports(profile: dict, base_fn: str) -> dict:
+    """
+    Writes `<base_fn>.svg`, `<base_fn>.html` flamegraphs and `<base_fn>.speedscope.json`
+
+    :return: {'svg': path, 'html': path, 'speedscope': path}
+    """
+    paths = dict(svg=base_fn + '.svg', html=base_fn + '.html', speedscope=base_fn + '.speedscope.json')
+    with open(paths['svg'], 'w') as fh:
+        fh.write(render_flamegraph_svg(profile))
+    with open(paths['html'], 'w') as fh:
+        fh.write(render_flamegraph_html(profile))
+    with open(paths['speedscope'], 'w') as fh:
+        json.dump(export_speedscope(profile), fh)
+    return paths
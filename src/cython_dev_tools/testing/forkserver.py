@@ -0,0 +1,389 @@
+"""
+Pre-warmed fork server for `tests` / `run` commands
+
+The server process imports pytest, numpy and all project extension modules (from the build manifest) once,
+and forks a child for each request, so the child starts running tests without any import overhead.
+Client terminal (stdin/stdout/stderr) file descriptors are passed to the child via the unix socket.
+The socket is created in a private (0700) directory, and both sides check that the peer is run by the same user.
+
+The server is invalidated (exits) when the build manifest reports rebuilt extension modules, or when any
+of the imported project python modules has been changed, the client restarts it automatically.
+"""
+import array
+import hashlib
+import importlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from cython_dev_tools.logs import log
+from cython_dev_tools.building.build import load_build_manifest
+from cython_dev_tools.settings import CYTHON_TOOLS_DIRNAME
+
+# Preloaded on the server start (if available)
+WARM_PRELOAD_MODULES = ['pytest', 'numpy', 'coverage', 'unittest']
+# Unix socket path length is limited (108 bytes on Linux, 104 on macOS)
+MAX_SOCKET_PATH = 100
+
+
+def private_dir(path) -> str:
+    """
+    Creates (if needed) a directory accessible only by the current user, refuses to use a foreign or shared one
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise RuntimeError(f'Warm server socket directory is not owned by the current user: {path}')
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def warm_socket_path(project_root) -> str:
+    """
+    Socket path in the private `.cython_dev_tools/warm/` dir, or in the private per-user runtime / tmp dir
+    when the project path is too long for the unix socket
+    """
+    sock_path = os.path.join(os.path.abspath(project_root), CYTHON_TOOLS_DIRNAME, 'warm', 'warm.sock')
+    if len(sock_path.encode()) <= MAX_SOCKET_PATH:
+        private_dir(os.path.dirname(sock_path))
+        return sock_path
+
+    root_hash = hashlib.sha1(os.path.abspath(project_root).encode()).hexdigest()[:12]
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(private_dir(os.path.join(runtime_dir, f'cytool-warm-{os.getuid()}')), f'{root_hash}.sock')
+
+
+def check_peer(conn):
+    """
+    Raises PermissionError if the other end of the unix socket is run by another user
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        # Not Linux, relying on the private socket directory
+        return
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+    if uid != os.getuid():
+        raise PermissionError(f'Warm server socket peer (pid {pid}) is run by another user (uid {uid})')
+
+
+def _send_msg(conn, msg: dict, fds=None):
+    data = (json.dumps(msg) + '\n').encode()
+    if fds:
+        conn.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+    else:
+        conn.sendall(data)
+
+
+def _recv_msg(conn, max_fds=0):
+    """
+    Receives one JSON line message (and optionally passed file descriptors)
+    """
+    fds = array.array('i')
+    buf = b''
+    while not buf.endswith(b'\n'):
+        if max_fds and not fds:
+            data, ancdata, flags, addr = conn.recvmsg(65536, socket.CMSG_LEN(max_fds * fds.itemsize))
+            for cmsg_level, cmsg_type, cmsg_data in ancdata:
+                if cmsg_level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+                    fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+        else:
+            data = conn.recv(65536)
+        if not data:
+            return None, list(fds)
+        buf += data
+    return json.loads(buf.decode()), list(fds)
+
+
+class WarmForkServer:
+    def __init__(self, project_root, cython_dev_tools_path):
+        self.project_root = project_root
+        self.cython_dev_tools_path = cython_dev_tools_path
+        self.manifest_modules = {}
+        self.loaded_files = {}
+
+    def preload(self):
+        if self.project_root not in sys.path:
+            sys.path.insert(0, self.project_root)
+
+        for m in WARM_PRELOAD_MODULES:
+            try:
+                importlib.import_module(m)
+            except ImportError:
+                log.trace(f'Preload: {m} is not available')
+
+        self.manifest_modules = load_build_manifest(self.cython_dev_tools_path).get('modules', {})
+        for module_name in self.manifest_modules.keys():
+            try:
+                importlib.import_module(module_name)
+            except Exception as exc:
+                # Some modules may have side effects or fail on import, just skip them
+                log.debug(f'Preload: failed to import {module_name}: {exc}')
+
+        # Track all imported project files (including .py), to catch the changes
+        for m in list(sys.modules.values()):
+            fn = getattr(m, '__file__', None)
+            if fn and os.path.abspath(fn).startswith(self.project_root + os.path.sep) and os.path.exists(fn):
+                self.loaded_files[fn] = os.path.getmtime(fn)
+        log.info(f'Warm server preloaded {len(self.loaded_files)} project modules')
+
+    def is_stale(self) -> bool:
+        manifest_modules = load_build_manifest(self.cython_dev_tools_path).get('modules', {})
+        if {k: v.get('mtime') for k, v in manifest_modules.items()} != \
+                {k: v.get('mtime') for k, v in self.manifest_modules.items()}:
+            log.debug('Build manifest has changed')
+            return True
+
+        for fn, mtime in self.loaded_files.items():
+            if not os.path.exists(fn) or os.path.getmtime(fn) != mtime:
+                log.debug(f'Project module has changed: {fn}')
+                return True
+        return False
+
+    def serve(self, sock_path):
+        if os.path.exists(sock_path):
+            os.unlink(sock_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(sock_path)
+        server.listen(8)
+        log.info(f'Warm server listening at {sock_path} (pid {os.getpid()})')
+
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        check_peer(conn)
+                    except PermissionError as exc:
+                        log.warning(f'Rejected connection: {exc}')
+                        continue
+                    request, fds = _recv_msg(conn, max_fds=3)
+                    if request is None:
+                        continue
+                    if request['kind'] == 'stop':
+                        _send_msg(conn, dict(status='stopped'))
+                        break
+                    if request['kind'] == 'status':
+                        _send_msg(conn, dict(status='ok', pid=os.getpid(), stale=self.is_stale(),
+                                             n_modules=len(self.loaded_files)))
+                        continue
+                    if self.is_stale():
+                        for fd in fds:
+                            os.close(fd)
+                        _send_msg(conn, dict(status='stale'))
+                        break
+
+                    ret = self.fork_request(server, conn, request, fds)
+                    try:
+                        _send_msg(conn, dict(status='done', ret=ret))
+                    except OSError:
+                        log.debug(f'Client disconnected before the result')
+        finally:
+            server.close()
+            if os.path.exists(sock_path):
+                os.unlink(sock_path)
+            log.info('Warm server stopped')
+
+    def fork_request(self, server, conn, request, fds) -> int:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            # Child process
+            server.close()
+            conn.close()
+            os._exit(run_forked_request(request, fds))
+
+        for fd in fds:
+            os.close(fd)
+
+        is_client_alive = True
+        while True:
+            wpid, status = os.waitpid(pid, os.WNOHANG)
+            if wpid == pid:
+                if os.WIFSIGNALED(status):
+                    return -os.WTERMSIG(status)
+                return os.WEXITSTATUS(status)
+
+            if not is_client_alive:
+                time.sleep(0.05)
+                continue
+
+            readable, _, _ = select.select([conn], [], [], 0.05)
+            if readable and not conn.recv(1, socket.MSG_PEEK):
+                # Client has gone (i.e. Ctrl+C), stop the child too
+                log.debug(f'Client disconnected, terminating child {pid}')
+                os.kill(pid, signal.SIGTERM)
+                is_client_alive = False
+
+
+def run_forked_request(request, fds) -> int:
+    """
+    Runs in the forked child, returns exit code
+    """
+    try:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for i, fd in enumerate(fds):
+            if fd != i:
+                os.dup2(fd, i)
+                os.close(fd)
+        # Re-open standard streams, which are now pointing to the client terminal
+        sys.stdin = open(0, 'r', closefd=False)
+        sys.stdout = open(1, 'w', buffering=1, closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        for p in reversed(request['env'].get('PYTHONPATH', '').split(':')):
+            if p and p not in sys.path:
+                sys.path.insert(0, p)
+
+        if request['kind'] == 'pytest':
+            import pytest
+            sys.argv = ['pytest'] + request['args']
+            return int(pytest.main(request['args']))
+        elif request['kind'] == 'run':
+            package, entry_method = request['args']
+            if entry_method is None:
+                runpy.run_module(package, run_name='__main__', alter_sys=True)
+            else:
+                m = importlib.import_module(package)
+                getattr(m, entry_method)()
+            return 0
+        else:
+            raise ValueError(f'Unknown request kind: {request["kind"]}')
+    except SystemExit as exc:
+        return exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 1)
+    except KeyboardInterrupt:
+        return 130
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def serve(project_root, cython_dev_tools_path):
+    """
+    Fork server process entry point
+    """
+    server = WarmForkServer(project_root, cython_dev_tools_path)
+    server.preload()
+    server.serve(warm_socket_path(project_root))
+
+
+def _connect(project_root):
+    """
+    Connects to the running server, or returns None (no server, or a stale socket file left by a killed one)
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(warm_socket_path(project_root))
+    except OSError:
+        sock.close()
+        return None
+    try:
+        check_peer(sock)
+    except PermissionError:
+        sock.close()
+        raise
+    return sock
+
+
+def stop_warm_server(project_root) -> bool:
+    """
+    Stops the server, returns False if it was not running
+    """
+    sock = _connect(project_root)
+    if sock is None:
+        return False
+    with sock:
+        _send_msg(sock, dict(kind='stop'))
+        _recv_msg(sock)
+    return True
+
+
+def start_warm_server(project_root, cython_dev_tools_path, env, timeout=60):
+    log.info('Starting warm server')
+    log_fn = os.path.join(cython_dev_tools_path, 'warm_server.log')
+    with open(log_fn, 'a') as log_fh:
+        subprocess.Popen(['python', '-c',
+                          f'from cython_dev_tools.logs import log; log.setup("cython_dev_tools__warm", verbosity=2); '
+                          f'from cython_dev_tools.testing.forkserver import serve; serve({project_root!r}, {cython_dev_tools_path!r})'],
+                         env=env, cwd=project_root, stdin=subprocess.DEVNULL, stdout=log_fh, stderr=subprocess.STDOUT,
+                         start_new_session=True)
+
+    t_start = time.time()
+    while time.time() - t_start < timeout:
+        sock = _connect(project_root)
+        if sock is not None:
+            return sock
+        time.sleep(0.05)
+    raise RuntimeError(f'Warm server has not started in {timeout} sec, see {log_fn}')
+
+
+def warm_request(project_root, cython_dev_tools_path, kind, args, env) -> int:
+    """
+    Runs request in the pre-warmed fork server (starts it if not running)
+
+    :param kind: 'pytest' (args - pytest arguments) or 'run' (args - [package, entry_method])
+    :return: exit code (negative for signals, like subprocess.Popen)
+    """
+    for attempt in range(2):
+        sock = _connect(project_root)
+        if sock is None:
+            sock = start_warm_server(project_root, cython_dev_tools_path, env)
+
+        with sock:
+            _send_msg(sock, dict(kind=kind, args=args, cwd=os.getcwd(), env=env),
+                      fds=[sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+            reply, _ = _recv_msg(sock)
+
+        if reply is None:
+            raise RuntimeError(f'Warm server connection lost')
+        if reply['status'] == 'stale':
+            log.info('Warm server is outdated (project rebuilt or changed), restarting')
+            # Wait until the old server releases the socket
+            t_start = time.time()
+            while os.path.exists(warm_socket_path(project_root)) and time.time() - t_start < 5:
+                time.sleep(0.02)
+            continue
+        return reply['ret']
+
+    raise RuntimeError(f'Warm server failed to start with the actual project state')
+
+
+def warm_command(args):
+    log.setup('cython_dev_tools__warm', verbosity=args.verbose)
+    from cython_dev_tools.common import check_project_initialized
+
+    project_root, cython_dev_tools_path = check_project_initialized(args.project_root)
+
+    if args.stop:
+        print('Warm server stopped' if stop_warm_server(project_root) else 'Warm server is not running')
+        return
+
+    sock = _connect(project_root)
+    if sock is None:
+        env = os.environ.copy()
+        env["PYTHONPATH"] = f"{project_root}:" + env["PYTHONPATH"] if "PYTHONPATH" in env else f"{project_root}"
+        sock = start_warm_server(project_root, cython_dev_tools_path, env)
+
+    with sock:
+        _send_msg(sock, dict(kind='status'))
+        reply, _ = _recv_msg(sock)
+    print(f'Warm server is running (pid {reply["pid"]}), preloaded project modules: {reply["n_modules"]}, '
+          f'{"outdated" if reply["stale"] else "up to date"}')
@@ -0,0 +1,128 @@
+"""
+Per-test duration, CPU time and peak RSS history
+
+Each `cytool tests` run is recorded into `.cython_dev_tools/test_history.db` (SQLite), and compared with the rolling
+median of the previous runs of the same test to catch performance / memory regressions early.
+"""
+import os
+import sqlite3
+import statistics
+from datetime import datetime
+from typing import List, Dict, Optional
+
+from cython_dev_tools.logs import log
+
+TEST_HISTORY_FILENAME = 'test_history.db'
+TEST_METRICS = ('duration', 'cpu', 'peak_rss', 'rss_growth')
+
+# Metric values below these thresholds are too noisy to compare
+REGRESSION_MIN_VALUES = {
+    'duration': 0.01,  # seconds
+    'rss_growth': 1024 * 1024,  # 1 MB
+}
+
+
+def open_test_history(cython_dev_tools_path) -> sqlite3.Connection:
+    conn = sqlite3.connect(os.path.join(cython_dev_tools_path, TEST_HISTORY_FILENAME))
+    conn.row_factory = sqlite3.Row
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            revision TEXT
+        );
+        CREATE TABLE IF NOT EXISTS test_results (
+            run_id INTEGER NOT NULL REFERENCES runs(id),
+            test TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            duration REAL,
+            cpu REAL,
+            peak_rss INTEGER,
+            rss_growth INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS test_results_test ON test_results(test, run_id);
+    ''')
+    return conn
+
+
+def record_test_run(conn: sqlite3.Connection, results: Dict[str, dict], crashed: Dict[str, str] = None,
+                    revision: Optional[str] = None) -> int:
+    """
+    Stores test results of one run
+
+    :param results: {test_id: `finish` event of pytest_plugin}
+    :param crashed: {test_id: signal name}
+    :return: run id
+    """
+    with conn:
+        cur = conn.execute('INSERT INTO runs (started_at, revision) VALUES (?, ?)',
+                           (datetime.now().isoformat(timespec='seconds'), revision))
+        run_id = cur.lastrowid
+        rows = [(run_id, test_id, e['outcome']) + tuple(e.get(m) for m in TEST_METRICS)
+                for test_id, e in results.items()]
+        rows += [(run_id, test_id, 'crashed') + (None,) * len(TEST_METRICS) for test_id in (crashed or {})]
+        conn.executemany('INSERT INTO test_results VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    return run_id
+
+
+def find_regressions(conn: sqlite3.Connection, run_id: int, factor: float, window: int = 10,
+                     min_history: int = 3) -> List[dict]:
+    """
+    Finds passed tests of the run, which metrics exceed `factor` * median of the previous `window` passed runs
+    """
+    regressions = []
+    for row in conn.execute("SELECT * FROM test_results WHERE run_id = ? AND outcome = 'passed' ORDER BY test",
+                            (run_id,)):
+        history = conn.execute("SELECT * FROM test_results WHERE test = ? AND run_id < ? AND outcome = 'passed' "
+                               "ORDER BY run_id DESC LIMIT ?", (row['test'], run_id, window)).fetchall()
+        if len(history) < min_history:
+            continue
+
+        for metric in ('duration', 'rss_growth'):
+            values = [h[metric] for h in history if h[metric] is not None]
+            if row[metric] is None or len(values) < min_history:
+                continue
+            median = statistics.median(values)
+            min_value = REGRESSION_MIN_VALUES[metric]
+            if row[metric] >= min_value and row[metric] > factor * max(median, min_value):
+                regressions.append(dict(test=row['test'], metric=metric, value=row[metric], median=median))
+    return regressions
+
+
+def format_metric(metric, value) -> str:
+    if value is None:
+        return '-'
+    if metric in ('duration', 'cpu'):
+        return f'{value:.3f}s'
+    return f'{value / 1024 / 1024:.1f}MB'
+
+
+def log_regressions(regressions: List[dict], factor: float):
+    for r in regressions:
+        log.warning(f'Test {r["metric"]} regression (>{factor}x of median): {r["test"]} '
+                    f'{format_metric(r["metric"], r["value"])} (median {format_metric(r["metric"], r["median"])})')
+
+
+def print_tests_report(conn: sqlite3.Connection, kind: str, tests_rel_path='.', limit=20):
+    """
+    Prints the slowest (kind='slow') or the most memory-hungry (kind='memory') tests by their last result
+    """
+    sort_metric = {'slow': 'duration', 'memory': 'rss_growth'}[kind]
+
+    rows = conn.execute(f"SELECT r.*, (SELECT COUNT(*) FROM test_results h WHERE h.test = r.test) AS n_runs "
+                        f"FROM test_results r "
+                        f"WHERE r.run_id = (SELECT MAX(run_id) FROM test_results l WHERE l.test = r.test) "
+                        f"AND r.{sort_metric} IS NOT NULL "
+                        f"ORDER BY r.{sort_metric} DESC").fetchall()
+    if tests_rel_path != '.':
+        rows = [r for r in rows
+                if r['test'].split('::')[0] == tests_rel_path or r['test'].startswith(tests_rel_path + os.path.sep)]
+    if not rows:
+        print('No test history, run `cytool tests` first')
+        return
+
+    print(f'{"Duration":>10} {"CPU":>10} {"Peak RSS":>10} {"RSS growth":>10} {"Runs":>5}  Test')
+    for r in rows[:limit]:
+        print(f'{format_metric("duration", r["duration"]):>10} {format_metric("cpu", r["cpu"]):>10} '
+              f'{format_metric("peak_rss", r["peak_rss"]):>10} {format_metric("rss_growth", r["rss_growth"]):>10} '
+              f'{r["n_runs"]:>5}  {r["test"]}')
@@ -0,0 +1,222 @@
+"""
+Test impact analysis: maps .pyx/.py lines to the tests which execute them
+
+The map is produced by `cytool cover --test-contexts` (each test is recorded as coverage.py dynamic context),
+and used by `cytool tests --affected` to run only tests touching changed lines.
+"""
+import json
+import os
+import re
+import subprocess
+from typing import Dict, List, Optional, Set, Tuple
+
+from cython_dev_tools.logs import log
+
+IMPACT_MAP_FILENAME = 'test_impact.json'
+
+RE_DIFF_FILE = re.compile(r"^\+\+\+ (b/)?(?P<path>.*)$")
+RE_DIFF_OLD_FILE = re.compile(r"^--- (a/)?(?P<path>.*)$")
+RE_DIFF_HUNK = re.compile(r"^@@ -(?P<start>\d+)(,(?P<count>\d+))? \+\d+(,\d+)? @@")
+
+
+def lines_to_ranges(lines) -> str:
+    """
+    Compacts line numbers into string ranges, i.e. [1, 2, 3, 5, 8, 9] -> '1-3,5,8-9'
+    """
+    result = []
+    start = prev = None
+    for lno in sorted(set(lines)):
+        if start is None:
+            start = prev = lno
+        elif lno == prev + 1:
+            prev = lno
+        else:
+            result.append(f'{start}-{prev}' if prev != start else f'{start}')
+            start = prev = lno
+    if start is not None:
+        result.append(f'{start}-{prev}' if prev != start else f'{start}')
+    return ','.join(result)
+
+
+def ranges_to_lines(ranges: str) -> Set[int]:
+    """
+    Reverse of lines_to_ranges()
+    """
+    lines = set()
+    if not ranges:
+        return lines
+    for r in ranges.split(','):
+        if '-' in r:
+            start, end = r.split('-')
+            lines.update(range(int(start), int(end) + 1))
+        else:
+            lines.add(int(r))
+    return lines
+
+
+def git_revision(project_root) -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=project_root,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def save_impact_map(coverage_data_file, project_root, cython_dev_tools_path) -> str:
+    """
+    Converts coverage data with per-test contexts into compact impact map at `.cython_dev_tools/test_impact.json`
+
+    Format:
+        {'revision': <git HEAD at the time of coverage run>,
+         'tests': [<test id>, ...],
+         'files': {<path relative to project root>: {<test index>: '<line ranges>'}}
+        }
+    """
+    from coverage import CoverageData
+
+    data = CoverageData(basename=coverage_data_file)
+    data.read()
+
+    tests_idx = {}
+    files = {}
+    for fn in data.measured_files():
+        rel_fn = os.path.relpath(fn, project_root)
+        if rel_fn.startswith('..'):
+            log.trace(f'Impact map: skipping file outside project root {fn}')
+            continue
+
+        test_lines = {}
+        for lno, contexts in data.contexts_by_lineno(fn).items():
+            for ctx in contexts:
+                if not ctx:
+                    # Lines executed outside any test (i.e. imports during collection)
+                    continue
+                test_lines.setdefault(ctx, []).append(lno)
+
+        if not test_lines:
+            continue
+
+        file_map = files.setdefault(rel_fn, {})
+        for ctx, lines in test_lines.items():
+            idx = tests_idx.setdefault(ctx, len(tests_idx))
+            file_map[str(idx)] = lines_to_ranges(lines)
+
+    impact_map = dict(
+            revision=git_revision(project_root),
+            tests=list(tests_idx.keys()),
+            files=files,
+    )
+    impact_map_fn = os.path.join(cython_dev_tools_path, IMPACT_MAP_FILENAME)
+    with open(impact_map_fn, 'w') as fh:
+        json.dump(impact_map, fh, separators=(',', ':'))
+
+    log.info(f'Test impact map: {len(tests_idx)} tests, {len(files)} files -> {impact_map_fn}')
+    return impact_map_fn
+
+
+def load_impact_map(cython_dev_tools_path) -> dict:
+    impact_map_fn = os.path.join(cython_dev_tools_path, IMPACT_MAP_FILENAME)
+    if not os.path.exists(impact_map_fn):
+        raise FileNotFoundError(f'Test impact map not found at {impact_map_fn}, run `cytool cover --test-contexts` first')
+    with open(impact_map_fn, 'r') as fh:
+        return json.load(fh)
+
+
+def parse_git_diff(diff_text) -> Dict[str, Optional[Set[int]]]:
+    """
+    Parses `git diff -U0` output into {file: changed lines}, line numbers are taken from the old (base) side of the diff,
+    because the impact map was recorded against the base revision. New files get `None` (i.e. the whole file changed).
+    """
+    changed = {}
+    old_path = None
+    cur_path = None
+    for l in diff_text.splitlines():
+        g = RE_DIFF_OLD_FILE.match(l)
+        if g:
+            old_path = g['path']
+            continue
+        g = RE_DIFF_FILE.match(l)
+        if g:
+            if g['path'] == '/dev/null':
+                # Deleted file
+                cur_path = old_path
+            else:
+                cur_path = g['path']
+            if old_path == '/dev/null':
+                changed[cur_path] = None
+            else:
+                changed.setdefault(cur_path, set())
+            continue
+        g = RE_DIFF_HUNK.match(l)
+        if g and cur_path is not None and changed[cur_path] is not None:
+            start = int(g['start'])
+            count = 1 if g['count'] is None else int(g['count'])
+            if count == 0:
+                # Pure insertion after the line `start`
+                changed[cur_path].update((start, start + 1))
+            else:
+                changed[cur_path].update(range(start, start + count))
+    return changed
+
+
+def git_changed_lines(project_root, base_revision=None) -> Dict[str, Optional[Set[int]]]:
+    """
+    Changed lines of working tree (including staged and untracked files) against `base_revision`
+
+    Paths are relative to `project_root` (which may be a subdirectory of the git repo), changes outside it are ignored
+    """
+    base_revision = base_revision or 'HEAD'
+    try:
+        diff_text = subprocess.check_output(['git', 'diff', '-U0', '--no-color', '--no-renames', '--relative',
+                                             base_revision, '--', '.'],
+                                            cwd=project_root).decode(errors='replace')
+        untracked = subprocess.check_output(['git', 'ls-files', '--others', '--exclude-standard', '--', '.'],
+                                            cwd=project_root).decode(errors='replace')
+    except (subprocess.CalledProcessError, OSError) as exc:
+        raise RuntimeError(f'Failed to get changes from git at {project_root}: {exc}')
+
+    changed = parse_git_diff(diff_text)
+    for fn in untracked.splitlines():
+        changed[fn] = None
+    return changed
+
+
+def select_affected_tests(impact_map, changed: Dict[str, Optional[Set[int]]]) -> Tuple[List[str], List[str]]:
+    """
+    Finds minimal set of tests which executed any of the changed lines
+
+    :param impact_map: loaded impact map, see save_impact_map()
+    :param changed: {file path relative to project root: set of lines or None if the whole file changed}
+    :return: (sorted list of affected test ids, list of changed source files not covered by any test)
+    """
+    tests = impact_map['tests']
+    files = impact_map['files']
+    affected = set()
+    not_covered = []
+
+    for fn, lines in changed.items():
+        if not re.match(r'.*\.(py|pyx|pxd|pxi)$', fn):
+            continue
+
+        if fn.endswith('.pxd') or fn.endswith('.pxi'):
+            # Declarations (and inline functions) are compiled into the .pyx module with the same name,
+            # there is no reliable line mapping, so all tests of this module are affected
+            fn = fn[:-4] + '.pyx'
+            lines = None
+
+        is_test_file = re.match(r'^test_.*\.py[x]?$', os.path.basename(fn)) is not None
+        if is_test_file and fn.endswith('.py') and not any(t == fn or t.startswith(fn + '::') for t in tests):
+            # New or changed test file, which is not in the map yet
+            affected.add(fn)
+            continue
+
+        if fn not in files:
+            if not is_test_file:
+                not_covered.append(fn)
+            continue
+
+        for test_idx, ranges in files[fn].items():
+            if lines is None or not lines.isdisjoint(ranges_to_lines(ranges)):
+                affected.add(tests[int(test_idx)])
+
+    return sorted(affected), not_covered
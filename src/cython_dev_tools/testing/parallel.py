@@ -0,0 +1,289 @@
+"""
+Sharded parallel test runner with crash-isolated pytest workers
+
+Test modules are distributed across N shards balanced by historical durations, each shard is run by a separate
+`python -m pytest` process. When a worker crashes (i.e. segfault in Cython code), the running test is recorded as
+crashed, and the worker is respawned with the remaining tests of the shard. A crash outside tests (i.e. a module
+crashing on import) is isolated by running each module of the shard separately.
+"""
+import glob
+import json
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from cython_dev_tools.logs import log
+from cython_dev_tools.settings import CYTHON_TOOLS_DIRNAME
+
+TEST_DURATIONS_FILENAME = 'test_durations.json'
+
+
+def find_test_modules(project_root, tests_path) -> List[str]:
+    """
+    Python test modules (relative to project root) in tests_path file or directory
+    """
+    if not os.path.isdir(tests_path):
+        return [os.path.relpath(tests_path, project_root)]
+
+    modules = set()
+    for pattern in ('test_*.py', '*_test.py'):
+        for fn in glob.glob(os.path.join(tests_path, '**', pattern), recursive=True):
+            rel_fn = os.path.relpath(fn, project_root)
+            if CYTHON_TOOLS_DIRNAME in rel_fn.split(os.path.sep) or rel_fn.startswith('build' + os.path.sep):
+                continue
+            modules.add(rel_fn)
+    return sorted(modules)
+
+
+def load_test_durations(cython_dev_tools_path) -> Dict[str, float]:
+    durations_fn = os.path.join(cython_dev_tools_path, TEST_DURATIONS_FILENAME)
+    if not os.path.exists(durations_fn):
+        return {}
+    with open(durations_fn, 'r') as fh:
+        return json.load(fh)
+
+
+def save_test_durations(cython_dev_tools_path, durations: Dict[str, float]):
+    prev_durations = load_test_durations(cython_dev_tools_path)
+    prev_durations.update(durations)
+    with open(os.path.join(cython_dev_tools_path, TEST_DURATIONS_FILENAME), 'w') as fh:
+        json.dump(prev_durations, fh, indent=1, sort_keys=True)
+
+
+def shard_test_modules(modules: List[str], durations: Dict[str, float], n_shards: int) -> List[List[str]]:
+    """
+    Longest processing time first: assign the slowest module to the least loaded shard
+
+    Modules without history get the median duration of known modules
+    """
+    known = sorted(durations[m] for m in modules if m in durations)
+    default_duration = known[len(known) // 2] if known else 1.0
+
+    shards = [[] for _ in range(max(1, min(n_shards, len(modules))))]
+    loads = [0.0] * len(shards)
+    for m in sorted(modules, key=lambda m: (-durations.get(m, default_duration), m)):
+        i = loads.index(min(loads))
+        shards[i].append(m)
+        loads[i] += durations.get(m, default_duration)
+    return shards
+
+
+def read_test_events(report_fn) -> List[dict]:
+    events = []
+    if not os.path.exists(report_fn):
+        return events
+    with open(report_fn, 'r') as fh:
+        for l in fh:
+            try:
+                events.append(json.loads(l))
+            except ValueError:
+                # Possibly incomplete last line, when the worker crashed
+                pass
+    return events
+
+
+class ShardWorker:
+    """
+    Runs pytest for one shard of test modules, and respawns it after crashes until all tests are done
+    """
+    def __init__(self, worker_id, modules, project_root, work_dir, pytest_args, env):
+        """
+        :param modules: test modules or test ids relative to project root
+        """
+        self.worker_id = worker_id
+        self.modules = modules
+        self.project_root = project_root
+        self.pytest_args = pytest_args
+        self.env = env
+        self.report_fn = os.path.join(work_dir, f'worker_{worker_id}.jsonl')
+        self.log_fn = os.path.join(work_dir, f'worker_{worker_id}.log')
+        self.results = {}
+        self.crashed = {}
+        self.process = None
+        self.is_cancelled = False
+        self.n_spawns = 0
+
+    def run(self):
+        deselect = []
+        with open(self.log_fn, 'w') as log_fh:
+            sig_name = self.run_pytest(self.modules, deselect, log_fh)
+
+            module_items = {}
+            for item in self.modules:
+                module_items.setdefault(item.split('::')[0], []).append(item)
+
+            if sig_name is not None and len(module_items) > 1:
+                # pytest imports all modules of the shard before the first test, so a module crashing on import
+                # takes down the whole shard, each module is run separately to find the crashing one
+                log.warning(f'Worker #{self.worker_id} crashed with {sig_name} outside tests, running '
+                            f'{len(module_items)} modules of the shard separately')
+                for items in module_items.values():
+                    if self.is_cancelled:
+                        break
+                    self.mark_crashed(items, self.run_pytest(items, deselect, log_fh))
+            else:
+                self.mark_crashed(self.modules, sig_name)
+
+        log.trace(f'Worker #{self.worker_id} done, spawned {self.n_spawns} times')
+        return self
+
+    def run_pytest(self, modules, deselect, log_fh) -> Optional[str]:
+        """
+        Runs pytest for the modules, and respawns it after crashes in tests (the crashed test is deselected)
+
+        :param deselect: node ids of finished and crashed tests, updated in place
+        :return: signal name if the worker crashed outside any test (i.e. importing extension module), or None
+        """
+        while not self.is_cancelled:
+            if os.path.exists(self.report_fn):
+                os.unlink(self.report_fn)
+
+            run_instruct = ['-m', 'pytest',
+                            '-p', 'cython_dev_tools.testing.pytest_plugin',
+                            f'--cytool-report={self.report_fn}',
+                            f'--rootdir={self.project_root}',
+                            ] + self.pytest_args
+            for nodeid in deselect:
+                run_instruct.append(f'--deselect={nodeid}')
+            run_instruct += modules
+
+            log.trace(f'Worker #{self.worker_id} python args: {run_instruct}')
+            self.process = subprocess.Popen(['python'] + run_instruct, env=self.env, cwd=self.project_root,
+                                            stdout=log_fh, stderr=subprocess.STDOUT)
+            self.n_spawns += 1
+            log.trace(f'Worker #{self.worker_id} spawned (pid {self.process.pid})')
+            ret = self.process.wait()
+            log_fh.flush()
+
+            running = {}
+            for e in read_test_events(self.report_fn):
+                if e['event'] == 'start':
+                    running[e['nodeid']] = e['test']
+                elif e['event'] == 'finish':
+                    running.pop(e['nodeid'], None)
+                    self.results[e['test']] = e
+                    deselect.append(e['nodeid'])
+
+            if ret >= 0 or self.is_cancelled:
+                break
+
+            try:
+                sig_name = signal.Signals(-ret).name
+            except ValueError:
+                sig_name = f'signal {-ret}'
+
+            if not running:
+                # Crashed outside any test (i.e. during collection, when importing extension module)
+                return sig_name
+
+            for nodeid, test in running.items():
+                log.critical(f'Worker #{self.worker_id} crashed with {sig_name} at {test}, respawning')
+                self.crashed[test] = sig_name
+                deselect.append(nodeid)
+        return None
+
+    def mark_crashed(self, modules, sig_name):
+        if sig_name is None:
+            return
+        log.critical(f'Worker #{self.worker_id} crashed with {sig_name} outside tests, '
+                     f'modules are not completed: {modules}, see {self.log_fn}')
+        for m in modules:
+            self.crashed.setdefault(m, sig_name)
+
+    def cancel(self):
+        self.is_cancelled = True
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+def run_parallel_tests(project_root, cython_dev_tools_path, tests_path, n_workers, pytest_args, env, test_ids=None) -> dict:
+    """
+    Runs tests in `n_workers` pytest processes
+
+    :param tests_path: tests directory or module path
+    :param pytest_args: extra pytest arguments (i.e. -q, --disable-warnings)
+    :param env: workers environment
+    :param test_ids: run only these test ids (relative to project root), instead of all tests in tests_path
+    :return: summary dict {'results': {test_id: finish event}, 'crashed': {test_id: signal name}}
+    """
+    if test_ids is not None:
+        module_tests = {}
+        for test_id in test_ids:
+            module_tests.setdefault(test_id.split('::')[0], []).append(test_id)
+        modules = sorted(module_tests.keys())
+    else:
+        module_tests = None
+        modules = find_test_modules(project_root, tests_path)
+    if not modules:
+        log.error(f'No test modules found in {tests_path}')
+        return dict(results={}, crashed={})
+
+    durations = load_test_durations(cython_dev_tools_path)
+    shards = shard_test_modules(modules, durations, n_workers)
+    log.info(f'Running {len(modules)} test modules in {len(shards)} workers')
+
+    work_dir = os.path.join(cython_dev_tools_path, 'parallel')
+    os.makedirs(work_dir, exist_ok=True)
+
+    if module_tests is not None:
+        shards = [[t for m in shard for t in module_tests[m]] for shard in shards]
+
+    workers = [ShardWorker(i, shard, project_root, work_dir, pytest_args, env) for i, shard in enumerate(shards)]
+    for w in workers:
+        log.debug(f'Worker #{w.worker_id}: {w.modules}')
+
+    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+        futures = [executor.submit(w.run) for w in workers]
+        try:
+            for f in futures:
+                # Waiting with timeout, otherwise KeyboardInterrupt is not delivered until the end
+                while not f.done():
+                    threading.Event().wait(0.2)
+                f.result()
+        except KeyboardInterrupt:
+            log.error('Interrupted, stopping workers')
+            for w in workers:
+                w.cancel()
+            raise
+
+    results = {}
+    crashed = {}
+    for w in workers:
+        results.update(w.results)
+        crashed.update(w.crashed)
+
+    if module_tests is None:
+        # Update module durations for the next runs balancing (only full module runs)
+        module_durations = {}
+        for test_id, e in results.items():
+            module = test_id.split('::')[0]
+            module_durations[module] = module_durations.get(module, 0.0) + e['duration']
+        save_test_durations(cython_dev_tools_path, module_durations)
+
+    print_summary(results, crashed, [w.log_fn for w in workers])
+    return dict(results=results, crashed=crashed)
+
+
+def print_summary(results, crashed, log_files):
+    outcomes = {}
+    for test_id, e in sorted(results.items()):
+        outcomes.setdefault(e['outcome'], []).append(test_id)
+
+    for outcome in ('failed', 'error'):
+        for test_id in outcomes.get(outcome, []):
+            print(f'{outcome.upper()} {test_id}')
+    for test_id, sig_name in sorted(crashed.items()):
+        print(f'CRASHED ({sig_name}) {test_id}')
+
+    summary = ', '.join(f'{len(v)} {k}' for k, v in sorted(outcomes.items()))
+    if crashed:
+        summary += f', {len(crashed)} crashed'
+    print(f'==== {summary or "no tests ran"} ====')
+
+    if crashed or outcomes.get('failed') or outcomes.get('error'):
+        print('Worker logs with details:')
+        for fn in log_files:
+            print(f'\tfile://{fn}')
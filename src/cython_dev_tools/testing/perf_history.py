@@ -0,0 +1,202 @@
+"""
+Performance history database for `bench`, `lprun` and `callgrind` results
+
+Append-only SQLite database at `.cython_dev_tools/perf_history.db`, each record carries git revision, build variant,
+compiler flags and machine fingerprint, so the results are compared only with the same machine and build measurements.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sysconfig
+from datetime import datetime
+from typing import Optional
+
+from cython_dev_tools.building.build import load_build_manifest
+from cython_dev_tools.common import machine_fingerprint
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.impact import git_revision
+from cython_dev_tools.testing.stats import mann_whitney_u
+
+PERF_HISTORY_FILENAME = 'perf_history.db'
+
+
+def open_perf_history(cython_dev_tools_path) -> sqlite3.Connection:
+    conn = sqlite3.connect(os.path.join(cython_dev_tools_path, PERF_HISTORY_FILENAME))
+    conn.row_factory = sqlite3.Row
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS perf_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            target TEXT NOT NULL,
+            revision TEXT,
+            is_dirty INTEGER,
+            variant TEXT,
+            flags TEXT,
+            machine_id TEXT,
+            machine TEXT,
+            stats TEXT,
+            samples TEXT
+        );
+        CREATE INDEX IF NOT EXISTS perf_records_target ON perf_records(kind, target, machine_id);
+    ''')
+    return conn
+
+
+def git_is_dirty(project_root) -> Optional[bool]:
+    try:
+        return bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=project_root,
+                                            stderr=subprocess.DEVNULL).strip())
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def build_variant(cython_dev_tools_path, package=None):
+    """
+    Build variant name and compilation flags of the package module by the last build manifest
+
+    :return: (variant, flags dict)
+    """
+    manifest = load_build_manifest(cython_dev_tools_path)
+    if not manifest:
+        return 'unknown', {}
+
+    module = manifest['modules'].get(package, {}) if package else {}
+    if not manifest['is_debug']:
+        variant = f'release-{manifest["build_profile"]}' if manifest.get('build_profile') else 'release'
+    elif manifest['trace_only']:
+        variant = 'debug-trace-only'
+    else:
+        variant = 'debug'
+    if module.get('traced'):
+        variant += '-traced'
+
+    flags = dict(
+        cflags=sysconfig.get_config_var('CFLAGS'),
+        define_macros=module.get('define_macros'),
+        extra_compile_args=module.get('extra_compile_args'),
+        extra_link_args=module.get('extra_link_args'),
+        compiler_directives=module.get('compiler_directives'),
+    )
+    return variant, flags
+
+
+def flags_hash(flags: dict) -> str:
+    return hashlib.sha1(json.dumps(flags or {}, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def record_perf(project_root, cython_dev_tools_path, kind, target, package=None, stats=None, samples=None,
+                build_path=None) -> int:
+    """
+    Appends performance record
+
+    :param kind: 'bench', 'sweep', 'experiment', 'lprun' or 'callgrind'
+    :param target: benchmark / profile target (with arguments)
+    :param package: target module name, to get build flags
+    :param build_path: `.cython_dev_tools` path of the measured build (i.e. variant tree), by default the project one
+    :return: record id
+    """
+    variant, flags = build_variant(build_path or cython_dev_tools_path, package)
+    machine = machine_fingerprint()
+    conn = open_perf_history(cython_dev_tools_path)
+    try:
+        with conn:
+            cur = conn.execute('INSERT INTO perf_records (created_at, kind, target, revision, is_dirty, variant, flags, '
+                               'machine_id, machine, stats, samples) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (datetime.now().isoformat(timespec='seconds'), kind, target,
+                                git_revision(project_root), git_is_dirty(project_root), variant, json.dumps(flags),
+                                machine['id'], json.dumps(machine), json.dumps(stats), json.dumps(samples)))
+            return cur.lastrowid
+    finally:
+        conn.close()
+
+
+def find_baseline_record(project_root, cython_dev_tools_path, kind, target, baseline, exclude_id=None,
+                         any_machine=False, variant=None, flags=None) -> Optional[dict]:
+    """
+    The latest record of the target measured at the `baseline` git revision (or 'last' - the previous record),
+    on the same machine, with the same build
+
+    :param any_machine: records of other machines too, i.e. for hardware independent metrics (instruction counts),
+        but only with the same Python version and architecture
+    :param variant: build variant of the measured build (see `build_variant()`), records of other variants are skipped
+    :param flags: compilation flags of the measured build, records with other flags are skipped
+    """
+    machine = machine_fingerprint()
+    query = 'SELECT * FROM perf_records WHERE kind = ? AND target = ? AND id != ?'
+    params = [kind, target, exclude_id or -1]
+    if not any_machine:
+        query += ' AND machine_id = ?'
+        params.append(machine['id'])
+
+    if baseline != 'last':
+        try:
+            revision = subprocess.check_output(['git', 'rev-parse', baseline], cwd=project_root,
+                                               stderr=subprocess.DEVNULL).decode().strip()
+        except (subprocess.CalledProcessError, OSError):
+            raise ValueError(f'Baseline `{baseline}` is not a git revision, JSON results file, or `last`')
+        query += ' AND revision = ?'
+        params.append(revision)
+
+    conn = open_perf_history(cython_dev_tools_path)
+    try:
+        rows = conn.execute(query + ' ORDER BY id DESC', params).fetchall()
+    finally:
+        conn.close()
+
+    other_build = other_platform = None
+    for row in rows:
+        record = dict(row)
+        for k in ('flags', 'machine', 'stats', 'samples'):
+            record[k] = json.loads(record[k]) if record[k] else None
+        if record['machine'] and any(record['machine'].get(k) != machine[k] for k in ('python', 'machine')):
+            other_platform = other_platform or record
+            continue
+        if (variant is None or record['variant'] == variant) and \
+                (flags is None or flags_hash(record['flags']) == flags_hash(flags)):
+            return record
+        other_build = other_build or record
+
+    if other_platform is not None:
+        # Instruction counts of other Python versions / architectures are not comparable either
+        log.warning(f'Baseline record #{other_platform["id"]} of {target} is skipped, it was measured with another '
+                    f'platform: Python {other_platform["machine"].get("python")} '
+                    f'{other_platform["machine"].get("machine")} vs Python {machine["python"]} {machine["machine"]}, '
+                    f'measure the baseline revision on this platform')
+    if other_build is not None:
+        # Debug vs release or other flags measurements are not comparable
+        log.warning(f'Baseline record #{other_build["id"]} of {target} is skipped, it was measured with another build: '
+                    f'`{other_build["variant"]}` (flags {flags_hash(other_build["flags"])}) vs `{variant}` '
+                    f'(flags {flags_hash(flags)}), rebuild the baseline revision in the same way and measure it again')
+    return None
+
+
+def compare_samples(baseline_groups, groups, alpha=0.05, min_change=0.02) -> dict:
+    """
+    Checks if `groups` (timings grouped by process) are significantly slower than `baseline_groups`
+
+    Samples measured in the same process are not independent (like in `stats.describe()`), so the test is done
+    by per-process means, or by samples when there is only one process
+
+    :param alpha: significance level of one-sided Mann-Whitney U test
+    :param min_change: the median slowdown less than this (relative) is not reported even if significant
+    """
+    if len(baseline_groups) > 1 and len(groups) > 1:
+        _, p_value = mann_whitney_u([statistics.mean(g) for g in groups], [statistics.mean(g) for g in baseline_groups],
+                                    alternative='greater')
+    else:
+        _, p_value = mann_whitney_u([s for g in groups for s in g], [s for g in baseline_groups for s in g],
+                                    alternative='greater')
+    baseline_median = statistics.median([s for g in baseline_groups for s in g])
+    median = statistics.median([s for g in groups for s in g])
+    change = median / baseline_median - 1.0
+    return dict(
+        baseline_median=baseline_median,
+        median=median,
+        change=change,
+        p_value=p_value,
+        is_slowdown=p_value < alpha and change > min_change,
+    )
@@ -0,0 +1,168 @@
+"""
+Common profile data format of the function-level profilers (`cytool perf`, `cytool profile`)
+
+Profiles are saved at `.cython_dev_tools/profiles/<package>.<func>_<kind>_<datetime>.json`:
+
+    {"kind": "perf", "target": "pkg/mod.pyx@func(10)", "unit": "samples", "total": 1500,
+     "stacks": {"pkg.mod.func;pkg.mod.helper": 1200, ...},
+     "functions": {"pkg.mod.helper": {"self": 1100, "total": 1200, "file": "pkg/mod.pyx", "line": 12}, ...},
+     "lines": {"pkg/mod.pyx:15": {"self": 900, "total": 1000, "code": "x += f(i)"}, ...}}
+
+Stacks are collapsed (root frame first, separated by `;`), as used by flamegraph tools, they are saved as
+`.folded` file next to the profile too, with flamegraph SVG/HTML and speedscope exports (see `testing/flamegraph.py`).
+Frames of Cython functions are labeled by pyx qualified names, and lines keep their source code, so profiles
+of different builds (or revisions) are comparable (see `testing/profile_diff.py`).
+"""
+import importlib
+import json
+import os
+import time
+from datetime import datetime
+from functools import reduce
+
+from cython_dev_tools.common import check_method_args
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.flamegraph import write_profile_exports
+
+PROFILES_DIRNAME = 'profiles'
+
+
+def load_call_target(cython_dev_tools_path, package, entry_method, entry_args):
+    """
+    Imports the entry point function and evaluates its arguments (fixtures included)
+
+    :return: (func, args, kwargs)
+    """
+    entry_module = importlib.import_module(package)
+    func = reduce(getattr, entry_method.split('.'), entry_module)
+    f_args, f_kwargs = check_method_args(entry_args, fixture_variables(cython_dev_tools_path, package))
+    return func, f_args, f_kwargs
+
+
+def run_call_loop(func, args, kwargs, duration) -> int:
+    """
+    Calls the function repeatedly for at least `duration` seconds (at least once)
+
+    :return: number of calls
+    """
+    n_calls = 0
+    t_end = time.perf_counter() + duration
+    while True:
+        func(*args, **kwargs)
+        n_calls += 1
+        if time.perf_counter() >= t_end:
+            return n_calls
+
+
+def summarize_stacks(stacks: dict) -> dict:
+    """
+    Self and total weight of each frame of collapsed stacks (recursive frames are counted once per stack)
+    """
+    functions = {}
+    for stack, weight in stacks.items():
+        frames = stack.split(';')
+        for name in set(frames):
+            functions.setdefault(name, dict(self=0, total=0))['total'] += weight
+        functions[frames[-1]]['self'] += weight
+    return functions
+
+
+def make_profile(kind, target, unit, stacks: dict, lines: dict = None, frames_info: dict = None) -> dict:
+    """
+    Profile dict of the common format
+
+    :param stacks: collapsed stacks weights, i.e. {'pkg.mod.func;pkg.mod.helper': 12}
+    :param lines: pyx lines weights, i.e. {'pkg/mod.pyx:15': {'self': 10, 'total': 12}}
+    :param frames_info: pyx location of frames, i.e. {'pkg.mod.helper': {'file': 'pkg/mod.pyx', 'line': 12}}
+    """
+    functions = summarize_stacks(stacks)
+    for name, info in (frames_info or {}).items():
+        if name in functions:
+            functions[name].update(info)
+    return dict(kind=kind,
+                target=target,
+                created_at=datetime.now().isoformat(timespec='seconds'),
+                unit=unit,
+                total=sum(stacks.values()),
+                stacks=stacks,
+                functions=functions,
+                lines=lines or {},
+                )
+
+
+def attach_line_sources(lines: dict, project_root):
+    """
+    Adds stripped source code to profile lines (`file:line` keys relative to the project root)
+    """
+    sources = {}
+    for key, l in lines.items():
+        fn, lineno = key.rsplit(':', 1)
+        if fn not in sources:
+            full_fn = os.path.join(project_root, fn)
+            if os.path.exists(full_fn):
+                with open(full_fn, 'r', errors='replace') as fh:
+                    sources[fn] = fh.read().splitlines()
+            else:
+                sources[fn] = []
+        if 0 < int(lineno) <= len(sources[fn]):
+            l['code'] = sources[fn][int(lineno) - 1].strip()
+
+
+def write_collapsed_stacks(fn, stacks: dict):
+    with open(fn, 'w') as fh:
+        for stack, weight in sorted(stacks.items()):
+            fh.write(f'{stack} {weight}\n')
+
+
+def save_profile(cython_dev_tools_path, profile: dict, name: str) -> str:
+    """
+    Saves profile JSON, its collapsed stacks `.folded` file, flamegraphs and speedscope JSON
+
+    :param name: profile name, i.e. `<package>.<func>`
+    :return: profile JSON path
+    """
+    profiles_path = os.path.join(cython_dev_tools_path, PROFILES_DIRNAME)
+    os.makedirs(profiles_path, exist_ok=True)
+    base_fn = os.path.join(profiles_path, f'{name}_{profile["kind"]}_{datetime.now():%Y%m%d_%H%M%S}')
+    with open(base_fn + '.json', 'w') as fh:
+        json.dump(profile, fh, indent=1)
+    write_collapsed_stacks(base_fn + '.folded', profile['stacks'])
+    write_profile_exports(profile, base_fn)
+    log.debug(f'Profile saved: {base_fn}.json')
+    return base_fn + '.json'
+
+
+def load_profile(profile_fn) -> dict:
+    with open(profile_fn, 'r') as fh:
+        return json.load(fh)
+
+
+def print_hot_functions(profile: dict, limit=20, mapped_only=True):
+    """
+    Functions by self weight, `mapped_only` - only functions mapped to project sources
+    """
+    total = profile['total'] or 1
+    functions = [(name, f) for name, f in profile['functions'].items() if not mapped_only or f.get('file')]
+    print(f'Hot functions ({profile["total"]} {profile["unit"]} total):')
+    print(f'{"self":>7} {"total":>7} {profile["unit"]:>9}  function')
+    for name, f in sorted(functions, key=lambda x: (-x[1]['self'], -x[1]['total']))[:limit]:
+        location = f' ({f["file"]}:{f["line"]})' if f.get('file') else ''
+        print(f'{f["self"] / total:>7.1%} {f["total"] / total:>7.1%} {f["self"]:>9}  {name}{location}')
+
+
+def print_hot_lines(profile: dict, limit=20):
+    total = profile['total'] or 1
+    print(f'Hot pyx lines:')
+    print(f'{"self":>7} {"total":>7} {profile["unit"]:>9}  line')
+    for line, l in sorted(profile['lines'].items(), key=lambda x: (-x[1]['self'], -x[1]['total']))[:limit]:
+        code = f'  {l["code"]}' if l.get('code') else ''
+        print(f'{l["self"] / total:>7.1%} {l["total"] / total:>7.1%} {l["self"]:>9}  {line}{code}')
+
+
+def print_profile_files(profile_fn):
+    base_fn = os.path.splitext(profile_fn)[0]
+    print(f'Profile: {profile_fn}')
+    print(f'Collapsed stacks: {base_fn}.folded')
+    print(f'Flamegraph: {base_fn}.svg, {base_fn}.html')
+    print(f'Speedscope: {base_fn}.speedscope.json')
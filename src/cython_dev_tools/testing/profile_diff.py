@@ -0,0 +1,173 @@
+"""
+Differential comparison of two profiles (lprun, perf, or cProfile, see `testing/profile_data.py`)
+
+Profiles may have different units (i.e. perf samples vs cProfile microseconds), so functions and lines are compared
+by their share of the profile total. Functions are aligned by qualified name, or by pyx location when renamed;
+lines are aligned by `file:line`, or by the same source code in the file when shifted (i.e. another revision).
+The differential flamegraph has the shape of B, frames are red where their share has grown, blue where shrunk.
+"""
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from cython_dev_tools.common import check_project_initialized, open_url_in_browser
+from cython_dev_tools.testing.flamegraph import render_flamegraph_svg, render_flamegraph_html
+from cython_dev_tools.testing.profile_data import load_profile, PROFILES_DIRNAME
+
+# Share changes below this (percentage points) are not colored
+MIN_DIFF_COLOR = 0.1
+
+
+def align_functions(functions_a: dict, functions_b: dict) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Pairs of function names (A, B), None if the function is missing in one of profiles
+    """
+    pairs = [(name, name) for name in functions_a if name in functions_b]
+    unmatched_a = {name: f for name, f in functions_a.items() if name not in functions_b}
+    by_location = {(f['file'], f['line']): name for name, f in unmatched_a.items() if f.get('file')}
+    for name, f in functions_b.items():
+        if name in functions_a:
+            continue
+        name_a = by_location.pop((f.get('file'), f.get('line')), None) if f.get('file') else None
+        if name_a is not None:
+            unmatched_a.pop(name_a)
+        pairs.append((name_a, name))
+    pairs += [(name, None) for name in unmatched_a]
+    return pairs
+
+
+def align_lines(lines_a: dict, lines_b: dict) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Pairs of `file:line` keys (A, B), None if the line is missing in one of profiles
+    """
+    def code(lines, key):
+        return lines[key].get('code')
+
+    pairs = []
+    unmatched_a = []
+    for key in lines_a:
+        if key in lines_b and (code(lines_a, key) is None or code(lines_b, key) in (None, code(lines_a, key))):
+            pairs.append((key, key))
+        else:
+            unmatched_a.append(key)
+    matched_b = {key_b for _, key_b in pairs}
+
+    for key_b in lines_b:
+        if key_b in matched_b:
+            continue
+        fn_b, lineno_b = key_b.rsplit(':', 1)
+        # The same code in the same file, the nearest line wins
+        candidates = [key_a for key_a in unmatched_a
+                      if key_a.rsplit(':', 1)[0] == fn_b and code(lines_b, key_b)
+                      and code(lines_a, key_a) == code(lines_b, key_b)]
+        key_a = min(candidates, key=lambda k: abs(int(k.rsplit(':', 1)[1]) - int(lineno_b)), default=None)
+        if key_a is not None:
+            unmatched_a.remove(key_a)
+        pairs.append((key_a, key_b))
+    pairs += [(key_a, None) for key_a in unmatched_a]
+    return pairs
+
+
+def diff_entries(entries_a: dict, entries_b: dict, pairs, total_a, total_b) -> List[dict]:
+    """
+    Self / total shares of aligned functions or lines, ranked by the absolute self share change
+    """
+    rows = []
+    for key_a, key_b in pairs:
+        a = entries_a.get(key_a, {}) if key_a else {}
+        b = entries_b.get(key_b, {}) if key_b else {}
+        row = dict(a=key_a, b=key_b,
+                   a_self=a.get('self', 0) / (total_a or 1), b_self=b.get('self', 0) / (total_b or 1),
+                   a_total=a.get('total', 0) / (total_a or 1), b_total=b.get('total', 0) / (total_b or 1),
+                   code=b.get('code') or a.get('code'))
+        row.update(d_self=row['b_self'] - row['a_self'], d_total=row['b_total'] - row['a_total'])
+        rows.append(row)
+    rows.sort(key=lambda r: (-abs(r['d_self']), -abs(r['d_total'])))
+    return rows
+
+
+def path_shares(stacks: dict, rename: dict = None) -> dict:
+    """
+    Total share of each call path (stack prefix), frames renamed by `rename`
+    """
+    total = sum(stacks.values()) or 1
+    shares = {}
+    for stack, weight in stacks.items():
+        frames = [(rename or {}).get(name, name) for name in stack.split(';')]
+        for i in range(1, len(frames) + 1):
+            path = ';'.join(frames[:i])
+            shares[path] = shares.get(path, 0) + weight / total
+    return shares
+
+
+def diff_color(delta, max_delta) -> str:
+    if abs(delta) * 100 < MIN_DIFF_COLOR or max_delta <= 0:
+        return 'hsl(0, 0%, 88%)'
+    s = min(1.0, abs(delta) / max_delta)
+    return f'hsl({0 if delta > 0 else 220}, {50 + 40 * s:.0f}%, {85 - 30 * s:.0f}%)'
+
+
+def profile_diff(profile_a_fn, profile_b_fn, project_root=None, limit=20, browser=False) -> dict:
+    """
+    Compares profiles A (before) and B (after), prints ranked functions and lines tables,
+    saves the differential flamegraph (SVG/HTML)
+
+    :return: {'functions': rows, 'lines': rows, 'flamegraph': html path}
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    profile_a = load_profile(profile_a_fn)
+    profile_b = load_profile(profile_b_fn)
+
+    function_pairs = align_functions(profile_a['functions'], profile_b['functions'])
+    functions = diff_entries(profile_a['functions'], profile_b['functions'], function_pairs,
+                             profile_a['total'], profile_b['total'])
+    lines = diff_entries(profile_a['lines'], profile_b['lines'], align_lines(profile_a['lines'], profile_b['lines']),
+                         profile_a['total'], profile_b['total']) if profile_a['lines'] and profile_b['lines'] else []
+
+    # Differential flamegraph, A frames are renamed to the names of the aligned B functions
+    rename = {a: b for a, b in function_pairs if a and b and a != b}
+    shares_a = path_shares(profile_a['stacks'], rename)
+    shares_b = path_shares(profile_b['stacks'])
+    deltas = {path: share - shares_a.get(path, 0) for path, share in shares_b.items()}
+    max_delta = max((abs(d) for d in deltas.values()), default=0)
+    colors = {path: diff_color(d, max_delta) for path, d in deltas.items()}
+    details = {path: f'A: {shares_a.get(path, 0):.2%} -> B: {shares_b[path]:.2%} ({d * 100:+.2f}pp)'
+               for path, d in deltas.items()}
+
+    title = f'{os.path.basename(profile_a_fn)} -> {os.path.basename(profile_b_fn)}'
+    profiles_path = os.path.join(cython_dev_tools_path, PROFILES_DIRNAME)
+    os.makedirs(profiles_path, exist_ok=True)
+    base_fn = os.path.join(profiles_path, f'diff_{datetime.now():%Y%m%d_%H%M%S}')
+    with open(base_fn + '.svg', 'w') as fh:
+        fh.write(render_flamegraph_svg(profile_b, title=title, colors=colors, details=details))
+    with open(base_fn + '.html', 'w') as fh:
+        fh.write(render_flamegraph_html(profile_b, title=title, colors=colors, details=details))
+
+    print_profile_diff(profile_a, profile_b, functions, lines, limit=limit)
+    print()
+    print(f'Differential flamegraph (shape of B, red - grown, blue - shrunk): {base_fn}.svg, {base_fn}.html')
+    if browser:
+        open_url_in_browser(base_fn + '.html')
+    return dict(functions=functions, lines=lines, flamegraph=base_fn + '.html')
+
+
+def print_profile_diff(profile_a: dict, profile_b: dict, functions: List[dict], lines: List[dict], limit=20):
+    def describe(p):
+        return f'{p["kind"]} {p["target"]}, {p["total"]} {p["unit"]}'
+
+    print(f'A: {describe(profile_a)}')
+    print(f'B: {describe(profile_b)}')
+    print(f'Shares of the profile total, ranked by self change:')
+    print(f'{"A self":>7} {"B self":>7} {"change":>9} {"A total":>8} {"B total":>8} {"change":>9}  function')
+    for r in functions[:limit]:
+        name = r['b'] if r['a'] in (None, r['b']) else (f'{r["a"]} -> {r["b"]}' if r['b'] else r['a'])
+        print(f'{r["a_self"]:>7.1%} {r["b_self"]:>7.1%} {r["d_self"] * 100:>+7.2f}pp '
+              f'{r["a_total"]:>8.1%} {r["b_total"]:>8.1%} {r["d_total"] * 100:>+7.2f}pp  {name}')
+    if not lines:
+        return
+    print()
+    print(f'{"A self":>7} {"B self":>7} {"change":>9}  line')
+    for r in lines[:limit]:
+        key = r['b'] if r['a'] in (None, r['b']) else (f'{r["a"]} -> {r["b"]}' if r['b'] else r['a'])
+        code = f'  {r["code"]}' if r['code'] else ''
+        print(f'{r["a_self"]:>7.1%} {r["b_self"]:>7.1%} {r["d_self"] * 100:>+7.2f}pp  {key}{code}')
@@ -1,14 +1,32 @@
 from line_profiler import LineProfiler, show_text
+from line_profiler.line_profiler import LineStats
+import cProfile
 import importlib
+import json
+import linecache
+import pickle
+import pstats
+import statistics
+import subprocess
 import textwrap
 import os
 import sys
 import shutil
+import tempfile
+import time
 from datetime import datetime
 import inspect
 import cython_dev_tools.building
-from cython_dev_tools.common import check_project_initialized, open_url_in_browser, find_package_path, check_method_args
+from cython_dev_tools.common import check_project_initialized, open_url_in_browser, find_package_path, check_method_args, \
+    split_call_target
+from cython_dev_tools.building.variants import variant_env
 from cython_dev_tools.logs import log
+from cython_dev_tools.testing.perf_history import record_perf
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.call_profile import code_frame, pyx_function_names, cprofile_profile
+from cython_dev_tools.testing.profile_data import make_profile, save_profile, attach_line_sources, \
+    print_profile_files, PROFILES_DIRNAME
+from cython_dev_tools.testing.stats import describe, format_time
 
 
 def lprun_command(args):
@@ -18,6 +36,11 @@ def lprun_command(args):
           functions=args.function,
           modules=args.module,
           project_root=args.project_root,
+          trace_only=args.trace_only,
+          auto=args.auto,
+          auto_threshold=args.auto_threshold,
+          repeats=args.repeats,
+          limit=args.limit,
           )
 
 
@@ -52,94 +75,461 @@ class CythonLineProfiler(LineProfiler):
         return nfuncsadded
 
 
-def lprun(profile_target,
-          functions=None,
-          modules=None,
-          project_root=None,
-          ):
-    __cytool_functions = functions or []
-    __cytool_modules = modules or []
+class CdefLineTracer:
+    """
+    Line profiler of cdef functions, they have no Python code objects, so `LineProfiler` can't register them
 
-    # Check if cython tools in a good state in the project root
-    project_root, cython_dev_tools_path = check_project_initialized(project_root)
-    sys.path.insert(0, project_root)
-    log.info(f'Starting coverage at {project_root}')
+    Listens to line events of Cython `linetrace` builds (`build --debug`) via `sys.settrace()`, Cython trace frames
+    have pyx file name, function name and definition line, matched with the `cython_debug` function info.
+    """
+    def __init__(self):
+        # (function name, definition line): [(pyx path relative to the project root, full pyx path)]
+        self.functions = {}
+        # (full pyx path, definition line, function name): {lineno: [hits, time ns]}
+        self.timings = {}
 
-    if '(' not in profile_target and ')' not in profile_target and '@' not in profile_target:
-        raise ValueError(f'profile_target (got {profile_target}) should be a package path with entry point with args, '
-                         f'e.g. package/sub_package/module.pyx@main() or package.module@main(1, 2, n=5)')
+    def add_cdef_function(self, rel_fn, full_fn, name, lineno):
+        self.functions.setdefault((name, lineno), []).append((rel_fn, full_fn))
+        self.timings.setdefault((full_fn, lineno, name), {})
 
-    log.trace(f'profile_target: {profile_target}')
+    def __call__(self, frame, event, arg):
+        if event != 'call':
+            return None
+        code = frame.f_code
+        for rel_fn, full_fn in self.functions.get((code.co_name, code.co_firstlineno), []):
+            if code.co_filename.endswith(rel_fn):
+                return self.trace_lines(self.timings[(full_fn, code.co_firstlineno, code.co_name)])
+        # Cython trace frames call the local trace function on each line (even if None), Python frames skip lines
+        frame.f_trace_lines = False
+        return self.skip_lines
 
-    arg_i = profile_target.index('(')
+    @staticmethod
+    def skip_lines(frame, event, arg):
+        return None
 
-    entry_target = profile_target[:arg_i]
-    entry_args = profile_target[arg_i:]
+    @staticmethod
+    def trace_lines(timings: dict):
+        # The line time is the time till the next line event (or return) of the same call
+        last = [None, 0]
 
-    source_file, package, entry_method = find_package_path(project_root, entry_target)
-    log.trace((source_file, package, entry_method))
+        def trace(frame, event, arg):
+            t = time.perf_counter_ns()
+            if event == 'exception':
+                return trace
+            if last[0] is not None:
+                entry = timings.setdefault(last[0], [0, 0])
+                entry[0] += 1
+                entry[1] += t - last[1]
+            last[0] = frame.f_lineno if event == 'line' else None
+            last[1] = time.perf_counter_ns()
+            return trace
+        return trace
 
-    f_args, f_kwargs = check_method_args(entry_args)
-    log.trace(f'Arguments to pass into: {entry_method}(*{f_args}, **{f_kwargs})')
+    def runcall(self, func, *args, **kwargs):
+        sys.settrace(self)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.settrace(None)
 
-    log.trace(f'Importing {package}')
-    entry_module = importlib.import_module(package)
+    def get_timings(self, unit) -> dict:
+        """
+        Timings in `LineStats` format, i.e. {(filename, def line, name): [(lineno, hits, time in units)]}
+        """
+        return {func: [(lineno, hits, round(t * 1e-9 / unit)) for lineno, (hits, t) in sorted(lines.items())]
+                for func, lines in self.timings.items()}
 
-    def get_module_func(m, func_path):
-        try:
-            if '.' in func_path:
-                toks = func_path.split('.')
-                o = getattr(m, toks[0])
-                return get_module_func(o, '.'.join(toks[1:]))
-            else:
-                return getattr(m, func_path)
-        except AttributeError:
-            raise RuntimeError(f'Module/object {m} does no contain visible for Python method {entry_method}')
 
-    entry_func = get_module_func(entry_module, entry_method)
+def find_cdef_function(func_mapper: dict, package, func_path):
+    """
+    Definition line of the cdef function (or cdef class method) by `cython_debug` info, None if not found
+    """
+    qualified_name = f'{package}.{func_path}'
+    for fm in func_mapper.values():
+        for module_map in fm.values():
+            if module_map['module_name'] != package:
+                continue
+            for f_qualified_name, lineno in module_map['functions'].values():
+                if f_qualified_name == qualified_name:
+                    return lineno
+    return None
 
-    functions_to_profile = [entry_func]
 
-    for lp_func in __cytool_functions:
-        if '(' in lp_func or ')' in lp_func:
-            raise f'-f/-func arguments must be a simple path to a function WITHOUT arguments, got `{lp_func}`, i.e. `func` (if func in entry module)' \
-                  f' or `package/module.pyx@func` or `package.module@func`'
+def auto_select_functions(profile: dict, package, threshold=5.0) -> list:
+    """
+    Functions of the top-level package (with all its subpackages) with self time share >= `threshold` %
+
+    :param profile: function-level profile of the entry point call (see `testing/profile_data.py`)
+    :return: `-f` function paths, i.e. ['package/module.pyx@Cls.method'], hottest first
+    """
+    root_package = package.split('.')[0]
+    total = profile['total'] or 1
+    selected = []
+    for name, f in sorted(profile['functions'].items(), key=lambda x: -x[1]['self']):
+        if not f.get('file') or f['self'] / total * 100 < threshold:
+            continue
+        module = os.path.splitext(f['file'])[0].replace(os.sep, '.')
+        # I.e. `pkg.mod.func (wrapper)` of cpdef function
+        name = name.split(' ')[0]
+        if module.split('.')[0] != root_package or not name.startswith(module + '.'):
+            continue
+        method = name[len(module) + 1:]
+        if method.count('.') > 1 or '<' in method:
+            # Closures and nested classes can't be added by path
+            continue
+        if f'{f["file"]}@{method}' not in selected:
+            selected.append(f'{f["file"]}@{method}')
+    return selected
+
+
+def auto_profile_functions(entry_func, f_args, f_kwargs, project_root, cython_dev_tools_path, package, target,
+                           threshold=5.0) -> list:
+    """
+    Cheap function-level cProfile pass of the entry point call, selects hot functions for line profiling,
+    Cython functions of the debug build are visible for cProfile too (cdef included)
+    """
+    profiler = cProfile.Profile()
+    profiler.runcall(entry_func, *f_args, **f_kwargs)
+
+    from cython_dev_tools.debugger.valgrind import make_func_mapper
+    try:
+        func_mapper = make_func_mapper(cython_dev_tools_path)
+    except RuntimeError:
+        func_mapper = {}
+    profile = cprofile_profile(pstats.Stats(profiler).stats, project_root, func_mapper, target)
+    selected = auto_select_functions(profile, package, threshold=threshold)
+
+    total = profile['total'] or 1
+    print(f'Auto-selected functions (self time >= {threshold}% of {profile["total"]} us):')
+    for fn in selected:
+        file, method = fn.split('@')
+        module = os.path.splitext(file)[0].replace(os.sep, '.')
+        f = profile['functions'].get(f'{module}.{method}') or profile['functions'].get(f'{module}.{method} (wrapper)')
+        print(f'{f["self"] / total:>7.1%}  {fn}' if f else f'         {fn}')
+    print()
+    return selected
+
+
+def get_module_func(m, func_path):
+    try:
+        if '.' in func_path:
+            toks = func_path.split('.')
+            o = getattr(m, toks[0])
+            return get_module_func(o, '.'.join(toks[1:]))
+        else:
+            return getattr(m, func_path)
+    except AttributeError:
+        raise RuntimeError(f'Module/object {m} does no contain visible for Python method {func_path}')
+
+
+def line_timings_delta(before: dict, after: dict) -> dict:
+    """
+    Line timings of a single run by cumulative `LineStats` timings before and after it
+    """
+    delta = {}
+    for func, timings in after.items():
+        prev = {lineno: (hits, t) for lineno, hits, t in before.get(func, [])}
+        delta[func] = [(lineno, hits - prev.get(lineno, (0, 0))[0], t - prev.get(lineno, (0, 0))[1])
+                       for lineno, hits, t in timings if hits > prev.get(lineno, (0, 0))[0]]
+    return delta
+
+
+def aggregate_line_runs(runs: list) -> dict:
+    """
+    Per-line statistics of repeated runs, a line missing in a run counts as 0
+
+    :param runs: line timings of each run, i.e. [{(filename, def line, name): [(lineno, hits, time)]}]
+    :return: {(filename, def line, name): {lineno: {'hits': mean, 'time': mean, 'std': stdev, 'min':, 'max':}}}
+    """
+    values = {}
+    for run in runs:
+        for func, timings in run.items():
+            for lineno, hits, t in timings:
+                v = values.setdefault(func, {}).setdefault(lineno, dict(hits=[], time=[]))
+                v['hits'].append(hits)
+                v['time'].append(t)
+    stats = {}
+    for func, lines in values.items():
+        for lineno, v in lines.items():
+            times = v['time'] + [0] * (len(runs) - len(v['time']))
+            stats.setdefault(func, {})[lineno] = dict(hits=sum(v['hits']) / len(runs),
+                                                      time=statistics.fmean(times),
+                                                      std=statistics.stdev(times) if len(times) > 1 else 0.0,
+                                                      min=min(times),
+                                                      max=max(times))
+    return stats
+
+
+def resolve_profile_functions(functions, modules, project_root, cython_dev_tools_path, source_file, package,
+                              entry_module):
+    """
+    Python functions, modules and cdef functions (`CdefLineTracer`) to profile by `-f` / `-m` arguments
+    """
+    functions_to_profile = []
+    cdef_tracer = CdefLineTracer()
+    func_mapper = None
+
+    for lp_func in functions:
         if '@' not in lp_func:
             # Func definition related to the main module
-            _func = get_module_func(entry_module, lp_func)
-            functions_to_profile.append(_func)
+            f_source_file, f_package, f_entry_method, _func_m = source_file, package, lp_func, entry_module
         else:
             f_source_file, f_package, f_entry_method = find_package_path(project_root, lp_func, as_entry=False)
             _func_m = importlib.import_module(f_package)
+
+        try:
             _func = get_module_func(_func_m, f_entry_method)
-            functions_to_profile.append(_func)
+        except RuntimeError:
+            if not f_source_file.endswith('.pyx'):
+                raise
+            # Not visible for Python, cdef function
+            if func_mapper is None:
+                from cython_dev_tools.debugger.valgrind import make_func_mapper
+                func_mapper = make_func_mapper(cython_dev_tools_path)
+            lineno = find_cdef_function(func_mapper, f_package, f_entry_method)
+            if lineno is None:
+                raise
+            cdef_tracer.add_cdef_function(os.path.relpath(f_source_file, project_root), f_source_file,
+                                          f_entry_method.split('.')[-1], lineno)
+            log.trace(f'lprun added cdef function: {f_package}.{f_entry_method} at line {lineno}')
+            continue
 
+        functions_to_profile.append(_func)
         log.trace(f'lprun added profile function: {_func} code: {_func.__code__}')
 
     modules_to_profile = []
-    for lp_module in __cytool_modules:
-        if '@' in lp_module:
-            raise ValueError(f'You must pass module path without @, got {lp_module}')
+    for lp_module in modules:
         m_source_file, m_package, m_entry_method = find_package_path(project_root, lp_module, as_entry=False)
-
         m_module = importlib.import_module(m_package)
         modules_to_profile.append(m_module)
-        #breakpoint()
         log.trace(f'lprun added module: {m_module} {m_source_file}')
 
+    return functions_to_profile, modules_to_profile, cdef_tracer
+
+
+def run_lprun_worker(config: dict):
+    """
+    Line profiler process entry point, profiles `config['repeats']` calls of the target,
+    writes line timings of each run to config['result_file']
+    """
+    log.setup('cython_dev_tools__lprun', log_level=config['log_level'])
+    project_root, cython_dev_tools_path = config['project_root'], config['cython_dev_tools_path']
+    source_file, package, entry_method = config['source_file'], config['package'], config['entry_method']
+    sys.path.insert(0, project_root)
+
+    f_args, f_kwargs = check_method_args(config['entry_args'], fixture_variables(cython_dev_tools_path, package))
+    log.trace(f'Arguments to pass into: {entry_method}(*{f_args}, **{f_kwargs})')
+    entry_module = importlib.import_module(package)
+    entry_func = get_module_func(entry_module, entry_method)
+
+    functions = list(config['functions'])
+    if config['auto']:
+        for fn in auto_profile_functions(entry_func, f_args, f_kwargs, project_root, cython_dev_tools_path, package,
+                                         config['target'], threshold=config['auto_threshold']):
+            if fn not in functions and fn != f'{os.path.relpath(source_file, project_root)}@{entry_method}':
+                functions.append(fn)
+
+    functions_to_profile, modules_to_profile, cdef_tracer = resolve_profile_functions(
+        functions, config['modules'], project_root, cython_dev_tools_path, source_file, package, entry_module)
     importlib.invalidate_caches()
 
-    prof = CythonLineProfiler(*functions_to_profile)
+    prof = CythonLineProfiler(entry_func, *functions_to_profile)
     for m in modules_to_profile:
         prof.add_module(m)
 
+    totals = []
+    runs = []
     try:
-        prof.runcall(entry_func, *f_args, **f_kwargs)
-        prof.print_stats(stripzeros=True)
+        for _ in range(config['repeats']):
+            before = dict(prof.get_stats().timings)
+            t_start = time.perf_counter()
+            prof.runcall(entry_func, *f_args, **f_kwargs)
+            totals.append(time.perf_counter() - t_start)
+            runs.append(line_timings_delta(before, prof.get_stats().timings))
     except TypeError as exc:
         if 'argument' in str(exc):
             full_spec = inspect.getfullargspec(entry_func)
             raise RuntimeError(f'Incorrect arguments passed to entry_func: {entry_method}, got *args={f_args}, **kwargs={f_kwargs}\n\t{full_spec}')
         raise
+    unit = prof.get_stats().unit
+
+    if cdef_tracer.functions:
+        # Separate calls, so the Python trace hook overhead doesn't distort line_profiler timings
+        log.info(f'Profiling cdef functions in separate calls of {entry_method}')
+        for run in runs:
+            before = cdef_tracer.get_timings(unit)
+            cdef_tracer.runcall(entry_func, *f_args, **f_kwargs)
+            run.update(line_timings_delta(before, cdef_tracer.get_timings(unit)))
+        for (fn, lineno, func_name), timings in cdef_tracer.get_timings(unit).items():
+            if not timings:
+                log.warning(f'No line events of cdef {func_name} ({fn}:{lineno}), missing build --debug?')
+
+    with open(config['result_file'], 'w') as fh:
+        json.dump(dict(unit=unit,
+                       totals=totals,
+                       runs=[[[*func, timings] for func, timings in run.items()] for run in runs]), fh)
+
+
+def lprun(profile_target,
+          functions=None,
+          modules=None,
+          project_root=None,
+          trace_only=None,
+          auto=False,
+          auto_threshold=5.0,
+          repeats=5,
+          limit=10,
+          ) -> str:
+    """
+    Line profiler of the entry point call in a clean python process
+
+    :param auto: select functions by cProfile pass first (self time >= `auto_threshold` % of the total)
+    :param repeats: the target is called `repeats` times, line timings are averaged with stdev
+    :param limit: number of lines in hot lines variance table
+    :return: profile JSON path
+    """
+    # Check if cython tools in a good state in the project root
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    log.info(f'Starting line profiler at {project_root}')
+
+    for lp_func in functions or []:
+        if '(' in lp_func or ')' in lp_func:
+            raise ValueError(f'-f/-func arguments must be a simple path to a function WITHOUT arguments, got `{lp_func}`, '
+                             f'i.e. `func` (if func in entry module) or `package/module.pyx@func` or `package.module@func`')
+    for lp_module in modules or []:
+        if '@' in lp_module:
+            raise ValueError(f'You must pass module path without @, got {lp_module}')
+    if repeats < 1:
+        raise ValueError(f'repeats must be >= 1, got {repeats}')
+
+    if trace_only:
+        # Otherwise, the project must be already built with `build --debug`
+        log.debug(f'Rebuilding with line tracing only for {trace_only}')
+        cython_dev_tools.building.build(project_root, is_debug=True, trace_only=trace_only)
+
+    log.trace(f'profile_target: {profile_target}')
+    entry_target, entry_args = split_call_target(profile_target)
+
+    source_file, package, entry_method = find_package_path(project_root, entry_target)
+    log.trace((source_file, package, entry_method))
+    check_method_args(entry_args, fixture_variables(cython_dev_tools_path, dry_run=True))
+
+    profiles_path = os.path.join(cython_dev_tools_path, PROFILES_DIRNAME)
+    os.makedirs(profiles_path, exist_ok=True)
+    config = dict(log_level=log.log_level,
+                  project_root=project_root,
+                  cython_dev_tools_path=cython_dev_tools_path,
+                  target=profile_target,
+                  source_file=source_file,
+                  package=package,
+                  entry_method=entry_method,
+                  entry_args=entry_args,
+                  functions=list(functions or []),
+                  modules=list(modules or []),
+                  auto=auto,
+                  auto_threshold=auto_threshold,
+                  repeats=repeats,
+                  )
+    # Unique result file, concurrent runs don't overwrite each other results
+    fd, config['result_file'] = tempfile.mkstemp(prefix='lprun_worker_result_', suffix='.json', dir=profiles_path)
+    os.close(fd)
+    try:
+        ret = subprocess.call(['python', '-c',
+                               f'from cython_dev_tools.testing.profiler import run_lprun_worker; '
+                               f'run_lprun_worker({config!r})'],
+                              env=variant_env(project_root), cwd=project_root)
+        if ret != 0 or os.path.getsize(config['result_file']) == 0:
+            raise RuntimeError(f'Line profiler process failed with exit code {ret}')
+        with open(config['result_file'], 'r') as fh:
+            result = json.load(fh)
+    finally:
+        os.unlink(config['result_file'])
+
+    unit = result['unit']
+    runs = [{(fn, lineno, name): [tuple(t) for t in timings] for fn, lineno, name, timings in run}
+            for run in result['runs']]
+    line_stats = aggregate_line_runs(runs)
+    lstats = LineStats({func: [(lineno, round(st['hits']), round(st['time'])) for lineno, st in sorted(lines.items())]
+                        for func, lines in line_stats.items()}, unit)
+    show_text(lstats.timings, unit, stripzeros=True)
+    print_line_variance(line_stats, unit, project_root, len(runs), limit=limit)
+
+    # Function totals (mean of runs) for the performance history
+    func_totals = {f'{os.path.relpath(fn, project_root)}:{lineno}({func_name})': sum(t for _, _, t in timings) * unit
+                   for (fn, lineno, func_name), timings in lstats.timings.items() if timings}
+    record_perf(project_root, cython_dev_tools_path, 'lprun', profile_target, package,
+                stats=dict(describe(result['totals']), functions=func_totals), samples=[result['totals']])
+
+    line_std = {(fn, lineno): st['std'] * unit * 1e6 for (fn, _, _), lines in line_stats.items()
+                for lineno, st in lines.items()}
+    profile = lprun_profile(lstats, project_root, cython_dev_tools_path, profile_target, line_std=line_std,
+                            entry=(source_file, entry_method.rsplit('.', 1)[-1]))
+    profile['repeats'] = len(runs)
+    profile_fn = save_profile(cython_dev_tools_path, profile, f'{package}.{entry_method}')
+    # Mean of runs, i.e. `python -m line_profiler <file>.lprof`
+    with open(os.path.splitext(profile_fn)[0] + '.lprof', 'wb') as fh:
+        pickle.dump(lstats, fh, pickle.HIGHEST_PROTOCOL)
+    print()
+    print_profile_files(profile_fn)
+    print(f'Line profiler stats: {os.path.splitext(profile_fn)[0]}.lprof')
+    return profile_fn
+
+
+def print_line_variance(line_stats: dict, unit, project_root, n_runs, limit=10):
+    lines = [(fn, lineno, st) for (fn, _, _), func_lines in line_stats.items() for lineno, st in func_lines.items()]
+    lines.sort(key=lambda x: -x[2]['time'])
+    print(f'Hot lines (mean of {n_runs} runs):')
+    print(f'{"time":>12} {"stdev":>12} {"cv":>6} {"hits":>9}  line')
+    for fn, lineno, st in lines[:limit]:
+        cv = st['std'] / st['time'] if st['time'] else 0.0
+        code = linecache.getline(fn, lineno).strip()
+        print(f'{format_time(st["time"] * unit):>12} {format_time(st["std"] * unit):>12} {cv:>6.1%} '
+              f'{st["hits"]:>9g}  {os.path.relpath(fn, project_root)}:{lineno}  {code}')
+
+
+def lprun_profile(lstats, project_root, cython_dev_tools_path, target, line_std: dict = None,
+                  entry: tuple = None) -> dict:
+    """
+    Profile of line_profiler stats (see `testing/profile_data.py`), without the call tree: each profiled function
+    is a root frame, so line and function `self` include the time of callees. Nested profiled functions are counted
+    in their callers too, the profile `total` is the time of the entry function only (of the longest function if
+    the entry is not profiled)
+
+    :param line_std: line time stdev of repeated runs (us) by (filename, lineno), saved as line `std`
+    :param entry: (filename, function name) of the entry point
+    """
+    from cython_dev_tools.debugger.valgrind import make_func_mapper
+    try:
+        function_names = pyx_function_names(make_func_mapper(cython_dev_tools_path))
+    except RuntimeError:
+        function_names = {}
+
+    stacks = {}
+    lines = {}
+    frames_info = {}
+    entry_total = None
+    for (fn, lineno, func_name), timings in lstats.timings.items():
+        if not timings:
+            continue
+        frame = code_frame((fn, lineno, func_name), project_root, function_names)
+        func_total = round(sum(t for _, _, t in timings) * lstats.unit * 1e6)
+        stacks[frame['name']] = stacks.get(frame['name'], 0) + func_total
+        if entry and (frame.get('file'), func_name) == (os.path.relpath(entry[0], project_root), entry[1]):
+            entry_total = (entry_total or 0) + func_total
+        if not frame.get('file'):
+            continue
+        frames_info[frame['name']] = dict(file=frame['file'], line=frame['line'])
+        for line_no, _, t in timings:
+            l = lines.setdefault(f'{frame["file"]}:{line_no}', dict(self=0, total=0))
+            l['self'] += round(t * lstats.unit * 1e6)
+            l['total'] += round(t * lstats.unit * 1e6)
+            if line_std and (fn, line_no) in line_std:
+                l['std'] = round(line_std[(fn, line_no)], 3)
+    attach_line_sources(lines, project_root)
+    profile = make_profile('lprun', target, 'us', {k: v for k, v in stacks.items() if v > 0}, lines=lines,
+                           frames_info=frames_info)
+    # Roots are not disjoint, the sum of stacks counts nested functions more than once
+    profile['total'] = entry_total if entry_total is not None else max(stacks.values(), default=0)
+    return profile
 
 
@@ -0,0 +1,154 @@
+"""
+Pytest plugin used internally by cython tools commands
+
+It's loaded explicitly by `cytool` via `python -m pytest -p cython_dev_tools.testing.pytest_plugin ...`,
+and it does nothing unless one of `--cytool-*` options is given.
+"""
+import json
+import os
+import re
+import resource
+import sys
+import time
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('cytool', 'Cython tools internals')
+    group.addoption('--cytool-contexts', action='store_true', default=False,
+                    help='Switch coverage.py dynamic context to the current test id (used by `cytool cover --test-contexts`)')
+    group.addoption('--cytool-report', default=None, metavar='FILE',
+                    help='Append JSON line events of each test start/finish (with duration, CPU time and peak RSS) to FILE (used by `cytool tests`)')
+
+
+def cytool_test_id(item):
+    """
+    Test id relative to current working dir (i.e. project root), unlike pytest `nodeid` which is relative to pytest rootdir
+    """
+    _, _, test_name = item.nodeid.partition('::')
+    test_path = os.path.relpath(str(item.fspath), os.getcwd())
+    if test_name:
+        return f'{test_path}::{test_name}'
+    return test_path
+
+
+def _read_proc_status_kb(field):
+    try:
+        with open('/proc/self/status', 'r') as fh:
+            m = re.search(rf'^{field}:\s+(\d+) kB', fh.read(), re.MULTILINE)
+            return int(m.group(1)) if m else None
+    except OSError:
+        return None
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets process peak RSS (VmHWM) to the current RSS, only Linux supports this
+
+    :return: False if peak RSS can't be reset, then the peak of the whole process life is measured
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def current_rss() -> int:
+    """
+    Current RSS in bytes (0 if unknown)
+    """
+    rss_kb = _read_proc_status_kb('VmRSS')
+    return rss_kb * 1024 if rss_kb is not None else 0
+
+
+def peak_rss() -> int:
+    """
+    Peak RSS in bytes since the last `reset_peak_rss()` (or the process start)
+    """
+    hwm_kb = _read_proc_status_kb('VmHWM')
+    if hwm_kb is None:
+        # ru_maxrss is in kilobytes on Linux, but in bytes on MacOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return hwm_kb * 1024
+
+
+class CytoolEventsReport:
+    """
+    Writes JSON line per event, and flushes immediately, so the last started test is known even after segfault
+    """
+    def __init__(self, report_fn):
+        self.fh = open(report_fn, 'a')
+        self.outcomes = {}
+
+    def write(self, **event):
+        self.fh.write(json.dumps(event) + '\n')
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+    def pytest_runtest_logreport(self, report):
+        # Test outcome is failed if any of setup/call/teardown is failed
+        outcome = self.outcomes.get(report.nodeid)
+        if report.failed:
+            outcome = 'failed' if report.when == 'call' else 'error'
+        elif report.skipped and outcome in (None, 'passed'):
+            outcome = 'skipped'
+        elif outcome is None:
+            outcome = 'passed'
+        self.outcomes[report.nodeid] = outcome
+
+
+def pytest_configure(config):
+    report_fn = config.getoption('cytool_report')
+    if report_fn:
+        config.pluginmanager.register(CytoolEventsReport(report_fn), 'cytool_report')
+
+
+def pytest_unconfigure(config):
+    report = config.pluginmanager.get_plugin('cytool_report')
+    if report is not None:
+        report.close()
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    report = item.config.pluginmanager.get_plugin('cytool_report')
+    if report is not None:
+        report.write(event='start', test=cytool_test_id(item), nodeid=item.nodeid)
+        reset_peak_rss()
+        rss_start = current_rss()
+        cpu_start = time.process_time()
+        t_start = time.perf_counter()
+
+    cov = None
+    if item.config.getoption('cytool_contexts'):
+        try:
+            from coverage import Coverage
+            cov = Coverage.current()
+        except ImportError:
+            cov = None
+
+    if cov is not None:
+        # All lines executed in setup/call/teardown will be recorded with this test id
+        cov.switch_context(cytool_test_id(item))
+    try:
+        yield
+    finally:
+        if cov is not None:
+            cov.switch_context('')
+
+    if report is not None:
+        duration = time.perf_counter() - t_start
+        cpu = time.process_time() - cpu_start
+        test_peak_rss = peak_rss()
+        report.write(event='finish', test=cytool_test_id(item), nodeid=item.nodeid,
+                     outcome=report.outcomes.get(item.nodeid, 'passed'),
+                     duration=duration,
+                     cpu=cpu,
+                     peak_rss=test_peak_rss,
+                     rss_growth=max(0, test_peak_rss - rss_start),
+                     )
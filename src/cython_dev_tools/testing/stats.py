@@ -0,0 +1,192 @@
+"""
+Statistics helpers for benchmarks (pure python, scipy is not required)
+"""
+import math
+import random
+import statistics
+from typing import List, Sequence
+
+
+def _betacf(a, b, x, max_iter=200, eps=3e-16):
+    """
+    Continued fraction for the incomplete beta function (Numerical Recipes, Lentz's method)
+    """
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, max_iter + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < eps:
+            break
+    return h
+
+
+def betainc(a, b, x) -> float:
+    """
+    Regularized incomplete beta function I_x(a, b)
+    """
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    ln_front = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1.0 - x)
+    if x < (a + 1.0) / (a + b + 2.0):
+        return math.exp(ln_front) * _betacf(a, b, x) / a
+    return 1.0 - math.exp(ln_front) * _betacf(b, a, 1.0 - x) / b
+
+
+def student_t_cdf(t, df) -> float:
+    x = df / (df + t * t)
+    tail = 0.5 * betainc(df / 2.0, 0.5, x)
+    return 1.0 - tail if t > 0 else tail
+
+
+def student_t_ppf(q, df) -> float:
+    """
+    Quantile of Student's t-distribution (bisection over CDF)
+    """
+    if not 0.0 < q < 1.0:
+        raise ValueError(f'Quantile must be in (0, 1), got {q}')
+    if q < 0.5:
+        return -student_t_ppf(1.0 - q, df)
+    lo, hi = 0.0, 1.0
+    while student_t_cdf(hi, df) < q:
+        hi *= 2.0
+    for _ in range(200):
+        mid = (lo + hi) / 2.0
+        if student_t_cdf(mid, df) < q:
+            lo = mid
+        else:
+            hi = mid
+        if hi - lo < 1e-12 * max(1.0, hi):
+            break
+    return (lo + hi) / 2.0
+
+
+def format_time(seconds) -> str:
+    for unit, scale in (('s', 1.0), ('ms', 1e-3), ('us', 1e-6)):
+        if abs(seconds) >= scale:
+            return f'{seconds / scale:.3f}{unit}'
+    return f'{seconds / 1e-9:.1f}ns'
+
+
+def mean_confidence_interval(values: Sequence[float], confidence=0.95):
+    """
+    Confidence interval of the mean (t-distribution)
+
+    :return: (low, high), or (mean, mean) when less than 2 values
+    """
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, mean
+    sem = statistics.stdev(values) / math.sqrt(len(values))
+    t = student_t_ppf(0.5 + confidence / 2.0, len(values) - 1)
+    return mean - t * sem, mean + t * sem
+
+
+def describe(samples: List[float], groups: List[List[float]] = None, confidence=0.95) -> dict:
+    """
+    Summary statistics of samples
+
+    :param groups: samples grouped by process, the confidence interval is calculated by group means,
+        because samples measured in the same process are not independent
+    """
+    ci_values = [statistics.fmean(g) for g in groups] if groups and len(groups) > 1 else samples
+    ci_low, ci_high = mean_confidence_interval(ci_values, confidence)
+    return dict(
+        n=len(samples),
+        mean=statistics.fmean(samples),
+        median=statistics.median(samples),
+        stdev=statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        min=min(samples),
+        max=max(samples),
+        confidence=confidence,
+        ci_low=ci_low,
+        ci_high=ci_high,
+    )
+
+
+def mann_whitney_u(x: Sequence[float], y: Sequence[float], alternative='two-sided'):
+    """
+    Mann-Whitney U test (normal approximation with tie correction)
+
+    :param alternative: 'two-sided', 'greater' (x tends to be greater than y) or 'less'
+    :return: (U statistic of x, p-value)
+    """
+    n1, n2 = len(x), len(y)
+    if n1 == 0 or n2 == 0:
+        raise ValueError('Both samples must be non-empty')
+
+    values = sorted([(v, 0) for v in x] + [(v, 1) for v in y])
+    ranks = [0.0] * len(values)
+    tie_term = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        # Average rank of the ties group (1-based)
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2.0 + 1.0
+        n_ties = j - i + 1
+        tie_term += n_ties ** 3 - n_ties
+        i = j + 1
+
+    r1 = sum(r for r, (_, group) in zip(ranks, values) if group == 0)
+    u1 = r1 - n1 * (n1 + 1) / 2.0
+
+    n = n1 + n2
+    mu = n1 * n2 / 2.0
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1)))) if n > 1 else 0.0
+    if sigma == 0.0:
+        return u1, 1.0
+
+    normal = statistics.NormalDist()
+    if alternative == 'greater':
+        p = 1.0 - normal.cdf((u1 - mu - 0.5) / sigma)
+    elif alternative == 'less':
+        p = normal.cdf((u1 - mu + 0.5) / sigma)
+    elif alternative == 'two-sided':
+        z = (abs(u1 - mu) - 0.5) / sigma
+        p = min(1.0, 2.0 * (1.0 - normal.cdf(z)))
+    else:
+        raise ValueError(f'Unknown alternative: {alternative}')
+    return u1, p
+
+
+def bootstrap_ratio_ci(baseline: Sequence[float], values: Sequence[float], confidence=0.95, n_resamples=2000,
+                       stat=statistics.median, seed=0):
+    """
+    Bootstrap percentile confidence interval of stat(baseline) / stat(values), i.e. speedup of `values` timings
+
+    :return: (ratio, ci_low, ci_high)
+    """
+    rnd = random.Random(seed)
+    ratios = []
+    for _ in range(n_resamples):
+        b = rnd.choices(baseline, k=len(baseline))
+        v = rnd.choices(values, k=len(values))
+        ratios.append(stat(b) / stat(v))
+    ratios.sort()
+    alpha = (1.0 - confidence) / 2.0
+    ci_low = ratios[int(math.floor(alpha * (n_resamples - 1)))]
+    ci_high = ratios[int(math.ceil((1.0 - alpha) * (n_resamples - 1)))]
+    return stat(baseline) / stat(values), ci_low, ci_high
@@ -1,11 +1,20 @@
 import os
 import subprocess
 import sys
+from contextlib import closing
 from cython_dev_tools.logs import log
-from cython_dev_tools.common import check_project_initialized, check_method_exists, find_package_path, make_run_args
+from cython_dev_tools.common import check_project_initialized, check_method_exists, find_package_path, make_run_args, log_exit_code
+from cython_dev_tools.testing.impact import load_impact_map, git_changed_lines, select_affected_tests, git_revision
+from cython_dev_tools.testing.parallel import run_parallel_tests, read_test_events
+from cython_dev_tools.testing.history import open_test_history, record_test_run, find_regressions, log_regressions, \
+    print_tests_report
+from cython_dev_tools.testing.forkserver import warm_request
+from cython_dev_tools.building.profiles import build_profile
 import re
 import signal
 
+TESTS_REPORT_FILENAME = 'tests_report.jsonl'
+
 
 def tests_command(args):
     log.setup('cython_dev_tools__tests', verbosity=args.verbose)
@@ -15,6 +24,13 @@ def tests_command(args):
           last_failed=args.lf,
           disable_warnings=args.disable_warnings,
           project_root=args.project_root,
+          affected=args.affected,
+          affected_base=args.affected_base,
+          workers=args.workers,
+          warm=args.warm,
+          report=args.report,
+          regression_factor=args.regression_factor,
+          profile=args.profile,
           )
 
 
@@ -23,10 +39,22 @@ def tests(tests_target,
           quiet=False,
           last_failed=False,
           disable_warnings=False,
+          affected=False,
+          affected_base=None,
+          workers=None,
+          warm=False,
+          report=None,
+          regression_factor=2.0,
+          profile=None,
           ):
     log.debug(f'Running: {tests_target}')
     # Check if cython tools in a good state in the project root
     project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    if profile:
+        if affected:
+            raise ValueError('--affected is not supported with --profile, the profile tree has no git repository')
+        # Run in the build profile tree, tests history is kept separately for the profile
+        project_root, cython_dev_tools_path = check_project_initialized(build_profile(project_root, profile))
 
     # Building python args
     tests_path = os.path.join(project_root, tests_target)
@@ -34,6 +62,11 @@ def tests(tests_target,
     if not os.path.exists(tests_path):
         raise FileNotFoundError(f'tests_target = {tests_path} not exists')
 
+    if report is not None:
+        with closing(open_test_history(cython_dev_tools_path)) as conn:
+            print_tests_report(conn, report, os.path.relpath(tests_path, project_root))
+        return
+
     if not os.path.isdir(tests_path):
         # Getting run target
         source_file, package, entry_method = find_package_path(project_root, tests_target, as_entry=False)
@@ -44,6 +77,16 @@ def tests(tests_target,
     else:
         run_instruct = ['-m', 'pytest', f'{tests_path}']
 
+    affected_tests = None
+    if affected:
+        affected_tests = get_affected_tests(project_root, cython_dev_tools_path, tests_path, affected_base)
+        if not affected_tests:
+            log.info(f'No tests affected by changes in {tests_target}')
+            return
+        log.info(f'Running {len(affected_tests)} affected tests')
+        # Replace tests target by the list of affected test ids (i.e. `path/test_module.py::TestClass::test_method`)
+        run_instruct = run_instruct[:2] + [os.path.join(project_root, t) for t in affected_tests]
+
     # Get rid of annoying ".pytest_cache" folder in the root dir!
     run_instruct.insert(-1, f'--override-ini=cache_dir={os.path.join(cython_dev_tools_path, ".pytest_cache")}')
     if last_failed:
@@ -63,25 +106,92 @@ def tests(tests_target,
     else:
         my_env["PYTHONPATH"] = f"{project_root}"
 
-    p = subprocess.Popen(['python'] + run_instruct, env=my_env)
-    log.trace("Python spawned (pid %d)", p.pid)
-
-    while True:
-        try:
-            ret = p.wait()
-            if ret == 0:
-                log.trace(f'python correctly finished')
-            elif ret == -11:
-                # Segmentation fault
-                log.critical(f'Python SEGMENTATION FAULT during running: {tests_target} ErrCode: {ret}, try to run with `debug` command')
-            elif  ret == -5:
-                log.critical(f'Python POSSIBLE unhandled breakpoint during running: {tests_target} ErrCode: {ret}, try to run with `debug` command')
+    if workers is not None and workers > 1:
+        # Pytest options only, the tests target is split by workers
+        pytest_args = [a for a in run_instruct[2:] if a.startswith('-')]
+        summary = run_parallel_tests(project_root, cython_dev_tools_path, tests_path, workers, pytest_args, my_env,
+                                     test_ids=affected_tests)
+        record_test_history(project_root, cython_dev_tools_path, summary['results'], summary['crashed'],
+                            regression_factor)
+        return summary
+
+    # Per-test duration, CPU time and peak RSS are written by the plugin
+    report_fn = os.path.join(cython_dev_tools_path, TESTS_REPORT_FILENAME)
+    if os.path.exists(report_fn):
+        os.unlink(report_fn)
+    run_instruct[2:2] = ['-p', 'cython_dev_tools.testing.pytest_plugin', f'--cytool-report={report_fn}']
+
+    if warm:
+        ret = warm_request(project_root, cython_dev_tools_path, 'pytest', run_instruct[2:], my_env)
+        log_exit_code(ret, tests_target)
+    else:
+        p = subprocess.Popen(['python'] + run_instruct, env=my_env)
+        log.trace("Python spawned (pid %d)", p.pid)
+
+        while True:
+            try:
+                ret = p.wait()
+                log_exit_code(ret, tests_target)
+            except KeyboardInterrupt:
+                pass
+            except:
+                log.exception(f'Exception during running python: {run_instruct}')
             else:
-                log.error(f'Python returned error while running: {tests_target} ErrCode: {ret}')
-        except KeyboardInterrupt:
-            pass
-        except:
-            log.exception(f'Exception during running python: {run_instruct}')
-        else:
-            break
-
+                break
+
+    results = {}
+    running = {}
+    for e in read_test_events(report_fn):
+        if e['event'] == 'start':
+            running[e['test']] = e
+        elif e['event'] == 'finish':
+            running.pop(e['test'], None)
+            results[e['test']] = e
+
+    crashed = {}
+    if ret < 0:
+        # The test which was running at the moment of crash
+        try:
+            sig_name = signal.Signals(-ret).name
+        except ValueError:
+            sig_name = f'signal {-ret}'
+        crashed = {test_id: sig_name for test_id in running}
+    record_test_history(project_root, cython_dev_tools_path, results, crashed, regression_factor)
+
+
+def record_test_history(project_root, cython_dev_tools_path, results, crashed, regression_factor):
+    """
+    Saves test results into the history, and warns about tests with time/memory regression
+    """
+    if not results and not crashed:
+        return
+
+    with closing(open_test_history(cython_dev_tools_path)) as conn:
+        run_id = record_test_run(conn, results, crashed, revision=git_revision(project_root))
+        log.debug(f'Test history: recorded run #{run_id} with {len(results) + len(crashed)} tests')
+        if regression_factor:
+            log_regressions(find_regressions(conn, run_id, regression_factor), regression_factor)
+
+
+def get_affected_tests(project_root, cython_dev_tools_path, tests_path, base_revision=None):
+    """
+    Selects tests (ids relative to project root) which executed lines changed since `base_revision`
+
+    :param base_revision: git revision to compare with, by default the revision of the last `cytool cover --test-contexts` run
+    """
+    impact_map = load_impact_map(cython_dev_tools_path)
+    base_revision = base_revision or impact_map.get('revision')
+    log.debug(f'Selecting affected tests, changes since revision: {base_revision}')
+
+    changed = git_changed_lines(project_root, base_revision)
+    log.trace(f'Changed files: {list(changed.keys())}')
+
+    affected_tests, not_covered = select_affected_tests(impact_map, changed)
+    for fn in not_covered:
+        log.warning(f'Changed file is not covered by any test: {fn}')
+
+    tests_rel_path = os.path.relpath(tests_path, project_root)
+    if tests_rel_path != '.':
+        affected_tests = [t for t in affected_tests
+                          if t.split('::')[0] == tests_rel_path or t.startswith(tests_rel_path + os.path.sep)]
+    return affected_tests
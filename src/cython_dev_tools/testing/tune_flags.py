@@ -0,0 +1,251 @@
+"""
+C compiler flags autotuning
+
+Greedy search over the flags space, separately for each module: starting from distutils defaults, each round tries
+to add (or switch) one flag option of the module in a separate variant tree build, and keeps the fastest one
+if it is significantly faster (Mann-Whitney U test). The Pareto front of benchmark time vs the module .so size
+is reported among all tried flag sets of the module.
+"""
+import json
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from cython_dev_tools.building.build import load_build_manifest, is_traced_module
+from cython_dev_tools.building.flag_profiles import save_flag_profile
+from cython_dev_tools.building.variants import build_variant_tree, variant_env, variant_name
+from cython_dev_tools.common import check_project_initialized, find_package_path, check_method_args, split_call_target, \
+    machine_fingerprint
+from cython_dev_tools.logs import log
+from cython_dev_tools.testing.bench import measure_call, BENCH_DIRNAME
+from cython_dev_tools.testing.fixtures import fixture_variables
+from cython_dev_tools.testing.perf_history import record_perf, compare_samples
+from cython_dev_tools.testing.stats import describe, format_time, mann_whitney_u
+
+TUNE_FLAGS_DIRNAME = 'tune_flags'
+
+# Flag options, alternatives are separated by `|`
+FLAGS_SEARCH_SPACE = ['-O2|-O3', '-march=native', '-ffast-math', '-funroll-loops', '-fno-semantic-interposition',
+                      '-flto']
+
+
+def tune_flags_command(args):
+    log.setup('cython_dev_tools__tune_flags', verbosity=args.verbose)
+
+    tune_flags(args.bench,
+               modules=args.module,
+               flags=args.flags,
+               project_root=args.project_root,
+               processes=args.processes,
+               repeats=args.repeats,
+               warmup=args.warmup,
+               min_time=args.min_time,
+               alpha=args.alpha,
+               save=args.save,
+               )
+
+
+def parse_flags_space(flags: List[str] = None) -> List[List[str]]:
+    """
+    ['-O2|-O3', '-march=native'] -> [['-O2', '-O3'], ['-march=native']]
+    """
+    return [[f.strip() for f in option.split('|') if f.strip()] for option in (flags or FLAGS_SEARCH_SPACE)]
+
+
+def flags_candidates(current: List[str], space: List[List[str]]) -> List[List[str]]:
+    """
+    All flag sets which differ from `current` by one option added (or switched to another alternative),
+    flags are ordered as in the search space
+    """
+    candidates = []
+    for i, option in enumerate(space):
+        for alternative in option:
+            if alternative in current:
+                continue
+            chosen = [next((f for f in opt if f in current), None) for opt in space]
+            chosen[i] = alternative
+            candidates.append([f for f in chosen if f])
+    return candidates
+
+
+def pareto_front(points) -> List[int]:
+    """
+    Indexes of non-dominated (time, size) points, both minimized
+    """
+    front = []
+    for i, (t, s) in enumerate(points):
+        if not any((t2 <= t and s2 <= s) and (t2 < t or s2 < s) for t2, s2 in points):
+            front.append(i)
+    return front
+
+
+def modules_so_size(variant_root, manifest: dict, modules: List[str]) -> int:
+    size = 0
+    for module_name, m in manifest.get('modules', {}).items():
+        so_fn = os.path.join(variant_root, m['so_path'])
+        if is_traced_module(module_name, modules) and os.path.exists(so_fn):
+            size += os.path.getsize(so_fn)
+    return size
+
+
+def check_test_power(processes, repeats, alpha):
+    """
+    Checks if the improvement test can reach `alpha` at all, it is done by per-process means (by samples of a single
+    process, see `perf_history.compare_samples()`), so even fully separated timings of few processes are not significant
+    """
+    n = processes if processes > 1 else repeats
+    _, min_p_value = mann_whitney_u(range(n, 2 * n), range(n), alternative='greater')
+    if min_p_value >= alpha:
+        raise ValueError(f'The improvement test of {processes} processes can not be significant at alpha={alpha} '
+                         f'(the smallest p-value is {min_p_value:.3f}), use more --processes')
+    if min_p_value > alpha / 2:
+        log.warning(f'The improvement test of {processes} processes is significant at alpha={alpha} only when all '
+                    f'timings are separated (the smallest p-value is {min_p_value:.3f}), use more --processes')
+
+
+def tune_flags(bench_target,
+               modules: List[str] = None,
+               flags: List[str] = None,
+               project_root=None,
+               processes=5,
+               repeats=5,
+               warmup=1,
+               min_time=0.1,
+               alpha=0.05,
+               min_change=0.02,
+               save=False,
+               ) -> dict:
+    """
+    Searches C compiler flags for the fastest benchmark, separately for each module
+
+    :param bench_target: benchmark target, i.e. `package/module.pyx@func(10)`
+    :param modules: packages/modules to tune (by default the benchmark target module), each module is searched
+        with the flags applied only to it, the other modules keep default (or saved profile) flags
+    :param flags: flags search space, i.e. ['-O2|-O3', '-march=native'], see FLAGS_SEARCH_SPACE
+    :param alpha: significance level of the improvement test
+    :param min_change: minimal relative speedup to accept the flag
+    :param save: save the best flags as the module profiles (used by the next builds)
+    :return: results dict, {'modules': {module: {'best': flags, 'configs': tried configs}}, ...}
+    """
+    project_root, cython_dev_tools_path = check_project_initialized(project_root)
+    check_test_power(processes, repeats, alpha)
+
+    entry_target, entry_args = split_call_target(bench_target)
+    source_file, package, entry_method = find_package_path(project_root, entry_target)
+    check_method_args(entry_args, fixture_variables(cython_dev_tools_path, dry_run=True))
+    modules = modules or [package]
+    space = parse_flags_space(flags)
+
+    modules_results = {}
+    for module in modules:
+        module_results = tune_module_flags(project_root, cython_dev_tools_path, bench_target, module, space,
+                                           processes=processes, repeats=repeats, warmup=warmup, min_time=min_time,
+                                           alpha=alpha, min_change=min_change)
+        print_tune_flags_results(bench_target, module, module_results['configs'])
+        print()
+        modules_results[module] = module_results
+
+    if any('-ffast-math' in r['best'] for r in modules_results.values()):
+        log.warning('-ffast-math changes floating point semantics (NaN/Inf handling, associativity), '
+                    'check the results by unit tests')
+
+    results = dict(target=bench_target,
+                   created_at=datetime.now().isoformat(timespec='seconds'),
+                   space=space,
+                   modules=modules_results,
+                   )
+    tune_path = os.path.join(cython_dev_tools_path, TUNE_FLAGS_DIRNAME)
+    os.makedirs(tune_path, exist_ok=True)
+    results_fn = os.path.join(tune_path, f'{package}.{entry_method}_{datetime.now():%Y%m%d_%H%M%S}.json')
+    with open(results_fn, 'w') as fh:
+        json.dump(results, fh, indent=1)
+    log.info(f'Tuning results saved: {results_fn}')
+
+    if save:
+        for module, r in modules_results.items():
+            if not r['best']:
+                log.info(f'Default flags are the best for {module}, no flag profile saved')
+                continue
+            best = next(c for c in r['configs'] if c['is_best'])
+            save_flag_profile(cython_dev_tools_path, module, r['best'],
+                              target=bench_target,
+                              speedup=best['speedup'],
+                              machine_id=machine_fingerprint()['id'])
+            log.info(f'Flag profile `{" ".join(r["best"])}` saved for {module}, run `cytool build` to apply')
+    return results
+
+
+def tune_module_flags(project_root, cython_dev_tools_path, bench_target, module, space: List[List[str]],
+                      processes=5, repeats=5, warmup=1, min_time=0.1, alpha=0.05, min_change=0.02) -> dict:
+    """
+    Greedy flags search of one module, the flags are applied only to the `module` in variant tree builds
+
+    :return: {'best': best flags, 'configs': [tried config with 'flags', 'stats', 'speedup', 'is_pareto', 'is_best']}
+    """
+    entry_target, entry_args = split_call_target(bench_target)
+    source_file, package, entry_method = find_package_path(project_root, entry_target)
+    tried = {}
+
+    def evaluate(compile_flags) -> Optional[dict]:
+        key = ' '.join(compile_flags)
+        if key in tried:
+            return tried[key]
+        name = variant_name('flags', dict(flags=compile_flags, modules=[module]))
+        try:
+            variant_root = build_variant_tree(project_root, cython_dev_tools_path, name,
+                                              compile_flags=compile_flags, flags_modules=[module])
+        except (SystemExit, Exception) as exc:
+            log.warning(f'Build failed with flags `{key}` of {module}, skipping: {exc}')
+            tried[key] = None
+            return None
+        variant_tools_path = os.path.join(variant_root, os.path.basename(cython_dev_tools_path))
+        bench_path = os.path.join(variant_tools_path, BENCH_DIRNAME)
+        os.makedirs(bench_path, exist_ok=True)
+
+        log.info(f'Benchmarking {module} flags `{key or "<defaults>"}`')
+        groups, loops = measure_call(variant_root, variant_tools_path, package, entry_method, entry_args, bench_path,
+                                     variant_env(variant_root), processes=processes, repeats=repeats, warmup=warmup,
+                                     min_time=min_time)
+        samples = [s for g in groups for s in g]
+        stats = describe(samples, groups)
+        record_perf(project_root, cython_dev_tools_path, 'tune-flags', f'{bench_target} [{module}: {key}]', package,
+                    stats=stats, samples=groups, build_path=variant_tools_path)
+        tried[key] = dict(flags=compile_flags, stats=stats, samples=groups, loops=loops,
+                          so_size=modules_so_size(variant_root, load_build_manifest(variant_tools_path), [module]))
+        log.info(f'{module} `{key or "<defaults>"}`: median {format_time(stats["median"])}, '
+                 f'.so size {tried[key]["so_size"]}')
+        return tried[key]
+
+    baseline = evaluate([])
+    if baseline is None:
+        raise RuntimeError('Build failed with default flags, try `cytool build` first')
+
+    best = baseline
+    while True:
+        results = [r for r in (evaluate(c) for c in flags_candidates(best['flags'], space)) if r is not None]
+        if not results:
+            break
+        fastest = min(results, key=lambda r: r['stats']['median'])
+        # Is the current best significantly slower than the fastest candidate?
+        if not compare_samples(fastest['samples'], best['samples'], alpha=alpha, min_change=min_change)['is_slowdown']:
+            break
+        best = fastest
+        log.info(f'{module} round winner: `{" ".join(best["flags"])}`')
+
+    configs = [r for r in tried.values() if r is not None]
+    front = pareto_front([(r['stats']['median'], r['so_size']) for r in configs])
+    for i, r in enumerate(configs):
+        r.update(speedup=baseline['stats']['median'] / r['stats']['median'], is_pareto=i in front,
+                 is_best=r is best)
+    return dict(best=best['flags'], configs=configs)
+
+
+def print_tune_flags_results(bench_target, module, configs):
+    print(f'{bench_target}, flags applied to: {module}')
+    print('(> - best by greedy search, * - Pareto front of time vs .so size)')
+    width = max(len(' '.join(r['flags']) or '<defaults>') for r in configs)
+    print(f'   {"Flags":<{width}} {"median":>12} {"speedup":>9} {".so size":>10}')
+    for r in sorted(configs, key=lambda r: r['stats']['median']):
+        mark = ('>' if r['is_best'] else ' ') + ('*' if r['is_pareto'] else ' ')
+        print(f'{mark} {" ".join(r["flags"]) or "<defaults>":<{width}} {format_time(r["stats"]["median"]):>12} '
+              f'{r["speedup"]:>8.2f}x {r["so_size"]:>10}')
@@ -0,0 +1,2 @@
+# Generated by `tests/init_test_project.py`, has its own tests (run by `cytool test` in the project root)
+collect_ignore = ['init_project']
@@ -0,0 +1,35 @@
+"""
+Shared `func_mapper` fixtures (see `cython_dev_tools.debugger.valgrind.make_func_mapper()`) of perf / valgrind tests
+"""
+import os
+import shutil
+from cython_dev_tools.debugger.valgrind import make_func_mapper as make_build_func_mapper
+
+INIT_PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init_project')
+INIT_PROJECT_TOOLS_PATH = os.path.join(INIT_PROJECT_ROOT, '.cython_dev_tools')
+
+# Valgrind tools integration tests run on the `init_project` debug build
+HAS_VALGRIND = shutil.which('valgrind') is not None
+HAS_INIT_PROJECT = os.path.exists(os.path.join(INIT_PROJECT_TOOLS_PATH, 'cython_debug'))
+
+
+def make_func_mapper() -> dict:
+    """
+    Synthetic `pkg/mod.pyx` module: recip_square() at line 1 (C line 1820-1822 -> line 3),
+    approx_pi2() at line 8 (C line 2130 -> line 10, 2135 -> line 12)
+    """
+    module_map = dict(module_name='pkg.mod',
+                      module_c_basename='mod.c',
+                      module_pyx_fn='/prj/pkg/mod.pyx',
+                      module_c_fn='/prj/.cython_dev_tools/src/pkg/mod.c',
+                      functions={'__pyx_f_3pkg_3mod_recip_square': ('pkg.mod.recip_square', 1),
+                                 '__pyx_pw_3pkg_3mod_3approx_pi2': ('pkg.mod.approx_pi2', 8)},
+                      line_numbers={1820: 3, 1822: 3, 2130: 10, 2135: 12})
+    return {'mod.c': {f: module_map for f in module_map['functions']}}
+
+
+def init_project_func_mapper() -> dict:
+    """
+    Real func_mapper of the `tests/init_project` debug build (see `tests/init_test_project.py`)
+    """
+    return make_build_func_mapper(INIT_PROJECT_TOOLS_PATH)
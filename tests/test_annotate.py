@@ -1,11 +1,42 @@
 import unittest
 from cython_dev_tools.building import annotate
+from cython_dev_tools.building.annotate import profile_heatmap_html
+from cython_dev_tools.testing.profile_data import make_profile
+
+ANNOTATION_HTML = '''<html><head></head>
+<body class="cython">
+<div class="cython"><pre class="cython line score-0" onclick="toggle()">+<span class="">1</span>: <span class="k">cdef</span> double inner(long i):</pre>
+<pre class='cython code score-0 '>c code</pre><pre class="cython line score-5" onclick="toggle()">+<span class="">2</span>:     return 1. / i</pre>
+<pre class='cython code score-5 '>c code</pre><pre class="cython line score-0">&#xA0;<span class="">3</span>: </pre>
+</div></body></html>
+'''
+
 
 class AnnotateTestCase(unittest.TestCase):
     def test_annotate(self):
         project_root = './init_project'
         annotate('.', project_root=project_root)
 
+    def test_profile_heatmap_html(self):
+        profile = make_profile('lprun', 'pkg/mod.pyx@main()', 'us', {'pkg.mod.inner': 100},
+                               lines={'pkg/mod.pyx:2': dict(self=80, total=80, code='return 1. / i'),
+                                      'pkg/other.pyx:2': dict(self=20, total=20)},
+                               frames_info={'pkg.mod.inner': dict(file='pkg/mod.pyx', line=1)})
+        html, file_share = profile_heatmap_html(ANNOTATION_HTML, 'pkg/mod.pyx', profile, 'p.json', hot_threshold=1.0)
+
+        self.assertAlmostEqual(0.8, file_share)
+        self.assertIn('<pre class="cython line score-5 cytools-hot-yellow" id="L2" onclick="toggle()">', html)
+        self.assertIn('>80.0%</span>+<span class="">2</span>', html)
+        # Function total on the definition line
+        self.assertIn('total: 0.100 ms (100.0%)</span>+<span class="">1</span>', html)
+        self.assertIn('<pre class="cython line score-0" id="L3"><span class="cytools-heat"></span>&#xA0;', html)
+        self.assertIn('<a href="#L2">line 2</a>', html)
+        self.assertIn('.cytools-heat', html)
+
+        # Below the threshold
+        html, _ = profile_heatmap_html(ANNOTATION_HTML, 'pkg/mod.pyx', profile, 'p.json', hot_threshold=90.0)
+        self.assertNotIn('cytools-hot-yellow"', html)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import json
+import math
+import tempfile
+from cython_dev_tools.common import split_call_target, check_method_args, machine_fingerprint
+from cython_dev_tools.testing.stats import student_t_ppf, mean_confidence_interval, describe, mann_whitney_u, format_time
+from cython_dev_tools.testing.perf_history import compare_samples, find_baseline_record, open_perf_history
+from cython_dev_tools.testing.complexity import parse_sweep, fit_complexity
+
+
+class BenchTestCase(unittest.TestCase):
+    def test_student_t_ppf(self):
+        self.assertAlmostEqual(12.7062, student_t_ppf(0.975, 1), places=4)
+        self.assertAlmostEqual(2.7764, student_t_ppf(0.975, 4), places=4)
+        self.assertAlmostEqual(-2.2281, student_t_ppf(0.025, 10), places=4)
+        self.assertAlmostEqual(1.9623, student_t_ppf(0.975, 1000), places=4)
+
+    def test_describe(self):
+        st = describe([1.0, 2.0, 3.0, 4.0], groups=[[1.0, 2.0], [3.0, 4.0]])
+        self.assertEqual(4, st['n'])
+        self.assertEqual(2.5, st['mean'])
+        self.assertEqual(1.0, st['min'])
+        # CI by 2 group means: 2.5 +/- 12.706 * 1.0
+        self.assertAlmostEqual(2.5 - 12.7062, st['ci_low'], places=4)
+        self.assertAlmostEqual(2.5 + 12.7062, st['ci_high'], places=4)
+
+        self.assertEqual((5.0, 5.0), mean_confidence_interval([5.0]))
+
+    def test_mann_whitney_u(self):
+        # Asymptotic p-values with tie and continuity correction, as scipy.stats.mannwhitneyu(method='asymptotic')
+        u, p = mann_whitney_u([1, 2, 3, 4, 5], [6, 7, 8, 9, 10], alternative='less')
+        self.assertEqual(0.0, u)
+        self.assertAlmostEqual(0.006093, p, places=5)
+
+        u, p = mann_whitney_u([1, 2, 2, 3], [2, 3, 3, 4])
+        self.assertEqual(3.0, u)
+        self.assertAlmostEqual(0.172034, p, places=5)
+
+        self.assertEqual((4.5, 1.0), mann_whitney_u([1, 1, 1], [1, 1, 1]))
+
+    def test_compare_samples(self):
+        baseline = [[1.0, 1.01, 0.99, 1.02], [0.98, 1.0, 1.01, 0.99], [1.0, 1.02, 0.99, 1.0],
+                    [0.99, 1.0, 1.01, 0.98], [1.01, 1.0, 1.0, 0.99]]
+        c = compare_samples(baseline, [[s * 1.2 for s in g] for g in baseline])
+        self.assertTrue(c['is_slowdown'])
+        self.assertAlmostEqual(0.2, c['change'])
+
+        self.assertFalse(compare_samples(baseline, [[s * 0.8 for s in g] for g in baseline])['is_slowdown'])
+        # Significant, but too small
+        self.assertFalse(compare_samples(baseline, [[s * 1.01 + 0.02 for s in g] for g in baseline],
+                                         min_change=0.05)['is_slowdown'])
+
+        # The test is done by per-process means (n=5, not n=20), pooled samples would be significant
+        groups = [[s * 1.05 for s in g] for g in baseline[:3]] + baseline[3:]
+        self.assertTrue(compare_samples([[s for g in baseline for s in g]], [[s for g in groups for s in g]])['is_slowdown'])
+        self.assertFalse(compare_samples(baseline, groups)['is_slowdown'])
+
+    def test_find_baseline_record(self):
+        release_flags = dict(cflags='-O2', define_macros=None)
+        with tempfile.TemporaryDirectory() as tools_path:
+            conn = open_perf_history(tools_path)
+            with conn:
+                for variant, flags, median in [('release', release_flags, 1.0),
+                                               ('release', dict(release_flags, cflags='-O3'), 2.0),
+                                               ('debug', release_flags, 3.0)]:
+                    conn.execute('INSERT INTO perf_records (created_at, kind, target, variant, flags, machine_id, '
+                                 'stats, samples) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                 ('2024-01-01T00:00:00', 'bench', 'mod.pyx@f', variant, json.dumps(flags),
+                                  machine_fingerprint()['id'], json.dumps(dict(median=median)), json.dumps([[median]])))
+            conn.close()
+
+            def find(**kwargs):
+                record = find_baseline_record(tools_path, tools_path, 'bench', 'mod.pyx@f', 'last', **kwargs)
+                return record and record['stats']['median']
+
+            self.assertEqual(3.0, find())
+            self.assertEqual(1.0, find(variant='release', flags=dict(define_macros=None, cflags='-O2')))
+            self.assertEqual(2.0, find(variant='release'))
+            # Records of other builds are never used as the baseline
+            self.assertIsNone(find(variant='release', flags=dict(release_flags, cflags='-O0')))
+            self.assertIsNone(find(variant='debug-trace-only'))
+
+    def test_find_baseline_record_any_machine(self):
+        machine = machine_fingerprint()
+        with tempfile.TemporaryDirectory() as tools_path:
+            conn = open_perf_history(tools_path)
+            with conn:
+                for other, instructions in [(dict(machine, node='ci-runner', id='other'), 1000),
+                                            (dict(machine, node='ci-runner', python='2.7.18', id='py27'), 2000),
+                                            (dict(machine, node='ci-runner', machine='aarch64', id='arm'), 3000)]:
+                    conn.execute('INSERT INTO perf_records (created_at, kind, target, machine_id, machine, stats) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 ('2024-01-01T00:00:00', 'callgrind', 'mod.pyx@f()', other['id'], json.dumps(other),
+                                  json.dumps(dict(instructions=instructions))))
+            conn.close()
+
+            def find(**kwargs):
+                record = find_baseline_record(tools_path, tools_path, 'callgrind', 'mod.pyx@f()', 'last', **kwargs)
+                return record and record['stats']['instructions']
+
+            self.assertIsNone(find())
+            # Other machine with the same Python version and architecture
+            self.assertEqual(1000, find(any_machine=True))
+
+    def test_split_call_target(self):
+        self.assertEqual(('pkg/mod.pyx@main', '(1, n=[1, 2])'), split_call_target('pkg/mod.pyx@main(1, n=[1, 2])'))
+        self.assertRaises(ValueError, split_call_target, 'pkg/mod.pyx@main')
+        self.assertRaises(ValueError, split_call_target, 'pkg.mod(1)')
+
+    def test_check_method_args_variables(self):
+        self.assertEqual(((1000,), {'k': 500}), check_method_args('(n, k=n // 2)', {'n': 1000}))
+        self.assertRaises(ValueError, check_method_args, '(n)')
+
+    def test_parse_sweep(self):
+        self.assertEqual(('n', [1000, 10000, 100000]), parse_sweep('n=1e3:1e5:log10'))
+        self.assertEqual(('size', [16, 32, 64]), parse_sweep('size=16:64:log2'))
+        self.assertEqual(('n', [10, 15, 20]), parse_sweep('n=10:20:5'))
+        self.assertEqual(('x', [0.5, 1.0, 1.5]), parse_sweep('x=0.5:1.5:0.5'))
+        self.assertRaises(ValueError, parse_sweep, 'n=1e3:1e5')
+        self.assertRaises(ValueError, parse_sweep, 'n=0:1e5:log10')
+
+    def test_fit_complexity(self):
+        ns = [1000, 10000, 100000, 1000000]
+        self.assertEqual('O(n)', fit_complexity(ns, [1e-6 + 2e-9 * n for n in ns])['best'])
+        self.assertEqual('O(n log n)', fit_complexity(ns, [1e-9 * n * math.log(n) for n in ns])['best'])
+        fit = fit_complexity(ns, [1e-12 * n ** 2 for n in ns])
+        self.assertEqual('O(n^2)', fit['best'])
+        self.assertAlmostEqual(2.0, fit['exponent'])
+        self.assertEqual('O(1)', fit_complexity(ns, [1e-6, 1.01e-6, 0.99e-6, 1e-6])['best'])
+
+    def test_format_time(self):
+        self.assertEqual('1.500s', format_time(1.5))
+        self.assertEqual('2.000ms', format_time(0.002))
+        self.assertEqual('15.0ns', format_time(1.5e-8))
+
+
+if __name__ == '__main__':
+    unittest.main()
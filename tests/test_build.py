@@ -1,5 +1,6 @@
 import unittest
 from cython_dev_tools.building import build
+from cython_dev_tools.building.build import is_traced_module, get_module_name
 
 class BuildTestCase(unittest.TestCase):
     def test_build(self):
@@ -8,6 +9,17 @@ class BuildTestCase(unittest.TestCase):
               is_debug=True,
               annotate=True)
 
+    def test_is_traced_module(self):
+        self.assertEqual('pkg.sub.mod', get_module_name('pkg/sub/mod.pyx'))
+        self.assertEqual('pkg.sub.mod', get_module_name('./pkg/sub/mod.pyx'))
+
+        self.assertEqual(True, is_traced_module('pkg.sub.mod', None))
+        self.assertEqual(True, is_traced_module('pkg.sub.mod', []))
+        self.assertEqual(True, is_traced_module('pkg.sub.mod', ['pkg.sub']))
+        self.assertEqual(True, is_traced_module('pkg.sub.mod', ['other', 'pkg.sub.mod']))
+        self.assertEqual(False, is_traced_module('pkg.sub2.mod', ['pkg.sub']))
+        self.assertEqual(False, is_traced_module('pkg.submod', ['pkg.sub']))
+
 
 if __name__ == '__main__':
     unittest.main()
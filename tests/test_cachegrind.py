@@ -0,0 +1,118 @@
+import unittest
+import io
+import os
+from cython_dev_tools.debugger.callgrind import parse_callgrind
+from cython_dev_tools.debugger.cachegrind import cachegrind, cachegrind_pyx_costs, cachegrind_profile, metric_value, \
+    miss_rate
+from cython_dev_tools.testing.profile_data import load_profile
+from tests.func_mapper_fixture import make_func_mapper, INIT_PROJECT_ROOT, HAS_INIT_PROJECT, HAS_VALGRIND
+
+CACHEGRIND_OUT = """\
+desc: I1 cache:         32768 B, 64 B, 8-way associative
+desc: D1 cache:         32768 B, 64 B, 8-way associative
+desc: LL cache:         8388608 B, 64 B, 16-way associative
+cmd: python -c from cython_dev_tools.debugger.valgrind import run_valgrind_worker; run_valgrind_worker({'calls': 1})
+events: Ir I1mr ILmr Dr D1mr DLmr Dw D1mw DLmw Bc Bcm Bi Bim
+fl=/prj/.cython_dev_tools/src/pkg/mod.c
+fn=__pyx_pf_3pkg_3mod_2approx_pi2
+2130 1000 0 0 400 100 10 100 0 0 200 20 0 0
+2135 500 0 0 100 0 0 0 0 0 100 1
+2140 10 0 0 5 1 0 0 0 0
+fn=__pyx_f_3pkg_3mod_recip_square
+1820 300 0 0 50 25 5 0 0 0 50 5 0 0
+fl=/usr/include/python3.11/object.h
+fn=__pyx_pf_3pkg_3mod_2approx_pi2
+500 20 0 0 10 2 0 0 0 0
+fl=???
+fn=_PyEval_EvalFrameDefault
+0 90000 10 5 30000 300 30 10000 100 10 9000 900 100 10
+summary: 91830 10 5 30565 428 45 10100 100 10 9350 926 100 10
+"""
+
+
+class CachegrindTestCase(unittest.TestCase):
+    def test_cachegrind_pyx_costs(self):
+        data = parse_callgrind(io.StringIO(CACHEGRIND_OUT))
+        self.assertEqual(91830, data['totals'][0])
+
+        lines, functions = cachegrind_pyx_costs(data, make_func_mapper())
+        self.assertEqual({'pkg/mod.pyx:10', 'pkg/mod.pyx:12', 'pkg/mod.pyx:8', 'pkg/mod.pyx:3'}, set(lines))
+        self.assertEqual(dict(Ir=1000, I1mr=0, ILmr=0, Dr=400, D1mr=100, DLmr=10, Dw=100, D1mw=0, DLmw=0,
+                              Bc=200, Bcm=20, Bi=0, Bim=0), lines['pkg/mod.pyx:10']['events'])
+        # Unmapped C line and inlined header code go to the function definition line
+        self.assertEqual(30, lines['pkg/mod.pyx:8']['events']['Ir'])
+        self.assertEqual(3, lines['pkg/mod.pyx:8']['events']['D1mr'])
+        # Trailing zero costs may be omitted
+        self.assertEqual(0, lines['pkg/mod.pyx:12']['events']['Bim'])
+
+        self.assertEqual({'pkg.mod.approx_pi2', 'pkg.mod.recip_square'}, set(functions))
+        self.assertEqual(('pkg/mod.pyx', 8), (functions['pkg.mod.approx_pi2']['file'],
+                                              functions['pkg.mod.approx_pi2']['line']))
+        self.assertEqual(1530, functions['pkg.mod.approx_pi2']['events']['Ir'])
+
+    def test_cachegrind_out_file(self):
+        # Uncompressed `fl=` / `fn=` names, repeated functions of inlined headers, `summary:` instead of `totals:`
+        with open(os.path.join(os.path.dirname(__file__), 'test_inputs', 'cachegrind.out.4321')) as fh:
+            data = parse_callgrind(fh)
+        self.assertEqual(['Ir', 'I1mr', 'ILmr', 'Dr', 'D1mr', 'DLmr', 'Dw', 'D1mw', 'DLmw', 'Bc', 'Bcm', 'Bi', 'Bim'],
+                         data['events'])
+        self.assertEqual(3168570, data['totals'][0])
+        self.assertEqual(sum(sum(c[0] for c in f['self'].values()) for f in data['functions'].values()),
+                         data['totals'][0])
+        self.assertEqual({'/prj/.cython_dev_tools/profile/pkg/mod.c', '/usr/include/python3.11/object.h'},
+                         set(file for file, _ in data['functions'][(None, '__pyx_pf_3pkg_3mod_2approx_pi2')]['self']))
+
+        lines, functions = cachegrind_pyx_costs(data, make_func_mapper())
+        self.assertEqual({'pkg/mod.pyx:1', 'pkg/mod.pyx:3', 'pkg/mod.pyx:8', 'pkg/mod.pyx:10', 'pkg/mod.pyx:12'},
+                         set(lines))
+        self.assertEqual(8000, lines['pkg/mod.pyx:3']['events']['Ir'])
+        self.assertEqual(dict(Ir=7000, I1mr=0, ILmr=0, Dr=2000, D1mr=125, DLmr=0, Dw=1000, D1mw=16, DLmw=0,
+                              Bc=1000, Bcm=498, Bi=0, Bim=0), lines['pkg/mod.pyx:12']['events'])
+        # Wrapper, implementation and inlined header code of approx_pi2()
+        self.assertEqual(60, lines['pkg/mod.pyx:8']['events']['Ir'])
+        self.assertEqual({'pkg.mod.approx_pi2': 12060, 'pkg.mod.recip_square': 10000},
+                         {name: f['events']['Ir'] for name, f in functions.items()})
+
+        profile = cachegrind_profile(lines, functions, 'D1', 'pkg/mod.pyx@approx_pi2(1000)')
+        self.assertEqual(209, profile['total'])
+        self.assertEqual(141, profile['lines']['pkg/mod.pyx:12']['self'])
+
+    def test_metrics(self):
+        events = dict(Dr=400, D1mr=100, Dw=100, D1mw=25, DLmr=10, Bc=200, Bcm=20, Bi=0, Bim=0)
+        self.assertEqual(125, metric_value(events, 'D1'))
+        self.assertEqual(10, metric_value(events, 'LL'))
+        self.assertEqual(20, metric_value(events, 'mispredicts'))
+        self.assertEqual('25.0%', miss_rate(events, 'D1'))
+        self.assertEqual('10.0%', miss_rate(events, 'mispredicts'))
+        self.assertEqual('-', miss_rate(dict(Ir=10), 'LL'))
+
+    def test_cachegrind_profile(self):
+        lines, functions = cachegrind_pyx_costs(parse_callgrind(io.StringIO(CACHEGRIND_OUT)), make_func_mapper())
+        profile = cachegrind_profile(lines, functions, 'D1', 'pkg/mod.pyx@approx_pi2()')
+
+        self.assertEqual('cachegrind', profile['kind'])
+        self.assertEqual('D1 misses', profile['unit'])
+        self.assertEqual({'pkg.mod.approx_pi2': 103, 'pkg.mod.recip_square': 25}, profile['stacks'])
+        self.assertEqual(128, profile['total'])
+        self.assertEqual(dict(self=25, total=25, file='pkg/mod.pyx', line=1),
+                         profile['functions']['pkg.mod.recip_square'])
+        # Lines without misses are not in the profile
+        self.assertEqual({'pkg/mod.pyx:10', 'pkg/mod.pyx:8', 'pkg/mod.pyx:3'}, set(profile['lines']))
+        self.assertEqual(100, profile['lines']['pkg/mod.pyx:10']['self'])
+        self.assertEqual(1000, profile['lines']['pkg/mod.pyx:10']['events']['Ir'])
+
+        profile = cachegrind_profile(lines, functions, 'mispredicts', 'pkg/mod.pyx@approx_pi2()')
+        self.assertEqual({'pkg/mod.pyx:10': 20, 'pkg/mod.pyx:12': 1, 'pkg/mod.pyx:3': 5},
+                         {k: l['self'] for k, l in profile['lines'].items()})
+
+
+@unittest.skipUnless(HAS_VALGRIND and HAS_INIT_PROJECT, 'valgrind or tests/init_project build is missing')
+class CachegrindIntegrationTestCase(unittest.TestCase):
+    def test_cachegrind(self):
+        profile = load_profile(cachegrind('cy_tools_samples/profiler/cy_module.pyx@approx_pi2(1000)',
+                                          project_root=INIT_PROJECT_ROOT, metric='Ir'))
+        self.assertEqual('cachegrind', profile['kind'])
+        self.assertEqual(('cy_tools_samples/profiler/cy_module.pyx', 8),
+                         (profile['functions']['cy_tools_samples.profiler.cy_module.approx_pi2']['file'],
+                          profile['functions']['cy_tools_samples.profiler.cy_module.approx_pi2']['line']))
+        self.assertGreater(profile['lines']['cy_tools_samples/profiler/cy_module.pyx:12']['self'], 0)
@@ -0,0 +1,96 @@
+import unittest
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from cython_dev_tools.testing.call_profile import cprofile_stacks, code_frame, cprofile_profile, \
+    python_qualified_names
+from cython_dev_tools.testing.flamegraph import stacks_tree, render_flamegraph_svg, render_flamegraph_html, \
+    export_speedscope, write_profile_exports
+from cython_dev_tools.testing.profile_data import make_profile
+
+MAIN = ('pkg/mod.pyx', 8, 'main')
+HELPER = ('pkg/mod.pyx', 1, 'helper')
+SQRT = ('~', 0, '<built-in method math.sqrt>')
+DISABLE = ('~', 0, "<method 'disable' of '_lsprof.Profiler' objects>")
+
+# func: (cc, nc, tt, ct, callers{caller: (cc, nc, tt, ct)}), `helper` is called by `main` and directly by the root
+STATS = {
+    MAIN: (1, 1, 0.5, 1.0, {}),
+    HELPER: (3, 3, 0.4, 0.6, {MAIN: (2, 2, 0.2, 0.3), ('/usr/lib/python3.11/runpy.py', 1, 'run'): (1, 1, 0.2, 0.3)}),
+    SQRT: (3, 3, 0.2, 0.2, {HELPER: (3, 3, 0.2, 0.2)}),
+    DISABLE: (1, 1, 0.0, 0.0, {}),
+}
+
+
+class CallProfileTestCase(unittest.TestCase):
+    def test_code_frame(self):
+        names = {('pkg.mod', 1, 'helper'): 'pkg.mod.Cls.helper'}
+        self.assertEqual(dict(name='pkg.mod.Cls.helper', file='pkg/mod.pyx', line=1),
+                         code_frame(HELPER, '/prj', names))
+        self.assertEqual(dict(name='pkg.mod.main', file='pkg/mod.pyx', line=8),
+                         code_frame(('/prj/pkg/mod.pyx', 8, 'main'), '/prj', names))
+        self.assertEqual(dict(name='math.sqrt'), code_frame(SQRT, '/prj', names))
+        self.assertEqual(dict(name='pkg.mod.main'), code_frame(('~', 0, '<pkg.mod.main>'), '/prj', names))
+        self.assertEqual(dict(name='run (runpy.py:1)'),
+                         code_frame(('/usr/lib/python3.11/runpy.py', 1, 'run'), '/prj', names))
+
+    def test_python_qualified_names(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fn = os.path.join(tmp_dir, 'mod.py')
+            with open(fn, 'w') as fh:
+                fh.write('def main():\n'
+                         '    def inner():\n'
+                         '        pass\n'
+                         'class SQ:\n'
+                         '    @staticmethod\n'
+                         '    def square(x):\n'
+                         '        return x * x\n')
+            self.assertEqual({1: 'main', 2: 'main.<locals>.inner', 5: 'SQ.square'}, python_qualified_names(fn))
+            self.assertEqual(dict(name='mod.SQ.square', file='mod.py', line=5),
+                             code_frame((fn, 5, 'square'), tmp_dir, {}))
+
+    def test_cprofile_stacks(self):
+        labels = {MAIN: 'main', HELPER: 'helper', SQRT: 'sqrt'}
+        stacks = cprofile_stacks(STATS, labels)
+        # helper is a root too (its caller is not profiled), time is split by edges: 0.3 + 0.3
+        self.assertEqual({'main': 500000,
+                          'main;helper': 200000,
+                          'main;helper;sqrt': 100000,
+                          'helper': 200000,
+                          'helper;sqrt': 100000,
+                          }, stacks)
+
+    def test_cprofile_profile(self):
+        profile = cprofile_profile(STATS, '/prj', {}, 'pkg/mod.pyx@main()')
+        self.assertEqual('us', profile['unit'])
+        self.assertNotIn(DISABLE[2], profile['functions'])
+        self.assertEqual(dict(self=500000, total=800000, file='pkg/mod.pyx', line=8), profile['functions']['pkg.mod.main'])
+        self.assertEqual(200000, profile['functions']['math.sqrt']['total'])
+
+    def test_flamegraph(self):
+        profile = make_profile('perf', 'pkg/mod.pyx@main()', 'samples', {'main;helper': 3, 'main': 1, 'other': 1},
+                               frames_info={'main': dict(file='pkg/mod.pyx', line=8)})
+        tree = stacks_tree(profile['stacks'])
+        self.assertEqual(5, tree['value'])
+        self.assertEqual(4, tree['children']['main']['value'])
+        self.assertEqual(3, tree['children']['main']['children']['helper']['value'])
+
+        svg = ET.fromstring(render_flamegraph_svg(profile))
+        titles = [t.text for t in svg.iter('{http://www.w3.org/2000/svg}title')]
+        self.assertEqual(['main (4 samples, 80.00%)', 'helper (3 samples, 60.00%)', 'other (1 samples, 20.00%)'], titles)
+        self.assertIn('zoom(g)', render_flamegraph_html(profile))
+
+        speedscope = export_speedscope(profile)
+        frames = speedscope['shared']['frames']
+        self.assertEqual(dict(name='main', file='pkg/mod.pyx', line=8), frames[0])
+        samples = [[frames[i]['name'] for i in s] for s in speedscope['profiles'][0]['samples']]
+        self.assertEqual([['main', 'helper'], ['main'], ['other']], samples)
+        self.assertEqual([3, 1, 1], speedscope['profiles'][0]['weights'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = write_profile_exports(profile, os.path.join(tmp_dir, 'p'))
+            self.assertTrue(all(os.path.exists(fn) for fn in paths.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
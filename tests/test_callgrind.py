@@ -0,0 +1,167 @@
+import unittest
+import io
+import os
+import json
+import tempfile
+from cython_dev_tools.debugger.callgrind import callgrind, parse_callgrind, callgrind_pyx_graph, callgrind_profile, \
+    write_callgrind, entry_symbol, compare_instructions
+from tests.func_mapper_fixture import make_func_mapper, INIT_PROJECT_ROOT, HAS_INIT_PROJECT, HAS_VALGRIND
+
+CALLGRIND_OUT = """\
+# callgrind format
+version: 1
+creator: callgrind-3.19.0
+pid: 1234
+cmd:  python -c from cython_dev_tools.debugger.valgrind import run_valgrind_worker; run_valgrind_worker({'calls': 1})
+part: 1
+
+desc: I1 cache:
+positions: line
+events: Ir
+summary: 960
+
+ob=(1) /prj/pkg/mod.cpython-311-x86_64-linux-gnu.so
+fl=(1) /prj/.cython_dev_tools/src/pkg/mod.c
+fn=(1) __pyx_pw_3pkg_3mod_3approx_pi2
+2050 10
+cfn=(2) __pyx_pf_3pkg_3mod_2approx_pi2
+calls=1 2100
++2 950
+
+fn=(2)
+2130 100
++5 50
+cfn=(3) __pyx_f_3pkg_3mod_recip_square
+calls=100 1800
+* 600
+cob=(2) /usr/lib/libm.so.6
+cfi=(2) ???
+cfn=(4) sqrt
+calls=100 0
+2135 200
+
+fn=(3)
+1820 600
+
+ob=(2)
+fl=(2)
+fn=(4)
+0 200
+
+totals: 960
+"""
+
+
+class CallgrindTestCase(unittest.TestCase):
+    def test_parse_callgrind(self):
+        data = parse_callgrind(io.StringIO(CALLGRIND_OUT))
+        self.assertEqual(['Ir'], data['events'])
+        self.assertEqual([960], data['totals'])
+
+        so = '/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so'
+        c_fn = '/prj/.cython_dev_tools/src/pkg/mod.c'
+        pf = data['functions'][(so, '__pyx_pf_3pkg_3mod_2approx_pi2')]
+        self.assertEqual(c_fn, pf['file'])
+        self.assertEqual({(c_fn, 2130): [100], (c_fn, 2135): [50]}, pf['self'])
+        self.assertEqual({((so, '__pyx_f_3pkg_3mod_recip_square'), c_fn, 2135): dict(calls=100, costs=[600]),
+                          (('/usr/lib/libm.so.6', 'sqrt'), c_fn, 2135): dict(calls=100, costs=[200])},
+                         pf['calls'])
+
+        pw = data['functions'][(so, '__pyx_pw_3pkg_3mod_3approx_pi2')]
+        self.assertEqual({((so, '__pyx_pf_3pkg_3mod_2approx_pi2'), c_fn, 2052): dict(calls=1, costs=[950])},
+                         pw['calls'])
+        sqrt = data['functions'][('/usr/lib/libm.so.6', 'sqrt')]
+        self.assertEqual('???', sqrt['file'])
+        self.assertEqual({('???', 0): [200]}, sqrt['self'])
+
+    def test_callgrind_pyx_graph(self):
+        graph = callgrind_pyx_graph(parse_callgrind(io.StringIO(CALLGRIND_OUT)), make_func_mapper())
+        self.assertEqual({'pkg.mod.approx_pi2', 'pkg.mod.recip_square', 'sqrt'}, set(graph))
+
+        # Python wrapper and implementation are merged, the wrapper call is dropped
+        node = graph['pkg.mod.approx_pi2']
+        self.assertTrue(node['is_pyx'])
+        self.assertEqual(('pkg/mod.pyx', 8), (node['file'], node['line']))
+        self.assertEqual({('pkg/mod.pyx', 8): [10], ('pkg/mod.pyx', 10): [100], ('pkg/mod.pyx', 12): [50]},
+                         node['self'])
+        self.assertEqual({('pkg.mod.recip_square', 'pkg/mod.pyx', 12): dict(calls=100, costs=[600]),
+                          ('sqrt', 'pkg/mod.pyx', 12): dict(calls=100, costs=[200])},
+                         node['calls'])
+        self.assertEqual({('pkg/mod.pyx', 3): [600]}, graph['pkg.mod.recip_square']['self'])
+        self.assertFalse(graph['sqrt']['is_pyx'])
+
+    def test_callgrind_profile(self):
+        graph = callgrind_pyx_graph(parse_callgrind(io.StringIO(CALLGRIND_OUT)), make_func_mapper())
+        profile = callgrind_profile(graph, ['Ir'], 'pkg.mod.approx_pi2', 'pkg/mod.pyx@approx_pi2()')
+
+        self.assertEqual('callgrind', profile['kind'])
+        self.assertEqual('Ir', profile['unit'])
+        self.assertEqual(960, profile['total'])
+        self.assertEqual({'pkg.mod.approx_pi2': 160,
+                          'pkg.mod.approx_pi2;pkg.mod.recip_square': 600,
+                          'pkg.mod.approx_pi2;sqrt': 200}, profile['stacks'])
+        self.assertEqual(dict(self=160, total=960, file='pkg/mod.pyx', line=8),
+                         profile['functions']['pkg.mod.approx_pi2'])
+        self.assertNotIn('file', profile['functions']['sqrt'])
+        self.assertEqual({'pkg/mod.pyx:8': dict(self=10, total=10),
+                          'pkg/mod.pyx:10': dict(self=100, total=100),
+                          'pkg/mod.pyx:12': dict(self=50, total=850),
+                          'pkg/mod.pyx:3': dict(self=600, total=600)}, profile['lines'])
+
+    def test_write_callgrind(self):
+        graph = callgrind_pyx_graph(parse_callgrind(io.StringIO(CALLGRIND_OUT)), make_func_mapper())
+        fh = io.StringIO()
+        write_callgrind(fh, graph, ['Ir'], '/prj', cmd='pkg/mod.pyx@approx_pi2()')
+
+        data = parse_callgrind(io.StringIO(fh.getvalue()))
+        self.assertEqual([960], data['totals'])
+        so = '/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so'
+        func = data['functions'][(so, 'pkg.mod.approx_pi2')]
+        self.assertEqual('/prj/pkg/mod.pyx', func['file'])
+        self.assertEqual({('/prj/pkg/mod.pyx', 8): [10], ('/prj/pkg/mod.pyx', 10): [100],
+                          ('/prj/pkg/mod.pyx', 12): [50]}, func['self'])
+        self.assertEqual(dict(calls=100, costs=[600]),
+                         func['calls'][((so, 'pkg.mod.recip_square'), '/prj/pkg/mod.pyx', 12)])
+        self.assertEqual({('???', 0): [200]}, data['functions'][('/usr/lib/libm.so.6', 'sqrt')]['self'])
+
+    def test_entry_symbol(self):
+        func_mapper = make_func_mapper()
+        self.assertEqual('__pyx_pw_3pkg_3mod_3approx_pi2', entry_symbol(func_mapper, 'pkg.mod', 'approx_pi2'))
+        self.assertRaises(ValueError, entry_symbol, func_mapper, 'pkg.mod', 'unknown')
+        self.assertRaises(ValueError, entry_symbol, func_mapper, 'pkg.other', 'approx_pi2')
+
+    def test_compare_instructions(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            baseline_fn = os.path.join(tmp_dir, 'baseline.json')
+            with open(baseline_fn, 'w') as fh:
+                json.dump(dict(kind='callgrind', total=20000, calls=2), fh)
+
+            comparison = compare_instructions(tmp_dir, tmp_dir, 'pkg/mod.pyx@approx_pi2()', 10050, baseline_fn, 1)
+            self.assertAlmostEqual(0.005, comparison['change'])
+            self.assertFalse(comparison['is_regression'])
+
+            comparison = compare_instructions(tmp_dir, tmp_dir, 'pkg/mod.pyx@approx_pi2()', 10200, baseline_fn, 1)
+            self.assertTrue(comparison['is_regression'])
+
+            with open(baseline_fn, 'w') as fh:
+                json.dump(dict(kind='perf', total=20000), fh)
+            self.assertRaises(ValueError, compare_instructions, tmp_dir, tmp_dir, 'pkg/mod.pyx@approx_pi2()',
+                              10050, baseline_fn, 1)
+
+
+@unittest.skipUnless(HAS_VALGRIND and HAS_INIT_PROJECT, 'valgrind or tests/init_project build is missing')
+class CallgrindIntegrationTestCase(unittest.TestCase):
+    def test_callgrind(self):
+        target = 'cy_tools_samples/profiler/cy_module.pyx@approx_pi2(1000)'
+        result = callgrind(target, project_root=INIT_PROJECT_ROOT)
+        self.assertGreater(result['instructions'], 0)
+        with open(result['profile']) as fh:
+            profile = json.load(fh)
+        approx_pi2 = profile['functions']['cy_tools_samples.profiler.cy_module.approx_pi2']
+        self.assertEqual(('cy_tools_samples/profiler/cy_module.pyx', 8), (approx_pi2['file'], approx_pi2['line']))
+        self.assertEqual(profile['total'], approx_pi2['total'])
+        self.assertIn('cy_tools_samples/profiler/cy_module.pyx:12', profile['lines'])
+
+        # Instruction counts per call are deterministic
+        result = callgrind(target, project_root=INIT_PROJECT_ROOT, calls=2, compare=result['profile'])
+        self.assertFalse(result['comparison']['is_regression'])
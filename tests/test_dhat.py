@@ -0,0 +1,76 @@
+import unittest
+from cython_dev_tools.debugger.dhat import dhat, dhat_report, dhat_notes, sorted_sites
+from cython_dev_tools.debugger.valgrind import OTHER_SITE
+from tests.func_mapper_fixture import make_func_mapper, INIT_PROJECT_ROOT, HAS_INIT_PROJECT, HAS_VALGRIND
+
+DHAT_OUT = {
+    'dhatFileVersion': 2,
+    'mode': 'heap',
+    'verb': 'Allocated',
+    'bklt': True,
+    'bkacc': True,
+    'tu': 'instrs',
+    'Mtu': 'instr',
+    'cmd': "python -c from cython_dev_tools.debugger.valgrind import run_valgrind_worker; run_valgrind_worker({})",
+    'te': 100000,
+    'tg': 50000,
+    'pps': [
+        # Boxed results, allocated in `recip_square` called by `approx_pi2`
+        dict(tb=3200, tbk=100, tl=20000, mb=32, mbk=1, gb=0, gbk=0, eb=0, ebk=0, rb=800, wb=1600, fs=[1, 2, 3, 4]),
+        dict(tb=1600, tbk=50, tl=10000, mb=32, mbk=1, gb=0, gbk=0, eb=0, ebk=0, rb=400, wb=800, fs=[1, 5, 3]),
+        # Long-lived buffer, rarely accessed
+        dict(tb=8000, tbk=1, tl=90000, mb=8000, mbk=1, gb=8000, gbk=1, eb=0, ebk=0, rb=100, wb=0, fs=[1, 4, 6]),
+        # Interpreter
+        dict(tb=500, tbk=5, tl=100, mb=500, mbk=5, gb=0, gbk=0, eb=0, ebk=0, rb=1000, wb=1000, fs=[1, 6]),
+    ],
+    'ftbl': [
+        '[root]',
+        '0x483B7F3: malloc (in /usr/libexec/valgrind/vgpreload_dhat-amd64-linux.so)',
+        '0x4F1A20: PyFloat_FromDouble (in /usr/lib/libpython3.11.so)',
+        '0x5A5: __pyx_f_3pkg_3mod_recip_square (mod.c:1820)',
+        '0x5B0: __pyx_pf_3pkg_3mod_2approx_pi2 (mod.c:2135)',
+        '0x5C0: __pyx_f_3pkg_3mod_recip_square (mod.c:1822)',
+        '0x4F1: _PyEval_EvalFrameDefault (in /usr/lib/libpython3.11.so)',
+    ],
+}
+
+
+class DhatTestCase(unittest.TestCase):
+    def test_dhat_report(self):
+        report = dhat_report(DHAT_OUT, make_func_mapper(), 'pkg/mod.pyx@approx_pi2()')
+        self.assertEqual('instrs', report['time_unit'])
+        self.assertEqual(dict(blocks=156, bytes=13300), report['totals'])
+        self.assertEqual({'pkg/mod.pyx:3', 'pkg/mod.pyx:12', OTHER_SITE}, set(report['sites']))
+
+        # Program points with the same innermost pyx line are merged
+        site = report['sites']['pkg/mod.pyx:3']
+        self.assertEqual(dict(name='pkg.mod.recip_square', file='pkg/mod.pyx', line=3, blocks=150, bytes=4800,
+                              max_bytes=64, lifetime=30000, reads=1200, writes=2400, avg_size=32, avg_lifetime=200,
+                              access_ratio=0.75), site)
+        self.assertEqual(8000, report['sites']['pkg/mod.pyx:12']['bytes'])
+        self.assertIsNone(report['sites'][OTHER_SITE]['name'])
+
+        self.assertRaises(ValueError, dhat_report, dict(DHAT_OUT, mode='copy'), make_func_mapper(), '')
+
+    def test_sorted_sites(self):
+        report = dhat_report(DHAT_OUT, make_func_mapper(), 'pkg/mod.pyx@approx_pi2()')
+        self.assertEqual(['pkg/mod.pyx:3', 'pkg/mod.pyx:12', OTHER_SITE], sorted_sites(report, 'blocks'))
+        self.assertEqual(['pkg/mod.pyx:12', 'pkg/mod.pyx:3', OTHER_SITE], sorted_sites(report, 'bytes'))
+        self.assertEqual(['pkg/mod.pyx:3', 'pkg/mod.pyx:12', OTHER_SITE], sorted_sites(report, 'lifetime'))
+        self.assertEqual(['pkg/mod.pyx:12', 'pkg/mod.pyx:3', OTHER_SITE], sorted_sites(report, 'access'))
+
+    def test_dhat_notes(self):
+        report = dhat_report(DHAT_OUT, make_func_mapper(), 'pkg/mod.pyx@approx_pi2()')
+        self.assertEqual('short-lived, low access', dhat_notes(report['sites']['pkg/mod.pyx:3']))
+        self.assertEqual('low access', dhat_notes(report['sites']['pkg/mod.pyx:12']))
+        self.assertEqual('short-lived', dhat_notes(report['sites'][OTHER_SITE]))
+
+
+@unittest.skipUnless(HAS_VALGRIND and HAS_INIT_PROJECT, 'valgrind or tests/init_project build is missing')
+class DhatIntegrationTestCase(unittest.TestCase):
+    def test_dhat(self):
+        # sum() mallocs 10000 ints at line 15 on each call
+        report = dhat('cy_tools_samples/debugging/memory_leaks.pyx@main', project_root=INIT_PROJECT_ROOT, calls=3)
+        site = report['sites']['cy_tools_samples/debugging/memory_leaks.pyx:15']
+        self.assertGreaterEqual(site['blocks'], 3)
+        self.assertGreaterEqual(site['bytes'], 3 * 10000 * 4)
@@ -0,0 +1,52 @@
+import unittest
+from cython_dev_tools.testing.experiment import parse_directive_values, directive_combinations, speedup_ci
+from cython_dev_tools.testing.stats import bootstrap_ratio_ci
+from cython_dev_tools.building.variants import variant_name
+
+
+class ExperimentTestCase(unittest.TestCase):
+    def test_parse_directive_values(self):
+        self.assertEqual(('boundscheck', [True, False]), parse_directive_values('boundscheck=True,False'))
+        self.assertEqual(('language_level', [3, '3str']), parse_directive_values('language_level=3, 3str'))
+        self.assertRaises(ValueError, parse_directive_values, 'boundscheck')
+
+    def test_directive_combinations(self):
+        combs = directive_combinations(['boundscheck=True,False', 'wraparound=True,False'])
+        self.assertEqual(4, len(combs))
+        self.assertEqual(dict(boundscheck=True, wraparound=True), combs[0])
+        self.assertEqual(dict(boundscheck=False, wraparound=False), combs[-1])
+
+    def test_variant_name(self):
+        self.assertEqual(variant_name('exp', dict(a=1, b=2)), variant_name('exp', dict(b=2, a=1)))
+        self.assertNotEqual(variant_name('exp', dict(a=1)), variant_name('exp', dict(a=2)))
+        self.assertTrue(variant_name('exp', dict(a=1)).startswith('exp_'))
+
+    def test_bootstrap_ratio_ci(self):
+        baseline = [2.0, 2.1, 1.9, 2.05, 1.95] * 4
+        faster = [1.0, 1.05, 0.95, 1.02, 0.98] * 4
+        ratio, lo, hi = bootstrap_ratio_ci(baseline, faster)
+        self.assertAlmostEqual(2.0, ratio, places=6)
+        self.assertTrue(1.8 < lo <= ratio <= hi < 2.2)
+
+        ratio, lo, hi = bootstrap_ratio_ci(baseline, baseline)
+        self.assertEqual(1.0, ratio)
+        self.assertTrue(lo <= 1.0 <= hi)
+
+    def test_speedup_ci(self):
+        # Process means vary more than samples of the same process
+        baseline = [[m + d for d in (-0.01, 0.0, 0.01, 0.0)] for m in (1.8, 2.2, 1.9, 2.1, 2.0)]
+        faster = [[s / 2 for s in g] for g in baseline]
+        ratio, lo, hi = speedup_ci(baseline, faster)
+        self.assertAlmostEqual(2.0, ratio, places=6)
+        self.assertTrue(lo <= ratio <= hi)
+
+        # The interval by per-process means is wider than by pooled samples
+        _, pooled_lo, pooled_hi = bootstrap_ratio_ci([s for g in baseline for s in g], [s for g in faster for s in g])
+        self.assertGreater(hi - lo, pooled_hi - pooled_lo)
+
+        # Single process: samples
+        self.assertEqual(bootstrap_ratio_ci(baseline[0], faster[0]), speedup_ci(baseline[:1], faster[:1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
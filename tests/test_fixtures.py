@@ -0,0 +1,63 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+from cython_dev_tools.common import check_method_args
+from cython_dev_tools.testing.fixtures import fixture_variables
+
+FACTORY_MODULE = '''
+import numpy as np
+N_CALLS = []
+
+def make_array(n, value=1.0):
+    N_CALLS.append(n)
+    return np.full(n, value)
+
+def make_dict(n):
+    return {'n': n}
+'''
+
+
+class FixturesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp_dir, 'cytool_fixtures_mod.py'), 'w') as fh:
+            fh.write(FACTORY_MODULE)
+        sys.path.insert(0, self.tmp_dir)
+
+    def tearDown(self):
+        sys.path.remove(self.tmp_dir)
+        sys.modules.pop('cytool_fixtures_mod', None)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fixture_args(self):
+        variables = fixture_variables(self.tmp_dir, 'cytool_fixtures_mod')
+        args, kwargs = check_method_args('(@fixture:make_array(n, value=2.0), d=@fixture:make_dict(3), n=n)',
+                                         dict(variables, n=5))
+        self.assertIsInstance(args[0], np.memmap)
+        self.assertEqual([2.0] * 5, list(args[0]))
+        self.assertEqual({'d': {'n': 3}, 'n': 5}, kwargs)
+
+        # Cached
+        args, _ = check_method_args('(@fixture:cytool_fixtures_mod.make_array(5, value=2.0),)', variables)
+        self.assertEqual([2.0] * 5, list(args[0]))
+        import cytool_fixtures_mod
+        self.assertEqual([5], cytool_fixtures_mod.N_CALLS)
+
+        # Copy-on-write, the cache is not changed
+        args[0][0] = 100
+        args, _ = check_method_args('(@fixture:make_array(5, value=2.0),)', variables)
+        self.assertEqual(2.0, args[0][0])
+
+        self.assertEqual(2, len(os.listdir(os.path.join(self.tmp_dir, 'fixtures'))))
+
+    def test_fixture_args_errors(self):
+        self.assertRaises(ValueError, check_method_args, '(@fixture:make_array(5),)')
+        self.assertEqual(((None,), {}), check_method_args('(@fixture:make_array(5),)',
+                                                          fixture_variables(self.tmp_dir, dry_run=True)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import os
+import socket
+import stat
+import sys
+import tempfile
+import time
+from unittest import mock
+from cython_dev_tools.testing.forkserver import warm_socket_path, check_peer, warm_request, stop_warm_server, \
+    _connect, MAX_SOCKET_PATH
+
+WARM_SAMPLE = """\
+import os
+
+def main():
+    with open('warm_result.txt', 'w') as fh:
+        fh.write(f'done {os.getpid()}')
+"""
+
+
+class ForkServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.project_root = os.path.realpath(self.tmp_dir.name)
+        self.cython_dev_tools_path = os.path.join(self.project_root, '.cython_dev_tools')
+        os.makedirs(self.cython_dev_tools_path)
+        with open(os.path.join(self.project_root, 'warm_sample.py'), 'w') as fh:
+            fh.write(WARM_SAMPLE)
+        self.env = os.environ.copy()
+        self.env['PYTHONPATH'] = self.project_root
+
+    def tearDown(self):
+        stop_warm_server(self.project_root)
+        self.tmp_dir.cleanup()
+
+    def warm_run(self):
+        # Client terminal descriptors are passed to the forked child
+        with open(os.devnull, 'r') as stdin, open(os.devnull, 'w') as stdout, \
+                mock.patch.object(sys, 'stdin', stdin), mock.patch.object(sys, 'stdout', stdout), \
+                mock.patch.object(sys, 'stderr', stdout), mock.patch('os.getcwd', return_value=self.project_root):
+            return warm_request(self.project_root, self.cython_dev_tools_path, 'run', ['warm_sample', 'main'],
+                                self.env)
+
+    def read_result(self):
+        with open(os.path.join(self.project_root, 'warm_result.txt')) as fh:
+            return fh.read()
+
+    def test_warm_socket_path(self):
+        sock_path = warm_socket_path(self.project_root)
+        self.assertEqual(os.path.join(self.cython_dev_tools_path, 'warm', 'warm.sock'), sock_path)
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(os.path.dirname(sock_path)).st_mode))
+
+        # Too long for unix socket, falls back to the private per-user runtime dir
+        long_root = os.path.join(self.project_root, 'p' * MAX_SOCKET_PATH)
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.project_root}):
+            sock_path = warm_socket_path(long_root)
+        self.assertEqual(os.path.join(self.project_root, f'cytool-warm-{os.getuid()}'), os.path.dirname(sock_path))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(os.path.dirname(sock_path)).st_mode))
+
+    def test_check_peer(self):
+        a, b = socket.socketpair(socket.AF_UNIX)
+        with a, b:
+            check_peer(a)
+            check_peer(b)
+
+    def test_warm_request_round_trip(self):
+        self.assertEqual(0, self.warm_run())
+        first_pid = self.read_result()
+        self.assertTrue(first_pid.startswith('done'))
+
+        # The server keeps running, each request is a new fork
+        self.assertIsNotNone(_connect(self.project_root))
+        self.assertEqual(0, self.warm_run())
+        self.assertNotEqual(first_pid, self.read_result())
+
+        self.assertTrue(stop_warm_server(self.project_root))
+        t_start = time.time()
+        while os.path.exists(warm_socket_path(self.project_root)) and time.time() - t_start < 5:
+            time.sleep(0.02)
+        self.assertFalse(os.path.exists(warm_socket_path(self.project_root)))
+        self.assertFalse(stop_warm_server(self.project_root))
+
+    def test_warm_request_stale_socket(self):
+        # Socket file left by a killed server
+        sock_path = warm_socket_path(self.project_root)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(sock_path)
+        sock.close()
+        self.assertTrue(os.path.exists(sock_path))
+        self.assertIsNone(_connect(self.project_root))
+
+        self.assertEqual(0, self.warm_run())
+        self.assertTrue(self.read_result().startswith('done'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import shutil
+import tempfile
+import unittest
+from contextlib import closing
+from cython_dev_tools.testing.history import open_test_history, record_test_run, find_regressions
+
+
+def _result(duration, rss_growth=0, outcome='passed'):
+    return dict(outcome=outcome, duration=duration, cpu=duration, peak_rss=100 * 1024 * 1024, rss_growth=rss_growth)
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_find_regressions(self):
+        mb = 1024 * 1024
+        with closing(open_test_history(self.tmp_dir)) as conn:
+            for d in (0.10, 0.12, 0.11):
+                record_test_run(conn, {'t.py::test_slow': _result(d, 2 * mb), 't.py::test_fast': _result(0.001)})
+
+            run_id = record_test_run(conn, {'t.py::test_slow': _result(0.3, 10 * mb),
+                                            't.py::test_fast': _result(0.005),
+                                            't.py::test_new': _result(10.0)},
+                                     crashed={'t.py::test_crash': 'SIGSEGV'})
+            regressions = find_regressions(conn, run_id, factor=2.0)
+            self.assertEqual([('t.py::test_slow', 'duration', 0.11), ('t.py::test_slow', 'rss_growth', 2 * mb)],
+                             [(r['test'], r['metric'], r['median']) for r in regressions])
+
+            self.assertEqual([], find_regressions(conn, run_id, factor=5.0))
+
+            rows = conn.execute("SELECT outcome FROM test_results WHERE test = 't.py::test_crash'").fetchall()
+            self.assertEqual(['crashed'], [r['outcome'] for r in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import subprocess
+import tempfile
+from cython_dev_tools.testing.impact import lines_to_ranges, ranges_to_lines, parse_git_diff, select_affected_tests, \
+    git_changed_lines
+
+GIT_DIFF = """diff --git a/pkg/mod.pyx b/pkg/mod.pyx
+index 1111111..2222222 100644
+--- a/pkg/mod.pyx
++++ b/pkg/mod.pyx
+@@ -8 +8 @@ cpdef cytoolzz_cpdeffunc(int a, int b):
+-    return a + b
++    return a + b  # changed
+@@ -20,2 +20,0 @@ def f():
+-    a = 1
+-    b = 2
+@@ -30,0 +29,1 @@ def g():
++    c = 3
+diff --git a/pkg/new_mod.py b/pkg/new_mod.py
+new file mode 100644
+index 0000000..3333333
+--- /dev/null
++++ b/pkg/new_mod.py
+@@ -0,0 +1,2 @@
++a = 1
++b = 2
+"""
+
+
+class ImpactTestCase(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual('', lines_to_ranges([]))
+        self.assertEqual('1-3,5,8-9', lines_to_ranges([9, 1, 2, 3, 5, 8, 2]))
+        self.assertEqual({1, 2, 3, 5, 8, 9}, ranges_to_lines('1-3,5,8-9'))
+        self.assertEqual(set(), ranges_to_lines(''))
+
+    def test_parse_git_diff(self):
+        changed = parse_git_diff(GIT_DIFF)
+        self.assertEqual({8, 20, 21, 30, 31}, changed['pkg/mod.pyx'])
+        self.assertEqual(None, changed['pkg/new_mod.py'])
+
+    def test_select_affected_tests(self):
+        impact_map = {
+            'tests': ['pkg/tests/test_mod.py::T::test_a', 'pkg/tests/test_mod.py::T::test_b', 'pkg/tests/test_other.py::test_c'],
+            'files': {
+                'pkg/mod.pyx': {'0': '1-5,8', '1': '10-12', '2': '40'},
+                'pkg/other.py': {'2': '1-3'},
+            }
+        }
+        affected, not_covered = select_affected_tests(impact_map, {'pkg/mod.pyx': {8, 9}})
+        self.assertEqual(['pkg/tests/test_mod.py::T::test_a'], affected)
+        self.assertEqual([], not_covered)
+
+        affected, not_covered = select_affected_tests(impact_map, {'pkg/mod.pxd': {1}, 'pkg/untested.pyx': {1}})
+        self.assertEqual(impact_map['tests'], affected)
+        self.assertEqual(['pkg/untested.pyx'], not_covered)
+
+        affected, not_covered = select_affected_tests(impact_map, {'pkg/tests/test_new.py': None, 'README.md': None})
+        self.assertEqual(['pkg/tests/test_new.py'], affected)
+        self.assertEqual([], not_covered)
+
+    def test_git_changed_lines_project_subdir(self):
+        with tempfile.TemporaryDirectory() as repo:
+            def git(*args):
+                subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+                                      cwd=repo, stdout=subprocess.DEVNULL)
+
+            project_root = os.path.join(repo, 'project')
+            os.makedirs(os.path.join(project_root, 'pkg'))
+            for fn in [os.path.join(project_root, 'pkg', 'mod.pyx'), os.path.join(repo, 'outside.py')]:
+                with open(fn, 'w') as fh:
+                    fh.write('a = 1\nb = 2\n')
+            git('init', '-q')
+            git('add', '.')
+            git('commit', '-q', '-m', 'init')
+
+            for fn in [os.path.join(project_root, 'pkg', 'mod.pyx'), os.path.join(repo, 'outside.py')]:
+                with open(fn, 'a') as fh:
+                    fh.write('c = 3\n')
+            with open(os.path.join(project_root, 'pkg', 'new_mod.py'), 'w') as fh:
+                fh.write('d = 4\n')
+
+            # Paths are relative to the project root, not to the git toplevel
+            self.assertEqual({'pkg/mod.pyx': {2, 3}, 'pkg/new_mod.py': None}, git_changed_lines(project_root))
+
+
+if __name__ == '__main__':
+    unittest.main()
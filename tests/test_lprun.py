@@ -1,5 +1,11 @@
 import unittest
+import os
+import tempfile
+from types import SimpleNamespace
 from cython_dev_tools.testing import lprun
+from cython_dev_tools.testing.profiler import CdefLineTracer, find_cdef_function, auto_select_functions, \
+    line_timings_delta, aggregate_line_runs, lprun_profile
+from cython_dev_tools.testing.profile_data import make_profile
 
 
 class LPRunTestCase(unittest.TestCase):
@@ -43,5 +49,104 @@ class LPRunTestCase(unittest.TestCase):
               modules=['cy_tools_samples/profiler/cy_module.pyx'],
               project_root='./init_project')
 
+
+
+class CdefLineTracerTestCase(unittest.TestCase):
+    def test_find_cdef_function(self):
+        module_map = dict(module_name='pkg.mod',
+                          functions={'__pyx_f_3pkg_3mod_inner': ('pkg.mod.inner', 1),
+                                     '__pyx_f_3pkg_3mod_3Acc_add': ('pkg.mod.Acc.add', 10)})
+        func_mapper = {'mod.c': {cname: module_map for cname in module_map['functions']}}
+        self.assertEqual(1, find_cdef_function(func_mapper, 'pkg.mod', 'inner'))
+        self.assertEqual(10, find_cdef_function(func_mapper, 'pkg.mod', 'Acc.add'))
+        self.assertEqual(None, find_cdef_function(func_mapper, 'pkg.other', 'inner'))
+
+    def test_trace_lines(self):
+        tracer = CdefLineTracer()
+        tracer.add_cdef_function('pkg/mod.pyx', '/prj/pkg/mod.pyx', 'inner', 1)
+
+        def frame(name, firstlineno, lineno=None):
+            code = SimpleNamespace(co_name=name, co_firstlineno=firstlineno, co_filename='pkg/mod.pyx')
+            return SimpleNamespace(f_code=code, f_lineno=lineno or firstlineno, f_trace_lines=True)
+
+        # Not profiled frames don't trace lines
+        other = frame('outer', 14)
+        self.assertEqual(tracer.skip_lines, tracer(other, 'call', None))
+        self.assertFalse(other.f_trace_lines)
+
+        for _ in range(2):
+            trace = tracer(frame('inner', 1), 'call', None)
+            for lineno in [2, 3, 4]:
+                trace = trace(frame('inner', 1, lineno), 'line', None)
+            trace(frame('inner', 1, 4), 'return', None)
+
+        timings = tracer.get_timings(1e-9)[('/prj/pkg/mod.pyx', 1, 'inner')]
+        self.assertEqual([2, 3, 4], [lineno for lineno, _, _ in timings])
+        self.assertEqual([2, 2, 2], [hits for _, hits, _ in timings])
+        self.assertTrue(all(t >= 0 for _, _, t in timings))
+
+
+class AutoSelectTestCase(unittest.TestCase):
+    def test_auto_select_functions(self):
+        stacks = {'pkg.mod.main': 10,
+                  'pkg.mod.main;pkg.sub.mod.Cls.method': 50,
+                  'pkg.mod.main;pkg.mod.helper (wrapper);pkg.mod.helper': 30,
+                  'pkg.mod.main;pkg.mod.cold': 2,
+                  'pkg.mod.main;pkg.mod.main.<locals>.inner': 10,
+                  'pkg.mod.main;other.mod.func': 40,
+                  'pkg.mod.main;math.sqrt': 40,
+                  }
+        frames_info = {'pkg.mod.main': dict(file='pkg/mod.pyx', line=1),
+                       'pkg.sub.mod.Cls.method': dict(file='pkg/sub/mod.py', line=5),
+                       'pkg.mod.helper (wrapper)': dict(file='pkg/mod.pyx', line=8),
+                       'pkg.mod.helper': dict(file='pkg/mod.pyx', line=8),
+                       'pkg.mod.cold': dict(file='pkg/mod.pyx', line=20),
+                       'pkg.mod.main.<locals>.inner': dict(file='pkg/mod.pyx', line=2),
+                       'other.mod.func': dict(file='other/mod.py', line=1),
+                       }
+        profile = make_profile('cprofile', 'pkg/mod.pyx@main()', 'us', stacks, frames_info=frames_info)
+        # Other packages, closures, built-ins and functions below threshold are skipped
+        self.assertEqual(['pkg/sub/mod.py@Cls.method', 'pkg/mod.pyx@helper', 'pkg/mod.pyx@main'],
+                         auto_select_functions(profile, 'pkg.mod', threshold=5.0))
+        self.assertEqual(['pkg/sub/mod.py@Cls.method'], auto_select_functions(profile, 'pkg.mod', threshold=20.0))
+
+
+class LineRunsTestCase(unittest.TestCase):
+    def test_line_timings_delta(self):
+        func = ('/prj/pkg/mod.pyx', 1, 'main')
+        before = {func: [(2, 10, 100), (3, 5, 50)]}
+        after = {func: [(2, 20, 180), (3, 5, 50), (4, 1, 7)]}
+        self.assertEqual({func: [(2, 10, 80), (4, 1, 7)]}, line_timings_delta(before, after))
+
+    def test_aggregate_line_runs(self):
+        func = ('/prj/pkg/mod.pyx', 1, 'main')
+        runs = [{func: [(2, 10, 100), (3, 1, 10)]},
+                {func: [(2, 10, 120)]},
+                {func: [(2, 10, 140), (3, 1, 20)]}]
+        stats = aggregate_line_runs(runs)
+        self.assertEqual(dict(hits=10, time=120, std=20, min=100, max=140), stats[func][2])
+        # Missing in a run counts as 0
+        self.assertEqual(10, stats[func][3]['time'])
+        self.assertEqual(0, stats[func][3]['min'])
+        self.assertAlmostEqual(2 / 3, stats[func][3]['hits'])
+
+    def test_lprun_profile_total(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            main = (os.path.join(project_root, 'pkg', 'mod.py'), 1, 'main')
+            helper = (os.path.join(project_root, 'pkg', 'mod.py'), 10, 'helper')
+            # main() spends 80us of its 100us in helper()
+            lstats = SimpleNamespace(unit=1e-6, timings={main: [(2, 1, 20), (3, 1, 80)], helper: [(11, 4, 80)]})
+            profile = lprun_profile(lstats, project_root, os.path.join(project_root, '.cython_dev_tools'),
+                                    'pkg/mod.py@main()', entry=(main[0], 'main'))
+            self.assertEqual({'pkg.mod.main': 100, 'pkg.mod.helper': 80}, profile['stacks'])
+            # The callee is not counted twice
+            self.assertEqual(100, profile['total'])
+            self.assertEqual(dict(self=80, total=80), profile['lines']['pkg/mod.py:3'])
+
+            # Entry is not profiled
+            del lstats.timings[main]
+            self.assertEqual(80, lprun_profile(lstats, project_root, project_root, 'pkg/mod.py@main()')['total'])
+
+
 if __name__ == '__main__':
     unittest.main()
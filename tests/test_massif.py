@@ -0,0 +1,114 @@
+import unittest
+import io
+from cython_dev_tools.debugger.massif import massif, parse_massif, massif_tree_sites, massif_report, top_sites, \
+    render_massif_html
+from cython_dev_tools.debugger.valgrind import OTHER_SITE, format_bytes
+from tests.func_mapper_fixture import make_func_mapper, INIT_PROJECT_ROOT, HAS_INIT_PROJECT, HAS_VALGRIND
+
+MASSIF_OUT = """\
+desc: --massif-out-file=/prj/.cython_dev_tools/massif/massif.out --depth=30 --detailed-freq=1
+cmd: python -c from cython_dev_tools.debugger.valgrind import run_valgrind_worker; run_valgrind_worker({'calls': 1})
+time_unit: i
+#-----------
+snapshot=0
+#-----------
+time=0
+mem_heap_B=0
+mem_heap_extra_B=0
+mem_stacks_B=0
+heap_tree=empty
+#-----------
+snapshot=1
+#-----------
+time=1000
+mem_heap_B=1500
+mem_heap_extra_B=40
+mem_stacks_B=0
+heap_tree=peak
+n2: 1500 (heap allocation functions) malloc/new/new[], --alloc-fns, etc.
+ n2: 1300 0x4C2DB8F: malloc (vg_replace_malloc.c:299)
+  n1: 1000 0x5A5: __pyx_pf_3pkg_3mod_2approx_pi2 (mod.c:2130)
+   n0: 1000 0x4F1: _PyEval_EvalFrameDefault (in /usr/lib/libpython3.11.so)
+  n1: 300 0x6B0: PyList_New (in /usr/lib/libpython3.11.so)
+   n1: 300 0x6C0: __pyx_f_3pkg_3mod_recip_square (mod.c:1820)
+    n0: 300 0x5A5: __pyx_pf_3pkg_3mod_2approx_pi2 (mod.c:2135)
+ n0: 200 in 3 places, all below massif's threshold (1.00%)
+#-----------
+snapshot=2
+#-----------
+time=2000
+mem_heap_B=400
+mem_heap_extra_B=16
+mem_stacks_B=0
+heap_tree=detailed
+n1: 400 (heap allocation functions) malloc/new/new[], --alloc-fns, etc.
+ n1: 400 0x4C2DB8F: malloc (vg_replace_malloc.c:299)
+  n1: 400 0x7A0: ??? (in /usr/lib/libpython3.11.so)
+   n0: 400 0x5A5: __pyx_pf_3pkg_3mod_2approx_pi2 (mod.c:2135)
+"""
+
+
+class MassifTestCase(unittest.TestCase):
+    def test_parse_massif(self):
+        data = parse_massif(io.StringIO(MASSIF_OUT))
+        self.assertEqual('i', data['time_unit'])
+        self.assertTrue(data['cmd'].startswith('python -c'))
+        self.assertEqual(3, len(data['snapshots']))
+        self.assertEqual(['empty', 'peak', 'detailed'], [s['tree_kind'] for s in data['snapshots']])
+        self.assertIsNone(data['snapshots'][0]['tree'])
+
+        s = data['snapshots'][1]
+        self.assertEqual((1000, 1500, 40), (s['time'], s['heap'], s['heap_extra']))
+        tree = s['tree']
+        self.assertEqual(1500, tree['bytes'])
+        self.assertIsNone(tree['frame'])
+        self.assertEqual([1300, 200], [c['bytes'] for c in tree['children']])
+        malloc = tree['children'][0]
+        self.assertEqual(dict(symbol='malloc', object=None, file='vg_replace_malloc.c', line=299), malloc['frame'])
+        self.assertEqual(dict(symbol='PyList_New', object='/usr/lib/libpython3.11.so', file=None, line=None),
+                         malloc['children'][1]['frame'])
+        self.assertEqual('__pyx_pf_3pkg_3mod_2approx_pi2',
+                         malloc['children'][1]['children'][0]['children'][0]['frame']['symbol'])
+        self.assertIsNone(tree['children'][1]['frame'])
+        self.assertEqual('???', data['snapshots'][2]['tree']['children'][0]['children'][0]['frame']['symbol'])
+
+    def test_massif_tree_sites(self):
+        data = parse_massif(io.StringIO(MASSIF_OUT))
+        sites_info = {}
+        sites = massif_tree_sites(data['snapshots'][1]['tree'], make_func_mapper(), sites_info)
+        # The innermost pyx frame wins (`recip_square`, not its caller)
+        self.assertEqual({'pkg/mod.pyx:10': 1000, 'pkg/mod.pyx:3': 300, OTHER_SITE: 200}, sites)
+        self.assertEqual(dict(name='pkg.mod.recip_square', file='pkg/mod.pyx', line=3), sites_info['pkg/mod.pyx:3'])
+        self.assertEqual({}, massif_tree_sites(None, make_func_mapper(), sites_info))
+
+    def test_massif_report(self):
+        report = massif_report(parse_massif(io.StringIO(MASSIF_OUT)), make_func_mapper(), 'pkg/mod.pyx@approx_pi2()')
+        self.assertEqual(dict(index=1, time=1000, heap=1500, heap_extra=40), report['peak'])
+        self.assertEqual([{}, {'pkg/mod.pyx:10': 1000, 'pkg/mod.pyx:3': 300, OTHER_SITE: 200},
+                          {'pkg/mod.pyx:12': 400}], [t['sites'] for t in report['timeline']])
+
+        self.assertEqual(dict(name='pkg.mod.approx_pi2', file='pkg/mod.pyx', line=12, peak_bytes=0, max_bytes=400),
+                         report['sites']['pkg/mod.pyx:12'])
+        self.assertEqual(1000, report['sites']['pkg/mod.pyx:10']['peak_bytes'])
+        self.assertEqual(['pkg/mod.pyx:10', 'pkg/mod.pyx:3', OTHER_SITE, 'pkg/mod.pyx:12'], top_sites(report))
+        self.assertEqual(['pkg/mod.pyx:10', 'pkg/mod.pyx:3'], top_sites(report, limit=2))
+
+        page = render_massif_html(report)
+        self.assertIn('<svg', page)
+        self.assertIn('pkg.mod.recip_square', page)
+        self.assertIn('peak 1.5KB', page)
+
+    def test_format_bytes(self):
+        self.assertEqual('512B', format_bytes(512))
+        self.assertEqual('1.5KB', format_bytes(1536))
+        self.assertEqual('2.0MB', format_bytes(2 * 1024 ** 2))
+        self.assertEqual('3.00GB', format_bytes(3 * 1024 ** 3))
+
+
+@unittest.skipUnless(HAS_VALGRIND and HAS_INIT_PROJECT, 'valgrind or tests/init_project build is missing')
+class MassifIntegrationTestCase(unittest.TestCase):
+    def test_massif(self):
+        # sum() mallocs 10000 ints at line 15 and never frees them
+        report = massif('cy_tools_samples/debugging/memory_leaks.pyx@main', project_root=INIT_PROJECT_ROOT, calls=10)
+        site = report['sites']['cy_tools_samples/debugging/memory_leaks.pyx:15']
+        self.assertGreaterEqual(site['max_bytes'], 10000 * 4)
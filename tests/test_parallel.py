@@ -0,0 +1,88 @@
+import unittest
+import os
+import tempfile
+from cython_dev_tools.testing.parallel import shard_test_modules, ShardWorker
+
+CRASHING_TESTS = """\
+import os
+
+def count_run(name):
+    with open(os.path.join(os.path.dirname(__file__), 'runs.txt'), 'a') as fh:
+        fh.write(name + '\\n')
+
+def test_a():
+    count_run('test_a')
+
+def test_b():
+    count_run('test_b')
+    os.abort()
+
+def test_c():
+    count_run('test_c')
+"""
+
+CRASHING_IMPORT = """\
+import os
+
+os.abort()
+
+def test_never():
+    pass
+"""
+
+PASSING_TESTS = """\
+def test_ok():
+    pass
+"""
+
+
+class ParallelTestCase(unittest.TestCase):
+    def test_shard_test_modules(self):
+        durations = {'a.py': 10.0, 'b.py': 6.0, 'c.py': 5.0, 'd.py': 1.0}
+        shards = shard_test_modules(['a.py', 'b.py', 'c.py', 'd.py'], durations, 2)
+        self.assertEqual([['a.py', 'd.py'], ['b.py', 'c.py']], shards)
+
+        # Unknown modules get median duration
+        shards = shard_test_modules(['a.py', 'b.py', 'c.py', 'new.py'], durations, 2)
+        self.assertEqual([['a.py', 'c.py'], ['b.py', 'new.py']], shards)
+
+        # No more shards than modules
+        self.assertEqual([['a.py']], shard_test_modules(['a.py'], {}, 4))
+
+    def test_shard_worker_crash(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            with open(os.path.join(project_root, 'test_crash.py'), 'w') as fh:
+                fh.write(CRASHING_TESTS)
+
+            worker = ShardWorker(0, ['test_crash.py'], project_root, project_root,
+                                 ['-q', '-p', 'no:cacheprovider'], os.environ.copy())
+            worker.run()
+
+            # The crash is reported, the worker is respawned with the remaining tests
+            self.assertEqual({'test_crash.py::test_b': 'SIGABRT'}, worker.crashed)
+            self.assertEqual({'test_crash.py::test_a': 'passed', 'test_crash.py::test_c': 'passed'},
+                             {t: e['outcome'] for t, e in worker.results.items()})
+
+            # Finished and crashed tests are not rerun
+            with open(os.path.join(project_root, 'runs.txt')) as fh:
+                self.assertEqual(['test_a', 'test_b', 'test_c'], fh.read().split())
+
+    def test_shard_worker_import_crash(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            for fn, source in [('test_a_crash.py', CRASHING_IMPORT), ('test_b_ok.py', PASSING_TESTS),
+                               ('test_c_ok.py', PASSING_TESTS)]:
+                with open(os.path.join(project_root, fn), 'w') as fh:
+                    fh.write(source)
+
+            worker = ShardWorker(0, ['test_a_crash.py', 'test_b_ok.py', 'test_c_ok.py'], project_root, project_root,
+                                 ['-q', '-p', 'no:cacheprovider'], os.environ.copy())
+            worker.run()
+
+            # Only the module crashing on import is reported, tests of other modules of the shard are run
+            self.assertEqual({'test_a_crash.py': 'SIGABRT'}, worker.crashed)
+            self.assertEqual({'test_b_ok.py::test_ok': 'passed', 'test_c_ok.py::test_ok': 'passed'},
+                             {t: e['outcome'] for t, e in worker.results.items()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import os
+import tempfile
+from cython_dev_tools.debugger.perf import parse_perf_script, demangle_cython_symbol, map_cython_frame, \
+    perf_samples_profile
+from cython_dev_tools.testing.profile_data import summarize_stacks, save_profile, load_profile
+from tests.func_mapper_fixture import make_func_mapper, init_project_func_mapper, HAS_INIT_PROJECT
+
+PERF_SCRIPT = """\
+python 1234
+\t    7f1c2a3b4c5d __pyx_pf_3pkg_3mod_2approx_pi2+0x3d (/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so)
+  mod.c:2130
+\t    7f1c2a3b4000 __pyx_pw_3pkg_3mod_3approx_pi2+0x10 (/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so)
+  mod.c:2050
+\t    55d0c0a0b1c2 _PyEval_EvalFrameDefault+0x1234 (/usr/bin/python3.11)
+  ceval.c:5421
+
+python 1234
+\t    7f1c2a3b5000 __pyx_f_3pkg_3mod_recip_square.constprop.0+0x8 (/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so)
+  mod.c:1820
+\t    7f1c2a3b4c5d __pyx_pf_3pkg_3mod_2approx_pi2+0x5a (/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so)
+  mod.c:2135
+\t    55d0c0a0b1c2 _PyEval_EvalFrameDefault+0x1234 (/usr/bin/python3.11)
+  ceval.c:5421
+
+python 1234
+\t    7f1c2a3b6000 sqrt+0x8 (/usr/lib/libm.so.6)
+  ??:0
+\t    7f1c2a3b4c5d __pyx_pf_3pkg_3mod_2approx_pi2+0x5a (/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so)
+  mod.c:2135
+\t                0 [unknown] ([unknown])
+"""
+
+
+class PerfTestCase(unittest.TestCase):
+    def test_demangle_cython_symbol(self):
+        self.assertEqual('cy_tools_samples.profiler.cy_module.approx_pi2',
+                         demangle_cython_symbol('__pyx_pf_16cy_tools_samples_8profiler_9cy_module_2approx_pi2'))
+        self.assertEqual('cy_tools_samples.profiler.cy_module.SQ.recip_square_',
+                         demangle_cython_symbol('__pyx_pf_16cy_tools_samples_8profiler_9cy_module_2SQ_recip_square_'))
+        self.assertEqual('cy_tools_samples.profiler.cy_module.SQ.__reduce_cython__',
+                         demangle_cython_symbol('__pyx_pf_16cy_tools_samples_8profiler_9cy_module_2SQ_2__reduce_cython__'))
+        self.assertEqual('pkg.mod.recip_square', demangle_cython_symbol('__pyx_f_3pkg_3mod_recip_square'))
+        self.assertIsNone(demangle_cython_symbol('__Pyx_PyObject_Call'))
+        self.assertIsNone(demangle_cython_symbol('_PyEval_EvalFrameDefault'))
+
+    def test_demangle_cython_symbol_underscores(self):
+        module_map = dict(module_name='pkg.mod', module_c_basename='mod.c', module_pyx_fn='/prj/pkg/mod.pyx',
+                          module_c_fn='/prj/pkg/mod.c', line_numbers={},
+                          functions={'__pyx_pw_3pkg_3mod_5main_loop': ('pkg.mod.main_loop', 3),
+                                     '__pyx_pw_3pkg_3mod_11update_all_fast': ('pkg.mod.update_all_fast', 10),
+                                     '__pyx_pw_3pkg_3mod_2SQ_5calc_x': ('pkg.mod.SQ.calc_x', 20)})
+        func_mapper = {'mod.c': {f: module_map for f in module_map['functions']}}
+
+        # Function counter prefix is not a length prefix of a class name
+        self.assertEqual('pkg.mod.main_loop', demangle_cython_symbol('__pyx_pf_3pkg_3mod_4main_loop', func_mapper))
+        self.assertEqual('pkg.mod.update_all_fast',
+                         demangle_cython_symbol('__pyx_pf_3pkg_3mod_10update_all_fast', func_mapper))
+        self.assertEqual('pkg.mod.SQ.calc_x', demangle_cython_symbol('__pyx_pf_3pkg_3mod_2SQ_4calc_x', func_mapper))
+        # Unknown functions of the known module and class
+        self.assertEqual('pkg.mod.SQ.__reduce_cython__',
+                         demangle_cython_symbol('__pyx_pf_3pkg_3mod_2SQ_2__reduce_cython__', func_mapper))
+        self.assertEqual('pkg.mod.new_func_2', demangle_cython_symbol('__pyx_pf_3pkg_3mod_12new_func_2', func_mapper))
+
+        self.assertEqual(dict(name='pkg.mod.main_loop', file='pkg/mod.pyx', line=3, func_line=3),
+                         map_cython_frame(func_mapper, '__pyx_pf_3pkg_3mod_4main_loop', 'mod.c', 100))
+
+    def test_parse_perf_script(self):
+        samples = parse_perf_script(PERF_SCRIPT)
+        self.assertEqual(3, len(samples))
+        self.assertEqual(dict(symbol='__pyx_pf_3pkg_3mod_2approx_pi2',
+                              dso='/prj/pkg/mod.cpython-311-x86_64-linux-gnu.so',
+                              src_file='mod.c', src_line=2130), samples[0][0])
+        self.assertEqual(dict(symbol='sqrt', dso='/usr/lib/libm.so.6', src_file=None, src_line=None), samples[2][0])
+        self.assertEqual('[unknown]', samples[2][2]['symbol'])
+
+    def test_map_cython_frame(self):
+        func_mapper = make_func_mapper()
+        # Mapped by cython_debug info
+        self.assertEqual(dict(name='pkg.mod.recip_square', file='pkg/mod.pyx', line=3, func_line=1),
+                         map_cython_frame(func_mapper, '__pyx_f_3pkg_3mod_recip_square.isra.0', 'mod.c', 1820))
+        # Implementation of def function, only its wrapper is in cython_debug
+        self.assertEqual(dict(name='pkg.mod.approx_pi2', file='pkg/mod.pyx', line=12, func_line=8),
+                         map_cython_frame(func_mapper, '__pyx_pf_3pkg_3mod_2approx_pi2', 'mod.c', 2135))
+        # Unknown C line -> function line
+        self.assertEqual(8, map_cython_frame(func_mapper, '__pyx_pf_3pkg_3mod_2approx_pi2', 'mod.c', 1)['line'])
+        self.assertIsNone(map_cython_frame(func_mapper, '_PyEval_EvalFrameDefault', 'ceval.c', 5421))
+
+    @unittest.skipUnless(HAS_INIT_PROJECT, 'tests/init_project is not built, run tests/init_test_project.py')
+    def test_map_cython_frame_init_project(self):
+        func_mapper = init_project_func_mapper()
+        module_map = func_mapper['cy_module.c']['__pyx_pw_16cy_tools_samples_8profiler_9cy_module_3approx_pi2']
+        c_line = min(c for c, line in module_map['line_numbers'].items() if line == 12)
+
+        # `__pyx_pf_` implementation is not in cython_debug info, underscores in the module and function names
+        self.assertEqual(dict(name='cy_tools_samples.profiler.cy_module.approx_pi2',
+                              file='cy_tools_samples/profiler/cy_module.pyx', line=12, func_line=8),
+                         map_cython_frame(func_mapper, '__pyx_pf_16cy_tools_samples_8profiler_9cy_module_2approx_pi2',
+                                          'cy_module.c', c_line))
+        self.assertEqual('cy_tools_samples.profiler.cy_module.SQ.recip_square_',
+                         map_cython_frame(func_mapper, '__pyx_pf_16cy_tools_samples_8profiler_9cy_module_2SQ_'
+                                                       'recip_square_', 'cy_module.c')['name'])
+
+    def test_perf_samples_profile(self):
+        profile = perf_samples_profile(parse_perf_script(PERF_SCRIPT), make_func_mapper(), 'pkg/mod.pyx@approx_pi2')
+        self.assertEqual(3, profile['total'])
+        self.assertEqual({'_PyEval_EvalFrameDefault;pkg.mod.approx_pi2': 1,
+                          '_PyEval_EvalFrameDefault;pkg.mod.approx_pi2;pkg.mod.recip_square': 1,
+                          '[unknown];pkg.mod.approx_pi2;sqrt': 1}, profile['stacks'])
+        self.assertEqual(dict(self=1, total=3, file='pkg/mod.pyx', line=8), profile['functions']['pkg.mod.approx_pi2'])
+        self.assertEqual(dict(self=1, total=1), profile['functions']['sqrt'])
+        # Native callee time goes to the calling pyx line
+        self.assertEqual(dict(self=1, total=2), profile['lines']['pkg/mod.pyx:12'])
+        self.assertEqual(dict(self=1, total=1), profile['lines']['pkg/mod.pyx:3'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_fn = save_profile(tmp_dir, profile, 'pkg.mod.approx_pi2')
+            self.assertEqual(profile['stacks'], load_profile(profile_fn)['stacks'])
+            with open(os.path.splitext(profile_fn)[0] + '.folded') as fh:
+                self.assertEqual(['[unknown];pkg.mod.approx_pi2;sqrt 1\n',
+                                  '_PyEval_EvalFrameDefault;pkg.mod.approx_pi2 1\n',
+                                  '_PyEval_EvalFrameDefault;pkg.mod.approx_pi2;pkg.mod.recip_square 1\n'],
+                                 fh.readlines())
+
+    def test_summarize_stacks(self):
+        functions = summarize_stacks({'a;b;a': 2, 'a;c': 1})
+        self.assertEqual(dict(self=2, total=3), functions['a'])
+        self.assertEqual(dict(self=0, total=2), functions['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
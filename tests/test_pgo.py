@@ -0,0 +1,61 @@
+import unittest
+import os
+import json
+import tempfile
+from unittest import mock
+from cython_dev_tools.building.pgo import module_source_hash, apply_pgo_profiles, PGO_DIRNAME, PGO_PROFILES_FILENAME, \
+    PGO_USE_FLAGS
+from cython_dev_tools.building.build import extension_object_path
+
+
+class PGOTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.project_root = self.tmp_dir.name
+        self.tools_path = os.path.join(self.project_root, '.cython_dev_tools')
+        os.makedirs(os.path.join(self.project_root, 'pkg'))
+        os.makedirs(os.path.join(self.tools_path, PGO_DIRNAME))
+        with open(os.path.join(self.project_root, 'pkg', 'mod.pyx'), 'w') as fh:
+            fh.write('def f(): pass\n')
+
+        self.ext = mock.MagicMock(extra_compile_args=['-O2'], extra_link_args=[],
+                                  sources=[os.path.join(self.tools_path, 'src', 'pkg', 'mod.c')])
+        self.ext.name = 'pkg.mod'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def save_profile(self, source_hash):
+        with open(os.path.join(self.tools_path, PGO_DIRNAME, 'pkg.mod.gcda'), 'wb') as fh:
+            fh.write(b'gcda')
+        with open(os.path.join(self.tools_path, PGO_DIRNAME, PGO_PROFILES_FILENAME), 'w') as fh:
+            json.dump({'pkg.mod': dict(gcda='pkg.mod.gcda', source_hash=source_hash, target='pkg/mod.pyx@f')}, fh)
+
+    def test_module_source_hash(self):
+        h = module_source_hash(self.project_root, 'pkg.mod')
+        self.assertIsNotNone(h)
+        self.assertIsNone(module_source_hash(self.project_root, 'pkg.other'))
+
+        with open(os.path.join(self.project_root, 'pkg', 'mod.pxd'), 'w') as fh:
+            fh.write('cdef int g()\n')
+        self.assertNotEqual(h, module_source_hash(self.project_root, 'pkg.mod'))
+
+    def test_apply_pgo_profiles(self):
+        self.save_profile(module_source_hash(self.project_root, 'pkg.mod'))
+        build_temp = os.path.join(self.project_root, 'build', 'temp')
+
+        self.assertEqual(1, apply_pgo_profiles([self.ext], self.project_root, self.tools_path, build_temp))
+        self.assertEqual(['-O2'] + PGO_USE_FLAGS, self.ext.extra_compile_args)
+        gcda_fn = os.path.splitext(extension_object_path(self.ext, build_temp))[0] + '.gcda'
+        self.assertTrue(gcda_fn.startswith(build_temp))
+        self.assertTrue(os.path.exists(gcda_fn))
+
+    def test_apply_pgo_profiles_outdated(self):
+        self.save_profile('outdated')
+        self.assertEqual(0, apply_pgo_profiles([self.ext], self.project_root, self.tools_path,
+                                               os.path.join(self.project_root, 'build', 'temp')))
+        self.assertEqual(['-O2'], self.ext.extra_compile_args)
+
+
+if __name__ == '__main__':
+    unittest.main()
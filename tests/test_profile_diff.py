@@ -0,0 +1,46 @@
+import unittest
+from cython_dev_tools.testing.profile_diff import align_functions, align_lines, diff_entries, path_shares, diff_color
+
+
+class ProfileDiffTestCase(unittest.TestCase):
+    def test_align_functions(self):
+        fa = {'pkg.mod.main': dict(file='pkg/mod.pyx', line=8),
+              'pkg.mod.helper': dict(file='pkg/mod.pyx', line=1),
+              'math.sqrt': {}}
+        fb = {'pkg.mod.main': dict(file='pkg/mod.pyx', line=8),
+              'pkg.mod.Cls.helper': dict(file='pkg/mod.pyx', line=1),
+              'pkg.mod.new': dict(file='pkg/mod.pyx', line=20)}
+        self.assertEqual([('pkg.mod.main', 'pkg.mod.main'),
+                          ('pkg.mod.helper', 'pkg.mod.Cls.helper'),
+                          (None, 'pkg.mod.new'),
+                          ('math.sqrt', None)], align_functions(fa, fb))
+
+    def test_align_lines(self):
+        la = {'pkg/mod.pyx:10': dict(code='x += 1'), 'pkg/mod.pyx:11': dict(code='y = x')}
+        # A line inserted above, line 10 is a different code now
+        lb = {'pkg/mod.pyx:10': dict(code='z = 0'), 'pkg/mod.pyx:11': dict(code='x += 1'),
+              'pkg/mod.pyx:12': dict(code='y = x')}
+        self.assertEqual([(None, 'pkg/mod.pyx:10'),
+                          ('pkg/mod.pyx:10', 'pkg/mod.pyx:11'),
+                          ('pkg/mod.pyx:11', 'pkg/mod.pyx:12')], align_lines(la, lb))
+
+    def test_diff_entries(self):
+        # Different units, shares are compared
+        fa = {'main': dict(self=50, total=100), 'helper': dict(self=50, total=50)}
+        fb = {'main': dict(self=200, total=1000), 'helper': dict(self=800, total=800)}
+        rows = diff_entries(fa, fb, align_functions(fa, fb), 100, 1000)
+        self.assertEqual(['helper', 'main'], [r['b'] for r in rows])
+        self.assertAlmostEqual(0.3, rows[0]['d_self'])
+        self.assertAlmostEqual(-0.3, rows[1]['d_self'])
+        self.assertAlmostEqual(0.0, rows[1]['d_total'])
+
+    def test_path_shares(self):
+        shares = path_shares({'main;helper': 3, 'main': 1}, rename={'helper': 'Cls.helper'})
+        self.assertEqual({'main': 1.0, 'main;Cls.helper': 0.75}, shares)
+        self.assertTrue(diff_color(0.2, 0.2).startswith('hsl(0,'))
+        self.assertTrue(diff_color(-0.2, 0.2).startswith('hsl(220,'))
+        self.assertEqual('hsl(0, 0%, 88%)', diff_color(0.0, 0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
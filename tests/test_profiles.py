@@ -0,0 +1,51 @@
+import unittest
+import os
+import json
+import tempfile
+from cython_dev_tools.building.profiles import get_build_profile, get_build_profiles, BUILD_PROFILES, \
+    PROJECT_CONFIG_FILENAME
+from cython_dev_tools.building.build import is_directives_changed, BUILD_MANIFEST_FILENAME
+
+
+class BuildProfilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.project_root = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_json(self, fn, data):
+        with open(os.path.join(self.project_root, fn), 'w') as fh:
+            json.dump(data, fh)
+
+    def test_builtin_profiles(self):
+        self.assertEqual(BUILD_PROFILES, get_build_profiles(self.project_root))
+        self.assertEqual(['-Os'], get_build_profile(self.project_root, 'size')['extra_compile_args'])
+        self.assertRaises(ValueError, get_build_profile, self.project_root, 'unknown')
+
+    def test_project_config_profiles(self):
+        self.write_json(PROJECT_CONFIG_FILENAME, {'build_profiles': {
+            'fast': {'extra_compile_args': ['-O3'], 'compiler_directives': {'boundscheck': False}},
+            'bad': {'extra_link_args': ['-s']},
+        }})
+        profiles = get_build_profiles(self.project_root)
+        self.assertEqual({'boundscheck': False}, profiles['fast']['compiler_directives'])
+        self.assertEqual(BUILD_PROFILES['lto'], profiles['lto'])
+        self.assertRaises(ValueError, get_build_profile, self.project_root, 'bad')
+
+    def test_is_directives_changed(self):
+        self.assertFalse(is_directives_changed(self.project_root, {'boundscheck': False}))
+
+        self.write_json(BUILD_MANIFEST_FILENAME, {'modules': {
+            'pkg.a': {'compiler_directives': {'boundscheck': False}},
+            'other.b': {'compiler_directives': None},
+        }})
+        self.assertFalse(is_directives_changed(self.project_root, {'boundscheck': False}, ['pkg']))
+        self.assertTrue(is_directives_changed(self.project_root, {'boundscheck': False}))
+        self.assertTrue(is_directives_changed(self.project_root, {'boundscheck': True}, ['pkg']))
+        self.assertTrue(is_directives_changed(self.project_root, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
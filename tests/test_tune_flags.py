@@ -0,0 +1,85 @@
+import unittest
+import importlib
+import tempfile
+from unittest import mock
+from cython_dev_tools.testing.tune_flags import parse_flags_space, flags_candidates, pareto_front, check_test_power, \
+    tune_module_flags
+from cython_dev_tools.building.flag_profiles import find_module_profile, apply_flag_profiles, save_flag_profile, \
+    load_flag_profiles
+
+
+class TuneFlagsTestCase(unittest.TestCase):
+    def test_flags_candidates(self):
+        space = parse_flags_space(['-O2|-O3', '-march=native', '-flto'])
+        self.assertEqual([['-O2', '-O3'], ['-march=native'], ['-flto']], space)
+
+        self.assertEqual([['-O2'], ['-O3'], ['-march=native'], ['-flto']], flags_candidates([], space))
+        self.assertEqual([['-O2', '-march=native'], ['-O3', '-march=native', '-flto']],
+                         flags_candidates(['-O3', '-march=native'], space))
+
+    def test_pareto_front(self):
+        #                  fastest, biggest | dominated   | smallest    | same as #0
+        points = [(1.0, 300), (2.0, 400), (3.0, 100), (1.0, 300)]
+        self.assertEqual([0, 2, 3], pareto_front(points))
+
+    def test_check_test_power(self):
+        check_test_power(5, 5, alpha=0.05)
+        # 2 vs 2 process means are never significant
+        self.assertRaises(ValueError, check_test_power, 2, 5, alpha=0.05)
+        # Single process: the test is done by samples
+        check_test_power(1, 10, alpha=0.05)
+        self.assertRaises(ValueError, check_test_power, 5, 5, alpha=0.001)
+
+    def test_tune_module_flags_keeps_faster_flags(self):
+        def build_variant_tree(project_root, tools_path, name, compile_flags, flags_modules):
+            return '/prj/variants/' + ' '.join(compile_flags)
+
+        def measure_call(variant_root, *args, processes=5, repeats=5, **kwargs):
+            # -O3 is 20% faster, the other flags don't change the time, processes vary by 1%
+            time = 0.8 if '-O3' in variant_root else 1.0
+            return [[time * (1 + 0.01 * p) + 0.001 * r for r in range(repeats)] for p in range(processes)], 100
+
+        with mock.patch.multiple(importlib.import_module('cython_dev_tools.testing.tune_flags'),
+                                 find_package_path=mock.Mock(return_value=('/prj/pkg/mod.pyx', 'pkg.mod', 'f')),
+                                 build_variant_tree=build_variant_tree,
+                                 measure_call=measure_call,
+                                 record_perf=mock.Mock(),
+                                 load_build_manifest=mock.Mock(return_value={}),
+                                 modules_so_size=mock.Mock(return_value=1000)), \
+                mock.patch('os.makedirs'):
+            results = tune_module_flags('/prj', '/prj/.cython_dev_tools', 'pkg/mod.pyx@f()', 'pkg.mod',
+                                        parse_flags_space(['-O2|-O3', '-funroll-loops']))
+        self.assertEqual(['-O3'], results['best'])
+        best = next(c for c in results['configs'] if c['is_best'])
+        self.assertAlmostEqual(1.25, best['speedup'], places=2)
+
+    def test_find_module_profile(self):
+        profiles = {'pkg': dict(extra_compile_args=['-O2']),
+                    'pkg.sub.mod': dict(extra_compile_args=['-O3'])}
+        self.assertEqual(['-O3'], find_module_profile(profiles, 'pkg.sub.mod')['extra_compile_args'])
+        self.assertEqual(['-O2'], find_module_profile(profiles, 'pkg.other')['extra_compile_args'])
+        self.assertIsNone(find_module_profile(profiles, 'pkg2.mod'))
+        self.assertEqual(['-Os'], find_module_profile({'': dict(extra_compile_args=['-Os'])}, 'a.b')['extra_compile_args'])
+
+    def test_apply_flag_profiles(self):
+        shared_args = ['-Wno-unused-variable']
+        ext1 = mock.MagicMock(extra_compile_args=shared_args, extra_link_args=None)
+        ext1.name = 'pkg.mod'
+        ext2 = mock.MagicMock(extra_compile_args=shared_args, extra_link_args=None)
+        ext2.name = 'other.mod'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_flag_profile(tmp_dir, 'pkg', ['-O3', '-flto'], speedup=1.5)
+            profiles = load_flag_profiles(tmp_dir)
+            self.assertEqual(['-flto'], profiles['pkg']['extra_link_args'])
+            self.assertEqual(1.5, profiles['pkg']['speedup'])
+
+        self.assertEqual(1, apply_flag_profiles([ext1, ext2], profiles))
+        self.assertEqual(['-Wno-unused-variable', '-O3', '-flto'], ext1.extra_compile_args)
+        self.assertEqual(['-flto'], ext1.extra_link_args)
+        # Shared args list is not changed
+        self.assertEqual(['-Wno-unused-variable'], ext2.extra_compile_args)
+
+
+if __name__ == '__main__':
+    unittest.main()
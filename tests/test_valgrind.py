@@ -0,0 +1,86 @@
+import unittest
+import io
+from cython_dev_tools.debugger.valgrind import valgrind, parse_valgrind_xml
+from tests.func_mapper_fixture import make_func_mapper, INIT_PROJECT_ROOT, HAS_INIT_PROJECT, HAS_VALGRIND
+
+
+def xml_frame(fn, file=None, line=None, obj='/usr/lib/libpython3.11.so'):
+    src = f'<file>{file}</file><line>{line}</line>' if file else ''
+    return f'<frame><ip>0x4C2DB8F</ip><obj>{obj}</obj><fn>{fn}</fn>{src}</frame>'
+
+
+def xml_leak(kind, nbytes, nblocks, *frames):
+    return (f'<error><unique>0x1</unique><tid>1</tid><kind>{kind}</kind>'
+            f'<xwhat><text>{nbytes} bytes in {nblocks} blocks are lost in loss record 1 of 9</text>'
+            f'<leakedbytes>{nbytes}</leakedbytes><leakedblocks>{nblocks}</leakedblocks></xwhat>'
+            f'<stack>{"".join(frames)}</stack></error>')
+
+
+MALLOC = xml_frame('malloc', 'vg_replace_malloc.c', 299)
+RECIP = xml_frame('__pyx_f_3pkg_3mod_recip_square', 'mod.c', 1820)
+APPROX = xml_frame('__pyx_pf_3pkg_3mod_2approx_pi2', 'mod.c', 2135)
+EVAL = xml_frame('_PyEval_EvalFrameDefault')
+
+MEMCHECK_XML = f"""<?xml version="1.0"?>
+<valgrindoutput>
+<protocolversion>4</protocolversion>
+<protocoltool>memcheck</protocoltool>
+<preamble><line>Memcheck, a memory error detector</line></preamble>
+<pid>1234</pid>
+<tool>memcheck</tool>
+<error><unique>0x0</unique><tid>1</tid><kind>InvalidRead</kind><what>Invalid read of size 8</what>
+<stack>{RECIP}{APPROX}{EVAL}</stack>
+<auxwhat>Address 0x0 is not stack'd, malloc'd or (recently) free'd</auxwhat>
+</error>
+{xml_leak('Leak_DefinitelyLost', 100, 1, MALLOC, RECIP, APPROX, EVAL)}
+{xml_leak('Leak_DefinitelyLost', 300, 3, MALLOC, RECIP, APPROX, EVAL)}
+{xml_leak('Leak_DefinitelyLost', 64, 1, MALLOC, APPROX, EVAL)}
+{xml_leak('Leak_PossiblyLost', 1000, 10, MALLOC, EVAL)}
+<errorcounts><pair><count>1</count><unique>0x0</unique></pair></errorcounts>
+</valgrindoutput>
+"""
+
+
+class ValgrindTestCase(unittest.TestCase):
+    def test_parse_valgrind_xml(self):
+        report = parse_valgrind_xml(io.StringIO(MEMCHECK_XML), make_func_mapper())
+
+        # Identical stacks are grouped, sorted by bytes lost, stacks without Cython frames are skipped
+        self.assertEqual([dict(kind='Leak_DefinitelyLost', what=None, records=2, bytes=400, blocks=4,
+                               frames=['pkg.mod.recip_square (pkg/mod.pyx:3)', 'pkg.mod.approx_pi2 (pkg/mod.pyx:12)']),
+                          dict(kind='Leak_DefinitelyLost', what=None, records=1, bytes=64, blocks=1,
+                               frames=['pkg.mod.approx_pi2 (pkg/mod.pyx:12)'])],
+                         report['leaks'])
+        self.assertEqual([dict(kind='InvalidRead', what='Invalid read of size 8', records=1, bytes=0, blocks=0,
+                               frames=['pkg.mod.recip_square (pkg/mod.pyx:3)', 'pkg.mod.approx_pi2 (pkg/mod.pyx:12)'])],
+                         report['errors'])
+        self.assertEqual({'Leak_DefinitelyLost': dict(bytes=464, blocks=5),
+                          'Leak_PossiblyLost': dict(bytes=1000, blocks=10)}, report['leak_summary'])
+
+    def test_parse_valgrind_xml_no_filter_no_replace(self):
+        report = parse_valgrind_xml(io.StringIO(MEMCHECK_XML), make_func_mapper(),
+                                    replace_cython=False, filter_cython_only=False)
+        self.assertEqual(['malloc (vg_replace_malloc.c:299)',
+                          '__pyx_f_3pkg_3mod_recip_square (mod.c:1820)',
+                          '__pyx_pf_3pkg_3mod_2approx_pi2 (mod.c:2135)',
+                          '_PyEval_EvalFrameDefault (in /usr/lib/libpython3.11.so)'], report['leaks'][0]['frames'])
+        self.assertEqual(2, report['leaks'][0]['records'])
+
+    def test_parse_valgrind_xml_truncated(self):
+        # Valgrind killed in the middle of the output
+        xml = MEMCHECK_XML[:MEMCHECK_XML.index('<error><unique>0x1</unique>') + 40]
+        report = parse_valgrind_xml(io.StringIO(xml), make_func_mapper())
+        self.assertEqual(1, len(report['errors']))
+        self.assertEqual([], report['leaks'])
+
+
+@unittest.skipUnless(HAS_VALGRIND and HAS_INIT_PROJECT, 'valgrind or tests/init_project build is missing')
+class ValgrindIntegrationTestCase(unittest.TestCase):
+    def test_valgrind_leak(self):
+        # sum() mallocs 10000 ints at line 15 and never frees them
+        report = valgrind('cy_tools_samples/debugging/memory_leaks.pyx@main', project_root=INIT_PROJECT_ROOT)
+        leaks = [g for g in report['leaks'] if g['kind'] == 'Leak_DefinitelyLost'
+                 and any('cy_tools_samples/debugging/memory_leaks.pyx:15' in f for f in g['frames'])]
+        self.assertEqual(1, len(leaks))
+        self.assertGreaterEqual(leaks[0]['bytes'], 10000 * 4)
+        self.assertGreaterEqual(report['leak_summary']['Leak_DefinitelyLost']['bytes'], 10000 * 4)